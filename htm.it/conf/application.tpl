@@ -59,7 +59,31 @@ metric_error_grace_period = 10800
 [metric_listener]
 # Port to listen on for plaintext protocol messages
 plaintext_port = 2003
+# Port to listen on for binary protocol messages; see
+# htmengine.runtime.metric_listener.packBinarySample
+binary_port = 2005
 queue_name = htm.it.metric.custom.data
+# "threaded" serves each TCP client connection and UDP datagram in its own
+# thread; "event_loop" multiplexes all clients in a single thread and forwards
+# their samples through a single message bus connection
+server_mode = threaded
+# Samples from all clients are coalesced into messages of up to
+# coalesce_max_message_bytes, each published no later than coalesce_linger_ms
+# after its oldest sample arrived; clients are slowed down while more than
+# coalesce_max_pending_bytes of samples wait to be published. 0 linger time
+# disables coalescing, so that each client forwards its own messages.
+coalesce_linger_ms = 100
+coalesce_max_message_bytes = 262144
+coalesce_max_pending_bytes = 16777216
+
+[metric_storer]
+# "push" consumes custom metric messages as the broker delivers them, up to
+# prefetch_max unacked messages ahead; "poll" retrieves one message per broker
+# round trip and sleeps when the queue is empty
+consumer_mode = push
+prefetch_max = 400
+# Max milliseconds that a message waits for its batch to fill up in push mode
+batch_linger_ms = 50
 
 [security]
 apikey =
@@ -85,3 +109,16 @@ statistics_refresh_rate=24
 # Sample size to be used for the statistic calculation
 # We keep a max of one month of history (assumes 5 min metric period)
 statistics_sample_size=8640
+# Recent samples used for statistics are cached in memory, so that refreshes
+# don't need to re-read them from metric_data; bounds on the number of metrics
+# and the estimated memory of the cache
+sample_cache_max_metrics=2000
+sample_cache_max_mb=512
+
+[anomaly_service]
+# Number of workers that process model result batches in parallel, each owning
+# a hash partition of model IDs so that the results of each model are processed
+# in order; 0 processes all results in the service's consumer loop
+num_workers=0
+# Worker type: "thread" or "process"
+worker_type=process
@@ -17,6 +17,16 @@ model_input_queue_prefix = htm.it.mswapper.model.input.
 # Name of the Model Scheduler notification queue
 scheduler_notification_queue = htm.it.mswapper.scheduler.notification
 
+# Format of request and result batches submitted to the queues: "json" or
+# "binary". Consumers decode batches of either format, so "binary" may be
+# enabled once all services that consume the queues support it.
+batch_format = json
+
+# Model Scheduler notifications of confirmed request batches are coalesced
+# into a single notification message, which is sent once the oldest coalesced
+# model ID is this old; 0 sends a notification per confirmation of batches.
+notification_coalesce_window_ms = 250
+
 
 [model_runner]
 # The target number of model input request objects to be processed per
@@ -25,3 +35,41 @@ scheduler_notification_queue = htm.it.mswapper.scheduler.notification
 # batch, the actual number of requests processed before checkpointing the model
 # may be higher than this number.
 target_requests_per_checkpoint = 500
+
+# When greater than zero, each model slot runs a single long-lived ModelRunner
+# process that keeps recently-used models loaded in memory between runs, so
+# that swapping a model back in doesn't require loading it from its checkpoint.
+# The value is the memory budget in megabytes for the loaded models of each
+# slot, estimated from the sizes of their checkpoints; least-recently-used
+# models are unloaded to stay within the budget. When 0, a new ModelRunner
+# process is started for each run of a model.
+resident_models_memory_budget_mb = 0
+
+# When true, full model checkpoints are committed to disk in the background
+# while the model processes its next run of input batches; the request batches
+# of a run are acknowledged only after its checkpoint becomes durable.
+background_full_checkpoints = false
+
+
+[scheduling]
+# Policy for choosing the waiting model to run next and the running model to
+# preempt when all model slots are busy:
+#   fifo: waiting models run in order of arrival; the least-recently-active
+#     running model is preempted first
+#   priority_cost: models are ordered by the time of their input activity,
+#     advanced by the schedulingPriority of their model definition and set back
+#     by the depth of their pending input and by the size of their checkpoint,
+#     per the weights below. Real-time models thus take precedence over models
+#     that are backfilling large volumes of data.
+policy = fifo
+
+# (priority_cost) Seconds of precedence per unit of schedulingPriority
+priority_weight_sec = 60
+
+# (priority_cost) Seconds of precedence lost per doubling of the number of a
+# model's pending input batches
+input_depth_weight_sec = 10
+
+# (priority_cost) Seconds of precedence lost by a waiting model, and gained by a
+# running model, per megabyte of its checkpoint
+load_cost_weight_sec_per_mb = 0.5
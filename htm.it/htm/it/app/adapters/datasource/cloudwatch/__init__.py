@@ -476,6 +476,42 @@ class _CloudwatchDatasourceAdapter(DatasourceAdapterIface):
     return metricAdapter.getMetricData(start, end)
 
 
+  def getMetricDataBatch(self, requests):  # pylint: disable=R0201
+    """ Retrieve data of many metrics, fetching the data of metrics that share
+    region and period with few CloudWatch requests
+
+    :param requests: sequence of two-tuples (<metricSpec>, <start>), where
+      <metricSpec> is the metric specification for Cloudwatch-based model (see
+      monitorMetric()) and <start> is the UTC start time of the metric's data
+      range per getMetricData(); the end of the range is the current UTC time
+
+    :returns: list of results corresponding to the given requests; each result
+      is either the two-tuple (<data-sequence>, <next-start-time>) per
+      getMetricData or an Exception-based object if the metric's data couldn't
+      be retrieved
+    :rtype: list
+    """
+    results = [None] * len(requests)
+
+    # Requests with valid metric specs: (requestIndex, (metricAdapter, start))
+    adapterRequests = []
+
+    for i, (metricSpec, start) in enumerate(requests):
+      try:
+        adapterRequests.append(
+          (i, (AWSResourceAdapterBase.createMetricAdapter(metricSpec), start)))
+      except htm.it.app.exceptions.MetricNotSupportedError as e:
+        results[i] = e
+
+    batchResults = AWSResourceAdapterBase.getMetricDataBatch(
+      [request for _, request in adapterRequests])
+
+    for (i, _), result in zip(adapterRequests, batchResults):
+      results[i] = result
+
+    return results
+
+
   def describeRegions(self):  # pylint: disable=R0201
     """ Describe AWS regions
 
@@ -27,10 +27,12 @@ import collections
 import datetime
 import logging
 import math
+import os
 
 import boto.ec2
 import boto.ec2.cloudwatch
 import boto.exception
+import boto.utils
 
 
 import htm.it.app
@@ -69,6 +71,75 @@ class ResourceTypeNames(object):
 
 
 
+def _parseCloudWatchTimestamp(value):
+  """ Parse a timestamp of CloudWatch results; much faster than
+  boto.utils.parse_ts, which it falls back to, for the common
+  "YYYY-MM-DDTHH:MM:SSZ" format
+
+  :returns: naive UTC datetime.datetime
+  """
+  if len(value) == 20 and value[-1] == "Z":
+    return datetime.datetime(int(value[0:4]), int(value[5:7]),
+                             int(value[8:10]), int(value[11:13]),
+                             int(value[14:16]), int(value[17:19]))
+
+  return boto.utils.parse_ts(value)
+
+
+
+class _MetricDataResults(object):
+  """ Target of boto's XmlHandler for parsing the response of the CloudWatch
+  GetMetricData action, which boto's CloudWatchConnection doesn't support
+  natively
+  """
+
+  def __init__(self, connection):  # pylint: disable=W0613
+    # Map of metric data query IDs to lists of (timestamp, value) data points
+    self.series = dict()
+
+    # Token for requesting the next page of results; None if this is the last
+    # page
+    self.nextToken = None
+
+    # Path of the elements being parsed
+    self._path = []
+
+    # State of the MetricDataResults member being parsed
+    self._queryID = None
+    self._timestamps = []
+    self._values = []
+
+
+  def startElement(self, name, attrs, connection):  # pylint: disable=W0613
+    self._path.append(name)
+
+    if self._path[-2:] == ["MetricDataResults", "member"]:
+      self._queryID = None
+      self._timestamps = []
+      self._values = []
+
+    return None
+
+
+  def endElement(self, name, value, connection):  # pylint: disable=W0613
+    parent = self._path[-2] if len(self._path) > 1 else None
+
+    if name == "member" and parent == "Timestamps":
+      self._timestamps.append(_parseCloudWatchTimestamp(value))
+    elif name == "member" and parent == "Values":
+      self._values.append(float(value))
+    elif name == "Id" and self._path[-3:-1] == ["MetricDataResults", "member"]:
+      self._queryID = value
+    elif name == "member" and parent == "MetricDataResults":
+      self.series.setdefault(self._queryID, []).extend(
+        zip(self._timestamps, self._values))
+    elif name == "NextToken":
+      self.nextToken = value or None
+
+    self._path.pop()
+
+
+
 class AWSResourceAdapterBase(object):
   """ Base class for AWS Resource Adapters
 
@@ -81,6 +152,9 @@ class AWSResourceAdapterBase(object):
   # 60 seconds and must be a multiple of 60.
   METRIC_PERIOD = 300
 
+  # Max number of metric data queries in a CloudWatch GetMetricData request
+  _MAX_METRIC_DATA_QUERIES_PER_REQUEST = 100
+
   #
   # Class attributes required in Resource Adapters
   #
@@ -124,6 +198,12 @@ class AWSResourceAdapterBase(object):
   # This is populated by the metric adapter decorator.
   _defaultMetricRegistry = collections.defaultdict(list)
 
+  # Cache of CloudWatch connections used by getMetricDataBatch, so that each
+  # process reuses one connection per region
+  # key: (process-id, region, aws-access-key-id, aws-secret-access-key)
+  # value: boto.ec2.cloudwatch.CloudWatchConnection
+  _cloudwatchConnectionCache = dict()
+
 
   def __init__(self, region, dimensions):
     """
@@ -316,6 +396,105 @@ class AWSResourceAdapterBase(object):
     return (samples, nextCallStartTime)
 
 
+  @classmethod
+  def getMetricDataBatch(cls, requests, end=None):
+    """ Retrieve data of many metrics. Metrics are grouped by region, period
+    and time range, and the data of up to _MAX_METRIC_DATA_QUERIES_PER_REQUEST
+    metrics of a group is fetched per CloudWatch request over a connection
+    that's reused for all requests to the group's region.
+
+    The result for each metric is the same as that of its adapter's
+    getMetricData(start, end).
+
+    :param requests: sequence of two-tuples (<metric-adapter>, <start>), where
+      <metric-adapter> is an AWSResourceAdapterBase-based metric adapter and
+      <start> is the start argument of its getMetricData method
+
+    :param end: UTC end time of the metric data range; see getMetricData
+    :type end: datetime.datetime
+
+    :returns: list of results corresponding to the given requests; each result
+      is either the two-tuple (<data-sequence>, <next-start-time>) per
+      getMetricData or an Exception-based object if the metric's data couldn't
+      be retrieved
+    :rtype: list
+    """
+    results = [None] * len(requests)
+
+    # Time ranges pending retrieval: (requestIndex, fromDate, toDate, endDate)
+    pending = []
+
+    for i, (adapter, start) in enumerate(requests):
+      period = adapter.METRIC_PERIOD
+
+      fromDate, toDate = cloudwatch_utils.normalizeMetricCollectionTimeRange(
+        startTime=start,
+        endTime=end,
+        period=period)
+
+      if toDate <= fromDate:
+        adapter._log.warning(  # pylint: disable=W0212
+          "The requested date range=[%s..%s] is less than period=%ss; "
+          "adapter=%r", start, end, period, adapter)
+        results[i] = ([], fromDate)
+      else:
+        pending.append((i, fromDate, toDate, end or toDate))
+
+    while pending:
+      groups = collections.OrderedDict()
+      for entry in pending:
+        adapter = requests[entry[0]][0]
+        groups.setdefault(
+          (adapter._getCloudWatchRegion(),  # pylint: disable=W0212
+           adapter.METRIC_PERIOD, entry[1], entry[2]),
+          []).append(entry)
+
+      pending = []
+
+      for (region, period, fromDate, toDate), entries in groups.iteritems():
+        for j in xrange(0, len(entries),
+                        cls._MAX_METRIC_DATA_QUERIES_PER_REQUEST):
+          chunk = entries[j:j + cls._MAX_METRIC_DATA_QUERIES_PER_REQUEST]
+
+          try:
+            seriesList = cls._queryCloudWatchMetricDataBatch(
+              region=region,
+              adapters=[requests[entry[0]][0] for entry in chunk],
+              period=period,
+              start=fromDate,
+              end=toDate)
+          except Exception as ex:  # pylint: disable=W0703
+            if (isinstance(ex, boto.exception.BotoServerError) and
+                ex.status == 400 and ex.error_code == "Throttling"):
+              ex = htm.it.app.exceptions.MetricThrottleError(repr(ex))
+
+            for entry in chunk:
+              results[entry[0]] = ex
+            continue
+
+          for (i, _, _, endDate), samples in zip(chunk, seriesList):
+            if samples:
+              samples.sort(key=lambda sample: sample[0])
+              results[i] = (
+                samples,
+                samples[-1][0] + datetime.timedelta(seconds=period))
+              continue
+
+            # Try the next range
+            nextFromDate, nextToDate = (
+              cloudwatch_utils.normalizeMetricCollectionTimeRange(
+                startTime=toDate,
+                endTime=endDate,
+                period=period))
+
+            if nextFromDate < nextToDate:
+              pending.append((i, nextFromDate, nextToDate, endDate))
+            else:
+              results[i] = ([], nextFromDate)
+
+    return results
+
+
   def getMetricStatistics(self, start, end):
     """ Retrieve metric data statistics for the given time range
 
@@ -714,6 +893,18 @@ class AWSResourceAdapterBase(object):
     return None
 
 
+  def _getCloudWatchRegion(self):
+    """ Get the AWS region whose CloudWatch serves this adapter's metric data
+
+    NOTE: derived classes may override this method for metrics that CloudWatch
+      serves from a fixed region
+
+    :returns: AWS region name (e.g., "us-west-2"); the resource's region by
+      default
+    """
+    return self._region
+
+
   @cloudwatch_utils.retryOnCloudWatchTransientError()
   def _queryCloudWatchMetricStats(self, period, start, end, stats, region=None):
     """ Retrieve the  time-series data for requested statistics of a given
@@ -755,8 +946,8 @@ class AWSResourceAdapterBase(object):
       as a "Timestamp" property. The "Timestamp" property is a datatime.datetime
       object.
     """
-    connection = self._connectToAWSService(boto.ec2.cloudwatch,
-                                           region or self._region)
+    connection = self._connectToAWSService(
+      boto.ec2.cloudwatch, region or self._getCloudWatchRegion())
     data = connection.get_metric_statistics(
         period=period,
         start_time=start,
@@ -768,6 +959,101 @@ class AWSResourceAdapterBase(object):
         unit=self.UNIT)
     return data
 
+
+  @classmethod
+  @cloudwatch_utils.retryOnCloudWatchTransientError()
+  def _queryCloudWatchMetricDataBatch(cls, region, adapters, period, start,
+                                      end):
+    """ Retrieve the time-series data of the given metrics via one CloudWatch
+    GetMetricData request, following up with requests for subsequent pages of
+    results, if any
+
+    :param region: AWS region name of the metrics (e.g., "us-west-2")
+
+    :param adapters: sequence of up to _MAX_METRIC_DATA_QUERIES_PER_REQUEST
+      metric adapters
+
+    :param period: The granularity, in seconds, of the requested datapoints.
+      Period must be at least 60 seconds and must be a multiple of 60.
+    :type period: integer
+
+    :param start: UTC start time of the metric data range. The start value
+      is inclusive: results include datapoints with the time stamp specified.
+    :type start: datetime.datetime
+
+    :param end: UTC end time of the metric data range. The end value is
+      exclusive; results will include datapoints predating the time stamp
+      specified.
+    :type end: datetime.datetime
+
+    :returns: list of data point lists corresponding to the given adapters;
+      each data point is a two-tuple (<datetime timestamp>, <value>)
+    """
+    params = {
+      "StartTime": start.isoformat(),
+      "EndTime": end.isoformat(),
+      "ScanBy": "TimestampAscending"
+    }
+
+    for i, adapter in enumerate(adapters, 1):
+      prefix = "MetricDataQueries.member.%d." % (i,)
+      params[prefix + "Id"] = "m%d" % (i,)
+      params[prefix + "MetricStat.Metric.Namespace"] = adapter.NAMESPACE
+      params[prefix + "MetricStat.Metric.MetricName"] = adapter.METRIC_NAME
+
+      dimensions = adapter._dimensions  # pylint: disable=W0212
+      for j, (name, value) in enumerate(sorted(dimensions.iteritems()), 1):
+        dimensionPrefix = prefix + "MetricStat.Metric.Dimensions.member.%d." % (
+          j,)
+        params[dimensionPrefix + "Name"] = name
+        params[dimensionPrefix + "Value"] = value
+
+      params[prefix + "MetricStat.Period"] = period
+      params[prefix + "MetricStat.Stat"] = adapter.STATISTIC
+      if adapter.UNIT is not None:
+        params[prefix + "MetricStat.Unit"] = adapter.UNIT
+
+    connection = cls._getCloudWatchConnection(region)
+
+    series = dict()
+    while True:
+      results = connection.get_object("GetMetricData", params,
+                                      _MetricDataResults, verb="POST")
+
+      for queryID, samples in results.series.iteritems():
+        series.setdefault(queryID, []).extend(samples)
+
+      if results.nextToken is None:
+        break
+
+      params["NextToken"] = results.nextToken
+
+    return [series.get("m%d" % (i,), []) for i in xrange(1, len(adapters) + 1)]
+
+
+  @classmethod
+  def _getCloudWatchConnection(cls, region):
+    """ Get this process's cached CloudWatch connection to the given region,
+    connecting on first use
+
+    :param region: The name of AWS Region to connect to (e.g., "us-west-2")
+
+    :returns: boto.ec2.cloudwatch.CloudWatchConnection object
+
+    :raises htm.it.app.exceptions.InvalidAWSRegionName:
+    """
+    authArgs = cls._getFreshAWSAuthenticationArgs()
+
+    key = (os.getpid(), region, authArgs["aws_access_key_id"],
+           authArgs["aws_secret_access_key"])
+
+    connection = AWSResourceAdapterBase._cloudwatchConnectionCache.get(key)
+    if connection is None:
+      connection = cls._connectToAWSService(boto.ec2.cloudwatch, region)
+      AWSResourceAdapterBase._cloudwatchConnectionCache[key] = connection
+
+    return connection
+
   @classmethod
   def _connectToAWSService(cls, serviceModule, region):
     """ Connect to AWS service
@@ -100,10 +100,10 @@ class OpsWorksAdapter(AWSResourceAdapterBase):
     return stackList
 
 
-  def _queryCloudWatchMetricStats(self, period, start, end, stats):
-    """Override to hard-code us-east-1 region."""
-    return super(OpsWorksAdapter, self)._queryCloudWatchMetricStats(
-        period, start, end, stats, "us-east-1")
+  def _getCloudWatchRegion(self):
+    """Override to hard-code us-east-1 region, where CloudWatch serves the
+    metrics of OpsWorks stacks of all regions."""
+    return "us-east-1"
 
 
 
@@ -40,6 +40,7 @@ from htm.it.app.repository.queries import (
   addDeviceNotificationSettings,
   addMetric,
   addMetricData,
+  addMetricDataBatch,
   addMetricToAutostack,
   addNotification,
   batchAcknowledgeNotifications,
@@ -75,9 +76,11 @@ from htm.it.app.repository.queries import (
   getMetric,
   getMetricWithSharedLock,
   getMetricWithUpdateLock,
+  getMetricsWithUpdateLock,
   getMetricCountForServer,
   getMetricData,
   getMetricDataCount,
+  getMetricDataPerMetric,
   getProcessedMetricDataCount,
   getMetricDataWithRawAnomalyScoresTail,
   getMetricIdsSortedByDisplayValue,
@@ -94,6 +97,8 @@ from htm.it.app.repository.queries import (
   updateMetricColumns,
   updateMetricColumnsForRefStatus,
   updateMetricDataColumns,
+  updateMetricDataScoresBulk,
+  updateMetricDisplayValueRollup,
   updateNotificationDeviceTimestamp,
   updateNotificationMessageId,
   lockOperationExclusive,
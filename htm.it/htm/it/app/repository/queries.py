@@ -44,6 +44,7 @@ from htmengine.utils import jsonDecode
 from htmengine.repository.queries import (
   addMetric,
   addMetricData,
+  addMetricDataBatch,
   deleteMetric,
   deleteModel as htmengineDeleteModel,
   getCustomMetrics,
@@ -57,6 +58,7 @@ from htmengine.repository.queries import (
   getMetricCountForServer,
   getMetricData,
   getMetricDataCount,
+  getMetricDataPerMetric,
   getMetricDataWithRawAnomalyScoresTail,
   getMetricIdsSortedByDisplayValue,
   _getMetricImpl,
@@ -64,6 +66,7 @@ from htmengine.repository.queries import (
   getMetricStats,
   getMetricWithSharedLock,
   getMetricWithUpdateLock,
+  getMetricsWithUpdateLock,
   getProcessedMetricDataCount,
   getUnprocessedModelDataCount,
   incrementMetricRowid,
@@ -72,6 +75,8 @@ from htmengine.repository.queries import (
   updateMetricColumns,
   updateMetricColumnsForRefStatus,
   updateMetricDataColumns,
+  updateMetricDataScoresBulk,
+  updateMetricDisplayValueRollup,
   MetricStatus,
   OperationLock,
   saveMetricInstanceStatus,
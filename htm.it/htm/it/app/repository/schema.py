@@ -39,7 +39,8 @@ from htmengine.repository.schema import (instance_status_history,
                                          lock,
                                          metadata,
                                          metric,
-                                         metric_data)
+                                         metric_data,
+                                         metric_display_value_rollup)
 #pylint: enable=W0611
 
 
@@ -27,14 +27,14 @@ TODO: Need unit test for metric error grace period logic (see
 """
 from collections import defaultdict, OrderedDict
 from datetime import datetime
+import heapq
+import itertools
 import logging
 import multiprocessing
+import Queue
 import sys
-import threading
 import time
 
-from nupic.support.decorators import logExceptions
-
 from htm.it import htm_it_logging, logging_support
 import htm.it.app
 import htm.it.app.exceptions as app_exceptions
@@ -50,16 +50,15 @@ from htmengine.model_swapper.model_swapper_interface import (
 )
 
 from htm.it.app import repository
+from htm.it.app.aws import cloudwatch_utils
 from htm.it.app.repository.queries import MetricStatus
 
-from nta.utils.error_handling import abortProgramOnAnyException
+from nta.utils.date_time_utils import epochFromNaiveUTCDatetime
 
 
 
 _MODULE_NAME = "htm.it.metric_collector"
 
-_EXIT_CODE_ON_UNHANDLED_EXCEPTION_IN_THREAD = 1
-
 
 def _getLogger():
   return htm_it_logging.getExtendedLogger(_MODULE_NAME)
@@ -70,10 +69,10 @@ class _DataCollectionTask(object):
   """ Data collection task parameters for data collection worker process
   """
   __slots__ = ("metricID", "datasource", "metricSpec", "rangeStart",
-               "metricPeriod", "updateResourceStatus", "resultsQueue")
+               "metricPeriod", "updateResourceStatus")
 
   def __init__(self, metricID, datasource, metricSpec, rangeStart, metricPeriod,
-               updateResourceStatus, resultsQueue):
+               updateResourceStatus):
     """
     :param metricID: unique id of the metric associated with the task (presently
       only for diagnostics)
@@ -82,7 +81,6 @@ class _DataCollectionTask(object):
     :param rangeStart: start of data query range: datetime or None
     :param metricPeriod: metric data period in seconds
     :param updateResourceStatus: True to query the resource's status.
-    :param resultsQueue: Results Queue
     """
     # TODO: unit-test
 
@@ -92,7 +90,6 @@ class _DataCollectionTask(object):
     self.rangeStart = rangeStart
     self.metricPeriod = metricPeriod
     self.updateResourceStatus = updateResourceStatus
-    self.resultsQueue = resultsQueue
 
 
   def __repr__(self):
@@ -154,6 +151,24 @@ class _DataCollectionResult(object):
 
 
 
+class _PendingCollectionTask(object):
+  """ Bookkeeping of a data collection task submitted to the process pool
+  """
+  __slots__ = ("metricIDs", "asyncResult", "deadline",)
+
+
+  def __init__(self, metricIDs, asyncResult, deadline):
+    """
+    :param metricIDs: unique ids of the metrics collected by the task
+    :param asyncResult: multiprocessing.pool.AsyncResult of the task
+    :param deadline: unix epoch time by which the task's results are expected
+    """
+    self.metricIDs = metricIDs
+    self.asyncResult = asyncResult
+    self.deadline = deadline
+
+
+
 class _MetricInfoCacheItem(object):
   """ Information for optimizing metric's data polling. One of these is cached
   in memory for each metric whose data we attempted to collect. Each item
@@ -223,8 +238,31 @@ class MetricCollector(object):
   # Number of concurrent worker processes used for querying metrics
   _WORKER_PROCESS_POOL_SIZE = 10
 
-  # Amount of time to sleep when there are no metrics pending data collection
-  _NO_PENDING_METRICS_SLEEP_SEC = 10
+  # Max number of collection tasks submitted to the process pool per worker
+  # process; the surplus keeps the workers busy while the run-loop processes
+  # collection results
+  _MAX_PENDING_TASKS_PER_WORKER = 2
+
+  # Max number of metrics per collection task; a task's metrics share
+  # datasource, region and period, so that the worker can retrieve their data
+  # with few datasource requests
+  _MAX_METRICS_PER_TASK = 50
+
+  # Max time from submission of a collection task to the process pool until its
+  # results are processed; the metrics of a task that exceeds it (e.g., its
+  # worker process died) are released for collection again
+  _COLLECTION_TASK_TIMEOUT_SEC = 5 * 60
+
+  # Max interval between queries for metrics pending data collection; picks up
+  # new metrics and metrics whose next due time we can't predict
+  _CANDIDATE_METRICS_REFRESH_INTERVAL_SEC = 10
+
+  # Min interval between queries for metrics pending data collection; coalesces
+  # the queries triggered by metrics coming due around the same time
+  _MIN_CANDIDATE_METRICS_REFRESH_INTERVAL_SEC = 1
+
+  # Interval between logging of collection statistics
+  _STATS_LOG_INTERVAL_SEC = 60
 
   # Metric's period times this number is the duration of the metric's quarantine
   # time after a mettic errors out or returns empty data
@@ -239,7 +277,6 @@ class MetricCollector(object):
   # passes since last access to the item
   _METRIC_INFO_CACHE_ITEM_EXPIRATION_SEC = (60 * 60)
 
-  _SENTINEL = None
 
   def __init__(self):
     self._log = htm_it_logging.getExtendedLogger(self.__class__.__name__)
@@ -274,35 +311,74 @@ class MetricCollector(object):
     # corresponding values are _ResourceInfoCacheItem objects.
     self._resourceInfoCache = defaultdict(_ResourceInfoCacheItem)
 
-    self.metricStreamer = MetricStreamer()
+    # Metrics that are due for data collection and are waiting for their turn
+    # to be submitted to the process pool, in order of arrival. The keys are
+    # metric uid's and corresponding values are Metric instances.
+    self._readyMetrics = OrderedDict()
 
+    # Metrics whose collection tasks were submitted to the process pool and
+    # whose results haven't been processed yet. The keys are metric uid's and
+    # corresponding values are Metric instances.
+    self._inFlightMetrics = dict()
 
+    # Collection tasks submitted to the process pool whose results haven't
+    # been processed yet. The keys are task ids and corresponding values are
+    # _PendingCollectionTask instances.
+    self._pendingTasks = dict()
 
-  def _collectDataForMetrics(self, metricsToUpdate, processPool, resultsQueue):
-    """ Collect data for the given metrics
+    # Source of collection task ids
+    self._taskIDs = itertools.count()
 
-    :param metricsToUpdate: a dict of Metric instances which are due for
-      an update
+    # Min-heap of (dueTime, metricID) of metrics expected to come due for data
+    # collection at the given unix epoch time; each one triggers a query for
+    # metrics pending data collection at that time
+    self._dueTimes = []
 
-    :param processPool: Process poll in which collection tasks are mapped.
+    # Unix epoch time of the last query for metrics pending data collection
+    self._lastRefreshTime = 0
+
+    self.metricStreamer = MetricStreamer()
+
+
+  def _submitCollectionTasks(self, processPool, resultsQueue, maxTasks):
+    """ Submit data collection tasks for metrics in self._readyMetrics to the
+    process pool, moving them to self._inFlightMetrics. Metrics that share
+    datasource, region and period are batched in the same task, up to
+    _MAX_METRICS_PER_TASK metrics per task.
+
+    :param processPool: Process pool to which the collection tasks are
+      submitted
     :type processPool: multiprocessing.Pool
 
-    :param resultsQueue: Results Queue onto which collection results are
-      published
-    :type resultsQueue: multiprocessing.JoinableQueue
+    :param resultsQueue: Queue onto which the process pool's result-handler
+      thread places a (taskID, results) pair, where results is the sequence of
+      _DataCollectionResult objects of the task, when it becomes available
+    :type resultsQueue: Queue.Queue
 
-    :returns: Result of calling `processPool.map_async()`.  Call .wait() on the
-      return value to block until all map tasks have been completed.
-      Meanwhile, you may consume resultsQueue for the results as they become
-      available.
-    :rtype: multiprocessing.pool.AsyncResult
+    :param maxTasks: max number of tasks to submit
     """
-    # Create task parameters for concurrent processing
     now = time.time()
-    tasks = []
-    for metricObj in metricsToUpdate.values():
+
+    # Batches of tasks in order of their first metric's arrival
+    batches = []
+
+    # Map of batch keys to their batches that have room for more tasks
+    openBatches = dict()
+
+    for metricObj in self._readyMetrics.itervalues():
       metricSpec = utils.jsonDecode(metricObj.parameters)["metricSpec"]
 
+      key = (metricObj.datasource, metricSpec.get("region"),
+             metricObj.poll_interval)
+
+      batch = openBatches.get(key)
+      if batch is None:
+        if len(batches) >= maxTasks:
+          continue
+
+        batch = openBatches[key] = []
+        batches.append(batch)
+
       resourceCacheItem = self._resourceInfoCache[metricObj.server]
       if now >= resourceCacheItem.nextResourceStatusUpdateTime:
         updateResourceStatus = True
@@ -311,19 +387,68 @@ class MetricCollector(object):
       else:
         updateResourceStatus = False
 
-      task = _DataCollectionTask(
+      batch.append(_DataCollectionTask(
         metricID=metricObj.uid,
         datasource=metricObj.datasource,
         metricSpec=metricSpec,
         rangeStart=metricObj.last_timestamp,
         metricPeriod=metricObj.poll_interval,
-        updateResourceStatus=updateResourceStatus,
-        resultsQueue=resultsQueue)
+        updateResourceStatus=updateResourceStatus))
+
+      if len(batch) >= self._MAX_METRICS_PER_TASK:
+        del openBatches[key]
+
+    for batch in batches:
+      for task in batch:
+        self._inFlightMetrics[task.metricID] = (
+          self._readyMetrics.pop(task.metricID))
+
+      # _collect handles its own errors, but the callback isn't called if the
+      # task fails in the process pool itself (e.g., its results can't be
+      # pickled) or never completes (e.g., its worker process died); see
+      # _releaseFailedCollectionTasks
+      taskID = next(self._taskIDs)
+      asyncResult = processPool.apply_async(
+        _collect, (batch,),
+        callback=lambda results, taskID=taskID: resultsQueue.put(
+          (taskID, results)))
+
+      self._pendingTasks[taskID] = _PendingCollectionTask(
+        metricIDs=[task.metricID for task in batch],
+        asyncResult=asyncResult,
+        deadline=now + self._COLLECTION_TASK_TIMEOUT_SEC)
+
+
+  def _releaseFailedCollectionTasks(self):
+    """ Drop the pending collection tasks that failed in the process pool or
+    missed their deadline, and release their metrics from
+    self._inFlightMetrics, so that the next refresh of metrics pending data
+    collection picks them up again.
+    """
+    now = time.time()
+
+    for taskID, pendingTask in self._pendingTasks.items():
+      if pendingTask.asyncResult.ready():
+        if pendingTask.asyncResult.successful():
+          # Its results are on the results queue
+          continue
 
-      tasks.append(task)
+        error = None
+        try:
+          pendingTask.asyncResult.get(0)
+        except Exception as e: # pylint: disable=W0703
+          error = e
+        self._log.error("Collection task failed for metrics=%s: %r",
+                        pendingTask.metricIDs, error)
+      elif now >= pendingTask.deadline:
+        self._log.error("Collection task timed out for metrics=%s",
+                        pendingTask.metricIDs)
+      else:
+        continue
 
-    # Process the tasks concurrently, return immediately
-    return processPool.map_async(_collect, tasks)
+      del self._pendingTasks[taskID]
+      for metricID in pendingTask.metricIDs:
+        self._inFlightMetrics.pop(metricID, None)
 
 
   def _garbageCollectInfoCache(self):
@@ -581,63 +706,90 @@ class MetricCollector(object):
     return (numEmpty, numErrors)
 
 
-  @abortProgramOnAnyException(
-    _EXIT_CODE_ON_UNHANDLED_EXCEPTION_IN_THREAD,
-    logger=_getLogger())
-  @logExceptions(_getLogger)
-  def _processAndDispatchThreadTarget(self, engine, metricsToUpdate,
-                                      resultsQueue, modelSwapper, statsPipe):
-    """ Process collected metrics data; publish it on the destination
-    message queue, and update metric instance status and metric collection
-    state.
+  def _refreshReadyMetrics(self, engine):
+    """ Query metrics that are due for an update and merge them into
+    self._readyMetrics: metrics that are already waiting keep their place in
+    line and get their refreshed Metric instances, newly-due metrics are added
+    at the end, and metrics that are no longer due are dropped. Metrics whose
+    collection is in flight are skipped.
 
     :param engine: SQLAlchemy engine object
     :type engine: sqlalchemy.engine.Engine
+    """
+    now = self._lastRefreshTime = time.time()
 
-    :param metricsToUpdate: a sequence of Metric instances which were due for
-      an update
-    :type metricsToUpdate: collections.OrderedDict
+    # Drop the expected due times that this query accounts for
+    while self._dueTimes and self._dueTimes[0][0] <= now:
+      heapq.heappop(self._dueTimes)
 
-    :param resultsQueue: Queue from which a sequence of _DataCollectionResult
-      instances are processed
-    :type resultsQueue: multiprocessing.JoinableQueue
+    candidates = self._getCandidateMetrics(engine)
+    if not candidates:
+      self._readyMetrics.clear()
+      return
 
-    :param modelSwapper: ModelSwapperInterface object for running models
+    for metricID in self._readyMetrics.keys():
+      if metricID not in candidates:
+        del self._readyMetrics[metricID]
 
-    :param statsPipe: Pipe in which the final statistics are conveyed in the
-      form of a 2-tuple (numEmpty, numErrors), where numEmpty is the count of
-      metrics with empty data (not ready or data gap) numErrors is the count
-      of metrics with errors
-    :type statsPipe: multiprocessing.Pipe (non-duplex)
+    for metricID, metricObj in candidates.iteritems():
+      if metricID not in self._inFlightMetrics:
+        self._readyMetrics[metricID] = metricObj
+
+
+  def _scheduleNextDueTime(self, metricObj, collectResult):
+    """ Predict the time when the metric will come due for its next update,
+    and schedule a query for metrics pending data collection at that time.
+
+    :param metricObj: Metric instance whose collection result was just processed
 
-    :returns: None
+    :param collectResult: the metric's _DataCollectionResult object
     """
-    numEmpty = numErrors = 0
+    dueTime = None
+
+    if (not isinstance(collectResult.data, Exception) and
+        collectResult.nextCallStart is not None):
+      # NOTE: this must be coordinated with
+      # repository._getCloudwatchMetricReadinessPredicate()
+      dueTime = (
+        epochFromNaiveUTCDatetime(collectResult.nextCallStart) +
+        metricObj.poll_interval +
+        cloudwatch_utils.getMetricCollectionBackoffSeconds(
+          metricObj.poll_interval))
 
-    while True:
-      try:
-        collectResult = resultsQueue.get(True)
+    quarantineEndTime = self._metricInfoCache[metricObj.uid].quarantineEndTime
+    if quarantineEndTime > time.time():
+      dueTime = (quarantineEndTime if dueTime is None
+                 else max(dueTime, quarantineEndTime))
 
-        if collectResult is self._SENTINEL:
-          # There are no more results to process
-          break
+    if dueTime is not None:
+      heapq.heappush(self._dueTimes, (dueTime, metricObj.uid))
 
-        stats = self._processCollectedData(engine,
-                                           metricsToUpdate,
-                                           modelSwapper,
-                                           collectResult)
-        numEmpty += stats[0]
-        numErrors += stats[1]
 
-      finally:
-        resultsQueue.task_done()
+  def _getNextRefreshTime(self):
+    """ Get the time of the next query for metrics pending data collection
 
-    statsPipe.send((numEmpty, numErrors))
+    :returns: unix epoch time
+    """
+    refreshTime = (self._lastRefreshTime +
+                   self._CANDIDATE_METRICS_REFRESH_INTERVAL_SEC)
 
+    if self._dueTimes:
+      refreshTime = min(
+        refreshTime,
+        max(self._dueTimes[0][0],
+            (self._lastRefreshTime +
+             self._MIN_CANDIDATE_METRICS_REFRESH_INTERVAL_SEC)))
+
+    return refreshTime
 
 
   def run(self):
     """ Collect metric data and status for active metrics
+
+    Metrics are collected continuously rather than in rounds: each metric is
+    submitted to the process pool as soon as it comes due and a worker is
+    available, and its result is processed as soon as it arrives, so a slow
+    datasource call doesn't hold up collection of other metrics.
     """
     # NOTE: the process pool must be created BEFORE this main (parent) process
     # creates any global or class-level shared resources (e.g., boto
@@ -647,74 +799,97 @@ class MetricCollector(object):
     # can't take advantage of the process Pool's maxtasksperchild feature
     # either (for the same reason)
     self._log.info("Starting htm-it Metric Collector")
-    resultsQueue = multiprocessing.Manager().JoinableQueue()
 
-    recvPipe, sendPipe = multiprocessing.Pipe(False)
+    # Collection results arrive over the process pool's own result pipe and are
+    # placed on this queue by the pool's result-handler thread
+    resultsQueue = Queue.Queue()
 
     processPool = multiprocessing.Pool(
       processes=self._WORKER_PROCESS_POOL_SIZE,
       maxtasksperchild=None)
 
+    maxPendingTasks = (self._WORKER_PROCESS_POOL_SIZE *
+                       self._MAX_PENDING_TASKS_PER_WORKER)
+
+    statsStartTime = time.time()
+    numProcessed = numEmpty = numErrors = 0
+
     try:
       with ModelSwapperInterface() as modelSwapper:
         engine = repository.engineFactory()
         while True:
-          startTime = time.time()
+          now = time.time()
 
-          if startTime > self._nextCacheGarbageCollectionTime:
+          if now > self._nextCacheGarbageCollectionTime:
             # TODO: unit-test
             self._garbageCollectInfoCache()
 
-          # Determine which metrics are due for an update
-          metricsToUpdate = self._getCandidateMetrics(engine)
-
-          filterDuration = time.time() - startTime
-
-          if not metricsToUpdate:
-            time.sleep(self._NO_PENDING_METRICS_SLEEP_SEC)
-            continue
-
-          # Collect metric data
-          collectionStartTime = time.time()
-
-          poolResults = self._collectDataForMetrics(metricsToUpdate,
-                                                    processPool,
-                                                    resultsQueue)
-
-          # Process/dispatch results in parallel in another thread as results
-          # become available in resultsQueue
-          dispatchThread = (
-            threading.Thread(target=self._processAndDispatchThreadTarget,
-                             args=(engine,
-                                   metricsToUpdate,
-                                   resultsQueue,
-                                   modelSwapper,
-                                   sendPipe)))
-          dispatchStartTime = time.time()
-          dispatchThread.start()
-
-          # Syncronize with processPool
-          poolResults.wait() # Wait for collection tasks to complete
-
-          metricPollDuration = time.time() - collectionStartTime
-
-          resultsQueue.join() # Block until all tasks completed...
-
-          # Syncronize with dispatchThread
-          resultsQueue.put(self._SENTINEL) # Signal to dispatchThread that
-                                           # there are no more results to
-                                           # process.
-          resultsQueue.join()
-          numEmpty, numErrors = recvPipe.recv() # Get dispatchThread stats
-
-          dispatchDuration = time.time() - dispatchStartTime
-
-          self._log.info(
-            "Processed numMetrics=%d; numEmpty=%d; numErrors=%d; "
-            "duration=%.4fs (filter=%.4fs; query=%.4fs; dispatch=%.4fs)",
-            len(metricsToUpdate), numEmpty, numErrors,
-            time.time() - startTime, filterDuration,
-            metricPollDuration, dispatchDuration)
+          if now >= self._getNextRefreshTime():
+            # Determine which metrics are due for an update
+            self._refreshReadyMetrics(engine)
+
+          # Keep the process pool supplied with collection tasks
+          if (self._readyMetrics and
+              len(self._pendingTasks) < maxPendingTasks):
+            self._submitCollectionTasks(
+              processPool,
+              resultsQueue,
+              maxTasks=maxPendingTasks - len(self._pendingTasks))
+
+          # Wait for the next task's results, but no longer than the next
+          # refresh of metrics pending data collection or the earliest task
+          # deadline
+          wakeTime = min(
+            [self._getNextRefreshTime()] +
+            [pendingTask.deadline
+             for pendingTask in self._pendingTasks.itervalues()])
+          timeout = max(wakeTime - time.time(), 0)
+          try:
+            taskResults = resultsQueue.get(True, timeout)
+          except Queue.Empty:
+            taskResults = None
+
+          while taskResults is not None:
+            taskID, collectResults = taskResults
+
+            if self._pendingTasks.pop(taskID, None) is None:
+              # The task timed out and its metrics were already released
+              self._log.warning("Dropped late results of collection task=%s",
+                                collectResults)
+              collectResults = ()
+
+            for collectResult in collectResults:
+              metricObj = self._inFlightMetrics[collectResult.metricID]
+
+              stats = self._processCollectedData(engine,
+                                                 self._inFlightMetrics,
+                                                 modelSwapper,
+                                                 collectResult)
+              numProcessed += 1
+              numEmpty += stats[0]
+              numErrors += stats[1]
+
+              del self._inFlightMetrics[collectResult.metricID]
+              self._scheduleNextDueTime(metricObj, collectResult)
+
+            # Process the results of other tasks that are already available
+            try:
+              taskResults = resultsQueue.get_nowait()
+            except Queue.Empty:
+              taskResults = None
+
+          self._releaseFailedCollectionTasks()
+
+          now = time.time()
+          if now >= statsStartTime + self._STATS_LOG_INTERVAL_SEC:
+            self._log.info(
+              "Processed numMetrics=%d; numEmpty=%d; numErrors=%d; "
+              "duration=%.4fs; numReady=%d; numInFlight=%d",
+              numProcessed, numEmpty, numErrors, now - statsStartTime,
+              len(self._readyMetrics), len(self._inFlightMetrics))
+
+            statsStartTime = now
+            numProcessed = numEmpty = numErrors = 0
     finally:
       self._log.info("Exiting Metric Collector run-loop")
       processPool.terminate()
@@ -722,43 +897,55 @@ class MetricCollector(object):
 
 
 
-def _collect(task):
-  """ Executed via multiprocessing Pool: Collect metric data and corresponding
-  resource status.
+def _collect(tasks):
+  """ Executed via multiprocessing Pool: Collect data of a batch of metrics and
+  corresponding resource statuses.
+
+  :param tasks: sequence of _DataCollectionTask instances of metrics that share
+    datasource, region and period
 
-  :param task: a _DataCollectionTask instance
+  :returns: list of _DataCollectionResult instances corresponding to the given
+    tasks; it's conveyed to the parent process over the pool's result pipe
   """
   log = htm_it_logging.getExtendedLogger(MetricCollector.__name__)
 
   startTime = time.time()
 
-  result = _DataCollectionResult(metricID=task.metricID)
+  results = [_DataCollectionResult(metricID=task.metricID) for task in tasks]
 
   dsAdapter = None
 
   try:
-    dsAdapter = createDatasourceAdapter(task.datasource)
-    result.data, result.nextCallStart = dsAdapter.getMetricData(
-      metricSpec=task.metricSpec,
-      start=task.rangeStart,
-      end=None)
+    dsAdapter = createDatasourceAdapter(tasks[0].datasource)
+    batchData = dsAdapter.getMetricDataBatch(
+      [(task.metricSpec, task.rangeStart) for task in tasks])
   except Exception as e: # pylint: disable=W0703
-    log.exception("getMetricData failed in task=%s", task)
-    result.data = e
+    log.exception("getMetricDataBatch failed in tasks=%s", tasks)
+    batchData = [e] * len(tasks)
 
-  try:
-    if task.updateResourceStatus:
-      result.resourceStatus = dsAdapter.getMetricResourceStatus(
-        metricSpec=task.metricSpec)
-  except Exception as e: # pylint: disable=W0703
-    log.exception("getMetricResourceStatus failed in task=%s", task)
-    result.resourceStatus = e
+  for task, result, data in zip(tasks, results, batchData):
+    if isinstance(data, Exception):
+      log.error("getMetricData failed in task=%s: %r", task, data)
+      result.data = data
+    else:
+      result.data, result.nextCallStart = data
+
+  collectionDuration = time.time() - startTime
 
-  result.duration = time.time() - startTime
+  for task, result in zip(tasks, results):
+    statusStartTime = time.time()
+
+    try:
+      if task.updateResourceStatus:
+        result.resourceStatus = dsAdapter.getMetricResourceStatus(
+          metricSpec=task.metricSpec)
+    except Exception as e: # pylint: disable=W0703
+      log.exception("getMetricResourceStatus failed in task=%s", task)
+      result.resourceStatus = e
 
-  task.resultsQueue.put(result)
+    result.duration = collectionDuration + time.time() - statusStartTime
 
-  return True
+  return results
 
 
 
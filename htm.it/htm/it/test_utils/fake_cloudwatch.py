@@ -0,0 +1,349 @@
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2015, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+"""
+Local fake of the AWS CloudWatch query API for tests and benchmarks of metric
+data collection.
+
+FakeCloudWatchServer serves the GetMetricStatistics and GetMetricData actions
+over HTTP on the loopback interface, synthesizing deterministic data points
+for any metric, and counts the requests that it receives. Use
+FakeCloudWatchServer.connectToRegion in place of
+boto.ec2.cloudwatch.connect_to_region to direct boto at the fake:
+
+  with FakeCloudWatchServer(latencySec=0.05) as server:
+    with patch("boto.ec2.cloudwatch.connect_to_region",
+               side_effect=server.connectToRegion):
+      ...
+    print server.requestCounts
+"""
+
+import BaseHTTPServer
+import collections
+from datetime import datetime, timedelta
+import SocketServer
+import threading
+import time
+import urlparse
+import zlib
+from xml.sax.saxutils import escape
+
+import boto.ec2.cloudwatch
+from boto.regioninfo import RegionInfo
+
+
+
+_XMLNS = "http://monitoring.amazonaws.com/doc/2010-08-01/"
+
+_EPOCH = datetime.utcfromtimestamp(0)
+
+# Max number of data points returned per GetMetricData request
+_MAX_DATAPOINTS_PER_PAGE = 100800
+
+
+
+def _parseTimestamp(value):
+  """ Parse a timestamp of a CloudWatch request
+
+  :param value: ISO-8601 UTC timestamp with or without the "Z" suffix
+  :returns: naive UTC datetime.datetime
+  """
+  value = value.rstrip("Z")
+  if "." in value:
+    return datetime.strptime(value, "%Y-%m-%dT%H:%M:%S.%f")
+
+  return datetime.strptime(value, "%Y-%m-%dT%H:%M:%S")
+
+
+
+def _formatTimestamp(value):
+  return value.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+
+def generateDatapoints(namespace, metricName, dimensions, period, start, end):
+  """ Synthesize the data points of a metric; the same metric and time range
+  always yield the same data points
+
+  :param namespace: CloudWatch namespace
+  :param metricName: CloudWatch metric name
+  :param dimensions: dict of CloudWatch dimensions
+  :param period: data point period in seconds
+  :param datetime.datetime start: inclusive UTC start of the time range
+  :param datetime.datetime end: exclusive UTC end of the time range
+
+  :returns: list of (<datetime timestamp>, <value>) two-tuples sorted by
+    timestamp; timestamps are aligned on multiples of period since the epoch
+  """
+  seed = zlib.crc32("%s/%s/%r" % (namespace, metricName,
+                                  sorted(dimensions.iteritems())))
+
+  startSec = int((start - _EPOCH).total_seconds())
+  endSec = int((end - _EPOCH).total_seconds())
+
+  datapoints = []
+  for timestampSec in xrange(startSec + (-startSec % period), endSec, period):
+    value = (zlib.crc32(str(timestampSec), seed) & 0xFFFF) / 655.36
+    datapoints.append((_EPOCH + timedelta(seconds=timestampSec), value))
+
+  return datapoints
+
+
+
+def _extractMembers(params, prefix):
+  """ Extract the members of a list parameter of a query API request
+
+  :param params: dict of request parameters
+  :param prefix: parameter name prefix of the list's members, such as
+    "MetricDataQueries.member."
+
+  :returns: list of dicts of the members' sub-parameters, ordered by member
+    index
+  """
+  members = collections.defaultdict(dict)
+  for name, value in params.iteritems():
+    if name.startswith(prefix):
+      index, _, subName = name[len(prefix):].partition(".")
+      members[int(index)][subName] = value
+
+  return [members[index] for index in sorted(members)]
+
+
+
+class _RequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+  """ Handler of CloudWatch query API requests """
+
+  # Keep connections alive, as CloudWatch does
+  protocol_version = "HTTP/1.1"
+
+
+  def log_message(self, *args):
+    pass
+
+
+  def do_GET(self):  # pylint: disable=C0103
+    self._handleRequest(urlparse.urlparse(self.path).query)
+
+
+  def do_POST(self):  # pylint: disable=C0103
+    self._handleRequest(
+      self.rfile.read(int(self.headers.getheader("Content-Length", 0))))
+
+
+  def _handleRequest(self, query):
+    params = dict((name, values[0])
+                  for name, values in urlparse.parse_qs(query).iteritems())
+
+    action = params.get("Action")
+    self.server.fake.countRequest(action)
+
+    if self.server.fake.latencySec:
+      time.sleep(self.server.fake.latencySec)
+
+    if action == "GetMetricStatistics":
+      status, body = 200, self._getMetricStatistics(params)
+    elif action == "GetMetricData":
+      status, body = 200, self._getMetricData(params)
+    else:
+      status = 400
+      body = ("<ErrorResponse xmlns=\"%s\"><Error><Type>Sender</Type>"
+              "<Code>InvalidAction</Code><Message>Unsupported action=%s"
+              "</Message></Error><RequestId>0</RequestId></ErrorResponse>" %
+              (_XMLNS, escape(str(action))))
+
+    self.send_response(status)
+    self.send_header("Content-Type", "text/xml")
+    self.send_header("Content-Length", str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+
+  @staticmethod
+  def _getMetricStatistics(params):
+    dimensions = dict(
+      (member["Name"], member["Value"])
+      for member in _extractMembers(params, "Dimensions.member."))
+    statistics = [params[name] for name in sorted(params)
+                  if name.startswith("Statistics.member.")]
+
+    datapoints = generateDatapoints(
+      namespace=params["Namespace"],
+      metricName=params["MetricName"],
+      dimensions=dimensions,
+      period=int(params["Period"]),
+      start=_parseTimestamp(params["StartTime"]),
+      end=_parseTimestamp(params["EndTime"]))
+
+    members = []
+    for timestamp, value in datapoints:
+      members.append(
+        "<member><Timestamp>%s</Timestamp><Unit>%s</Unit>%s</member>" % (
+          _formatTimestamp(timestamp),
+          escape(params.get("Unit", "None")),
+          "".join("<%s>%r</%s>" % (stat, value, stat) for stat in statistics)))
+
+    return (
+      "<GetMetricStatisticsResponse xmlns=\"%s\"><GetMetricStatisticsResult>"
+      "<Datapoints>%s</Datapoints><Label>%s</Label></GetMetricStatisticsResult>"
+      "<ResponseMetadata><RequestId>0</RequestId></ResponseMetadata>"
+      "</GetMetricStatisticsResponse>" % (
+        _XMLNS, "".join(members), escape(params["MetricName"])))
+
+
+  @staticmethod
+  def _getMetricData(params):
+    start = _parseTimestamp(params["StartTime"])
+    end = _parseTimestamp(params["EndTime"])
+    maxDatapoints = int(params.get("MaxDatapoints", _MAX_DATAPOINTS_PER_PAGE))
+    offset = int(params.get("NextToken", 0))
+
+    # Data points of all queries, in order of the queries:
+    # (queryID, timestamp, value)
+    datapoints = []
+    queryIDs = []
+    for query in _extractMembers(params, "MetricDataQueries.member."):
+      queryIDs.append(query["Id"])
+
+      dimensions = dict(
+        (member["Name"], member["Value"])
+        for member in _extractMembers(query,
+                                      "MetricStat.Metric.Dimensions.member."))
+
+      datapoints.extend(
+        (query["Id"], timestamp, value)
+        for timestamp, value in generateDatapoints(
+          namespace=query["MetricStat.Metric.Namespace"],
+          metricName=query["MetricStat.Metric.MetricName"],
+          dimensions=dimensions,
+          period=int(query["MetricStat.Period"]),
+          start=start,
+          end=end))
+
+    page = datapoints[offset:offset + maxDatapoints]
+    nextToken = (offset + maxDatapoints
+                 if offset + maxDatapoints < len(datapoints) else None)
+
+    series = collections.OrderedDict()
+    if offset == 0:
+      # The first page accounts for all queries, including those without data
+      for queryID in queryIDs:
+        series[queryID] = []
+
+    for queryID, timestamp, value in page:
+      series.setdefault(queryID, []).append((timestamp, value))
+
+    members = []
+    for queryID, samples in series.iteritems():
+      members.append(
+        "<member><Id>%s</Id><Label>%s</Label><Timestamps>%s</Timestamps>"
+        "<Values>%s</Values><StatusCode>%s</StatusCode></member>" % (
+          escape(queryID), escape(queryID),
+          "".join("<member>%s</member>" % (_formatTimestamp(timestamp),)
+                  for timestamp, _ in samples),
+          "".join("<member>%r</member>" % (value,) for _, value in samples),
+          "Complete" if nextToken is None else "PartialData"))
+
+    return (
+      "<GetMetricDataResponse xmlns=\"%s\"><GetMetricDataResult>"
+      "<MetricDataResults>%s</MetricDataResults>%s<Messages/>"
+      "</GetMetricDataResult><ResponseMetadata><RequestId>0</RequestId>"
+      "</ResponseMetadata></GetMetricDataResponse>" % (
+        _XMLNS, "".join(members),
+        ("<NextToken>%d</NextToken>" % (nextToken,)
+         if nextToken is not None else "")))
+
+
+
+class _ThreadingHTTPServer(SocketServer.ThreadingMixIn,
+                           BaseHTTPServer.HTTPServer):
+  daemon_threads = True
+
+
+
+class FakeCloudWatchServer(object):
+  """ Fake CloudWatch service listening on an ephemeral port of the loopback
+  interface
+  """
+
+  def __init__(self, latencySec=0):
+    """
+    :param latencySec: seconds by which to delay each response, emulating the
+      round trip to CloudWatch
+    """
+    self.latencySec = latencySec
+
+    # Counts of received requests by action name
+    self.requestCounts = collections.Counter()
+    self._requestCountsLock = threading.Lock()
+
+    self._httpServer = None
+    self._serverThread = None
+
+
+  def __enter__(self):
+    self.start()
+    return self
+
+
+  def __exit__(self, *_args):
+    self.stop()
+
+
+  @property
+  def port(self):
+    return self._httpServer.server_address[1]
+
+
+  def start(self):
+    self._httpServer = _ThreadingHTTPServer(("127.0.0.1", 0), _RequestHandler)
+    self._httpServer.fake = self
+
+    self._serverThread = threading.Thread(target=self._httpServer.serve_forever,
+                                          name="FakeCloudWatchServer")
+    self._serverThread.setDaemon(True)
+    self._serverThread.start()
+
+
+  def stop(self):
+    self._httpServer.shutdown()
+    self._httpServer.server_close()
+    self._serverThread.join()
+
+
+  def countRequest(self, action):
+    with self._requestCountsLock:
+      self.requestCounts[action] += 1
+
+
+  def connectToRegion(self, region_name, **kwargs):  # pylint: disable=C0103
+    """ Stand-in for boto.ec2.cloudwatch.connect_to_region that connects to
+    this fake
+
+    :param region_name: name of AWS region
+    :param kwargs: other args of boto.ec2.cloudwatch.connect_to_region
+
+    :rtype: boto.ec2.cloudwatch.CloudWatchConnection
+    """
+    return boto.ec2.cloudwatch.CloudWatchConnection(
+      region=RegionInfo(name=region_name, endpoint="127.0.0.1"),
+      port=self.port,
+      is_secure=False,
+      **kwargs)
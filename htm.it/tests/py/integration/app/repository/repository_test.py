@@ -25,7 +25,7 @@
 import datetime
 import unittest
 import uuid
-from mock import Mock
+from mock import Mock, patch
 
 import MySQLdb.constants
 import sqlalchemy
@@ -210,6 +210,11 @@ class TestRepositoryAPI(unittest.TestCase):
               display_value=3)
       .where(schema.metric_data.c.uid == metricObj.uid))
 
+    with self.engine.begin() as conn:
+      repository.updateMetricDisplayValueRollup(
+        conn, metricObj.uid,
+        [Mock(timestamp=timestamp, display_value=3) for _, timestamp in data])
+
     with self.engine.connect() as conn:
       repository.deleteModel(conn, metricObj.uid)
       metricObj = repository.getMetric(conn, metricObj.uid)
@@ -226,6 +231,8 @@ class TestRepositoryAPI(unittest.TestCase):
                         metricDataRow.display_value is None
                         for metricDataRow in metricDataObjs))
 
+    self.assertEqual(self._getMetricDisplayValueRollup(metricObj.uid), {})
+
 
   def testGetCustomMetricByName(self):
     metricId = str(uuid.uuid4())
@@ -368,6 +375,54 @@ class TestRepositoryAPI(unittest.TestCase):
     self.assertEqual(metricObj.last_rowid, 4)
 
 
+  def testAddMetricDataBatch(self):
+    now = datetime.datetime.now().replace(microsecond=0)
+
+    metricObj1 = self._addGenericMetric()
+    metricObj2 = self._addGenericMetric()
+
+    with self.engine.connect() as conn:
+      repository.addMetricData(conn, metricObj2.uid, [[0, now]])
+
+    dataByMetricId = {
+      metricObj1.uid: [[1, now],
+                       [2, now + datetime.timedelta(minutes=5)]],
+      metricObj2.uid: [[3, now + datetime.timedelta(minutes=5)]],
+    }
+
+    with self.engine.connect() as conn:
+      with conn.begin():
+        lockedRows = repository.getMetricsWithUpdateLock(
+          conn,
+          dataByMetricId.keys(),
+          fields=[schema.metric.c.uid, schema.metric.c.last_rowid])
+
+        rowsByMetricId = repository.addMetricDataBatch(
+          conn,
+          dataByMetricId,
+          dict((row.uid, row.last_rowid) for row in lockedRows))
+
+    self.assertItemsEqual(rowsByMetricId.keys(), dataByMetricId.keys())
+
+    self.assertEqual([row["rowid"] for row in rowsByMetricId[metricObj1.uid]],
+                     [1, 2])
+    self.assertEqual([row["rowid"] for row in rowsByMetricId[metricObj2.uid]],
+                     [2])
+
+    with self.engine.connect() as conn:
+      self.assertEqual(
+        repository.getMetric(conn, metricObj1.uid).last_rowid, 2)
+      self.assertEqual(
+        repository.getMetric(conn, metricObj2.uid).last_rowid, 2)
+
+      storedRows = repository.getMetricData(conn, metricObj1.uid).fetchall()
+
+    self.assertEqual([(row.rowid, row.metric_value, row.timestamp)
+                      for row in storedRows],
+                     [(1, 1, now),
+                      (2, 2, now + datetime.timedelta(minutes=5))])
+
+
   def testaddNotification(self):
     metricObj = self._addGenericMetric()
     settingObj = self._addGenericNotificationSettings()
@@ -1215,6 +1270,173 @@ class TestRepositoryAPI(unittest.TestCase):
     self.assertEqual(metricDataRow.display_value, 3)
 
 
+  def testUpdateMetricDataScoresBulk(self):
+    metricId = str(uuid.uuid4())
+    now = datetime.datetime.now()
+    now = now.replace(second=0, microsecond=0) # truncate microseconds
+    data = [[i, now - datetime.timedelta(minutes=5 * (12 - i))]
+            for i in xrange(12)]
+
+    metricObj = self._addGenericMetric(uid=metricId)
+
+    with self.engine.connect() as conn:
+      repository.addMetricData(conn, metricObj.uid, data)
+
+    # Update a subset of rows, leaving the first and last rows untouched
+    updates = [Mock(rowid=rowid,
+                    raw_anomaly_score=rowid / 100.0,
+                    anomaly_score=rowid / 10.0,
+                    display_value=rowid * 1000)
+               for rowid in xrange(2, 12)]
+
+    with patch("htmengine.repository.queries"
+               "._MAX_METRIC_DATA_SCORE_UPDATE_ROWS", new=3):
+      with self.engine.begin() as conn:
+        repository.updateMetricDataScoresBulk(conn, metricObj.uid, updates)
+
+    with self.engine.connect() as conn:
+      metricDataRows = repository.getMetricData(conn, metricObj.uid).fetchall()
+
+    self.assertEqual(len(metricDataRows), 12)
+
+    for row in metricDataRows:
+      if row.rowid in (1, 12):
+        self.assertIsNone(row.raw_anomaly_score)
+        self.assertIsNone(row.anomaly_score)
+        self.assertIsNone(row.display_value)
+      else:
+        self.assertEqual(row.raw_anomaly_score, row.rowid / 100.0)
+        self.assertEqual(row.anomaly_score, row.rowid / 10.0)
+        self.assertEqual(row.display_value, row.rowid * 1000)
+
+
+  def _getMetricDisplayValueRollup(self, metricId):
+    rollup = schema.metric_display_value_rollup
+    result = self.engine.execute(
+      sqlalchemy.select([rollup.c.block_size_sec,
+                         rollup.c.time_block,
+                         rollup.c.max_display_value])
+      .where(rollup.c.uid == metricId))
+
+    return dict(((row[0], row[1]), row[2]) for row in result)
+
+
+  def testUpdateMetricDisplayValueRollup(self):
+    metricObj = self._addGenericMetric()
+
+    start = datetime.datetime(2015, 11, 10, 0, 0, 0)
+    startEpoch = int((start - datetime.datetime(1970, 1, 1)).total_seconds())
+
+    rows = [Mock(timestamp=start + datetime.timedelta(minutes=5 * i),
+                 display_value=(i * 7) % 10)
+            for i in xrange(12)]
+    # Rows that weren't scored are not rolled up
+    rows.append(Mock(timestamp=start + datetime.timedelta(hours=1),
+                     display_value=None))
+
+    with self.engine.begin() as conn:
+      repository.updateMetricDisplayValueRollup(conn, metricObj.uid, rows)
+
+    rollup = self._getMetricDisplayValueRollup(metricObj.uid)
+
+    # One 5-minute block per row, and a single block per larger block size
+    self.assertEqual(len(rollup), 14)
+    for i in xrange(12):
+      self.assertEqual(rollup[(300, startEpoch // 300 + i)], (i * 7) % 10)
+    self.assertEqual(rollup[(3600, startEpoch // 3600)], 9)
+    self.assertEqual(rollup[(28800, startEpoch // 28800)], 9)
+
+    # Lower display values in the same blocks leave the max values alone, while
+    # higher ones replace them
+    rows = [Mock(timestamp=start + datetime.timedelta(minutes=5),
+                 display_value=5),
+            Mock(timestamp=start + datetime.timedelta(minutes=10),
+                 display_value=1000)]
+
+    with self.engine.begin() as conn:
+      repository.updateMetricDisplayValueRollup(conn, metricObj.uid, rows)
+
+    rollup = self._getMetricDisplayValueRollup(metricObj.uid)
+
+    self.assertEqual(len(rollup), 14)
+    self.assertEqual(rollup[(300, startEpoch // 300 + 1)], 7)
+    self.assertEqual(rollup[(300, startEpoch // 300 + 2)], 1000)
+    self.assertEqual(rollup[(3600, startEpoch // 3600)], 1000)
+    self.assertEqual(rollup[(28800, startEpoch // 28800)], 1000)
+
+    # Blocks that can no longer fall within any period are removed
+    later = start + datetime.timedelta(hours=24)
+    laterEpoch = startEpoch + 24 * 3600
+    rows = [Mock(timestamp=later, display_value=1)]
+
+    with self.engine.begin() as conn:
+      repository.updateMetricDisplayValueRollup(conn, metricObj.uid, rows)
+
+    rollup = self._getMetricDisplayValueRollup(metricObj.uid)
+
+    self.assertEqual(
+      rollup,
+      {(300, laterEpoch // 300): 1,
+       (3600, laterEpoch // 3600): 1,
+       (28800, startEpoch // 28800): 1000,
+       (28800, laterEpoch // 28800): 1})
+
+
+  def testGetMetricIdsSortedByDisplayValue(self):
+    # Timestamps beyond those of other tests' metric data, so that these
+    # metrics determine the end of the window
+    end = (datetime.datetime.utcnow().replace(second=0, microsecond=0) +
+           datetime.timedelta(days=3650))
+    end -= datetime.timedelta(minutes=end.minute % 5)
+    epochBase = datetime.datetime(1970, 1, 1)
+
+    metricRows = dict()
+
+    for multiplier in (1, 3):
+      metricObj = self._addGenericMetric()
+
+      data = [[i, end - datetime.timedelta(minutes=5 * (300 - i))]
+              for i in xrange(301)]
+
+      with self.engine.connect() as conn:
+        repository.addMetricData(conn, metricObj.uid, data)
+
+      rows = [Mock(rowid=i + 1,
+                   timestamp=timestamp,
+                   raw_anomaly_score=0.5,
+                   anomaly_score=0.5,
+                   display_value=(i * multiplier) % 17)
+              for i, timestamp in data]
+
+      with self.engine.begin() as conn:
+        repository.updateMetricDataScoresBulk(conn, metricObj.uid, rows)
+        repository.updateMetricDisplayValueRollup(conn, metricObj.uid, rows)
+
+      metricRows[metricObj.uid] = rows
+
+    for period in (2, 24, 192):
+      # Sum of max display values per block within the window
+      windowStart = end - datetime.timedelta(hours=period)
+      expected = dict()
+      for metricId, rows in metricRows.iteritems():
+        blockMaxValues = dict()
+        for row in rows:
+          if row.timestamp > windowStart:
+            block = (int((row.timestamp - epochBase).total_seconds()) //
+                     (period * 150))
+            blockMaxValues[block] = max(row.display_value,
+                                        blockMaxValues.get(block))
+        expected[metricId] = sum(blockMaxValues.itervalues())
+
+      with self.engine.connect() as conn:
+        displayValueMap = repository.getMetricIdsSortedByDisplayValue(
+          conn, str(period))
+
+      self.assertEqual(
+        dict((metricId, displayValueMap[metricId]) for metricId in metricRows),
+        expected)
+
+
   def testUpdateNotificationMessageId(self):
     metricObj = self._addGenericMetric()
     settingObj = self._addGenericNotificationSettings()
@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2015, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+"""
+Benchmark retrieval of CloudWatch metric data one metric at a time versus
+batched retrieval, against a local fake CloudWatch service with simulated
+round-trip latency.
+"""
+
+from datetime import datetime, timedelta
+import logging
+from optparse import OptionParser
+import time
+
+from mock import patch
+
+from htm.it import logging_support
+from htm.it.app.adapters.datasource.cloudwatch.aws_base import (
+  AWSResourceAdapterBase)
+from htm.it.test_utils.fake_cloudwatch import FakeCloudWatchServer
+
+
+
+gLog = logging.getLogger(__name__)
+
+
+_REGIONS = ("us-west-2", "us-east-1", "eu-west-1", "ap-southeast-1")
+
+
+
+def main(numMetrics, numRegions, latencySec, rangeMinutes):
+  """
+  :param numMetrics: number of EC2 CPUUtilization metrics to retrieve
+  :param numRegions: number of regions that the metrics are spread across
+  :param latencySec: simulated round-trip latency of CloudWatch requests
+  :param rangeMinutes: duration of each metric's data range in minutes
+  """
+  adapters = [
+    AWSResourceAdapterBase.createMetricAdapter(
+      dict(region=_REGIONS[i % numRegions],
+           namespace="AWS/EC2",
+           metric="CPUUtilization",
+           dimensions={"InstanceId": "i-%08x" % (i,)}))
+    for i in xrange(numMetrics)]
+
+  end = datetime(2015, 11, 7, 12, 0, 0)
+  start = end - timedelta(minutes=rangeMinutes)
+
+  with FakeCloudWatchServer(latencySec=latencySec) as server:
+    with patch("boto.ec2.cloudwatch.connect_to_region",
+               side_effect=server.connectToRegion):
+      startTime = time.time()
+      singleResults = [adapter.getMetricData(start=start, end=end)
+                       for adapter in adapters]
+      singleDuration = time.time() - startTime
+      singleRequests = sum(server.requestCounts.itervalues())
+
+      server.requestCounts.clear()
+
+      startTime = time.time()
+      batchResults = AWSResourceAdapterBase.getMetricDataBatch(
+        [(adapter, start) for adapter in adapters], end=end)
+      batchDuration = time.time() - startTime
+      batchRequests = sum(server.requestCounts.itervalues())
+
+  if batchResults != singleResults:
+    raise Exception("Batched results differ from per-metric results")
+
+  gLog.info("{TAG:CWBENCH.SINGLE} numMetrics=%d; numRequests=%d; "
+            "duration=%.4fs", numMetrics, singleRequests, singleDuration)
+  gLog.info("{TAG:CWBENCH.BATCH} numMetrics=%d; numRequests=%d; "
+            "duration=%.4fs", numMetrics, batchRequests, batchDuration)
+
+
+
+def _parseArgs():
+  """ Parses command-line args
+
+  :returns: a dict;
+    {"numMetrics": <num-metrics>, "numRegions": <num-regions>,
+     "latencySec": <latency-sec>, "rangeMinutes": <range-minutes>}
+  """
+  helpString = (
+    "%prog [OPTIONS]\n"
+    "Compare per-metric and batched retrieval of CloudWatch metric data "
+    "against a local fake CloudWatch service.")
+
+  parser = OptionParser(helpString)
+
+  parser.add_option(
+    "--metrics",
+    action="store",
+    type="int",
+    default=500,
+    dest="numMetrics",
+    help="Number of metrics to retrieve [default: %default]")
+
+  parser.add_option(
+    "--regions",
+    action="store",
+    type="int",
+    default=2,
+    dest="numRegions",
+    help=("Number of regions that the metrics are spread across, up to %d "
+          "[default: %%default]" % (len(_REGIONS),)))
+
+  parser.add_option(
+    "--latency",
+    action="store",
+    type="float",
+    default=0.05,
+    dest="latencySec",
+    help="Simulated CloudWatch round-trip latency in seconds "
+         "[default: %default]")
+
+  parser.add_option(
+    "--range",
+    action="store",
+    type="int",
+    default=10,
+    dest="rangeMinutes",
+    help=("Duration of each metric's data range in minutes; e.g., 10 for "
+          "steady-state collection of 5-minute metrics [default: %default]"))
+
+  (options, posArgs) = parser.parse_args()
+
+  if posArgs:
+    parser.error("Unexpected positional args: %s" % (posArgs,))
+
+  if not 1 <= options.numRegions <= len(_REGIONS):
+    parser.error("Expected 1..%d regions, but got %r" % (len(_REGIONS),
+                                                        options.numRegions))
+
+  return dict(numMetrics=options.numMetrics,
+              numRegions=options.numRegions,
+              latencySec=options.latencySec,
+              rangeMinutes=options.rangeMinutes)
+
+
+
+if __name__ == "__main__":
+  logging_support.LoggingSupport.initTool()
+
+  try:
+    main(**_parseArgs())
+  except Exception:
+    gLog.exception("Failed")
+    raise
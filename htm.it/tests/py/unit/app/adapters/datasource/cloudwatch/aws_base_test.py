@@ -26,13 +26,18 @@
 from datetime import datetime, timedelta
 import unittest
 
+from boto.exception import BotoServerError
 import mock
 from mock import Mock, patch
 
+import htm.it.app.exceptions
 from htm.it.app.adapters.datasource.cloudwatch import aws_base
+from htm.it.test_utils import fake_cloudwatch
 
 
 
+@patch.dict(aws_base.AWSResourceAdapterBase._cloudwatchConnectionCache,
+            clear=True)
 class AwsBaseTest(unittest.TestCase):
 
 
@@ -136,6 +141,117 @@ class AwsBaseTest(unittest.TestCase):
                                       stats=["Average"])
 
 
+  @staticmethod
+  def _createEC2MetricAdapters(region, numMetrics):
+    return [
+      aws_base.AWSResourceAdapterBase.createMetricAdapter(
+        dict(region=region,
+             namespace="AWS/EC2",
+             metric="CPUUtilization",
+             dimensions={"InstanceId": "i-%08x" % (i,)}))
+      for i in xrange(numMetrics)]
+
+
+  def testGetMetricDataBatchMatchesGetMetricData(self):
+    adapters = (self._createEC2MetricAdapters("us-west-2", 120) +
+                self._createEC2MetricAdapters("us-east-1", 5))
+
+    end = datetime(2015, 11, 7, 12, 0, 0)
+    starts = [end - timedelta(days=1), end - timedelta(hours=2),
+              end - timedelta(minutes=1)]
+    requests = [(adapter, starts[i % len(starts)])
+                for i, adapter in enumerate(adapters)]
+
+    with fake_cloudwatch.FakeCloudWatchServer() as server:
+      with patch("boto.ec2.cloudwatch.connect_to_region", autospec=True,
+                 side_effect=server.connectToRegion) as connectMock:
+        expectedResults = [adapter.getMetricData(start=start, end=end)
+                           for adapter, start in requests]
+        self.assertEqual(server.requestCounts["GetMetricStatistics"],
+                         len(requests) - len(requests) // len(starts))
+
+        results = aws_base.AWSResourceAdapterBase.getMetricDataBatch(
+          requests, end=end)
+
+    self.assertEqual(results, expectedResults)
+
+    # One request per region and time range; none for the metrics whose time
+    # range is shorter than their period
+    self.assertEqual(server.requestCounts["GetMetricData"], 4)
+
+    # getMetricDataBatch reused one connection per region
+    self.assertEqual(connectMock.call_count,
+                     server.requestCounts["GetMetricStatistics"] + 2)
+
+
+  def testGetMetricDataBatchOfOpsWorksMetricsQueriesUSEast1(self):
+    # CloudWatch serves OpsWorks metrics from us-east-1 regardless of the
+    # stack's region
+    adapters = [
+      aws_base.AWSResourceAdapterBase.createMetricAdapter(
+        dict(region="us-west-2",
+             namespace="AWS/OpsWorks",
+             metric="cpu_idle",
+             dimensions={"StackId": "stack-%d" % (i,)}))
+      for i in xrange(2)]
+
+    end = datetime(2015, 11, 7, 12, 0, 0)
+    requests = [(adapter, end - timedelta(hours=2)) for adapter in adapters]
+
+    with fake_cloudwatch.FakeCloudWatchServer() as server:
+      with patch("boto.ec2.cloudwatch.connect_to_region", autospec=True,
+                 side_effect=server.connectToRegion) as connectMock:
+        expectedResults = [adapter.getMetricData(start=start, end=end)
+                           for adapter, start in requests]
+
+        results = aws_base.AWSResourceAdapterBase.getMetricDataBatch(
+          requests, end=end)
+
+    self.assertEqual(results, expectedResults)
+    self.assertEqual(server.requestCounts["GetMetricData"], 1)
+
+    self.assertEqual(
+      set(callArgs[1]["region_name"]
+          for callArgs in connectMock.call_args_list),
+      set(["us-east-1"]))
+
+
+  def testGetMetricDataBatchFollowsNextToken(self):
+    adapters = self._createEC2MetricAdapters("us-west-2", 3)
+
+    end = datetime(2015, 11, 7, 12, 0, 0)
+    requests = [(adapter, end - timedelta(hours=2)) for adapter in adapters]
+
+    with fake_cloudwatch.FakeCloudWatchServer() as server:
+      with patch("boto.ec2.cloudwatch.connect_to_region", autospec=True,
+                 side_effect=server.connectToRegion):
+        expectedResults = [adapter.getMetricData(start=start, end=end)
+                           for adapter, start in requests]
+
+        with patch.object(fake_cloudwatch, "_MAX_DATAPOINTS_PER_PAGE", 10):
+          results = aws_base.AWSResourceAdapterBase.getMetricDataBatch(
+            requests, end=end)
+
+    self.assertEqual(results, expectedResults)
+    self.assertEqual(server.requestCounts["GetMetricData"], 8)
+
+
+  def testGetMetricDataBatchWithThrottling(self):
+    adapters = self._createEC2MetricAdapters("us-west-2", 2)
+
+    throttleError = BotoServerError(400, "Fake Throttling")
+    throttleError.error_code = "Throttling"
+
+    with patch.object(aws_base.AWSResourceAdapterBase,
+                      "_queryCloudWatchMetricDataBatch",
+                      side_effect=throttleError):
+      results = aws_base.AWSResourceAdapterBase.getMetricDataBatch(
+        [(adapter, None) for adapter in adapters])
+
+    self.assertEqual(len(results), 2)
+    for result in results:
+      self.assertIsInstance(result, htm.it.app.exceptions.MetricThrottleError)
+
 
 
 if __name__ == "__main__":
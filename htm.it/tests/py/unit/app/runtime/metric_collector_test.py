@@ -35,9 +35,11 @@ Unit tests for htm.it.app.runtime.metric_collector
 
 import copy
 import datetime
+import heapq
 import itertools
 import json
-import multiprocessing
+import multiprocessing.pool
+import Queue
 import sys
 import threading
 import time
@@ -95,11 +97,40 @@ def _makeFreshMetricMockInstance(metricPollInterval, uid):
                                  datetime.datetime.utcnow(), uid)
 
 
+
+def _makeGetMetricDataBatchSideEffect(adapterMock):
+  """ Returns a side effect for getMetricDataBatch of the given datasource
+  adapter mock that delegates to the mock's getMetricData
+  """
+  def getMetricDataBatch(requests):
+    results = []
+    for metricSpec, start in requests:
+      try:
+        results.append(adapterMock.getMetricData(metricSpec=metricSpec,
+                                                 start=start,
+                                                 end=None))
+      except Exception as e:
+        results.append(e)
+
+    return results
+
+  return getMetricDataBatch
+
+
+
+def _applyAsync(fn, args, callback):
+  """ Synchronous stand-in for multiprocessing.Pool.apply_async """
+  callback(fn(*args))
+  return Mock(spec_set=multiprocessing.pool.AsyncResult,
+              **{"ready.return_value": True, "successful.return_value": True})
+
+
 @patch.object(metric_collector, "multiprocessing", autospec=True)
 @patch.object(metric_collector, "MetricStreamer", autospec=True)
 @patch.object(metric_collector, "repository", autospec=True)
 @patch.multiple(metric_collector.MetricCollector,
-                _NO_PENDING_METRICS_SLEEP_SEC=0.001,
+                _CANDIDATE_METRICS_REFRESH_INTERVAL_SEC=0.001,
+                _MIN_CANDIDATE_METRICS_REFRESH_INTERVAL_SEC=0,
                 _METRIC_QUARANTINE_DURATION_RATIO=0.0001,
                 _RESOURCE_STATUS_UPDATE_INTERVAL_SEC=0.0)
 @ConfigAttributePatch(htm.it.app.config.CONFIG_NAME,
@@ -116,18 +147,8 @@ class MetricCollectorTestCase(unittest.TestCase):
     metricsPerChunk = 4
 
     # Configure multiprocessing
-    def mapAsync(fn, tasks):
-      class _(object):
-        def wait(self):
-          map(fn, tasks)
-      return _()
-
-    multiprocessingMock.Pool.return_value.map_async.side_effect = mapAsync
-    multiprocessingMock.Pipe.side_effect = multiprocessing.Pipe
-    multiprocessingMock.Manager = (
-      Mock(return_value=(
-        Mock(JoinableQueue=(
-          Mock(side_effect=multiprocessing.JoinableQueue))))))
+    multiprocessingMock.Pool.return_value.apply_async.side_effect = (
+      _applyAsync)
 
     metricPollInterval = 5
 
@@ -155,6 +176,8 @@ class MetricCollectorTestCase(unittest.TestCase):
     adapterInstanceMock = Mock(
       spec_set=_CloudwatchDatasourceAdapter)
     adapterInstanceMock.getMetricData.side_effect = mockResults
+    adapterInstanceMock.getMetricDataBatch.side_effect = (
+      _makeGetMetricDataBatchSideEffect(adapterInstanceMock))
     adapterInstanceMock.getMetricResourceStatus.return_value = "status"
 
     createAdapterMock.return_value = adapterInstanceMock
@@ -255,18 +278,8 @@ class MetricCollectorTestCase(unittest.TestCase):
     exception = BotoServerError(500, "Fake BotoServerError")
 
     # Configure multiprocessing
-    def mapAsync(fn, tasks):
-      class _(object):
-        def wait(self):
-          map(fn, tasks)
-      return _()
-
-    multiprocessingMock.Pool.return_value.map_async.side_effect = mapAsync
-    multiprocessingMock.Pipe.side_effect = multiprocessing.Pipe
-    multiprocessingMock.Manager = (
-      Mock(return_value=(
-        Mock(JoinableQueue=(
-          Mock(side_effect=multiprocessing.JoinableQueue))))))
+    multiprocessingMock.Pool.return_value.apply_async.side_effect = (
+      _applyAsync)
 
     metricPollInterval = 5
 
@@ -292,6 +305,8 @@ class MetricCollectorTestCase(unittest.TestCase):
     adapterInstanceMock = Mock(
       spec_set=_CloudwatchDatasourceAdapter)
     adapterInstanceMock.getMetricData.side_effect = mockResults
+    adapterInstanceMock.getMetricDataBatch.side_effect = (
+      _makeGetMetricDataBatchSideEffect(adapterInstanceMock))
     adapterInstanceMock.getMetricResourceStatus.return_value = "status"
 
     createAdapterMock.return_value = adapterInstanceMock
@@ -337,18 +352,8 @@ class MetricCollectorTestCase(unittest.TestCase):
     """
 
     # Configure multiprocessing
-    def mapAsync(fn, tasks):
-      class _(object):
-        def wait(self):
-          map(fn, tasks)
-      return _()
-
-    multiprocessingMock.Pool.return_value.map_async.side_effect = mapAsync
-    multiprocessingMock.Pipe.side_effect = multiprocessing.Pipe
-    multiprocessingMock.Manager = (
-      Mock(return_value=(
-        Mock(JoinableQueue=(
-          Mock(side_effect=multiprocessing.JoinableQueue))))))
+    multiprocessingMock.Pool.return_value.apply_async.side_effect = (
+      _applyAsync)
 
     metricPollInterval = 5
 
@@ -374,6 +379,8 @@ class MetricCollectorTestCase(unittest.TestCase):
     adapterInstanceMock = Mock(
       spec_set=_CloudwatchDatasourceAdapter)
     adapterInstanceMock.getMetricData.side_effect = mockResults
+    adapterInstanceMock.getMetricDataBatch.side_effect = (
+      _makeGetMetricDataBatchSideEffect(adapterInstanceMock))
     adapterInstanceMock.getMetricResourceStatus.return_value = "status"
 
     createAdapterMock.return_value = adapterInstanceMock
@@ -408,6 +415,148 @@ class MetricCollectorTestCase(unittest.TestCase):
       repoMock.getCloudwatchMetricsPendingDataCollection.call_count,
       len(resultsOfGetCloudwatchMetricsPendingDataCollection))
 
+  @patch("sqlalchemy.engine.Engine", autospec=True)
+  def testRefreshReadyMetrics(self, engineMock, repoMock, *_mocks):
+    # Test that MetricCollector._refreshReadyMetrics keeps waiting metrics in
+    # line, appends newly-due metrics, drops metrics that are no longer due and
+    # skips metrics whose collection is in flight
+    metrics = dict((uid, _makeFreshMetricMockInstance(metricPollInterval=5,
+                                                      uid=uid))
+                   for uid in xrange(1, 6))
+
+    repoMock.retryOnTransientErrors.side_effect = lambda f: f
+    repoMock.getCloudwatchMetricsPendingDataCollection.return_value = [
+      metrics[4], metrics[3], metrics[1], metrics[5]]
+
+    collector = metric_collector.MetricCollector()
+    collector._readyMetrics[1] = Mock()
+    collector._readyMetrics[2] = Mock()
+    collector._inFlightMetrics[5] = metrics[5]
+    heapq.heappush(collector._dueTimes, (time.time() - 1, 3))
+    heapq.heappush(collector._dueTimes, (time.time() + 60, 4))
+
+    collector._refreshReadyMetrics(engineMock)
+
+    self.assertEqual(collector._readyMetrics.items(),
+                     [(1, metrics[1]), (4, metrics[4]), (3, metrics[3])])
+    self.assertEqual([metricID for _, metricID in collector._dueTimes], [4])
+
+
+  @patch.object(metric_collector.MetricCollector, "_MAX_METRICS_PER_TASK", 2)
+  def testSubmitCollectionTasksBatchesMetrics(self, *_mocks):
+    # Test that MetricCollector._submitCollectionTasks batches metrics by
+    # datasource, region and period, up to the given number of tasks
+    def makeMetric(uid, region, metricPollInterval=300):
+      metric = _makeFreshMetricMockInstance(metricPollInterval, uid)
+      metric.datasource = "cloudwatch"
+      metric.parameters = json.dumps({"metricSpec": {"region": region}})
+      return metric
+
+    metrics = [makeMetric(1, "us-west-2"),
+               makeMetric(2, "us-east-1"),
+               makeMetric(3, "us-west-2"),
+               makeMetric(4, "us-west-2", metricPollInterval=60),
+               makeMetric(5, "us-west-2"),
+               makeMetric(6, "us-east-1"),
+               makeMetric(7, "eu-west-1")]
+
+    collector = metric_collector.MetricCollector()
+    for metric in metrics:
+      collector._readyMetrics[metric.uid] = metric
+
+    processPoolMock = Mock(spec_set=multiprocessing.pool.Pool)
+    resultsQueue = Queue.Queue()
+
+    collector._submitCollectionTasks(processPoolMock, resultsQueue, maxTasks=4)
+
+    batches = [[task.metricID for task in args[1][0]]
+               for args, _ in processPoolMock.apply_async.call_args_list]
+    self.assertEqual(batches, [[1, 3], [2, 6], [4], [5]])
+
+    self.assertEqual(
+      sorted(task.metricIDs for task in collector._pendingTasks.itervalues()),
+      [[1, 3], [2, 6], [4], [5]])
+    self.assertEqual(collector._readyMetrics.keys(), [7])
+    self.assertItemsEqual(collector._inFlightMetrics.keys(),
+                          [1, 2, 3, 4, 5, 6])
+
+
+  def testReleaseFailedCollectionTasks(self, *_mocks):
+    # Test that MetricCollector._releaseFailedCollectionTasks releases the
+    # metrics of tasks that failed in the process pool or timed out, and keeps
+    # the tasks that are still running or whose results are on the way
+    def makeAsyncResult(ready, successful=True):
+      asyncResult = Mock(spec_set=multiprocessing.pool.AsyncResult)
+      asyncResult.ready.return_value = ready
+      asyncResult.successful.return_value = successful
+      asyncResult.get.side_effect = (
+        None if successful else
+        multiprocessing.pool.MaybeEncodingError("Fake pickling error", []))
+      return asyncResult
+
+    now = time.time()
+
+    collector = metric_collector.MetricCollector()
+    for metricID in xrange(1, 7):
+      collector._inFlightMetrics[metricID] = _makeFreshMetricMockInstance(
+        metricPollInterval=300, uid=metricID)
+
+    collector._pendingTasks = {
+      "running": metric_collector._PendingCollectionTask(
+        metricIDs=[1], asyncResult=makeAsyncResult(ready=False),
+        deadline=now + 60),
+      "done": metric_collector._PendingCollectionTask(
+        metricIDs=[2], asyncResult=makeAsyncResult(ready=True),
+        deadline=now - 1),
+      "failed": metric_collector._PendingCollectionTask(
+        metricIDs=[3, 4],
+        asyncResult=makeAsyncResult(ready=True, successful=False),
+        deadline=now + 60),
+      "timedOut": metric_collector._PendingCollectionTask(
+        metricIDs=[5, 6], asyncResult=makeAsyncResult(ready=False),
+        deadline=now - 1)
+    }
+
+    collector._releaseFailedCollectionTasks()
+
+    self.assertItemsEqual(collector._pendingTasks.keys(), ["running", "done"])
+    self.assertItemsEqual(collector._inFlightMetrics.keys(), [1, 2])
+
+
+  def testScheduleNextDueTime(self, *_mocks):
+    # Test that MetricCollector._scheduleNextDueTime predicts when the metric
+    # comes due per its next call start time and its quarantine
+    metricPollInterval = 300
+    mockMetric = _makeFreshMetricMockInstance(
+      metricPollInterval=metricPollInterval, uid=1)
+
+    collector = metric_collector.MetricCollector()
+
+    # Next call start time
+    nextCallStart = datetime.datetime(2015, 7, 1, 12, 0, 0)
+    result = metric_collector._DataCollectionResult(metricID=1)
+    result.data = [[nextCallStart, 1]]
+    result.nextCallStart = nextCallStart
+
+    collector._scheduleNextDueTime(mockMetric, result)
+
+    self.assertEqual(
+      heapq.heappop(collector._dueTimes),
+      ((nextCallStart - datetime.datetime(1970, 1, 1)).total_seconds() +
+       2 * metricPollInterval + 60,
+       1))
+
+    # Quarantine after error
+    quarantineEndTime = time.time() + 60
+    collector._metricInfoCache[1].quarantineEndTime = quarantineEndTime
+    result = metric_collector._DataCollectionResult(metricID=1)
+    result.data = BotoServerError(500, "Fake getData BotoServerError")
+
+    collector._scheduleNextDueTime(mockMetric, result)
+
+    self.assertEqual(collector._dueTimes, [(quarantineEndTime, 1)])
+
+
   @patch("sqlalchemy.engine.Engine", autospec=True)
   def testProcessCollectedDataWithEmptyNewData(self, engineMock, *_mocks):
     # Test MetricCollector._processCollectedData with collection result
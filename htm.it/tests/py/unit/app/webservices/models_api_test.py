@@ -603,21 +603,21 @@ class TestMetricDataHandler(unittest.TestCase):
      result["data"])
 
 
-  @patch.object(repository, "getMetricData", autospec=True)
+  @patch.object(repository, "getMetricDataPerMetric", autospec=True)
   def testMetricDataHandlerGetMultiMetricData(self,
-                                              getMetricDataMock,
+                                              getMetricDataPerMetricMock,
                                               _engineMock):
-    getMetricDataMock.return_value = []
+    getMetricDataPerMetricMock.return_value = []
     response = self.app.get("/data", headers=self.headers)
     assertions.assertResponseStatusCode(self, response, 200)
-    getMetricDataMock.assert_called_once_with(
+    getMetricDataPerMetricMock.assert_called_once_with(
       _engineMock.return_value.connect.return_value.__enter__.return_value,
-      metricId=None,
       fields=ANY,
+      limit=None,
       fromTimestamp=ANY,
       toTimestamp=ANY,
       score=ANY,
-      sort=ANY)
+      ascending=ANY)
 
 
   @patch.object(repository, "getMetricData", autospec=True)
@@ -635,21 +635,21 @@ class TestMetricDataHandler(unittest.TestCase):
      result["data"])
 
 
-  @patch.object(repository, "getMetricData", autospec=True)
+  @patch.object(repository, "getMetricDataPerMetric", autospec=True)
   def testMetricDataHandlerGetMultiMetricDataWithFromTimestamp(self,
-      getMetricDataMock, _engineMock):
-    getMetricDataMock.return_value = []
+      getMetricDataPerMetricMock, _engineMock):
+    getMetricDataPerMetricMock.return_value = []
     response = self.app.get("/data?from=2013-08-15 21:30:00",
      headers=self.headers)
     assertions.assertResponseStatusCode(self, response, 200)
-    getMetricDataMock.assert_called_once_with(
+    getMetricDataPerMetricMock.assert_called_once_with(
       _engineMock.return_value.connect.return_value.__enter__.return_value,
-      metricId=None,
       fields=ANY,
+      limit=None,
       fromTimestamp="2013-08-15 21:30:00",
       toTimestamp=ANY,
       score=ANY,
-      sort=ANY)
+      ascending=ANY)
 
 
   @patch.object(repository, "getMetricData", autospec=True)
@@ -666,22 +666,22 @@ class TestMetricDataHandler(unittest.TestCase):
      result["data"])
 
 
-  @patch.object(repository, "getMetricData", autospec=True)
+  @patch.object(repository, "getMetricDataPerMetric", autospec=True)
   def testMetricDataHandlerGetMultiMetricDataWithToTimestamp(self,
-      getMetricDataMock, _engineMock):
-    getMetricDataMock.return_value = self.decodeRowTuples(
+      getMetricDataPerMetricMock, _engineMock):
+    getMetricDataPerMetricMock.return_value = self.decodeRowTuples(
       self.metric_data["withto"])
     response = self.app.get("/data?to=2013-08-15 21:28:00",
      headers=self.headers)
     assertions.assertResponseStatusCode(self, response, 200)
-    getMetricDataMock.assert_called_once_with(
+    getMetricDataPerMetricMock.assert_called_once_with(
       _engineMock.return_value.connect.return_value.__enter__.return_value,
-      metricId=None,
       fields=ANY,
+      limit=None,
       fromTimestamp=ANY,
       toTimestamp="2013-08-15 21:28:00",
       score=ANY,
-      sort=ANY)
+      ascending=ANY)
 
 
   @patch.object(repository, "getMetricData", autospec=True)
@@ -699,20 +699,20 @@ class TestMetricDataHandler(unittest.TestCase):
      result["data"])
 
 
-  @patch.object(repository, "getMetricData", autospec=True)
+  @patch.object(repository, "getMetricDataPerMetric", autospec=True)
   def testMetricDataHandlerGetMultiMetricDataWithAnomaly(self,
-      getMetricDataMock, _engineMock):
-    getMetricDataMock.return_value = []
+      getMetricDataPerMetricMock, _engineMock):
+    getMetricDataPerMetricMock.return_value = []
     response = self.app.get("/data?anomaly=0.01", headers=self.headers)
     assertions.assertResponseStatusCode(self, response, 200)
-    getMetricDataMock.assert_called_once_with(
+    getMetricDataPerMetricMock.assert_called_once_with(
       _engineMock.return_value.connect.return_value.__enter__.return_value,
-      metricId=None,
       fields=ANY,
+      limit=None,
       fromTimestamp=ANY,
       toTimestamp=ANY,
       score=0.01,
-      sort=ANY)
+      ascending=ANY)
 
 
   @patch.object(repository, "getMetricData", autospec=True)
@@ -729,24 +729,76 @@ class TestMetricDataHandler(unittest.TestCase):
      result["data"])
 
 
-  @patch.object(repository, "getMetricData", autospec=True)
+  @patch.object(repository, "getMetricDataPerMetric", autospec=True)
   def testMetricDataHandlerGetMultiMetricDataWithToFromAnomaly(self,
-      getMetricDataMock, _engineMock):
-    getMetricDataMock.return_value = []
+      getMetricDataPerMetricMock, _engineMock):
+    getMetricDataPerMetricMock.return_value = []
     response = self.app.get("/data?from=2013-08-15 21:34:00&"
                             "to=2013-08-15 21:24:00&anomaly=0.025",
                             headers=self.headers)
     assertions.assertResponseStatusCode(self, response, 200)
-    getMetricDataMock.assert_called_once_with(
+    getMetricDataPerMetricMock.assert_called_once_with(
       _engineMock.return_value.connect.return_value.__enter__.return_value,
-      metricId=None,
       fields=ANY,
+      limit=None,
       fromTimestamp="2013-08-15 21:34:00",
       toTimestamp="2013-08-15 21:24:00",
       score=0.025,
+      ascending=ANY)
+
+
+  @patch.object(repository, "getMetricData", autospec=True)
+  def testMetricDataHandlerGetMetricDataWithLimit(self,
+                                                  getMetricDataMock,
+                                                  _engineMock):
+    getMetricDataMock.return_value = self.decodeRowTuples(
+      self.metric_data["datalist"][:2])
+    response = self.app.get(
+      "/be9fab-f416-4845-8dab-02d292244112/data?limit=2",
+      headers=self.headers)
+    assertions.assertSuccess(self, response)
+    result = jsonDecode(response.body)
+    self.assertEqual([row[1:] for row in self.metric_data["datalist"][:2]],
+                     result["data"])
+    getMetricDataMock.assert_called_once_with(
+      _engineMock.return_value.connect.return_value.__enter__.return_value,
+      metricId="be9fab-f416-4845-8dab-02d292244112",
+      fields=ANY,
+      limit=2,
+      fromTimestamp=ANY,
+      toTimestamp=ANY,
+      score=ANY,
       sort=ANY)
 
 
+  @patch.object(repository, "getMetricDataPerMetric", autospec=True)
+  def testMetricDataHandlerGetMultiMetricDataWithLimit(
+      self, getMetricDataPerMetricMock, _engineMock):
+    datalist = self.metric_data["datalist"]
+    rows = (self.decodeRowTuples(datalist[:2]) +
+            self.decodeRowTuples([["def"] + row[1:] for row in datalist[:1]]))
+    getMetricDataPerMetricMock.return_value = iter(rows)
+    response = self.app.get("/data?limit=2", headers=self.headers)
+    assertions.assertSuccess(self, response)
+    getMetricDataPerMetricMock.assert_called_once_with(
+      _engineMock.return_value.connect.return_value.__enter__.return_value,
+      fields=ANY,
+      limit=2,
+      fromTimestamp=ANY,
+      toTimestamp=ANY,
+      score=ANY,
+      ascending=False)
+
+    # Rows are grouped into one record per metric
+    result = jsonDecode(response.body)
+    self.assertEqual(result["names"],
+                     ["timestamp", "value", "anomaly_score", "rowid"])
+    self.assertEqual(
+      sorted(result["metrics"], key=lambda metric: metric["uid"]),
+      [{"uid": "abc", "data": [row[1:] for row in datalist[:2]]},
+       {"uid": "def", "data": [row[1:] for row in datalist[:1]]}])
+
+
   @patch("htm.it.app.webservices.models_api.repository.getMetricData")
   def testQuery(self, getMetricDataMock, _engineMock):
     getMetricDataMock.return_value = self.decodeRowTuples(
@@ -758,8 +810,8 @@ class TestMetricDataHandler(unittest.TestCase):
     assertions.assertSuccess(self, response)
 
 
-  @patch("htm.it.app.webservices.models_api.repository.getMetricData")
-  def testQueryMultiMetric(self, getMetricDataMock, _engineMock):
+  @patch("htm.it.app.webservices.models_api.repository.getMetricDataPerMetric")
+  def testQueryMultiMetric(self, getMetricDataPerMetricMock, _engineMock):
     response = self.app.get('/data?from=2013-08-15 21:34:00&' \
       'to=2013-08-15 21:24:00&anomaly=0.025', headers=self.headers)
     result = json.loads(response.body)
@@ -767,11 +819,12 @@ class TestMetricDataHandler(unittest.TestCase):
     self.assertIn("names", result)
 
 
-  @patch("htm.it.app.webservices.models_api.repository.getMetricData")
-  def testQueryMultiMetricAsBinaryStream(self, getMetricDataMock, _engineMock):
+  @patch("htm.it.app.webservices.models_api.repository.getMetricDataPerMetric")
+  def testQueryMultiMetricAsBinaryStream(self, getMetricDataPerMetricMock,
+                                         _engineMock):
     self.headers["Accept"] = "application/octet-stream"
 
-    getMetricDataMock.return_value = self.decodeRowTuples(
+    getMetricDataPerMetricMock.return_value = self.decodeRowTuples(
       self.metric_data["datalist"])
 
     response = self.app.get("/data?from=2013-08-15 21:34:00&" \
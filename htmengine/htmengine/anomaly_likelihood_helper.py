@@ -18,8 +18,11 @@
 #
 # http://numenta.org/licenses/
 # ----------------------------------------------------------------------
+from collections import deque, namedtuple, OrderedDict
 import itertools
 
+import numpy
+
 from nupic.algorithms import anomaly_likelihood as algorithms
 from htmengine import repository
 from htmengine.exceptions import MetricNotActiveError
@@ -35,6 +38,308 @@ NUM_SKIP_RECORDS = 288 # One day of records
 
 
 
+# A metric data sample used for anomaly likelihood statistics; has the same
+# attributes as the corresponding metric_data row
+_StatsSample = namedtuple("_StatsSample",
+                          "rowid timestamp metric_value raw_anomaly_score")
+
+
+
+class _StatsSampleTailCache(object):
+  """ In-memory cache of the tails of metrics' metric_data rows with raw anomaly
+  scores, as returned by repository.getMetricDataWithRawAnomalyScoresTail().
+
+  Each metric's tail is kept in a ring buffer of up to maxSamplesPerMetric
+  samples. The least-recently-used metrics are evicted to stay within the
+  bounds on the number of metrics and on the estimated memory size.
+
+  A tail is valid only while it's contiguous with the metric's next rows: a
+  lookup for rows that don't immediately follow the cached tail (e.g., after
+  redelivery of an inference result batch) misses and drops the tail.
+  """
+
+  # Estimated memory footprint of a cached sample, including the namedtuple,
+  # datetime and float objects
+  _ESTIMATED_SAMPLE_SIZE_BYTES = 200
+
+
+  class _Tail(object):
+    __slots__ = ("samples", "lastRowID", "isComplete")
+
+    def __init__(self, samples, lastRowID, isComplete):
+      # Ring buffer of _StatsSample instances in ascending rowid order
+      self.samples = samples
+      # rowid of the last sample; None if there are no samples
+      self.lastRowID = lastRowID
+      # True if the samples are all of the metric's rows with raw anomaly scores
+      self.isComplete = isComplete
+
+
+  def __init__(self, maxMetrics, maxMemoryBytes, maxSamplesPerMetric):
+    """
+    :param maxMetrics: max number of metrics with cached tails
+    :param maxMemoryBytes: max estimated memory size of all cached samples
+    :param maxSamplesPerMetric: capacity of each metric's ring buffer
+    """
+    self._maxMetrics = maxMetrics
+    self._maxSamples = maxMemoryBytes // self._ESTIMATED_SAMPLE_SIZE_BYTES
+    self._maxSamplesPerMetric = maxSamplesPerMetric
+
+    # Map of metric IDs to _Tail instances in LRU order
+    self._tails = OrderedDict()
+
+    self._numSamples = 0
+
+
+  def __len__(self):
+    return len(self._tails)
+
+
+  def __contains__(self, metricID):
+    return metricID in self._tails
+
+
+  @property
+  def numSamples(self):
+    return self._numSamples
+
+
+  def getTail(self, metricID, limit, nextRowID):
+    """ Get the cached tail of the metric's rows that precede the given row
+
+    :param metricID: the metric ID
+    :param limit: max number of tail samples to return
+    :param nextRowID: rowid of the metric's row that follows the tail
+
+    :returns: a list of up to limit _StatsSample instances in ascending rowid
+      order; None on cache miss
+    """
+    tail = self._tails.pop(metricID, None)
+    if tail is None:
+      return None
+
+    if (tail.lastRowID is None or tail.lastRowID + 1 != nextRowID or
+        (len(tail.samples) < limit and not tail.isComplete)):
+      # Not contiguous with the next row or doesn't hold enough samples
+      self._numSamples -= len(tail.samples)
+      return None
+
+    # Move to most-recently-used position
+    self._tails[metricID] = tail
+
+    return list(itertools.islice(tail.samples,
+                                 max(0, len(tail.samples) - limit),
+                                 len(tail.samples)))
+
+
+  def setTail(self, metricID, rows, isComplete):
+    """ Replace the metric's cached tail
+
+    :param metricID: the metric ID
+    :param rows: sequence of the metric's tail rows with raw anomaly scores in
+      ascending rowid order
+    :param isComplete: True if rows are all of the metric's rows with raw
+      anomaly scores
+    """
+    self.discard(metricID)
+
+    samples = deque(
+      (_StatsSample(row.rowid, row.timestamp, row.metric_value,
+                    row.raw_anomaly_score)
+       for row in rows),
+      maxlen=self._maxSamplesPerMetric)
+
+    self._tails[metricID] = self._Tail(
+      samples=samples,
+      lastRowID=samples[-1].rowid if samples else None,
+      isComplete=isComplete)
+    self._numSamples += len(samples)
+
+    self._evict()
+
+
+  def extendTail(self, metricID, rows):
+    """ Append rows that were just scored to the metric's cached tail, if any
+
+    :param metricID: the metric ID
+    :param rows: non-empty sequence of the metric's rows with raw anomaly scores
+      in ascending rowid order; if they don't immediately follow the cached
+      tail, the tail is dropped
+    """
+    tail = self._tails.pop(metricID, None)
+    if tail is None:
+      return
+
+    if tail.lastRowID is not None and tail.lastRowID + 1 != rows[0].rowid:
+      self._numSamples -= len(tail.samples)
+      return
+
+    self._numSamples -= len(tail.samples)
+    tail.samples.extend(
+      _StatsSample(row.rowid, row.timestamp, row.metric_value,
+                   row.raw_anomaly_score)
+      for row in rows)
+    tail.lastRowID = rows[-1].rowid
+    self._numSamples += len(tail.samples)
+
+    self._tails[metricID] = tail
+
+    self._evict()
+
+
+  def discard(self, metricID):
+    """ Drop the metric's cached tail, if any """
+    tail = self._tails.pop(metricID, None)
+    if tail is not None:
+      self._numSamples -= len(tail.samples)
+
+
+  def _evict(self):
+    """ Evict least-recently-used tails to stay within bounds """
+    while self._tails and (len(self._tails) > self._maxMetrics or
+                           self._numSamples > self._maxSamples):
+      _, tail = self._tails.popitem(last=False)
+      self._numSamples -= len(tail.samples)
+
+
+
+class _AnomalyLikelihoodBatch(object):
+  """ NumPy-based equivalent of calling algorithms.updateAnomalyLikelihoods()
+  for each of a run of raw anomaly scores in turn.
+
+  The moving averages and tail probabilities of all the scores are computed in
+  one pass, and the updated likelihood params are available after any number
+  of the scores. The results are identical to those of the per-score calls:
+  the moving average total is accumulated sequentially with the same
+  additions and subtractions, and the tail probability is looked up with the
+  same rounding.
+  """
+
+  # Per algorithms._filterLikelihoods()
+  _RED_THRESHOLD = 1.0 - 0.99999
+  _YELLOW_THRESHOLD = 1.0 - 0.999
+
+
+  def __init__(self, rawAnomalyScores, params):
+    """
+    :param rawAnomalyScores: non-empty sequence of raw anomaly scores in the
+      processed order
+    :param params: anomaly likelihood params per
+      algorithms.updateAnomalyLikelihoods(); not modified
+
+    :raises ValueError: if rawAnomalyScores is empty or params are invalid
+    """
+    if not rawAnomalyScores:
+      raise ValueError("Must have at least one anomalyScore")
+
+    if not algorithms.isValidEstimatorParams(params):
+      raise ValueError("'params' is not a valid params structure")
+
+    self._params = params
+    self._windowSize = windowSize = params["movingAverage"]["windowSize"]
+
+    # For backward compatibility, per algorithms.updateAnomalyLikelihoods()
+    self._historicalLikelihoods = params.get("historicalLikelihoods", [1.0])
+
+    historicalValues = params["movingAverage"]["historicalValues"]
+    numHistorical = len(historicalValues)
+    numScores = len(rawAnomalyScores)
+
+    # All values that pass through the moving average window, in order
+    self._values = list(historicalValues) + list(rawAnomalyScores)
+    self._numHistorical = numHistorical
+
+    # Whether the oldest value is dropped from the full window before each
+    # score is added
+    steps = numpy.arange(numScores)
+    if numHistorical <= windowSize:
+      dropMask = (numHistorical + steps) >= windowSize
+    else:
+      dropMask = numpy.zeros(numScores, dtype=bool)
+
+    # Number of values dropped from the window after each score is added
+    self._numDropped = numpy.cumsum(dropMask)
+
+    # Lay out the window updates in the order of MovingAverage.compute(), so
+    # that their sequential accumulation yields the same running totals
+    newValueIndexes = numpy.cumsum(1 + dropMask)
+    updates = numpy.empty(numScores + int(self._numDropped[-1]) + 1,
+                          dtype=float)
+    updates[0] = params["movingAverage"]["total"]
+    updates[newValueIndexes] = rawAnomalyScores
+    updates[newValueIndexes[dropMask] - 1] = -numpy.asarray(
+      self._values[:int(self._numDropped[-1])], dtype=float)
+
+    self._totals = numpy.add.accumulate(updates)[newValueIndexes]
+
+    averages = self._totals / (numHistorical + steps + 1 - self._numDropped)
+
+    # Tail probabilities per algorithms.normalProbability()
+    mean = params["distribution"]["mean"]
+    stdev = params["distribution"]["stdev"]
+
+    belowMean = averages < mean
+    x = numpy.where(belowMean, 2 * mean - averages, averages)
+    xs = 10 * (x - mean) / stdev
+
+    # Round half away from zero like the builtin round(); xs is non-negative
+    roundedXS = numpy.floor(xs)
+    roundedXS += (xs - roundedXS) >= 0.5
+
+    probabilities = numpy.where(
+      roundedXS > 70,
+      0.0,
+      algorithms.Q[numpy.minimum(roundedXS, 70).astype(int)])
+
+    self._rawLikelihoods = numpy.where(belowMean, 1.0 - probabilities,
+                                       probabilities)
+
+    # Filter the likelihoods per algorithms._filterLikelihoods()
+    previousLikelihoods = numpy.empty(numScores, dtype=float)
+    previousLikelihoods[0] = self._historicalLikelihoods[-1]
+    previousLikelihoods[1:] = self._rawLikelihoods[:-1]
+
+    self.likelihoods = numpy.where(
+      ((self._rawLikelihoods <= self._RED_THRESHOLD) &
+       (previousLikelihoods <= self._RED_THRESHOLD)),
+      self._YELLOW_THRESHOLD,
+      self._rawLikelihoods)
+
+
+  def getParams(self, numScores):
+    """ Get the anomaly likelihood params after the given number of scores
+
+    :param numScores: number of leading scores of the batch that were consumed;
+      at least 1
+
+    :returns: new anomaly likelihood params per
+      algorithms.updateAnomalyLikelihoods()
+    """
+    assert numScores >= 1, numScores
+
+    lastIndex = numScores - 1
+
+    historicalValues = self._values[
+      int(self._numDropped[lastIndex]):self._numHistorical + numScores]
+
+    historicalLikelihoods = (
+      list(self._historicalLikelihoods) +
+      self._rawLikelihoods[:numScores].tolist())
+    historicalLikelihoods = historicalLikelihoods[
+      -min(self._windowSize, len(historicalLikelihoods)):]
+
+    return {
+      "distribution": self._params["distribution"],
+      "movingAverage": {
+        "historicalValues": historicalValues,
+        "total": float(self._totals[lastIndex]),
+        "windowSize": self._windowSize,
+      },
+      "historicalLikelihoods": historicalLikelihoods,
+    }
+
+
+
 class AnomalyLikelihoodHelper(object):
   """ Helper class for running AnomalyLikelihood calculations in
   htmengine.runtime.anomaly_service.AnomalyService.
@@ -65,6 +370,27 @@ class AnomalyLikelihoodHelper(object):
     self._statisticsSampleSize = (
       config.getint("anomaly_likelihood", "statistics_sample_size"))
 
+    # Tails of metrics' samples for refreshing statistics without re-reading
+    # them from metric_data
+    self._sampleCache = _StatsSampleTailCache(
+      maxMetrics=config.getint("anomaly_likelihood",
+                               "sample_cache_max_metrics"),
+      maxMemoryBytes=config.getint("anomaly_likelihood",
+                                   "sample_cache_max_mb") * 1024 * 1024,
+      maxSamplesPerMetric=self._statisticsSampleSize)
+
+
+  def cacheScoredMetricData(self, metricID, metricDataRows):
+    """ Append metric data rows whose scores were just saved in metric_data to
+    the metric's cached tail of statistics samples. Must be called after
+    successfully saving the results of updateModelAnomalyScores().
+
+    :param metricID: the metric ID
+    :param metricDataRows: the sequence of MetricData instances that was passed
+      to updateModelAnomalyScores()
+    """
+    self._sampleCache.extendTail(metricID, metricDataRows)
+
 
   def _generateAnomalyParams(self, metricID, statsSampleCache,
                              defaultAnomalyParams):
@@ -221,7 +547,8 @@ class AnomalyLikelihoodHelper(object):
         metricID=metricObj.uid,
         statsSampleCache=None,
         consumedSamples=consumedSamples,
-        defaultAnomalyParams=anomalyParams)
+        defaultAnomalyParams=anomalyParams,
+        batchStartRowID=metricDataRows[0].rowid)
 
       # If this assertion fails, it implies that the count retrieved by our
       # call to MetricData.count above is no longer correct
@@ -241,7 +568,8 @@ class AnomalyLikelihoodHelper(object):
 
 
   def _refreshAnomalyParams(self, engine, metricID, statsSampleCache,
-                            consumedSamples, defaultAnomalyParams):
+                            consumedSamples, defaultAnomalyParams,
+                            batchStartRowID):
     """ Refresh anomaly likelihood parameters from the tail of
     statsSampleCache and consumedSamples up to self._statisticsSampleSize.
 
@@ -264,6 +592,8 @@ class AnomalyLikelihoodHelper(object):
       appended to statsSampleCache
     :param defaultAnomalyParams: the default anomaly params value; if can't
       generate new ones, this value will be returned in the result tuple
+    :param batchStartRowID: rowid of the first row of the inference result
+      batch being processed
 
     :returns: the tuple (anomalyParams, statsSampleCache,)
 
@@ -291,7 +621,8 @@ class AnomalyLikelihoodHelper(object):
       tail = self._tailMetricDataWithRawAnomalyScoresIter(
         engine,
         metricID,
-        max(0, self._statisticsSampleSize - len(consumedSamples)))
+        max(0, self._statisticsSampleSize - len(consumedSamples)),
+        batchStartRowID)
 
       statsSampleCache = list(itertools.chain(tail, consumedSamples))
     else:
@@ -306,31 +637,46 @@ class AnomalyLikelihoodHelper(object):
     return (anomalyParams, statsSampleCache,)
 
 
-  @classmethod
-  def _tailMetricDataWithRawAnomalyScoresIter(cls, engine, metricID, limit):
+  def _tailMetricDataWithRawAnomalyScoresIter(self, engine, metricID, limit,
+                                               nextRowID):
     """
     Fetch the tail of metric_data rows with non-null raw_anomaly_score
-    for the given metric ID
+    for the given metric ID from the sample cache or, on cache miss, from
+    metric_data; in the latter case, the cache is refilled with up to
+    self._statisticsSampleSize tail rows.
 
     :param engine: SQLAlchemy engine object
     :type engine: sqlalchemy.engine.Engine
     :param metricID: the metric ID
     :param limit: max number of tail rows to fetch
+    :param nextRowID: rowid of the metric's row that follows the tail
 
     :returns: an iterable that yields up to `limit` MetricData tail
-      instances with non-null raw_anomaly_score ordered by metric data timestamp
-      in ascending order
+      instances (or _StatsSample instances with the same attributes) with
+      non-null raw_anomaly_score ordered by metric data timestamp in ascending
+      order
 
     """
     if limit == 0:
       return tuple()
 
+    samples = self._sampleCache.getTail(metricID, limit, nextRowID)
+    if samples is not None:
+      return samples
+
+    fetchLimit = max(limit, self._statisticsSampleSize)
+
     with engine.connect() as conn:
       rows = repository.getMetricDataWithRawAnomalyScoresTail(conn,
                                                               metricID,
-                                                              limit=limit)
+                                                              limit=fetchLimit)
 
-    return reversed(rows)
+    rows = rows[::-1]
+
+    self._sampleCache.setTail(metricID, rows,
+                              isComplete=(len(rows) < fetchLimit))
+
+    return rows[max(0, len(rows) - limit):]
 
 
   def updateModelAnomalyScores(self, engine, metricObj, metricDataRows):
@@ -473,15 +819,21 @@ class AnomalyLikelihoodHelper(object):
         endRowID, anomalyParams["last_rowid_for_stats"],
         statisticsRefreshInterval, len(metricDataRows))
 
+      runSamples = metricDataRows[startRowIndex:limitIndex]
+      if runSamples:
+        # Score the whole run at once; the likelihood params are advanced below
+        # to the samples that are actually consumed
+        likelihoodBatch = _AnomalyLikelihoodBatch(
+          [md.raw_anomaly_score for md in runSamples],
+          anomalyParams["params"])
+        runLikelihoods = likelihoodBatch.likelihoods
+      else:
+        runLikelihoods = ()
+
       consumedSamples = []
-      for md in itertools.islice(metricDataRows, startRowIndex, limitIndex):
+      for md, likelihood in itertools.izip(runSamples, runLikelihoods):
         consumedSamples.append(md)
 
-        (likelihood,), _, anomalyParams["params"] = (
-          algorithms.updateAnomalyLikelihoods(
-            ((md.timestamp, md.metric_value, md.raw_anomaly_score),),
-            anomalyParams["params"]))
-
         # TODO: the float "cast" here seems redundant
         md.anomaly_score = float(1.0 - likelihood)
 
@@ -502,6 +854,10 @@ class AnomalyLikelihoodHelper(object):
                            metricObj.uid, md)
             break
 
+      if consumedSamples:
+        anomalyParams["params"] = likelihoodBatch.getParams(
+          len(consumedSamples))
+
       if startRowIndex + len(consumedSamples) < len(metricDataRows) or (
           consumedSamples[-1].rowid >= endRowID):
         # We stopped before the end of new samples, including a bypass-run,
@@ -512,7 +868,8 @@ class AnomalyLikelihoodHelper(object):
           metricID=metricObj.uid,
           statsSampleCache=statsSampleCache,
           consumedSamples=consumedSamples,
-          defaultAnomalyParams=anomalyParams)
+          defaultAnomalyParams=anomalyParams,
+          batchStartRowID=metricDataRows[0].rowid)
 
 
       startRowIndex += len(consumedSamples)
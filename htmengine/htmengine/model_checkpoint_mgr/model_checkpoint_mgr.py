@@ -24,6 +24,8 @@ This module implements the Model Checkpoint Manager that's responsible for
 saving and loading models to persistent storage.
 """
 
+from collections import namedtuple
+import cPickle as pickle
 import errno
 import json
 import os
@@ -78,6 +80,13 @@ def _getLogger():
 
 
 
+# A model checkpoint serialized by ModelCheckpointMgr.beginSave() and pending
+# completion by ModelCheckpointMgr.completeSave()
+_PendingCheckpoint = namedtuple("_PendingCheckpoint",
+                                "modelID tempRoot startTime")
+
+
+
 class ModelCheckpointMgr(object):
   """
   Goal: saving of model definitions, checkpoints and attributes must be atomic -
@@ -98,6 +107,7 @@ class ModelCheckpointMgr(object):
 
     checkpoint_store_1389761327.552464/ (seconds since epoch as suffix)
       attributes.data
+      log.data (optional; see appendCheckpointLog)
       model_instance/ (the contents are generated by CLA model)
         model.pkl
         modelextradata/
@@ -141,6 +151,10 @@ class ModelCheckpointMgr(object):
   # actual model checkpoint store directory
   _CHECKPOINT_INSTANCE_DIR_NAME = "model_instance"
 
+  # The append-only checkpoint log is stored in this file in the model
+  # checkpoint store directory
+  _CHECKPOINT_LOG_FILE_NAME = "log.data"
+
 
   def __init__(self):
     self._logger = _getLogger()
@@ -360,12 +374,29 @@ class ModelCheckpointMgr(object):
       integral component of the checkpoint. It may later be retrieved separately
       via ModelCheckpointMgr.loadCheckpointAttributes()
 
+    :raises: ModelNotFound if model's entry doesn't exit in the checkpoint
+      archive
+    """
+    self.completeSave(self.beginSave(modelID, model, attributes))
+
+
+  def beginSave(self, modelID, model, attributes):
+    """ First phase of checkpointing a model instance: serialize the model and
+    checkpoint attributes into a temporary checkpoint store. Once this returns,
+    the caller may resume using the model while the checkpoint is completed via
+    completeSave(), which is the phase that waits on storage (e.g., from another
+    thread). The checkpoint becomes current and durable when completeSave()
+    returns. See save() for the args.
+
+    :returns: a pending checkpoint object to pass to completeSave()
+
     :raises: ModelNotFound if model's entry doesn't exit in the checkpoint
       archive
     """
     startTime = time.time()
 
-    modelEntryDirPath = self._getModelDir(modelID, mustExist=True)
+    # Fail early if the model entry doesn't exist
+    self._getModelDir(modelID, mustExist=True)
 
     # Create the model checkpoint store in a temp directory first, then rename
     # it to its location in the model entry for integrity
@@ -390,6 +421,34 @@ class ModelCheckpointMgr(object):
         saveModelDir=os.path.join(
           tempCheckpointStoreDirPath,
           self._CHECKPOINT_INSTANCE_DIR_NAME))
+    except:
+      # Clean up
+      shutil.rmtree(tempRoot)
+      raise
+
+    return _PendingCheckpoint(modelID=modelID, tempRoot=tempRoot,
+                              startTime=startTime)
+
+
+  def completeSave(self, pendingCheckpoint):
+    """ Second phase of checkpointing a model instance: make the checkpoint
+    serialized by beginSave() durable and current.
+
+    :param pendingCheckpoint: the pending checkpoint object returned by
+      beginSave()
+
+    :raises: ModelNotFound if model's entry doesn't exit in the checkpoint
+      archive
+    """
+    modelID = pendingCheckpoint.modelID
+    tempRoot = pendingCheckpoint.tempRoot
+
+    try:
+      modelEntryDirPath = self._getModelDir(modelID, mustExist=True)
+
+      tempCheckpointStoreDirPath = os.path.join(
+        tempRoot,
+        self._CHECKPOINT_STORE_DIR_NAME_BASE)
 
       # Get temp checkpoint store tree in consistent state
       self._fsyncDirectoryTreeRecursively(tempCheckpointStoreDirPath)
@@ -441,7 +500,8 @@ class ModelCheckpointMgr(object):
 
     self._logger.info(
       "{TAG:MCKPT.SAVE} Saved model=%s: duration=%ss; directory=%s",
-      modelID, time.time() - startTime, newCheckpointStoreDirPath)
+      modelID, time.time() - pendingCheckpoint.startTime,
+      newCheckpointStoreDirPath)
 
 
   def load(self, modelID):
@@ -530,6 +590,113 @@ class ModelCheckpointMgr(object):
       return json.load(fileObj)
 
 
+  def appendCheckpointLog(self, modelID, objects, logSize):
+    """ Append objects to the model checkpoint log. The log is an append-only
+    sequence of objects that is stored as an integral component of the model
+    checkpoint; it starts out empty in each checkpoint saved via
+    ModelCheckpointMgr.save(). Unlike updateCheckpointAttributes(), the cost of
+    an append is proportional to the number of appended objects.
+
+    The log's valid size is tracked by the caller: the caller records the
+    returned size (e.g., via updateCheckpointAttributes()) once the append
+    succeeds and passes it to the next append and to loadCheckpointLog(), so
+    that anything appended without its size being recorded (e.g., due to
+    failure or crash) is disregarded.
+
+    :param modelID: unique model ID hex string
+
+    :param objects: a sequence of picklable objects to append
+
+    :param logSize: size of the log's valid content, as returned by the
+      previous append; 0 if nothing was appended since the checkpoint was saved.
+      Anything that follows it in the log is overwritten.
+
+    :returns: the new size of the log's valid content
+
+    :raises: ModelNotFound if the model checkpoint hasn't been saved yet or if
+      this model's entry doesn't exist in the checkpoint archive
+    """
+    checkpointDirPath = self._getCurrentCheckpointRealPath(modelID)
+
+    logFilePath = os.path.join(checkpointDirPath,
+                               self._CHECKPOINT_LOG_FILE_NAME)
+
+    fd = os.open(logFilePath, os.O_WRONLY | os.O_CREAT, 0644)
+    with os.fdopen(fd, "wb") as fileObj:
+      # Discard whatever may have been appended beyond the valid content
+      fileObj.truncate(logSize)
+      fileObj.seek(logSize)
+
+      for obj in objects:
+        pickle.dump(obj, fileObj, pickle.HIGHEST_PROTOCOL)
+
+      newLogSize = fileObj.tell()
+
+      # Get the log in consistent state
+      fileObj.flush()
+      self._fsyncReliably(fd)
+
+    if logSize == 0:
+      # The log file may have just been created
+      self._fsyncDirectoryOnly(checkpointDirPath)
+
+    return newLogSize
+
+
+  def loadCheckpointLog(self, modelID, logSize):
+    """ Retrieve the objects in the model checkpoint log in the order they were
+    appended via appendCheckpointLog(). The objects are read lazily, so the log
+    may be processed as a stream.
+
+    :param modelID: unique model ID hex string
+
+    :param logSize: size of the log's valid content, as returned by the last
+      successful call to appendCheckpointLog(); 0 if nothing was appended since
+      the checkpoint was saved
+
+    :returns: an iterator over the objects in the log
+
+    :raises: ModelNotFound if the model checkpoint hasn't been saved yet or if
+      this model's entry doesn't exist in the checkpoint archive
+    """
+    logFilePath = os.path.join(self._getCurrentCheckpointRealPath(modelID),
+                               self._CHECKPOINT_LOG_FILE_NAME)
+
+    if logSize == 0:
+      return iter(())
+
+    def readLog(fileObj):
+      with fileObj:
+        while fileObj.tell() < logSize:
+          yield pickle.load(fileObj)
+
+    return readLog(open(logFilePath, "rb"))
+
+
+  def getCheckpointSize(self, modelID):
+    """ Get the storage size of the model instance in the model's current
+    checkpoint; this is a reasonable estimate of the model's memory footprint
+    once it's loaded.
+
+    :param modelID: unique model ID
+
+    :returns: size of the saved model instance in bytes
+
+    :raises: ModelNotFound if the model checkpoint hasn't been saved yet or if
+      this model's entry doesn't exist in the checkpoint archive
+    """
+    modelInstanceDirPath = os.path.join(
+      self._getCurrentCheckpointRealPath(modelID),
+      self._CHECKPOINT_INSTANCE_DIR_NAME)
+
+    size = 0
+    for parentPath, _dirNames, fileNames in os.walk(modelInstanceDirPath):
+      for f in fileNames:
+        size += os.path.getsize(os.path.join(parentPath, f))
+
+    return size
+
+
   def clone(self, modelID, destModelID):
     """ Clone an existing model archive
 
@@ -26,12 +26,16 @@ processes are started by the Model Scheduler service.
 """
 
 import base64
+import collections
 import cPickle as pickle
 from datetime import datetime
+import itertools
 import logging
 from optparse import OptionParser
+import os
 import select
 import sys
+import threading
 import time
 import traceback
 
@@ -90,9 +94,11 @@ class ModelRunner(object):
   _MAX_TRACEBACK_TAIL = 400
 
 
-  def __init__(self, modelID):
+  def __init__(self, modelID, archiver=None):
     """
     :param modelID: model ID; string
+    :param archiver: optional _ModelArchiver instance of this model retained
+      from a previous run (see runResidentModels); a new one is created if None
     """
     self._logger = _getLogger()
 
@@ -100,7 +106,7 @@ class ModelRunner(object):
 
     self._swapperAPI = ModelSwapperInterface()
 
-    self._archiver = _ModelArchiver(self._modelID)
+    self._archiver = archiver or _ModelArchiver(self._modelID)
 
     # "deleteModel" command handler sets this flag to force our processing
     # loop to terminate
@@ -111,6 +117,11 @@ class ModelRunner(object):
     self._targetMaxRequestsPerCheckpoint = modelSwapperConfig.getint(
       "model_runner", "target_requests_per_checkpoint")
 
+    # When True, full checkpoints are completed in the background while we
+    # process the next run of input batches
+    self._backgroundCheckpoints = modelSwapperConfig.getboolean(
+      "model_runner", "background_full_checkpoints")
+
     self._profiling = (
       modelSwapperConfig.getboolean("debugging", "profiling") or
       self._logger.isEnabledFor(logging.DEBUG))
@@ -121,6 +132,12 @@ class ModelRunner(object):
       self._modelLoadSec = 0
 
 
+  @property
+  def archiver(self):
+    """ The model's _ModelArchiver instance """
+    return self._archiver
+
+
   @property
   def _model(self):
     """ An OPF Model object or None if not loaded yet """
@@ -183,6 +200,12 @@ class ModelRunner(object):
     # checkpoint
     modelCheckpointBatchIDSet = self._archiver.modelCheckpointBatchIDSet
 
+    # (consumer, lastRequestBatch) of the previous run whose full checkpoint is
+    # being completed in the background. The run's request batches may be acked
+    # only after the checkpoint becomes durable, and its consumer is kept open
+    # until then, because closing it would requeue the unacked batches.
+    pendingRun = None
+
     try:
       while not self._done:
         currentRunBatchIDSet = set()
@@ -190,9 +213,9 @@ class ModelRunner(object):
         currentRunNumRequests = 0
         lastRequestBatch = None
 
-        with self._swapperAPI.consumeRequests(
-            modelID=self._modelID, blocking=False) as consumer:
-
+        consumer = self._swapperAPI.consumeRequests(modelID=self._modelID,
+                                                    blocking=False)
+        try:
           if self._profiling:
             batchStartTime = time.time()
 
@@ -240,8 +263,11 @@ class ModelRunner(object):
             if self._profiling:
               submitStartTime = time.time()
 
+            # Results are pipelined; they're confirmed as a group before the
+            # run's input batches are acked
             self._swapperAPI.submitResults(modelID=self._modelID,
-                                           results=results)
+                                           results=results,
+                                           waitForConfirm=False)
 
             if self._profiling:
               now = time.time()
@@ -282,28 +308,47 @@ class ModelRunner(object):
           if lastRequestBatch is not None:
             assert len(currentRunBatchIDSet) > 0
 
+            # Results of this run must be confirmed by the broker before its
+            # request batches may be acked
+            self._swapperAPI.waitForConfirms()
+
             modelCheckpointBatchIDSet = currentRunBatchIDSet
 
+            # The previous run's checkpoint must become durable before we
+            # checkpoint this run
+            if pendingRun is not None:
+              previousRun, pendingRun = pendingRun, None
+              self._completePendingRun(previousRun)
+
+            checkpointPending = False
+
             # Checkpoint the model.
             if self._model is not None:
 
               if self._profiling:
                 checkpointStartTime = time.time()
 
-              self._archiver.saveModel(
+              checkpointPending = self._archiver.saveModel(
                 currentRunBatchIDSet=currentRunBatchIDSet,
-                currentRunInputSamples=currentRunInputSamples)
+                currentRunInputSamples=currentRunInputSamples,
+                inBackground=self._backgroundCheckpoints)
 
               if self._profiling:
                 self._logger.info(
                   "%r: {TAG:SWAP.MR.CHKPT.DONE} currentRunNumRequests=%s; "
-                  "currentRunNumBatches=%s; duration=%.4fs",
+                  "currentRunNumBatches=%s; pending=%s; duration=%.4fs",
                   self, currentRunNumRequests, len(currentRunBatchIDSet),
-                  time.time() - checkpointStartTime)
-
-            # Ack the last request batch and all unacked batches before it
-            # consumed during this run
-            lastRequestBatch.ack(multiple=True)
+                  checkpointPending, time.time() - checkpointStartTime)
+
+            if checkpointPending:
+              # Ack this run's request batches when the checkpoint becomes
+              # durable
+              pendingRun = (consumer, lastRequestBatch)
+              consumer = None
+            else:
+              # Ack the last request batch and all unacked batches before it
+              # consumed during this run
+              lastRequestBatch.ack(multiple=True)
 
           if not self._done:
             # Check if SwapController wants to preempt us (it closes the other
@@ -313,7 +358,19 @@ class ModelRunner(object):
               self._logger.debug("%r: SwapController wants to preempt us, "
                                 "leaving", self)
               self._done = True
+        finally:
+          if consumer is not None:
+            consumer.close()
+
+      if pendingRun is not None:
+        previousRun, pendingRun = pendingRun, None
+        self._completePendingRun(previousRun)
     finally:
+      if pendingRun is not None:
+        # We're failing; closing the consumer without acking causes the run's
+        # request batches to be redelivered
+        pendingRun[0].close()
+
       if totalBatches == 0:
         self._logger.warn("%r: zero input batches were processed", self)
 
@@ -324,6 +381,24 @@ class ModelRunner(object):
 
 
 
+  def _completePendingRun(self, pendingRun):
+    """ Wait for the full checkpoint of a previous run that's being completed
+    in the background to become durable, then ack the run's request batches
+    and close its consumer.
+
+    :param pendingRun: (consumer, lastRequestBatch) of the run
+    """
+    consumer, lastRequestBatch = pendingRun
+    try:
+      self._archiver.waitForCheckpoint()
+
+      # Ack the last request batch and all unacked batches before it consumed
+      # during that run
+      lastRequestBatch.ack(multiple=True)
+    finally:
+      consumer.close()
+
+
   def _processInputBatch(self, inputObjects, currentRunInputSamples):
     """ Process a batch of model commands and/or inference input data rows
 
@@ -358,6 +433,12 @@ class ModelRunner(object):
     Returns: a ModelCommandResult instance
     """
     self._logger.info("%r: Processing model command: %r", self, command)
+
+    # Model commands manipulate the model's checkpoint archive, so the
+    # checkpoint that's being completed in the background, if any, must be done
+    # first
+    self._archiver.waitForCheckpoint()
+
     try:
       if command.method == "defineModel":
         return self._defineModel(command)
@@ -396,6 +477,10 @@ class ModelRunner(object):
       inputSchema=command.args["inputRecordSchema"]
     )
 
+    if "schedulingPriority" in command.args:
+      newModelDefinition["schedulingPriority"] = (
+        command.args["schedulingPriority"])
+
     try:
       self._checkpointMgr.define(modelID=self._modelID,
                                  definition=newModelDefinition)
@@ -549,12 +634,28 @@ class _ModelArchiver(object):
   _BATCH_IDS_CHECKPOINT_ATTR_NAME = "batchIDs"
 
   # Name of the attribute that is stored as an integral component of the
-  # checkpoint. It contains a list of ModelInputRow objects processed since
-  # the last full checkpoint for use in preparing the last incremental
-  # model checkpoint for new input. The value is in pickle string format.
+  # checkpoint. It contains the size of the valid content of the checkpoint log
+  # (see ModelCheckpointMgr.appendCheckpointLog), which holds the input data
+  # samples processed since the last full checkpoint for use in preparing the
+  # last incremental model checkpoint for new input.
+  _INPUT_SAMPLES_LOG_SIZE_ATTR_NAME = "incrementalInputSamplesLogSize"
+
+  # Name of the attribute that is stored as an integral component of the
+  # checkpoint. It contains the number of input data samples in the checkpoint
+  # log.
+  _NUM_INPUT_SAMPLES_ATTR_NAME = "numIncrementalInputSamples"
+
+  # Name of the legacy attribute that is stored as an integral component of
+  # checkpoints made before the checkpoint log was introduced. It contains a
+  # list of input data samples processed since the last full checkpoint in
+  # base64-encoded pickle string format. The next incremental checkpoint moves
+  # these samples to the checkpoint log.
   _INPUT_SAMPLES_SINCE_CHECKPOINT_ATTR_NAME = "incrementalInputSamples"
 
-  _MAX_INCREMENTAL_CHECKPOINT_DATA_ROWS = 100
+  # NOTE: since an incremental checkpoint only appends the new samples to the
+  # checkpoint log, this is bounded by the time it takes to feed the samples to
+  # the model when loading it, rather than by checkpoint I/O
+  _MAX_INCREMENTAL_CHECKPOINT_DATA_ROWS = 500
 
 
   def __init__(self, modelID):
@@ -578,8 +679,20 @@ class _ModelArchiver(object):
 
     self._modelCheckpointBatchIDSetCache = None
 
-    # Input data samples that have accumulated since last full checkpoint
-    self._inputSamplesSinceLastFullCheckpointCache = None
+    # Number of input data samples that have accumulated since last full
+    # checkpoint
+    self._numInputSamplesSinceLastFullCheckpointCache = None
+
+    # Size of the valid content of the checkpoint log of input data samples
+    self._inputSamplesLogSize = 0
+
+    # Input data samples from the legacy
+    # _INPUT_SAMPLES_SINCE_CHECKPOINT_ATTR_NAME checkpoint attribute
+    self._legacyInputSamples = []
+
+    # _BackgroundCheckpointWriter that's completing the last full checkpoint;
+    # None if there is no pending checkpoint
+    self._pendingCheckpointWriter = None
 
 
   @property
@@ -609,28 +722,31 @@ class _ModelArchiver(object):
     return self._checkpointMgr
 
 
-  @property
-  def _inputSamplesSinceLastFullCheckpoint(self):
-    if self._inputSamplesSinceLastFullCheckpointCache is None:
-      self._loadCheckpointAttributes()
-    return self._inputSamplesSinceLastFullCheckpointCache
-
+  def isCheckpointCurrent(self):
+    """ Check whether the model's current checkpoint is still the one that this
+    archiver last loaded or saved. It won't be if the model was since run (and
+    checkpointed) by another ModelRunner or deleted, in which case the loaded
+    model is stale.
 
-  @_inputSamplesSinceLastFullCheckpoint.setter
-  def _inputSamplesSinceLastFullCheckpoint(self, value):
-    self._inputSamplesSinceLastFullCheckpointCache = value
+    :returns: True if the checkpoint is current; False if not
+    """
+    try:
+      checkpointAttributes = self._checkpointMgr.loadCheckpointAttributes(
+        self._modelID)
+    except model_checkpoint_mgr.ModelNotFound:
+      return False
 
+    # NOTE: batch IDs are unique, and every checkpoint saves the IDs of the
+    # batches that went into it
+    return (set(checkpointAttributes[self._BATCH_IDS_CHECKPOINT_ATTR_NAME]) ==
+            self._modelCheckpointBatchIDSetCache)
 
-  @classmethod
-  def _encodeDataSamples(cls, dataSamples):
-    """
-    :param dataSamples: a sequence of data samples to be saved as the
-      _INPUT_SAMPLES_SINCE_CHECKPOINT_ATTR_NAME checkpoint attribute
 
-    :returns: a string encoding of the data samples
-    """
-    return base64.standard_b64encode(pickle.dumps(dataSamples,
-                                                  pickle.HIGHEST_PROTOCOL))
+  @property
+  def _numInputSamplesSinceLastFullCheckpoint(self):
+    if self._numInputSamplesSinceLastFullCheckpointCache is None:
+      self._loadCheckpointAttributes()
+    return self._numInputSamplesSinceLastFullCheckpointCache
 
 
   @classmethod
@@ -651,18 +767,26 @@ class _ModelArchiver(object):
         self._modelID)
     except model_checkpoint_mgr.ModelNotFound:
       self._modelCheckpointBatchIDSetCache = set()
-      self._inputSamplesSinceLastFullCheckpoint = []
+      self._numInputSamplesSinceLastFullCheckpointCache = 0
+      self._inputSamplesLogSize = 0
+      self._legacyInputSamples = []
     else:
       self._modelCheckpointBatchIDSetCache = set(
         checkpointAttributes[self._BATCH_IDS_CHECKPOINT_ATTR_NAME])
 
-      inputSamples = checkpointAttributes.get(
+      legacyInputSamples = checkpointAttributes.get(
         self._INPUT_SAMPLES_SINCE_CHECKPOINT_ATTR_NAME)
-      if inputSamples:
-        self._inputSamplesSinceLastFullCheckpoint = self._decodeDataSamples(
-          inputSamples)
+      if legacyInputSamples:
+        self._legacyInputSamples = self._decodeDataSamples(legacyInputSamples)
       else:
-        self._inputSamplesSinceLastFullCheckpoint = []
+        self._legacyInputSamples = []
+
+      self._inputSamplesLogSize = checkpointAttributes.get(
+        self._INPUT_SAMPLES_LOG_SIZE_ATTR_NAME, 0)
+
+      self._numInputSamplesSinceLastFullCheckpointCache = (
+        len(self._legacyInputSamples) +
+        checkpointAttributes.get(self._NUM_INPUT_SAMPLES_ATTR_NAME, 0))
 
 
   def loadModel(self):
@@ -720,8 +844,18 @@ class _ModelArchiver(object):
 
     self._inputRowEncoder = _InputRowEncoder(fieldsMeta=inputFieldsMeta)
 
-    # If the checkpoint was incremental, feed the cached data into the model
-    for inputSample in self._inputSamplesSinceLastFullCheckpoint:
+    # If the checkpoint was incremental, feed the input samples processed since
+    # the last full checkpoint into the model, streaming them from the
+    # checkpoint log
+    if self._numInputSamplesSinceLastFullCheckpoint:
+      inputSamples = itertools.chain(
+        self._legacyInputSamples,
+        self._checkpointMgr.loadCheckpointLog(self._modelID,
+                                              self._inputSamplesLogSize))
+    else:
+      inputSamples = ()
+
+    for inputSample in inputSamples:
       # Convert a flat input sample into a format that is consumable by an OPF
       # model
       self._inputRowEncoder.appendRecord(inputSample)
@@ -730,46 +864,141 @@ class _ModelArchiver(object):
       self._model.run(self._inputRowEncoder.getNextRecordDict())
 
 
-  def saveModel(self, currentRunBatchIDSet, currentRunInputSamples):
+  def waitForCheckpoint(self):
+    """ Wait for the full checkpoint that's being completed in the background,
+    if any, to become durable
+
+    :raises: the exception, if any, that failed the checkpoint
+    """
+    writer = self._pendingCheckpointWriter
+    if writer is not None:
+      self._pendingCheckpointWriter = None
+      writer.wait()
+
+
+  def saveModel(self, currentRunBatchIDSet, currentRunInputSamples,
+                inBackground=False):
     """
     :param currentRunBatchIDSet: a set of batch ids to be saved in model
       checkpoint attributes
 
     :param currentRunInputSamples: a sequence of model input data sample objects
-      for incremental checkpoint; will be saved in checkpoint attributes if an
+      for incremental checkpoint; will be saved in the checkpoint log if an
       incremental checkpoint is performed.
+
+    :param inBackground: if True and a full checkpoint is performed, return as
+      soon as the model is serialized and complete the checkpoint in the
+      background; see waitForCheckpoint()
+
+    :returns: True if a full checkpoint is being completed in the background;
+      False if the checkpoint is durable
     """
+    # Checkpoints must be made in order
+    self.waitForCheckpoint()
+
     if self._model is not None:
       self._modelCheckpointBatchIDSetCache = currentRunBatchIDSet.copy()
 
+      numInputSamples = (self._numInputSamplesSinceLastFullCheckpoint +
+                         len(currentRunInputSamples))
+
       if (not self._hasCheckpoint or
-          (len(self._inputSamplesSinceLastFullCheckpoint) +
-           len(currentRunInputSamples)) >
-          self._MAX_INCREMENTAL_CHECKPOINT_DATA_ROWS):
+          numInputSamples > self._MAX_INCREMENTAL_CHECKPOINT_DATA_ROWS):
         # Perform a full checkpoint
-        self._inputSamplesSinceLastFullCheckpointCache = []
+        self._numInputSamplesSinceLastFullCheckpointCache = 0
+        self._inputSamplesLogSize = 0
+        self._legacyInputSamples = []
+
+        attributes = {
+          self._BATCH_IDS_CHECKPOINT_ATTR_NAME:
+            list(self._modelCheckpointBatchIDSetCache)}
+
+        if inBackground:
+          self._pendingCheckpointWriter = _BackgroundCheckpointWriter(
+            checkpointMgr=self._checkpointMgr,
+            pendingCheckpoint=self._checkpointMgr.beginSave(
+              modelID=self._modelID, model=self._model, attributes=attributes))
+          self._hasCheckpoint = True
+          return True
 
         self._checkpointMgr.save(
-          modelID=self._modelID, model=self._model,
-          attributes={
-            self._BATCH_IDS_CHECKPOINT_ATTR_NAME:
-              list(self._modelCheckpointBatchIDSetCache)})
+          modelID=self._modelID, model=self._model, attributes=attributes)
 
         self._hasCheckpoint = True
       else:
-        # Perform an incremental checkpoint
-        self._inputSamplesSinceLastFullCheckpoint.extend(currentRunInputSamples)
+        # Perform an incremental checkpoint: append the current run's input
+        # samples to the checkpoint log (preceded by legacy input samples, if
+        # any, which are thereby moved to the log), then record the log's new
+        # size along with the batch IDs
+        inputSamplesLogSize = self._checkpointMgr.appendCheckpointLog(
+          self._modelID,
+          self._legacyInputSamples + list(currentRunInputSamples),
+          self._inputSamplesLogSize)
+
         attributes = {
           self._BATCH_IDS_CHECKPOINT_ATTR_NAME:
             list(self._modelCheckpointBatchIDSetCache),
 
-          self._INPUT_SAMPLES_SINCE_CHECKPOINT_ATTR_NAME:
-            self._encodeDataSamples(self._inputSamplesSinceLastFullCheckpoint)
+          self._INPUT_SAMPLES_LOG_SIZE_ATTR_NAME: inputSamplesLogSize,
+
+          self._NUM_INPUT_SAMPLES_ATTR_NAME: numInputSamples
         }
 
         self._checkpointMgr.updateCheckpointAttributes(self._modelID,
                                                        attributes)
 
+        self._numInputSamplesSinceLastFullCheckpointCache = numInputSamples
+        self._inputSamplesLogSize = inputSamplesLogSize
+        self._legacyInputSamples = []
+
+    return False
+
+
+
+class _BackgroundCheckpointWriter(object):
+  """ Completes a model checkpoint started via ModelCheckpointMgr.beginSave()
+  in a background thread
+  """
+
+  def __init__(self, checkpointMgr, pendingCheckpoint):
+    """
+    :param checkpointMgr: ModelCheckpointMgr instance
+    :param pendingCheckpoint: pending checkpoint returned by
+      ModelCheckpointMgr.beginSave()
+    """
+    self._checkpointMgr = checkpointMgr
+    self._pendingCheckpoint = pendingCheckpoint
+
+    # sys.exc_info() of the exception that failed the checkpoint; None if none
+    self._excInfo = None
+
+    self._thread = threading.Thread(
+      target=self._runWriterThread,
+      name="CheckpointWriter-%s" % (pendingCheckpoint.modelID,))
+    self._thread.setDaemon(True)
+    self._thread.start()
+
+
+  @logExceptions(_getLogger)
+  def _runWriterThread(self):
+    try:
+      self._checkpointMgr.completeSave(self._pendingCheckpoint)
+    except Exception:
+      self._excInfo = sys.exc_info()
+      raise
+
+
+  def wait(self):
+    """ Wait for the checkpoint to become durable
+
+    :raises: the exception, if any, that failed the checkpoint
+    """
+    self._thread.join()
+
+    if self._excInfo is not None:
+      excType, excValue, excTraceback = self._excInfo
+      raise excType, excValue, excTraceback
+
 
 
 class _InputRowEncoder(RecordStreamIface):
@@ -851,6 +1080,156 @@ class _InputRowEncoder(RecordStreamIface):
 
 
 
+class _ResidentModelCache(object):
+  """ LRU set of loaded models that a resident ModelRunner process retains
+  between runs of the models, bounded by a memory budget. Each model's memory
+  footprint is estimated from the size of its checkpoint.
+  """
+
+  def __init__(self, memoryBudget):
+    """
+    :param memoryBudget: memory budget in bytes for the retained models
+    """
+    self._logger = _getLogger()
+
+    self._memoryBudget = memoryBudget
+
+    # Map of model IDs to (_ModelArchiver, estimated size in bytes) tuples,
+    # ordered from least- to most-recently used
+    self._entries = collections.OrderedDict()
+
+    self._totalSize = 0
+
+
+  def __len__(self):
+    return len(self._entries)
+
+
+  def __contains__(self, modelID):
+    return modelID in self._entries
+
+
+  def pop(self, modelID):
+    """ Remove the given model from the cache
+
+    :param modelID: model ID; string
+
+    :returns: the model's _ModelArchiver instance or None if not in the cache
+    """
+    entry = self._entries.pop(modelID, None)
+    if entry is None:
+      return None
+
+    archiver, size = entry
+    self._totalSize -= size
+    return archiver
+
+
+  def add(self, modelID, archiver, size):
+    """ Add a model to the cache as the most-recently used one, evicting
+    least-recently used models as needed to stay within the memory budget
+
+    :param modelID: model ID; string
+    :param archiver: the model's _ModelArchiver instance with the model loaded
+    :param size: estimated size of the loaded model in bytes
+    """
+    assert modelID not in self._entries, modelID
+
+    self._entries[modelID] = (archiver, size)
+    self._totalSize += size
+
+    while self._totalSize > self._memoryBudget:
+      evictedModelID, (_, evictedSize) = self._entries.popitem(last=False)
+      self._totalSize -= evictedSize
+      self._logger.debug(
+        "{TAG:SWAP.MR.RESIDENT.EVICT} model=%s; size=%s; numResidentModels=%s; "
+        "totalSize=%s", evictedModelID, evictedSize, len(self._entries),
+        self._totalSize)
+
+
+
+def _readControlLine(fd):
+  """ Read a line from the given file descriptor one byte at a time, so that
+  anything that follows the line remains unread and may be detected via
+  select() (see ModelRunner.run)
+
+  :param fd: file descriptor to read from
+
+  :returns: the line without the line separator; None on end of file
+  """
+  chars = []
+  while True:
+    c = os.read(fd, 1)
+    if not c:
+      return None
+    if c == "\n":
+      return "".join(chars)
+    chars.append(c)
+
+
+
+def runResidentModels(controlFD, statusFile, memoryBudget):
+  """ Run models one at a time on behalf of a SlotAgent, retaining
+  recently-used models in memory between runs, so that running the same model
+  again doesn't require loading it from its checkpoint.
+
+  The SlotAgent starts a model by writing the model's ID followed by a line
+  separator to controlFD, and requests preemption of the running model by
+  writing an empty line; the model's exit status (0 on success) is written to
+  statusFile as a line when the model is done. Returns when the other end of
+  controlFD is closed.
+
+  :param controlFD: file descriptor of the control pipe from SlotAgent
+  :param statusFile: file object for reporting model exit status to SlotAgent
+  :param memoryBudget: memory budget in bytes for the retained models
+  """
+  logger = _getLogger()
+
+  residentModels = _ResidentModelCache(memoryBudget)
+
+  while True:
+    modelID = _readControlLine(controlFD)
+    if modelID is None:
+      logger.info("{TAG:SWAP.MR.RESIDENT.CLOSE} numResidentModels=%s",
+                  len(residentModels))
+      break
+
+    modelID = modelID.strip()
+    if not modelID:
+      # Belated preemption request for a model that already finished
+      continue
+
+    archiver = residentModels.pop(modelID)
+    if archiver is not None and not archiver.isCheckpointCurrent():
+      logger.info("{TAG:SWAP.MR.RESIDENT.STALE} model=%s", modelID)
+      archiver = None
+
+    logger.debug("{TAG:SWAP.MR.RESIDENT.START} model=%s; resident=%s",
+                 modelID, archiver is not None)
+
+    exitStatus = 0
+    try:
+      with ModelRunner(modelID=modelID, archiver=archiver) as runner:
+        runner.run()
+    except Exception:  # pylint: disable=W0703
+      logger.exception("{TAG:SWAP.MR.RESIDENT.RUN.FAILED} model=%s", modelID)
+      exitStatus = 1
+    else:
+      archiver = runner.archiver
+      if archiver.model is not None:
+        try:
+          size = archiver.checkpointMgr.getCheckpointSize(modelID)
+        except model_checkpoint_mgr.ModelNotFound:
+          # The model was deleted
+          pass
+        else:
+          residentModels.add(modelID, archiver, size)
+
+    statusFile.write("%d\n" % (exitStatus,))
+    statusFile.flush()
+
+
+
 def main(argv):
   # Parse command line options
   helpString = (
@@ -861,10 +1240,31 @@ def main(argv):
   parser.add_option("--modelID", action="store", type="str",
     help="The Model ID string that identifies the model to run.")
 
+  parser.add_option("--resident", action="store_true", default=False,
+    help="Run models requested via stdin one at a time, retaining "
+         "recently-used models in memory between runs.")
+
   (options, args) = parser.parse_args(argv[1:])
   if len(args) > 0:
     parser.error("Didn't expect any positional args (%r)." % (args,))
 
+  if options.resident:
+    if options.modelID is not None:
+      parser.error("Didn't expect model ID with --resident")
+
+    memoryBudget = ModelSwapperConfig().getint(
+      "model_runner", "resident_models_memory_budget_mb") * 1024 * 1024
+
+    # Reserve our stdout for reporting model exit status to SlotAgent, and
+    # redirect everything else that's written to stdout to stderr so it can't
+    # corrupt the status reports
+    statusFile = os.fdopen(os.dup(sys.stdout.fileno()), "w")
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+
+    runResidentModels(controlFD=sys.stdin.fileno(), statusFile=statusFile,
+                      memoryBudget=memoryBudget)
+    return
+
   if options.modelID is None:
     parser.error("Missing model ID in command-line")
 
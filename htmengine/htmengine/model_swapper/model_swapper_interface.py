@@ -67,9 +67,12 @@ App layer reads results::
             batch.ack()
 """
 
-from collections import namedtuple
+from collections import namedtuple, OrderedDict
 import datetime
+import itertools
 import json
+import struct
+import threading
 import time
 import types
 import uuid
@@ -419,23 +422,56 @@ class ModelInferenceResult(_ModelRequestResultBase):
 
 
 class BatchPackager(object):
-  """ Serializer for a batch of request or result items """
+  """ Serializer for a batch of request or result items
+
+  Batches are marshalled either in JSON or in a compact binary format, which
+  packs runs of ModelInputRow instances with numeric and datetime fields and of
+  successful ModelInferenceResult instances into columns of fixed-size values,
+  falling back to JSON for other items. The binary format starts with a marker
+  and a version number, so unmarshal detects the format of each batch and
+  batches in the original JSON format remain decodable.
+  """
+
+  # Binary batch states start with this marker, which can't start a JSON batch
+  # state, followed by the format version byte
+  _BINARY_MARKER = "\x00"
+  _BINARY_VERSION = 1
+
+  # Binary batch segment type codes
+  _JSON_SEGMENT = "J"
+  _INPUT_ROW_SEGMENT = "I"
+  _INFERENCE_RESULT_SEGMENT = "R"
+
+  # ModelInputRow field type codes of input row segments
+  _DATETIME_FIELD = "T"
+  _FLOAT_FIELD = "d"
+  _INT_FIELD = "q"
+
+  # Segment type code and the segment's item count or, for JSON segments, the
+  # length of the JSON string
+  _SEGMENT_HEADER = struct.Struct("<cI")
+
+  _EPOCH = datetime.datetime.utcfromtimestamp(0)
+
+  _MIN_INT64 = -2 ** 63
+  _MAX_INT64 = 2 ** 63 - 1
 
 
   @classmethod
-  def marshal(cls, batch):
+  def marshal(cls, batch, binary=False):
     """ Marshal a batch of requests or results into a string, preserving their
     order.
 
-    The returned string will NOT contain newlines (this makes it convenient to
-    write newline-separated batches to stdout and readline them from stdin
-    without further escaping of the data).
+    In JSON format, the returned string will NOT contain newlines (this makes
+    it convenient to write newline-separated batches to stdout and readline
+    them from stdin without further escaping of the data). The binary format
+    may contain any bytes.
 
     :param batch: a sequence of requests or results (instances of ModelCommand,
       ModelInputRow)
+    :param binary: True to use the binary format; False to use JSON
 
     :returns: a string representation of the given batch, preserving order.
-      The returned string will not contain newlines.
 
     Example::
 
@@ -447,7 +483,46 @@ class BatchPackager(object):
 
     And similar for a result batch.
     """
-    return json.dumps([o.__getstate__() for o in batch])
+    if not binary:
+      return json.dumps([o.__getstate__() for o in batch])
+
+    parts = [cls._BINARY_MARKER, chr(cls._BINARY_VERSION)]
+
+    for layout, items in itertools.groupby(batch, cls._getColumnarLayout):
+      items = list(items)
+      numItems = len(items)
+
+      if layout is None:
+        state = json.dumps([o.__getstate__() for o in items])
+        parts.append(cls._SEGMENT_HEADER.pack(cls._JSON_SEGMENT, len(state)))
+        parts.append(state)
+
+      elif layout == cls._INFERENCE_RESULT_SEGMENT:
+        parts.append(cls._SEGMENT_HEADER.pack(layout, numItems))
+        parts.append(struct.pack("<%dq" % numItems,
+                                 *[r.rowID for r in items]))
+        parts.append(struct.pack("<%dd" % numItems,
+                                 *[r.anomalyScore for r in items]))
+
+      else:
+        # Input rows; the layout is the sequence of field type codes
+        parts.append(cls._SEGMENT_HEADER.pack(cls._INPUT_ROW_SEGMENT,
+                                              numItems))
+        parts.append(chr(len(layout)))
+        parts.extend(layout)
+        parts.append(struct.pack("<%dq" % numItems,
+                                 *[r.rowID for r in items]))
+
+        for i, fieldType in enumerate(layout):
+          if fieldType == cls._DATETIME_FIELD:
+            parts.append(struct.pack(
+              "<%dq" % numItems,
+              *[cls._encodeDateTime(r.data[i]) for r in items]))
+          else:
+            parts.append(struct.pack("<%d%s" % (numItems, fieldType),
+                                     *[r.data[i] for r in items]))
+
+    return "".join(parts)
 
 
   @classmethod
@@ -455,9 +530,129 @@ class BatchPackager(object):
     """ Unmarshal the given batchState string into a sequence of request or
     result instances (e.g., ModelCommand, ModelInputRow), preserving the
     original order
+
+    :raises ValueError: if batchState is in an unsupported binary format
+      version
     """
-    return tuple(_ModelRequestResultBase.__createFromState__(itemState)
-                 for itemState in json.loads(batchState))
+    if not batchState.startswith(cls._BINARY_MARKER):
+      return tuple(_ModelRequestResultBase.__createFromState__(itemState)
+                   for itemState in json.loads(batchState))
+
+    version = ord(batchState[1])
+    if version != cls._BINARY_VERSION:
+      raise ValueError("Unsupported binary batch format version=%s" %
+                       (version,))
+
+    items = []
+    offset = 2
+    while offset < len(batchState):
+      segmentType, count = cls._SEGMENT_HEADER.unpack_from(batchState, offset)
+      offset += cls._SEGMENT_HEADER.size
+
+      if segmentType == cls._JSON_SEGMENT:
+        items.extend(_ModelRequestResultBase.__createFromState__(itemState)
+                     for itemState in json.loads(
+                       batchState[offset:offset + count]))
+        offset += count
+        continue
+
+      if segmentType == cls._INFERENCE_RESULT_SEGMENT:
+        rowIDs = struct.unpack_from("<%dq" % count, batchState, offset)
+        offset += 8 * count
+
+        anomalyScores = struct.unpack_from("<%dd" % count, batchState, offset)
+        offset += 8 * count
+
+        for rowID, anomalyScore in itertools.izip(rowIDs, anomalyScores):
+          result = object.__new__(ModelInferenceResult)
+          result.rowID = rowID
+          result.status = 0
+          result.anomalyScore = anomalyScore
+          result.errorMessage = None
+          items.append(result)
+
+      elif segmentType == cls._INPUT_ROW_SEGMENT:
+        numFields = ord(batchState[offset])
+        layout = batchState[offset + 1:offset + 1 + numFields]
+        offset += 1 + numFields
+
+        rowIDs = struct.unpack_from("<%dq" % count, batchState, offset)
+        offset += 8 * count
+
+        columns = []
+        for fieldType in layout:
+          if fieldType == cls._DATETIME_FIELD:
+            columns.append([
+              cls._decodeDateTime(value)
+              for value in struct.unpack_from("<%dq" % count, batchState,
+                                              offset)])
+          else:
+            columns.append(struct.unpack_from("<%d%s" % (count, fieldType),
+                                              batchState, offset))
+          offset += 8 * count
+
+        for rowID, data in itertools.izip(rowIDs, itertools.izip(*columns)):
+          row = object.__new__(ModelInputRow)
+          row.rowID = rowID
+          row.data = list(data)
+          items.append(row)
+
+      else:
+        raise ValueError("Unexpected binary batch segment type=%r" %
+                         (segmentType,))
+
+    return tuple(items)
+
+
+  @classmethod
+  def _isInt64(cls, value):
+    return (isinstance(value, (int, long)) and not isinstance(value, bool) and
+            cls._MIN_INT64 <= value <= cls._MAX_INT64)
+
+
+  @classmethod
+  def _getColumnarLayout(cls, item):
+    """ Determine how the given item may be packed into binary columns
+
+    :returns: _INFERENCE_RESULT_SEGMENT for a successful ModelInferenceResult;
+      tuple of field type codes for a ModelInputRow; None if the item can't be
+      packed into columns without loss and needs to be serialized as JSON
+    """
+    if type(item) is ModelInferenceResult:
+      if (item.status == 0 and cls._isInt64(item.rowID) and
+          isinstance(item.anomalyScore, float)):
+        return cls._INFERENCE_RESULT_SEGMENT
+      return None
+
+    if type(item) is not ModelInputRow or not cls._isInt64(item.rowID):
+      return None
+
+    layout = []
+    for value in item.data:
+      if isinstance(value, datetime.datetime) and value.tzinfo is None:
+        layout.append(cls._DATETIME_FIELD)
+      elif isinstance(value, float):
+        layout.append(cls._FLOAT_FIELD)
+      elif cls._isInt64(value):
+        layout.append(cls._INT_FIELD)
+      else:
+        return None
+
+    return tuple(layout)
+
+
+  @classmethod
+  def _encodeDateTime(cls, dateTime):
+    """ Encode a naive UTC datetime as microseconds since the epoch """
+    delta = dateTime - cls._EPOCH
+    return ((delta.days * 86400 + delta.seconds) * 1000000 +
+            delta.microseconds)
+
+
+  @classmethod
+  def _decodeDateTime(cls, microseconds):
+    """ Inverse of _encodeDateTime """
+    return cls._EPOCH + datetime.timedelta(microseconds=microseconds)
 
 
 
@@ -576,6 +771,10 @@ class ModelSwapperInterface(object):
 
   _MODEL_INPUT_Q_PREFIX_OPTION_NAME = "model_input_queue_prefix"
 
+  _BATCH_FORMAT_OPTION_NAME = "batch_format"
+
+  _NOTIFICATION_COALESCE_WINDOW_OPTION_NAME = "notification_coalesce_window_ms"
+
 
   def __init__(self):
     """
@@ -597,6 +796,45 @@ class ModelSwapperInterface(object):
     self._schedulerNotificationQueueName = config.get(
       self._CONFIG_SECTION, self._SCHEDULER_NOTIFICATION_Q_OPTION_NAME)
 
+    # Submitted batches are marshalled in binary format if True, in JSON if
+    # False; consumed batches of either format are unmarshalled
+    batchFormat = config.get(self._CONFIG_SECTION,
+                             self._BATCH_FORMAT_OPTION_NAME)
+    if batchFormat not in ("json", "binary"):
+      raise ValueError("Unknown model swapper batch_format=%r" % (batchFormat,))
+    self._binaryBatches = (batchFormat == "binary")
+
+    # Model Scheduler notifications of confirmed request batches are coalesced
+    # for this long after the oldest one, across submitRequests calls
+    self._notificationCoalesceWindowSec = config.getfloat(
+      self._CONFIG_SECTION,
+      self._NOTIFICATION_COALESCE_WINDOW_OPTION_NAME) / 1000.0
+
+    # IDs of models with submitted request batches that haven't been confirmed
+    # yet (keys; values are None)
+    self._unconfirmedNotificationModelIDs = OrderedDict()
+
+    # IDs of models with confirmed request batches whose Model Scheduler
+    # notification hasn't been published yet (keys; values are None); guarded
+    # by self._notificationLock
+    self._pendingNotificationModelIDs = OrderedDict()
+    self._notificationLock = threading.Lock()
+
+    # Timer that publishes the pending notification at the end of the
+    # coalescing window
+    self._notificationTimer = None
+
+    # Serializes the use of self._notificationBus
+    self._notificationPublishLock = threading.Lock()
+
+    # Message bus connector for publishing notifications from the timer thread;
+    # created on demand
+    self._notificationBus = None
+
+    # Time (time.time()) when initSchedulerNotification() created the Model
+    # Scheduler's notification message queue; None if it wasn't called
+    self._schedulerNotificationInitTime = None
+
     # Message bus connector
     self._bus = MessageBusConnector()
 
@@ -642,10 +880,37 @@ class ModelSwapperInterface(object):
 
       assert not self._consumers
 
+    if self._unconfirmedNotificationModelIDs:
+      self._logger.warn(
+        "While closing %s, discarding Model Scheduler notification of "
+        "models=%s whose request batches weren't confirmed",
+        self.__class__.__name__,
+        self._unconfirmedNotificationModelIDs.keys())
+      self._unconfirmedNotificationModelIDs.clear()
+
+    # Publish the pending notification now rather than at the end of its
+    # coalescing window
+    if self._notificationTimer is not None:
+      self._notificationTimer.cancel()
+      self._notificationTimer.join()
+      self._notificationTimer = None
+
     try:
-      self._bus.close()
+      self._publishPendingSchedulerNotification()
+    except Exception:  # pylint: disable=W0703
+      self._logger.exception(
+        "While closing %s, failed to publish Model Scheduler notification",
+        self.__class__.__name__)
+
+    try:
+      if self._notificationBus is not None:
+        self._notificationBus.close()
+        self._notificationBus = None
     finally:
-      self._bus = None
+      try:
+        self._bus.close()
+      finally:
+        self._bus = None
 
 
   def _onConsumerClosed(self, consumer):
@@ -685,6 +950,9 @@ class ModelSwapperInterface(object):
         order to avoid the overhead of passing fields names with each and every
         input record, while permitting the necessary dictionaries to be
         constructed by ModelRunner for input to the OPF Model.
+      "schedulingPriority": optional number; models with higher priority are
+        favored by the "priority_cost" scheduling policy of Model Scheduler.
+        Defaults to 0.
     :param commandID: a numeric or string id to associate with the command and
       result.
     """
@@ -774,9 +1042,29 @@ class ModelSwapperInterface(object):
       return False
 
 
+  def getModelInputDepth(self, modelID):
+    """ Get the number of input request batches pending for a model
+
+    :param modelID: a string that uniquely identifies the target model.
+
+    :returns: the number of request batches in the model's input queue that
+      haven't been delivered to the model yet; 0 if the queue doesn't exist
+    """
+    try:
+      return self._bus.getMessageCount(self._getModelInputQName(modelID))
+    except message_bus_connector.MessageQueueNotFound:
+      return 0
+
+
   def getModelsWithInputPending(self):
     """ Get model IDs of all models with pending input (non-empty input queues)
 
+    NOTE: the Model Scheduler calls initSchedulerNotification() first, so that
+    input submitted after that point is also reported through notifications.
+    Since the broker's queue statistics lag behind the queues, this waits until
+    the statistics reflect the queues as of that point; otherwise, input
+    submitted just before it might be reported as missing and never scheduled.
+
     :returns: (possibly empty) sequence of model IDs whose input streams are
       non-empty
     """
@@ -788,14 +1076,27 @@ class ModelSwapperInterface(object):
       except message_bus_connector.MessageQueueNotFound:
         return False
 
-    prefix = self._modelInputQueueNamePrefix
+    statisticsTime = ((self._schedulerNotificationInitTime or time.time()) +
+                      message_bus_connector.MANAGEMENT_STATISTICS_LAG_SEC)
+    delay = statisticsTime - time.time()
+    if delay > 0:
+      self._logger.info("Waiting %.1fs for message queue statistics",
+                        delay)
+      time.sleep(delay)
+
+    # The depths of all input queues are retrieved at once, so that this scales
+    # with the number of models; only queues that the broker has no statistics
+    # for yet are checked individually
+    depths = self._bus.getMessageQueueDepths(
+      namePrefix=self._modelInputQueueNamePrefix)
+
     return tuple(
       self._getModelIDFromInputQName(mq)
-      for mq in self._bus.getAllMessageQueues()
-      if mq.startswith(prefix) and safeIsInputPending(mq))
+      for mq, depth in depths.iteritems()
+      if (depth > 0 if depth is not None else safeIsInputPending(mq)))
 
 
-  def submitRequests(self, modelID, requests):
+  def submitRequests(self, modelID, requests, waitForConfirm=True):
     """
     Submit a batch of requests for processing by a model with the given modelID.
 
@@ -810,9 +1111,15 @@ class ModelSwapperInterface(object):
       method instead of submitting the "defineModel" or "deleteModel" commands.
       Together, the sequence of requests constitutes a request "batch".
 
+    :param waitForConfirm: True to wait until the message bus confirms delivery
+      of the batch and of previously pipelined batches; False to pipeline the
+      batch, leaving confirmation to a subsequent waitForConfirms() call.
+      [default=True]
+
     :returns: UUID of the submitted batch (intended for test code only)
 
-    :raises: ModelNotFound if model's input endpoint doesn't exist
+    :raises: ModelNotFound if model's input endpoint doesn't exist; for
+      pipelined batches, it may be raised by a subsequent call instead
 
     Requests for a specific model will be processed in the submitted order.
     The results will be delivered asynchronously, along with the corresponding
@@ -824,17 +1131,21 @@ class ModelSwapperInterface(object):
     batchID = uuid.uuid1().hex
     msg = RequestMessagePackager.marshal(
       batchID=batchID,
-      batchState=BatchPackager.marshal(batch=requests))
+      batchState=BatchPackager.marshal(batch=requests,
+                                       binary=self._binaryBatches))
 
     mqName = self._getModelInputQName(modelID)
     try:
-      self._bus.publish(mqName, msg, persistent=True)
-    except message_bus_connector.MessageQueueNotFound as e:
-      self._logger.warn(
-        "App layer attempted to submit numRequests=%s to model=%s, but its "
-        "input queue doesn't exist. Likely a race condition with model "
-        "deletion path.", len(requests), modelID)
-      raise ModelNotFound(repr(e))
+      self._publishPipelined(mqName, msg, persistent=True)
+
+      # Notify Model Scheduler once the batch is confirmed, so it will schedule
+      # the model for processing input
+      self._unconfirmedNotificationModelIDs[modelID] = None
+
+      if waitForConfirm:
+        self.waitForConfirms()
+    except ModelNotFound:
+      raise
     except:
       self._logger.exception(
         "Failed to publish request batch=%s for model=%s via mq=%s; "
@@ -843,19 +1154,166 @@ class ModelSwapperInterface(object):
         msg[:32])
       raise
 
-    # Send a notification to Model Scheduler so it will schedule the model
-    # for processing input
+    return batchID
+
+
+  def waitForConfirms(self):
+    """ Wait until the message bus confirms delivery of the request and result
+    batches that were pipelined via submitRequests and submitResults with
+    waitForConfirm=False
+
+    Model Scheduler is notified of the models whose request batches were
+    delivered at the end of the notification coalescing window, which starts
+    at the oldest pending notification, so that the notifications of request
+    batches submitted within the window by consecutive calls are combined into
+    a single message.
+
+    :raises: ModelNotFound if the input endpoints of some of the models don't
+      exist; the other batches were delivered
+    """
+    try:
+      self._bus.waitForConfirms()
+    except message_bus_connector.UndeliveredMessagesError as e:
+      undelivered = e.undelivered
+    else:
+      undelivered = ()
+
+    undeliveredMQNames = set(mqName for mqName, _body in undelivered)
+    modelIDs = [modelID
+                for modelID in self._unconfirmedNotificationModelIDs
+                if self._getModelInputQName(modelID) not in undeliveredMQNames]
+    self._unconfirmedNotificationModelIDs.clear()
+
+    self._addSchedulerNotification(modelIDs)
+
+    if undelivered:
+      self._handleUndeliveredMessages(undelivered)
+
+
+  def _addSchedulerNotification(self, modelIDs):
+    """ Add models to the pending Model Scheduler notification, starting its
+    coalescing window if it's a new notification; without a coalescing window,
+    publish the notification right away
+
+    :param modelIDs: sequence of IDs of models with confirmed request batches
+    """
+    if not modelIDs:
+      return
+
+    if self._notificationCoalesceWindowSec <= 0:
+      self._publishSchedulerNotification(self._bus, modelIDs)
+      return
+
+    with self._notificationLock:
+      if not self._pendingNotificationModelIDs:
+        self._notificationTimer = threading.Timer(
+          self._notificationCoalesceWindowSec,
+          self._onNotificationCoalesceWindowElapsed)
+        self._notificationTimer.daemon = True
+        self._notificationTimer.start()
+
+      for modelID in modelIDs:
+        self._pendingNotificationModelIDs[modelID] = None
+
+
+  def _onNotificationCoalesceWindowElapsed(self):
+    """ Called in the notification timer's thread: publish the pending Model
+    Scheduler notification
+    """
+    try:
+      self._publishPendingSchedulerNotification()
+    except Exception:  # pylint: disable=W0703
+      self._logger.exception("Failed to publish Model Scheduler notification")
+
+
+  def _publishPendingSchedulerNotification(self):
+    """ Publish the pending Model Scheduler notification, if any, as a single
+    message carrying the IDs of all the models
+    """
+    with self._notificationPublishLock:
+      with self._notificationLock:
+        modelIDs = self._pendingNotificationModelIDs.keys()
+        self._pendingNotificationModelIDs.clear()
+
+      if not modelIDs:
+        return
+
+      if self._notificationBus is None:
+        self._notificationBus = MessageBusConnector()
+
+      self._publishSchedulerNotification(self._notificationBus, modelIDs)
+
+
+  def _publishSchedulerNotification(self, bus, modelIDs):
+    """ Publish a Model Scheduler notification
+
+    :param bus: MessageBusConnector instance to publish with
+    :param modelIDs: sequence of IDs of the models with new input
+    """
     try:
-      self._bus.publish(self._schedulerNotificationQueueName,
-                        json.dumps(modelID), persistent=False)
+      bus.publish(self._schedulerNotificationQueueName, json.dumps(modelIDs),
+                  persistent=False)
     except message_bus_connector.MessageQueueNotFound:
       # If it's not fully up yet, its notification queue might not have been
       # created, which is ok
       self._logger.warn(
-        "Couldn't send model data notification to Model Scheduler: mq=%s not "
-        "found. Model Scheduler service not started or initialized the mq yet?",
-        self._schedulerNotificationQueueName)
-    return batchID
+        "Couldn't send model data notification to Model Scheduler: mq=%s "
+        "not found. Model Scheduler service not started or initialized the "
+        "mq yet?", self._schedulerNotificationQueueName)
+
+
+  def _publishPipelined(self, mqName, body, persistent):
+    """ Publish a message without waiting for confirmation of its delivery
+
+    :raises: ModelNotFound if the input endpoints of models of previously
+      pipelined request batches don't exist
+    """
+    try:
+      self._bus.publish(mqName, body, persistent=persistent,
+                        waitForConfirm=False)
+    except message_bus_connector.UndeliveredMessagesError as e:
+      self._handleUndeliveredMessages(e.undelivered)
+
+
+  def _handleUndeliveredMessages(self, undelivered):
+    """ Recover from pipelined messages that couldn't be delivered because their
+    message queues were not found: results are re-published after declaring
+    the results message queue, and model scheduler notifications are dropped
+
+    :param undelivered: sequence of (mqName, body) pairs of the messages
+
+    :raises: ModelNotFound if request batches were undelivered
+    """
+    missingModelIDs = []
+    resultsQueueInitialized = False
+    for mqName, body in undelivered:
+      if mqName == self._resultsQueueName:
+        if not resultsQueueInitialized:
+          self._logger.info("submitResults: results mq=%s didn't exist; "
+                            "declaring now and re-publishing message", mqName)
+          self._initResultsMessageQueue()
+          resultsQueueInitialized = True
+
+        self._bus.publish(mqName, body, persistent=True)
+
+      elif mqName == self._schedulerNotificationQueueName:
+        # If it's not fully up yet, its notification queue might not have been
+        # created, which is ok
+        self._logger.warn(
+          "Couldn't send model data notification to Model Scheduler: mq=%s "
+          "not found. Model Scheduler service not started or initialized the "
+          "mq yet?", mqName)
+
+      else:
+        missingModelIDs.append(self._getModelIDFromInputQName(mqName))
+
+    if missingModelIDs:
+      self._logger.warn(
+        "App layer attempted to submit request batches to models=%s, but "
+        "their input queues don't exist. Likely a race condition with model "
+        "deletion path.", missingModelIDs)
+      raise ModelNotFound("Input queues of models=%s not found" %
+                          (missingModelIDs,))
 
 
   def consumeRequests(self, modelID, blocking=True):
@@ -910,7 +1368,7 @@ class ModelSwapperInterface(object):
     self._bus.createMessageQueue(self._resultsQueueName, durable=True)
 
 
-  def submitResults(self, modelID, results):
+  def submitResults(self, modelID, results, waitForConfirm=True):
     """
     Submit a batch of results (used by ModelSwapper layer)
 
@@ -920,21 +1378,23 @@ class ModelSwapperInterface(object):
     :param results: a sequence of ModelCommandResult and/or ModelInferenceResult
       instances
 
+    :param waitForConfirm: True to wait until the message bus confirms delivery
+      of the batch and of previously pipelined batches; False to pipeline the
+      batch, leaving confirmation to a subsequent waitForConfirms() call.
+      [default=True]
+
     NOTE: This assumes retry logic will be handled by the underlying MQ
     implementation.
     """
     msg = ResultMessagePackager.marshal(
       modelID=modelID,
-      batchState=BatchPackager.marshal(batch=results))
+      batchState=BatchPackager.marshal(batch=results,
+                                       binary=self._binaryBatches))
     try:
-      try:
-        self._bus.publish(self._resultsQueueName, msg, persistent=True)
-      except message_bus_connector.MessageQueueNotFound:
-        self._logger.info("submitResults: results mq=%s didn't exist; "
-                          "declaring now and re-publishing message",
-                          self._resultsQueueName)
-        self._initResultsMessageQueue()
-        self._bus.publish(self._resultsQueueName, msg, persistent=True)
+      self._publishPipelined(self._resultsQueueName, msg, persistent=True)
+
+      if waitForConfirm:
+        self.waitForConfirms()
     except:
       self._logger.exception(
         "submitResults: Failed to publish results from model=%s via mq=%s; "
@@ -943,11 +1403,27 @@ class ModelSwapperInterface(object):
       raise
 
 
-  def consumeResults(self):
+  def resultsPending(self):
+    """ Check if model results are waiting in the results queue
+
+    :returns: True if the results queue exists and has results that haven't
+      been delivered to a consumer yet; False otherwise
+    """
+    try:
+      return not self._bus.isEmpty(self._resultsQueueName)
+    except message_bus_connector.MessageQueueNotFound:
+      return False
+
+
+  def consumeResults(self, prefetchMax=None):
     """ Create an instance of the _MessageConsumer iterable for reading model
     results, a batch at a time. The iterable yields _ConsumedResultBatch
     instances.
 
+    :param prefetchMax: limit for how many unacked result batches may be
+      delivered to the consumer; None to use the message bus default.
+      Consumers that process several batches concurrently need a larger limit.
+
     :returns: an instance of model_swapper_interface._MessageConsumer iterable;
       IMPORTANT: the caller is responsible for closing it before closing this
       ModelSwapperInterface instance (hint: use the returned _MessageConsumer
@@ -965,7 +1441,8 @@ class ModelSwapperInterface(object):
                                 decode=_ConsumedResultBatch.decodeMessage,
                                 swapper=self,
                                 bus=self._bus,
-                                onQueueNotFound=self._initResultsMessageQueue)
+                                onQueueNotFound=self._initResultsMessageQueue,
+                                prefetchMax=prefetchMax)
 
     self._consumers.append(consumer)
 
@@ -979,6 +1456,8 @@ class ModelSwapperInterface(object):
     self._bus.createMessageQueue(self._schedulerNotificationQueueName,
                                  durable=False)
 
+    self._schedulerNotificationInitTime = time.time()
+
 
   def consumeModelSchedulerNotifications(self):
     """ Create an instance of the _MessageConsumer iterable for reading model
@@ -994,7 +1473,7 @@ class ModelSwapperInterface(object):
       with ModelSwapperInterface() as swapper:
         with swapper.consumeModelSchedulerNotifications() as consumer:
           for notification in consumer:
-            processNotification(notification.value)
+            processNotification(notification.modelIDs)
             notification.ack()
     """
     consumer = _MessageConsumer(mqName=self._schedulerNotificationQueueName,
@@ -1070,10 +1549,11 @@ class _ConsumedResultBatch(  # pylint: disable=W0232
 
 
 class _ConsumedNotification(  # pylint: disable=W0232
-    namedtuple("_ConsumedNotificationBase", "value ack")):
+    namedtuple("_ConsumedNotificationBase", "modelIDs ack")):
   """ Container for a consumed Model Scheduler notification
 
-  value: notification object
+  modelIDs: sequence of IDs of models that have new input; may contain
+    duplicates
   ack: function to call to ack the message: NoneType ack(multiple=False);
     recepient is responsible for ACK'ing each batch in order get more messages
     and also for supporting the "at-least-once" delivery guarantee.
@@ -1090,7 +1570,12 @@ class _ConsumedNotification(  # pylint: disable=W0232
 
     :returns: value that should be yielded by the _MessageConsumer iterable
     """
-    return cls(value=json.loads(msg.body), ack=msg.ack)
+    value = json.loads(msg.body)
+
+    # Notifications of a single model ID are published by earlier versions
+    modelIDs = value if isinstance(value, list) else [value]
+
+    return cls(modelIDs=modelIDs, ack=msg.ack)
 
 
 
@@ -1100,7 +1585,7 @@ class _MessageConsumer(object):
   """
 
   def __init__(self, mqName, blocking, decode, swapper,
-               bus, onQueueNotFound=None):
+               bus, onQueueNotFound=None, prefetchMax=None):
     """
     :param mqName: the name of the target message queue
     :param blocking: if True, the iterable will block until another batch
@@ -1116,6 +1601,8 @@ class _MessageConsumer(object):
       message_bus_connector.MessageQueueNotFound exception. onQueueNotFound is
       expected to create the queue. After calling onQueueNotFound, the consumer
       will attempt to restart the iterator.
+    :param prefetchMax: limit for how many unacked messages the broker may
+      deliver to the consumer; None to use the message bus default
     """
     self._logger = _getLogger()
     self._mqName = mqName
@@ -1124,12 +1611,14 @@ class _MessageConsumer(object):
     self._swapper = swapper
     self._bus = bus
     self._onQueueNotFound = onQueueNotFound
+    self._prefetchMax = prefetchMax
 
     self._mqConsumer = self._createMessageQueueConsumer()
 
 
   def _createMessageQueueConsumer(self):
-    return self._bus.consume(self._mqName, blocking=self._blocking)
+    return self._bus.consume(self._mqName, blocking=self._blocking,
+                             prefetchMax=self._prefetchMax)
 
 
   def __enter__(self):
@@ -0,0 +1,378 @@
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2015, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+"""
+This module implements the scheduling policies that SwapController uses to
+choose which waiting model to run next and which running model to preempt when
+all model slots are busy.
+"""
+
+import abc
+import heapq
+import itertools
+import math
+import time
+
+from htmengine.model_checkpoint_mgr import model_checkpoint_mgr
+from htmengine.model_checkpoint_mgr.model_checkpoint_mgr import (
+    ModelCheckpointMgr)
+from htmengine.model_swapper import ModelSwapperConfig
+
+
+
+def createSchedulingPolicy(swapperAPI):
+  """ Create the scheduling policy configured in the "scheduling" section of
+  model-swapper.conf
+
+  :param swapperAPI: ModelSwapperInterface instance for use by the policy in
+    the caller's thread
+
+  :returns: SchedulingPolicyBase-based instance
+  :raises ValueError: if the configured policy name is unknown
+  """
+  config = ModelSwapperConfig()
+
+  policyName = config.get("scheduling", "policy")
+
+  if policyName == FifoSchedulingPolicy.NAME:
+    return FifoSchedulingPolicy()
+
+  elif policyName == PriorityCostSchedulingPolicy.NAME:
+    return PriorityCostSchedulingPolicy(
+      swapperAPI=swapperAPI,
+      priorityWeightSec=config.getfloat("scheduling", "priority_weight_sec"),
+      inputDepthWeightSec=config.getfloat("scheduling",
+                                          "input_depth_weight_sec"),
+      loadCostWeightSecPerMB=config.getfloat("scheduling",
+                                             "load_cost_weight_sec_per_mb"))
+
+  else:
+    raise ValueError("Unknown model scheduling policy=%r" % (policyName,))
+
+
+
+class _IndexedHeap(object):
+  """ A min-heap of items identified by unique IDs.
+
+  Supports O(log n) insertion and removal of the item with the smallest key,
+  as well as removal and re-keying of arbitrary items by ID; removed entries
+  are discarded lazily.
+  """
+
+  # Rebuild the heap when it holds more than this many times as many entries as
+  # there are live items, so that lazily-removed entries don't pile up
+  _MAX_HEAP_TO_ITEMS_RATIO = 2
+
+
+  def __init__(self):
+    # Heap of [key, sequence, itemID, value, isLive] entries; sequence preserves
+    # insertion order of items with equal keys
+    self._heap = []
+
+    # Map of itemIDs to their live heap entries
+    self._entries = dict()
+
+    self._sequence = itertools.count()
+
+
+  def __len__(self):
+    return len(self._entries)
+
+
+  def __contains__(self, itemID):
+    return itemID in self._entries
+
+
+  def push(self, itemID, key, value=None):
+    """ Add an item, replacing the item with the same ID, if any
+
+    :param itemID: hashable ID of the item
+    :param key: the item's sort key; the item with the smallest key is popped
+      first
+    :param value: arbitrary value to associate with the item
+    """
+    self.remove(itemID)
+
+    entry = [key, next(self._sequence), itemID, value, True]
+    self._entries[itemID] = entry
+    heapq.heappush(self._heap, entry)
+
+    if len(self._heap) > (self._MAX_HEAP_TO_ITEMS_RATIO * len(self._entries) +
+                          1):
+      self._heap = [e for e in self._heap if e[4]]
+      heapq.heapify(self._heap)
+
+
+  def getValue(self, itemID):
+    """ Get the value associated with an item
+
+    :raises KeyError: if the item isn't present
+    """
+    return self._entries[itemID][3]
+
+
+  def remove(self, itemID):
+    """ Remove an item, if present
+
+    :returns: True if the item was removed; False if it wasn't present
+    """
+    entry = self._entries.pop(itemID, None)
+    if entry is None:
+      return False
+
+    entry[4] = False
+    return True
+
+
+  def pop(self):
+    """ Remove the item with the smallest key
+
+    :returns: (itemID, value) of the removed item
+    :raises IndexError: if the heap is empty
+    """
+    while self._heap:
+      entry = heapq.heappop(self._heap)
+      if entry[4]:
+        del self._entries[entry[2]]
+        return entry[2], entry[3]
+
+    raise IndexError("pop from empty _IndexedHeap")
+
+
+
+class SchedulingPolicyBase(object):
+  """ Base class for model scheduling policies. The policy tracks models that
+  are waiting for a free slot and running models that may be preempted.
+
+  Subclasses provide the sort keys of waiting and running models; the models
+  with the smallest keys are scheduled and preempted first, respectively.
+
+  NOTE: the policy is not thread-safe; SwapController uses it only from its
+  event loop
+  """
+
+  __metaclass__ = abc.ABCMeta
+
+
+  def __init__(self):
+    # Models waiting for a free slot
+    self._waitingModels = _IndexedHeap()
+
+    # Running models that are candidates for preemption; value is slot index
+    self._runningModels = _IndexedHeap()
+
+
+  @abc.abstractmethod
+  def _getWaitingModelKey(self, modelID):
+    """ Get the sort key of a model that starts waiting for a free slot; the
+    waiting model with the smallest key is scheduled first
+    """
+    raise NotImplementedError()
+
+
+  @abc.abstractmethod
+  def _getRunningModelKey(self, modelID):
+    """ Get the sort key of a running model; called when the model starts
+    running and whenever new input arrives for it. The running model with the
+    smallest key is preempted first.
+    """
+    raise NotImplementedError()
+
+
+  @property
+  def numWaitingModels(self):
+    return len(self._waitingModels)
+
+
+  def isModelWaiting(self, modelID):
+    return modelID in self._waitingModels
+
+
+  def addWaitingModel(self, modelID):
+    """ Add a model that needs to wait for a free slot """
+    assert modelID not in self._waitingModels, modelID
+    self._waitingModels.push(modelID, self._getWaitingModelKey(modelID))
+
+
+  def popNextWaitingModel(self):
+    """ Remove and return the ID of the waiting model that should be run next
+
+    :raises IndexError: if no models are waiting
+    """
+    modelID, _ = self._waitingModels.pop()
+    return modelID
+
+
+  def addRunningModel(self, modelID, slotIndex):
+    """ Register a model that was assigned to a slot as a preemption
+    candidate
+    """
+    self._runningModels.push(modelID, self._getRunningModelKey(modelID),
+                             slotIndex)
+
+
+  def updateRunningModel(self, modelID):
+    """ Notify the policy that new input arrived for a running model """
+    if modelID in self._runningModels:
+      self._runningModels.push(modelID, self._getRunningModelKey(modelID),
+                               self._runningModels.getValue(modelID))
+
+
+  def removeRunningModel(self, modelID):
+    """ Unregister a running model that completed execution """
+    self._runningModels.remove(modelID)
+
+
+  def popPreemptionVictim(self, excludedSlots):
+    """ Remove and return the running model that should be preempted next
+
+    :param excludedSlots: container of slot indexes that are already pending
+      preemption; running models in these slots are dropped from the
+      preemption candidates
+
+    :returns: (modelID, slotIndex) of the victim; None if there are no
+      preemption candidates
+    """
+    while self._runningModels:
+      modelID, slotIndex = self._runningModels.pop()
+      if slotIndex not in excludedSlots:
+        return modelID, slotIndex
+
+    return None
+
+
+
+class FifoSchedulingPolicy(SchedulingPolicyBase):
+  """ Waiting models are scheduled in the order of their arrival, and the
+  least-recently-active running model is preempted first
+  """
+
+  NAME = "fifo"
+
+
+  def _getWaitingModelKey(self, modelID):
+    # Ties are resolved in insertion order
+    return 0
+
+
+  def _getRunningModelKey(self, modelID):
+    return time.time()
+
+
+
+class PriorityCostSchedulingPolicy(SchedulingPolicyBase):
+  """ Models are ordered by a virtual time: the time of their input activity,
+  advanced by the model's priority and set back by the depth of its pending
+  input and by the expected cost of loading it from its checkpoint.
+
+  Real-time models with few pending input batches thus take precedence over
+  models that are backfilling large volumes of data, while models of equal
+  standing are served in order of arrival, so no model starves. Among running
+  models, those with low priority, deep input backlogs and cheap checkpoints
+  are preempted first.
+  """
+
+  NAME = "priority_cost"
+
+  _BYTES_PER_MB = 1024 * 1024
+
+
+  def __init__(self, swapperAPI, priorityWeightSec, inputDepthWeightSec,
+               loadCostWeightSecPerMB):
+    """
+    :param swapperAPI: ModelSwapperInterface instance for querying the depth
+      of models' input queues
+    :param priorityWeightSec: seconds of precedence per unit of a model's
+      schedulingPriority
+    :param inputDepthWeightSec: seconds of precedence lost per doubling of the
+      number of a model's pending input batches
+    :param loadCostWeightSecPerMB: seconds of precedence lost by a waiting
+      model, and gained by a running model, per megabyte of its checkpoint
+    """
+    super(PriorityCostSchedulingPolicy, self).__init__()
+
+    self._swapperAPI = swapperAPI
+    self._checkpointMgr = ModelCheckpointMgr()
+
+    self._priorityWeightSec = priorityWeightSec
+    self._inputDepthWeightSec = inputDepthWeightSec
+    self._loadCostWeightSecPerMB = loadCostWeightSecPerMB
+
+    # Map of modelIDs to (priorityOffset, inputDepthOffset, loadCostOffset) of
+    # waiting and running models; evaluated from the model's input queue,
+    # checkpoint and definition when the model starts waiting or running, and
+    # used for the model's keys until it's done running
+    self._offsetsCache = dict()
+
+
+  def _getModelPriority(self, modelID):
+    try:
+      definition = self._checkpointMgr.loadModelDefinition(modelID)
+    except model_checkpoint_mgr.ModelNotFound:
+      # The model is being defined or was deleted
+      return 0
+
+    return definition.get("schedulingPriority", 0)
+
+
+  def _getModelLoadCostMB(self, modelID):
+    try:
+      return (float(self._checkpointMgr.getCheckpointSize(modelID)) /
+              self._BYTES_PER_MB)
+    except model_checkpoint_mgr.ModelNotFound:
+      # The model has no checkpoint yet, so it's created from params
+      return 0.0
+
+
+  def _evaluateModelOffsets(self, modelID):
+    offsets = self._offsetsCache.get(modelID)
+    if offsets is None:
+      inputDepth = self._swapperAPI.getModelInputDepth(modelID)
+
+      offsets = self._offsetsCache[modelID] = (
+        self._priorityWeightSec * self._getModelPriority(modelID),
+        self._inputDepthWeightSec * math.log(1 + inputDepth, 2),
+        self._loadCostWeightSecPerMB * self._getModelLoadCostMB(modelID))
+
+    return offsets
+
+
+  def _getWaitingModelKey(self, modelID):
+    priorityOffset, inputDepthOffset, loadCostOffset = (
+      self._evaluateModelOffsets(modelID))
+
+    return time.time() - priorityOffset + inputDepthOffset + loadCostOffset
+
+
+  def _getRunningModelKey(self, modelID):
+    priorityOffset, inputDepthOffset, loadCostOffset = (
+      self._evaluateModelOffsets(modelID))
+
+    return time.time() + priorityOffset - inputDepthOffset + loadCostOffset
+
+
+  def removeRunningModel(self, modelID):
+    super(PriorityCostSchedulingPolicy, self).removeRunningModel(modelID)
+
+    # The model's input depth, checkpoint size and definition (e.g., after it's
+    # redefined with another schedulingPriority) may have changed by the next
+    # time it's scheduled
+    self._offsetsCache.pop(modelID, None)
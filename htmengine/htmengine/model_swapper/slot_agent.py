@@ -172,6 +172,250 @@ class ModelRunnerProxy(object):
 
 
 
+class ResidentModelRunnerProcess(object):
+  """ Create, control, and monitor a long-lived ModelRunner process that runs
+  models one at a time and retains recently-used models in memory between runs
+  (see model_runner.runResidentModels). The process is (re)started on demand.
+  """
+
+
+  _MAX_WAIT_FOR_GRACEFUL_STOP_SEC = 60*4
+  _MAX_WAIT_AFTER_SIGKILL_SEC = 10
+
+
+  def __init__(self, logger):
+    self._logger = logger
+
+    # Protects _process and _currentModel, which are shared with the status
+    # reader thread
+    self._lock = threading.Lock()
+
+    # subprocess.Popen instance of the ModelRunner process; None if not running
+    self._process = None
+
+    # _ResidentModelRunnerProxy of the model that's currently running in the
+    # ModelRunner process; None if no model is running
+    self._currentModel = None
+
+    self._statusReaderThread = None
+
+
+  def __repr__(self):
+    process = self._process
+    return "%s<pid=%s>" % (self.__class__.__name__,
+                           process.pid if process is not None else None)
+
+
+  def startModel(self, modelID, onTermination):
+    """ Start running the given model in the ModelRunner process, starting the
+    process if it isn't running.
+
+    :param modelID: model ID
+    :param onTermination: thread-safe callback that will be called when the
+      model finishes running
+
+    :returns: a ModelRunnerProxy-like instance for the model
+    """
+    modelRunner = _ResidentModelRunnerProxy(modelID=modelID,
+                                            onTermination=onTermination,
+                                            process=self,
+                                            logger=self._logger)
+
+    with self._lock:
+      assert self._currentModel is None, repr(self._currentModel)
+      if self._process is None:
+        self._startProcess()
+      self._currentModel = modelRunner
+      process = self._process
+
+    self._logger.debug("%r: Starting model=%s", self, modelID)
+    try:
+      process.stdin.write("%s\n" % (modelID,))
+      process.stdin.flush()
+    except IOError:
+      # The process must have died; the status reader thread will report it as
+      # the model's termination
+      self._logger.exception("%r: IO error starting model=%s", self, modelID)
+
+    return modelRunner
+
+
+  def requestPreemption(self):
+    """ Request the ModelRunner process to stop running its current model """
+    process = self._process
+    if process is None:
+      return
+
+    try:
+      process.stdin.write("\n")
+      process.stdin.flush()
+    except IOError:
+      # The process must have died; the status reader thread will report it as
+      # the model's termination
+      self._logger.exception("%r: IO error requesting preemption", self)
+
+
+  def kill(self):
+    """ Force-kill the ModelRunner process, if any """
+    process = self._process
+    if process is None:
+      return
+
+    self._logger.error("%r: Sending SIGKILL to ModelRunner", self)
+    try:
+      os.kill(process.pid, signal.SIGKILL)
+    except OSError as e:
+      if e.errno == errno.ESRCH:
+        # "no such process" - our thread must have already reaped it
+        pass
+      else:
+        raise
+
+
+  def close(self):
+    """ Stop the ModelRunner process gracefully, if it's running; blocking. MUST
+    NOT be called while a model is running.
+    """
+    with self._lock:
+      assert self._currentModel is None, repr(self._currentModel)
+      process = self._process
+      statusReaderThread = self._statusReaderThread
+
+    if process is None:
+      return
+
+    # Signal to ModelRunner that it should exit
+    self._logger.debug("%r: Stopping ModelRunner", self)
+    try:
+      process.stdin.close()
+    except IOError:
+      self._logger.exception("%r: IO error closing ModelRunner's stdin", self)
+
+    statusReaderThread.join(timeout=self._MAX_WAIT_FOR_GRACEFUL_STOP_SEC)
+    if statusReaderThread.isAlive():
+      self._logger.error("%r: Graceful shutdown of ModelRunner timed out", self)
+      self.kill()
+      statusReaderThread.join(timeout=self._MAX_WAIT_AFTER_SIGKILL_SEC)
+      assert not statusReaderThread.isAlive()
+
+    self._logger.debug("%r: ModelRunner stopped; returnCode=%s", self,
+                       process.returncode)
+
+
+  def _startProcess(self):
+    """ Start the ModelRunner process and its status reader thread; the caller
+    MUST hold self._lock
+    """
+    self._process = subprocess.Popen(
+      args=[sys.executable,
+            "-m", "htmengine.model_swapper.model_runner",
+            "--resident"],
+      stdin=subprocess.PIPE,
+      stdout=subprocess.PIPE,
+      close_fds=True)
+
+    self._logger.debug("%r: Started ModelRunner", self)
+
+    self._statusReaderThread = threading.Thread(
+      target=self._runStatusReaderThread,
+      args=(self._process,),
+      name="%s-status-%s" % (self.__class__.__name__, self._process.pid,))
+    self._statusReaderThread.setDaemon(True)
+    self._statusReaderThread.start()
+
+
+  @abortProgramOnAnyException(
+    _EXIT_CODE_ON_UNHANDLED_EXCEPTION_IN_THREAD,
+    logger=_getLogger())
+  @logExceptions(_getLogger)
+  def _runStatusReaderThread(self, process):
+    """ Pass the model exit status reports from the ModelRunner process to the
+    models' proxies until the process terminates
+    """
+    self._logger.debug("%r: _runStatusReaderThread is running", self)
+    for line in iter(process.stdout.readline, ""):
+      with self._lock:
+        modelRunner = self._currentModel
+        self._currentModel = None
+
+      assert modelRunner is not None, "Unexpected model status: %r" % (line,)
+      modelRunner.handleTermination(int(line))
+
+    returnCode = process.wait()
+    self._logger.debug("%r: ModelRunner subprocess terminated; returnCode=%s",
+                       self, returnCode)
+
+    with self._lock:
+      modelRunner = self._currentModel
+      self._currentModel = None
+      self._process = None
+
+    if modelRunner is not None:
+      # The process terminated while running the model
+      modelRunner.handleTermination(returnCode or 1)
+
+
+
+class _ResidentModelRunnerProxy(object):
+  """ ModelRunnerProxy-like interface for controlling and monitoring a model
+  that is running in a ResidentModelRunnerProcess
+  """
+
+
+  def __init__(self, modelID, onTermination, process, logger):
+    """
+    :param onTermination: thread-safe callback that will be called when the
+      model finishes running
+    :param process: the ResidentModelRunnerProcess instance running the model
+    """
+    self._logger = logger
+    self._modelID = modelID
+    self._onTermination = onTermination
+    self._process = process
+
+    # Receives the model's exit status from the process's status reader thread
+    self._exitStatusQ = Queue.Queue()
+
+
+  def __repr__(self):
+    return "%s<model=%s, process=%r>" % (self.__class__.__name__,
+                                         self._modelID, self._process)
+
+
+  def handleTermination(self, exitStatus):
+    """ [thread-safe] Called by ResidentModelRunnerProcess when the model
+    finishes running
+
+    :param exitStatus: the model's exit status; 0 on success
+    """
+    self._exitStatusQ.put(exitStatus)
+    self._onTermination()
+
+
+  def stopGracefully(self):
+    """ Gracefully stop running the model; blocking.
+
+    :returns: the model's exit status; 0 on success
+    """
+    self._logger.debug("%r: Stopping model", self)
+    if self._exitStatusQ.empty():
+      self._process.requestPreemption()
+
+    try:
+      exitStatus = self._exitStatusQ.get(
+        timeout=ResidentModelRunnerProcess._MAX_WAIT_FOR_GRACEFUL_STOP_SEC)
+    except Queue.Empty:
+      # Timed out, so force-kill the process this time
+      self._logger.error("%r: Graceful stop of model timed out", self)
+      self._process.kill()
+      exitStatus = self._exitStatusQ.get(
+        timeout=ResidentModelRunnerProcess._MAX_WAIT_AFTER_SIGKILL_SEC)
+
+    self._logger.debug("%r: Model stopped; exitStatus=%s", self, exitStatus)
+    return exitStatus
+
+
+
 class SlotAgent(object):
   """ Manage a single ModelRunner execution slot within a Model Scheduler
   service instance """
@@ -186,14 +430,23 @@ class SlotAgent(object):
   _THREAD_JOIN_TIMEOUT_SEC = 60
 
 
-  def __init__(self, slotID):
+  def __init__(self, slotID, residentModels=False):
     """
     slotID: slot identifier for logging
+    residentModels: if True, run models in a long-lived ModelRunner process
+      that retains recently-used models in memory between runs (see
+      ResidentModelRunnerProcess); otherwise, start a new ModelRunner process
+      for each run of a model.
     """
     self._logger = _getLogger()
 
     self._slotID = slotID
 
+    # ResidentModelRunnerProcess instance when running with resident models;
+    # used only by the event loop thread
+    self._residentProcess = (ResidentModelRunnerProcess(logger=self._logger)
+                             if residentModels else None)
+
     # ID of the model, if any, currently associated with this SlotAgent
     # instance; used for logging and error-checking at the interface only.
     # WARNING: not syncrhonized with the event loop thread!
@@ -302,11 +555,17 @@ class SlotAgent(object):
         modelID = evt["modelID"]
         self._logger.debug("%r: {TAG:SWAP.SA.MODEL.STARTING} model=%s", self,
                            modelID)
-        modelRunner = ModelRunnerProxy(
-          modelID=modelID,
-          onTermination=lambda: self._eventQ.put(
-            {"method" : self._MODEL_RUNNER_EXITED}),
-          logger=self._logger)
+        onTermination = lambda: self._eventQ.put(
+          {"method" : self._MODEL_RUNNER_EXITED})
+        if self._residentProcess is None:
+          modelRunner = ModelRunnerProxy(
+            modelID=modelID,
+            onTermination=onTermination,
+            logger=self._logger)
+        else:
+          modelRunner = self._residentProcess.startModel(
+            modelID=modelID,
+            onTermination=onTermination)
         modelState = _CurrentModelState(
           modelID=evt["modelID"], modelRunner=modelRunner,
           modelFinishedCallback=evt["modelFinishedCallback"])
@@ -379,6 +638,8 @@ class SlotAgent(object):
 
         if doClose:
           # Model is stopped, we're done!
+          if self._residentProcess is not None:
+            self._residentProcess.close()
           break
 
 
@@ -25,6 +25,7 @@ across a fixed set of SlotAgent instances based on incoming model commands and
 records.
 """
 
+from collections import OrderedDict
 from functools import partial
 import logging
 import Queue
@@ -36,6 +37,7 @@ from nupic.support.decorators import logExceptions, logEntryExit
 from htmengine.model_swapper import ModelSwapperConfig
 from htmengine.model_swapper.model_swapper_interface import (
     ModelSwapperInterface)
+from htmengine.model_swapper.scheduling_policy import createSchedulingPolicy
 from htmengine.model_swapper.slot_agent import SlotAgent
 from nta.utils.error_handling import abortProgramOnAnyException
 from htmengine import htmengine_logging
@@ -69,6 +71,11 @@ class SwapController(object):
 
   _EXIT_CODE_ON_FAILURE_OF_NOTIFICATION_READER_THREAD = 1
 
+  # Max number of models per slot whose last slot is remembered; a slot retains
+  # only as many resident models as fit its memory budget, so older entries
+  # are unlikely to still be loaded
+  _MAX_LAST_SLOT_ENTRIES_PER_SLOT = 100
+
   def __init__(self, concurrency):
     """
     concurrency: allowed number of model slots
@@ -82,6 +89,11 @@ class SwapController(object):
     # Allowed number of model slots
     self._concurrency = concurrency
 
+    # When True, each slot agent retains recently-used models in memory between
+    # runs, so we try to assign a model to the slot that ran it last
+    self._residentModels = ModelSwapperConfig().getint(
+      "model_runner", "resident_models_memory_budget_mb") > 0
+
     # Input-reader thread target function sets this when it starts running to
     # let our event loop know that things are off to a good start
     self._notificationReaderStartedEvent = threading.Event()
@@ -94,12 +106,21 @@ class SwapController(object):
     # once it detects that this flag is true
     self._stopNotificationReader = False
 
+    # IDs of models with new input that are pending handling by the event loop,
+    # in order of arrival (keys; values are None); notifications that arrive
+    # while the event loop is busy are merged here, so that the event queue
+    # holds at most one new-input event at a time
+    self._pendingInputModelIDs = OrderedDict()
+    self._pendingInputLock = threading.Lock()
+
     # The event loop will exit some time after an event handler sets this flag
     # to True
     self._eventLoopStopPending = False
 
     # (non-thread-safe) The tuple of all slot agents
-    self._slotAgents = tuple(SlotAgent(slotID=i) for i in xrange(concurrency))
+    self._slotAgents = tuple(SlotAgent(slotID=i,
+                                       residentModels=self._residentModels)
+                             for i in xrange(concurrency))
     assert self._slotAgents
 
     # Thread-safe event queue for SwapController
@@ -109,9 +130,10 @@ class SwapController(object):
     # threads because ModelSwapperInterface
     self._mainSwapper = ModelSwapperInterface()
 
-    # A (non-thread-safe) FIFO of models that are waiting to be scheduled for
-    # running; there is incoming data for them that needs to be processed
-    self._waitingModelsFIFO = []
+    # (non-thread-safe) Scheduling policy that tracks models that are waiting
+    # to be scheduled for running (there is incoming data for them that needs to
+    # be processed) and chooses running models for preemption
+    self._schedulingPolicy = createSchedulingPolicy(self._mainSwapper)
 
     # A (non-thread-safe) map of modelIDs to _RunningModelInfo instances
     self._runningModelsMap = dict()
@@ -123,6 +145,11 @@ class SwapController(object):
     # (non-thread-safe) Indexes of SlotAgents pending preemption
     self._pendingPreemptSlotsSet = set()
 
+    # (non-thread-safe) A map of modelIDs to indexes of the slots that last ran
+    # them, in least-recently-assigned order; maintained only when running with
+    # resident models and capped at _MAX_LAST_SLOT_ENTRIES_PER_SLOT per slot
+    self._lastSlotIndexByModel = OrderedDict()
+
     self._notificationReaderThread = threading.Thread(
       target=self._runNotificationReaderThread,
       name="%s-input-reader-%s" % (self.__class__.__name__, id(self)))
@@ -148,7 +175,8 @@ class SwapController(object):
 
     while True:
       if self._eventLoopStopPending:
-        if not self._runningModelsMap and not self._waitingModelsFIFO:
+        if (not self._runningModelsMap and
+            not self._schedulingPolicy.numWaitingModels):
           # All models are idle now, so close Slot Agents and bail out
           for sa in self._slotAgents:
             sa.close()
@@ -156,7 +184,8 @@ class SwapController(object):
           self._logger.info("Closed all Slot Agents; leaving event loop")
           break
 
-        elif not self._waitingModelsFIFO and not requestedStopOfRemainingModels:
+        elif (not self._schedulingPolicy.numWaitingModels and
+              not requestedStopOfRemainingModels):
           # Only running models remain, so request to stop them gracefully
           assert self._runningModelsMap
 
@@ -197,14 +226,20 @@ class SwapController(object):
     self._eventQ.put({"method" : self._STOP_EVENT_LOOP_REQUEST_METHOD})
 
 
-  def _newInputNotifyTS(self, modelID):
+  def _newInputNotifyTS(self, modelIDs):
     """ [thread-safe] Notify Model Swapper that new input data arrived for the
-    given model
+    given models
 
-    :param modelID: ID of the model for which new data arrived
+    :param modelIDs: iterable of IDs of the models for which new data arrived;
+      may contain duplicates
     """
-    self._eventQ.put(
-      {"method" : self._NEW_INPUT_NOTIFY_METHOD, "modelID" : modelID})
+    with self._pendingInputLock:
+      eventPending = bool(self._pendingInputModelIDs)
+      for modelID in modelIDs:
+        self._pendingInputModelIDs[modelID] = None
+
+      if not eventPending and self._pendingInputModelIDs:
+        self._eventQ.put({"method" : self._NEW_INPUT_NOTIFY_METHOD})
 
 
   def _modelDoneNotifyTS(self, modelID, exitStatus):
@@ -230,21 +265,31 @@ class SwapController(object):
     self._logger.info("Set _eventLoopStopPending")
 
 
-  def _handleNewInputNotifyEvent(self, method,  # pylint: disable=W0613
-                                 modelID):
-    """ Notification that new input was queued up for a particular model """
-    runningModelInfo = self._runningModelsMap.get(modelID)
-    if runningModelInfo is not None:
-      # This model is already running
-      runningModelInfo.updateTimestamp()
+  def _handleNewInputNotifyEvent(self, method):  # pylint: disable=W0613
+    """ Notification that new input was queued up for the models accumulated in
+    self._pendingInputModelIDs
+    """
+    with self._pendingInputLock:
+      modelIDs = self._pendingInputModelIDs.keys()
+      self._pendingInputModelIDs = OrderedDict()
 
-    elif modelID not in self._waitingModelsFIFO:
-      # This model was not running and is not awaiting execution
+    # Models that are already running
+    runningModelIDs = [modelID for modelID in modelIDs
+                       if modelID in self._runningModelsMap]
+    for modelID in runningModelIDs:
+      self._schedulingPolicy.updateRunningModel(modelID)
+
+    # Models that start waiting, in order of arrival
+    newModelIDs = [modelID for modelID in modelIDs
+                   if modelID not in self._runningModelsMap and
+                   not self._schedulingPolicy.isModelWaiting(modelID)]
+
+    self._logger.debug(
+      "Handling new input of numModels=%s: numRunning=%s; numNew=%s",
+      len(modelIDs), len(runningModelIDs), len(newModelIDs))
 
-      # TODO: for a large _waitingModelsFIFO, the membership check may be slow.
-      #  Consider employing a map of all models of interest with current state
-      #  (waiting/pending/running/idle) reflected in the items for O(1) lookups,
-      #  but profile first to see if it's a problem!
+    for modelID in newModelIDs:
+      # This model was not running and is not awaiting execution
 
       # NOTE: it's possible that the model has already processed all its input
       #  and we're handling this notification belatedly, and this may result in
@@ -255,19 +300,20 @@ class SwapController(object):
 
       if self._freeSlots:
         # No models should be waiting if we have a free slot
-        assert not self._waitingModelsFIFO, repr(self._waitingModelsFIFO)
+        assert not self._schedulingPolicy.numWaitingModels, (
+          self._schedulingPolicy.numWaitingModels)
 
         # Assign the model to a free slot
         self._assignModelToFreeSlot(modelID)
 
       else:
         # This model needs to wait until resources become available
-        self._waitingModelsFIFO.append(modelID)
+        self._schedulingPolicy.addWaitingModel(modelID)
 
         if self._profiling:
           self._logger.info("{TAG:SWAP.SC.MODEL.WAIT} model=%s; "
                             "numWaitingModels=%s; numPendingPreemptSlots=%s",
-                            modelID, len(self._waitingModelsFIFO),
+                            modelID, self._schedulingPolicy.numWaitingModels,
                             len(self._pendingPreemptSlotsSet))
 
         self._requestPreemptionOfRunningSlotIfNeededAndPossible()
@@ -281,14 +327,14 @@ class SwapController(object):
     exitStatus: the exit status of the ModelRunner process (per os.WEXITSTATUS)
     """
     doneModelInfo = self._runningModelsMap.pop(modelID)
-
+    self._schedulingPolicy.removeRunningModel(modelID)
 
     if self._profiling:
       self._logger.info(
         "{TAG:SWAP.SC.MODEL.DONE} model=%s; slot=%d; exitStatus=%d; "
         "duration=%s; numRunningModels=%s; numWaitingModels=%s", modelID,
         doneModelInfo.slotIndex, exitStatus, endTime - doneModelInfo.startTime,
-        len(self._runningModelsMap), len(self._waitingModelsFIFO))
+        len(self._runningModelsMap), self._schedulingPolicy.numWaitingModels)
 
     assert doneModelInfo.slotIndex not in self._freeSlots
     assert 0 <= doneModelInfo.slotIndex < len(self._slotAgents)
@@ -306,11 +352,11 @@ class SwapController(object):
     if self._mainSwapper.modelInputPending(modelID):
       # There is more unprocessed input data for the completed model,
       # so notify ourselves asynchronously to schedule this model
-      self._newInputNotifyTS(modelID)
+      self._newInputNotifyTS([modelID])
 
-    if self._waitingModelsFIFO:
+    if self._schedulingPolicy.numWaitingModels:
       # Start a waiting model, now that we know there is a free slot
-      newModelID = self._waitingModelsFIFO.pop(0)
+      newModelID = self._schedulingPolicy.popNextWaitingModel()
       self._assignModelToFreeSlot(newModelID)
 
       self._requestPreemptionOfRunningSlotIfNeededAndPossible()
@@ -319,15 +365,30 @@ class SwapController(object):
   def _assignModelToFreeSlot(self, modelID):
     """ Assign the given model to a free slot """
     assert modelID not in self._runningModelsMap
-    assert modelID not in self._waitingModelsFIFO
+    assert not self._schedulingPolicy.isModelWaiting(modelID)
+
+    lastSlotIndex = self._lastSlotIndexByModel.pop(modelID, None)
+    if lastSlotIndex in self._freeSlots:
+      # Prefer the slot that may still have this model loaded
+      self._freeSlots.remove(lastSlotIndex)
+      freeSlotIndex = lastSlotIndex
+    else:
+      freeSlotIndex = self._freeSlots.pop()
 
-    freeSlotIndex = self._freeSlots.pop()
+    if self._residentModels:
+      self._lastSlotIndexByModel[modelID] = freeSlotIndex
+
+      if (len(self._lastSlotIndexByModel) >
+          self._MAX_LAST_SLOT_ENTRIES_PER_SLOT * len(self._slotAgents)):
+        # Forget the least-recently-assigned model
+        self._lastSlotIndexByModel.popitem(last=False)
 
     self._slotAgents[freeSlotIndex].startModel(
       modelID=modelID,
       modelFinishedCallback=partial(self._modelDoneNotifyTS, modelID))
 
     self._runningModelsMap[modelID] = _RunningModelInfo(freeSlotIndex)
+    self._schedulingPolicy.addRunningModel(modelID, freeSlotIndex)
 
     assert ((len(self._runningModelsMap) + len(self._freeSlots)) ==
             len(self._slotAgents)), (
@@ -337,7 +398,8 @@ class SwapController(object):
       "{TAG:SWAP.SC.MODEL.ASSIGN} model=%s; slot=%s; numRunningModels=%s; "
       "numFreeSlots=%s; numWaitingModels=%s; numPendingPreemptSlots=%s",
       modelID, freeSlotIndex, len(self._runningModelsMap), len(self._freeSlots),
-      len(self._waitingModelsFIFO), len(self._pendingPreemptSlotsSet))
+      self._schedulingPolicy.numWaitingModels,
+      len(self._pendingPreemptSlotsSet))
 
 
   def _requestPreemptionOfRunningSlotIfNeededAndPossible(self):
@@ -345,30 +407,30 @@ class SwapController(object):
     # There shouldn't be any free slots when we're asked to preempt
     assert not self._freeSlots, repr(self._freeSlots)
 
-    if (len(self._waitingModelsFIFO) <= len(self._pendingPreemptSlotsSet) or
+    if (self._schedulingPolicy.numWaitingModels <=
+        len(self._pendingPreemptSlotsSet) or
         len(self._pendingPreemptSlotsSet) >= len(self._slotAgents)):
       # Not needed or no preemptable slots
       return
 
-    # Find an LRU non-pending-preempt busy slot agent, and request to
-    # preempt it
-    lru = sorted(
-      ((i.slotIndex, i.timestamp)
-        for i in self._runningModelsMap.itervalues()
-        if i.slotIndex not in self._pendingPreemptSlotsSet),
-      key=lambda element: element[1])
+    # Let the scheduling policy choose a non-pending-preempt busy slot agent,
+    # and request to preempt it
+    victim = self._schedulingPolicy.popPreemptionVictim(
+      self._pendingPreemptSlotsSet)
+    assert victim is not None, (len(self._runningModelsMap),
+                                len(self._pendingPreemptSlotsSet))
 
-    slotIndex, timestamp = lru.pop(0)
+    modelID, slotIndex = victim
 
-    # Request preemption of the LRU slot
+    # Request preemption of the victim's slot
     self._slotAgents[slotIndex].stopModel()
     self._pendingPreemptSlotsSet.add(slotIndex)
 
     if self._profiling:
       self._logger.info(
-        "{TAG:SWAP.SC.SLOT.PREEMPT.REQ} slot=%d with timestamp=%s; "
+        "{TAG:SWAP.SC.SLOT.PREEMPT.REQ} slot=%d with model=%s; "
         "numWaitingModels=%s; numPendingPreemptSlots=%s",
-        slotIndex, timestamp, len(self._waitingModelsFIFO),
+        slotIndex, modelID, self._schedulingPolicy.numWaitingModels,
         len(self._pendingPreemptSlotsSet))
 
 
@@ -395,12 +457,14 @@ class SwapController(object):
       # At start, notify main event loop of each model whose input is non-empty
       self._logger.info("Checking for models with pending input")
 
-      i = 0
-      for i, modelID in enumerate(swapperAPI.getModelsWithInputPending(), 1):
+      modelIDs = []
+      for modelID in swapperAPI.getModelsWithInputPending():
         self._logger.debug("Input pending for model=%s", modelID)
-        self._newInputNotifyTS(modelID=modelID)
+        modelIDs.append(modelID)
+
+      self._newInputNotifyTS(modelIDs)
 
-      self._logger.info("%s model(s) had pending input", i)
+      self._logger.info("%s model(s) had pending input", len(modelIDs))
 
       # Service the SwapController's input queue util stop is requested
       with swapperAPI.consumeModelSchedulerNotifications() as consumer:
@@ -415,7 +479,7 @@ class SwapController(object):
                   "Notification reader exiting due to stop request")
                 break
 
-              self._newInputNotifyTS(modelID=notification.value)
+              self._newInputNotifyTS(modelIDs=notification.modelIDs)
 
               notification.ack()
 
@@ -436,14 +500,7 @@ class _RunningModelInfo(object):
 
   def __init__(self, slotIndex):
     self._slotIndex = slotIndex
-    now = time.time()
-    self._startTime = now
-    self._activityTimestamp = now
-
-
-  def updateTimestamp(self):
-    """ Update input activity timestamp """
-    self._activityTimestamp = time.time()
+    self._startTime = time.time()
 
 
   @property
@@ -454,12 +511,6 @@ class _RunningModelInfo(object):
     return self._startTime
 
 
-  @property
-  def timestamp(self):
-    """ Input activity timestamp """
-    return self._activityTimestamp
-
-
   @property
   def slotIndex(self):
     return self._slotIndex
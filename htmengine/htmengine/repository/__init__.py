@@ -30,6 +30,7 @@ from nta.utils import sqlalchemy_utils
 from htmengine.repository.queries import (
   addMetric,
   addMetricData,
+  addMetricDataBatch,
   deleteMetric,
   deleteModel,
   getCustomMetricByName,
@@ -42,9 +43,11 @@ from htmengine.repository.queries import (
   getMetric,
   getMetricWithSharedLock,
   getMetricWithUpdateLock,
+  getMetricsWithUpdateLock,
   getMetricCountForServer,
   getMetricData,
   getMetricDataCount,
+  getMetricDataPerMetric,
   getProcessedMetricDataCount,
   getMetricDataWithRawAnomalyScoresTail,
   getMetricIdsSortedByDisplayValue,
@@ -58,6 +61,8 @@ from htmengine.repository.queries import (
   updateMetricColumns,
   updateMetricColumnsForRefStatus,
   updateMetricDataColumns,
+  updateMetricDataScoresBulk,
+  updateMetricDisplayValueRollup,
   lockOperationExclusive,
   OperationLock)
 
@@ -0,0 +1,221 @@
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2015, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+"""Range partitioning of the metric_data table by timestamp, so that old metric
+data may be purged by dropping whole partitions instead of deleting rows (see
+htmengine.runtime.metric_garbage_collector).
+
+A partitioned metric_data table is partitioned on TO_DAYS(timestamp) into:
+  p_start: rows older than the first dated partition
+  p<YYYYMMDD>: rows from the given UTC day up to the next partition; typically
+    spanning a day or a week each
+  p_future: rows beyond the last dated partition
+
+Once p_start is dropped, the first remaining partition takes over the older
+rows.
+
+NOTE: MySQL doesn't support foreign keys in partitioned tables and requires
+every unique key of a partitioned table to include the partitioning column, so
+partitioning drops metric_data_to_metric_fk and extends the primary key of
+metric_data to (uid, rowid, timestamp). Metric data is then no longer deleted
+by cascade along with its metric; see queries.deleteMetric.
+"""
+
+from collections import namedtuple
+from datetime import date, timedelta
+
+from sqlalchemy import text
+
+
+
+START_PARTITION = "p_start"
+
+FUTURE_PARTITION = "p_future"
+
+
+# Offset between date.toordinal() and MySQL's TO_DAYS() for the same date
+_TO_DAYS_OFFSET = 365
+
+
+
+class MetricDataPartition(namedtuple("MetricDataPartition",
+                                     "name lessThan estimatedNumRows")):
+  """ A partition of the metric_data table
+
+  name: partition name
+  lessThan: UTC date at the start of which the partition ends (exclusive);
+    None for the MAXVALUE partition
+  estimatedNumRows: number of rows in the partition estimated by MySQL
+  """
+  __slots__ = ()
+
+
+
+def _toDays(day):
+  """ Convert a date to its MySQL TO_DAYS() value """
+  return day.toordinal() + _TO_DAYS_OFFSET
+
+
+
+def _getPartitionDefinitions(days):
+  """ Generate partition definitions of dated partitions
+
+  :param days: ascending sequence of datetime.date at the start of each
+    partition; each partition ends at the start of the next one
+  :returns: list of partition definition SQL fragments; one fewer than days
+  """
+  return [
+    "PARTITION p%s VALUES LESS THAN (%d)" % (day.strftime("%Y%m%d"),
+                                             _toDays(nextDay))
+    for day, nextDay in zip(days[:-1], days[1:])]
+
+
+
+def _getPartitionStartDays(firstDay, lastDay, partitionDays):
+  """
+  :returns: list of datetime.date from firstDay in steps of partitionDays,
+    through the first step past lastDay
+  """
+  days = [firstDay]
+  while days[-1] <= lastDay:
+    days.append(days[-1] + timedelta(days=partitionDays))
+
+  return days
+
+
+
+def getMetricDataPartitions(conn):
+  """ Get the partitions of the metric_data table
+
+  :param conn: SQLAlchemy connection object
+  :type conn: sqlalchemy.engine.base.Connection
+  :returns: MetricDataPartition objects in partition order; empty if the
+    metric_data table is not partitioned
+  :rtype: list
+  """
+  result = conn.execute(text(
+    "SELECT PARTITION_NAME, PARTITION_DESCRIPTION, TABLE_ROWS "
+    "FROM information_schema.PARTITIONS "
+    "WHERE TABLE_SCHEMA=DATABASE() AND TABLE_NAME='metric_data' "
+    "  AND PARTITION_NAME IS NOT NULL "
+    "ORDER BY PARTITION_ORDINAL_POSITION"))
+
+  return [
+    MetricDataPartition(
+      name=name,
+      lessThan=(None if description == "MAXVALUE"
+                else date.fromordinal(int(description) - _TO_DAYS_OFFSET)),
+      estimatedNumRows=numRows)
+    for name, description, numRows in result]
+
+
+
+def getPartitionDays(partitions, default=7):
+  """ Infer the span of partitions from the last two dated partitions
+
+  :param partitions: MetricDataPartition objects from getMetricDataPartitions
+  :param int default: span to assume in absence of two dated partitions
+  :returns: number of days spanned by each partition
+  :rtype: int
+  """
+  bounds = [p.lessThan for p in partitions if p.lessThan is not None]
+  if len(bounds) < 2:
+    return default
+
+  return (bounds[-1] - bounds[-2]).days
+
+
+
+def partitionMetricDataTable(conn, firstDay, lastDay, partitionDays):
+  """ Partition an unpartitioned metric_data table; this rebuilds the table,
+  which may take a while for a large table.
+
+  :param conn: SQLAlchemy connection object
+  :type conn: sqlalchemy.engine.base.Connection
+  :param datetime.date firstDay: UTC day of the first dated partition; older
+    rows go to p_start
+  :param datetime.date lastDay: UTC day that the last dated partition must
+    cover; newer rows go to p_future
+  :param int partitionDays: number of days spanned by each dated partition;
+    e.g., 1 or 7
+  """
+  days = _getPartitionStartDays(firstDay, lastDay, partitionDays)
+
+  definitions = (
+    ["PARTITION %s VALUES LESS THAN (%d)" % (START_PARTITION,
+                                             _toDays(firstDay))] +
+    _getPartitionDefinitions(days) +
+    ["PARTITION %s VALUES LESS THAN MAXVALUE" % (FUTURE_PARTITION,)])
+
+  conn.execute(
+    "ALTER TABLE metric_data DROP FOREIGN KEY metric_data_to_metric_fk")
+
+  conn.execute(
+    "ALTER TABLE metric_data "
+    "DROP PRIMARY KEY, ADD PRIMARY KEY (uid, rowid, timestamp) "
+    "PARTITION BY RANGE (TO_DAYS(timestamp)) (%s)" % (", ".join(definitions),))
+
+
+
+def addMetricDataPartitions(conn, partitions, lastDay, partitionDays):
+  """ Add dated partitions to the partitioned metric_data table by splitting
+  p_future, so that they cover the given day
+
+  :param conn: SQLAlchemy connection object
+  :type conn: sqlalchemy.engine.base.Connection
+  :param partitions: MetricDataPartition objects from getMetricDataPartitions
+  :param datetime.date lastDay: UTC day that the last dated partition must
+    cover
+  :param int partitionDays: number of days spanned by each new partition
+  :returns: names of the added partitions
+  :rtype: list
+  """
+  bounds = [p.lessThan for p in partitions if p.lessThan is not None]
+  if bounds and bounds[-1] > lastDay:
+    return []
+
+  days = _getPartitionStartDays(bounds[-1] if bounds else lastDay,
+                                lastDay,
+                                partitionDays)
+
+  definitions = _getPartitionDefinitions(days)
+
+  conn.execute(
+    "ALTER TABLE metric_data REORGANIZE PARTITION %s INTO (%s)" % (
+      FUTURE_PARTITION,
+      ", ".join(definitions +
+                ["PARTITION %s VALUES LESS THAN MAXVALUE" %
+                 (FUTURE_PARTITION,)])))
+
+  return [definition.split()[1] for definition in definitions]
+
+
+
+def dropMetricDataPartitions(conn, partitionNames):
+  """ Drop partitions of the metric_data table along with their rows
+
+  :param conn: SQLAlchemy connection object
+  :type conn: sqlalchemy.engine.base.Connection
+  :param partitionNames: names of the partitions to drop; must not include
+    p_future
+  """
+  conn.execute("ALTER TABLE metric_data DROP PARTITION %s" % (
+    ", ".join(partitionNames),))
@@ -18,12 +18,15 @@
 #
 # http://numenta.org/licenses/
 # ----------------------------------------------------------------------
-from datetime import datetime
+from datetime import datetime, timedelta
+import itertools
 
-from sqlalchemy import func
+from sqlalchemy import and_, case, func, or_, text, union_all
 from sqlalchemy.sql import select
 from sqlalchemy.engine.base import Connection
 
+from nta.utils.date_time_utils import epochFromNaiveUTCDatetime
+
 from htmengine.exceptions import (MetricStatisticsNotReadyError,
                                   ObjectNotFoundError)
 import htmengine.utils
@@ -89,6 +92,12 @@ def deleteMetric(conn, metricId):
     # is kept by deleting any related data when necessary
     deleteModel(conn, metricId)
 
+    # Delete metric data explicitly, because a partitioned metric_data table
+    # lacks the foreign key that would cascade the delete (see
+    # htmengine.repository.metric_data_partitions)
+    conn.execute(schema.metric_data.delete() # pylint: disable=E1120
+                 .where(schema.metric_data.c.uid == metricId))
+
     # Delete metric
     result = (conn.execute(schema.metric.delete() # pylint: disable=E1120
                            .where(schema.metric.c.uid == metricId)))
@@ -134,6 +143,10 @@ def deleteModel(conn, metricId):
 
     conn.execute(update)
 
+    rollup = schema.metric_display_value_rollup
+    conn.execute(rollup.delete()  # pylint: disable=E1120
+                 .where(rollup.c.uid == metricId))
+
 
 
 
@@ -255,6 +268,38 @@ def getMetricWithUpdateLock(conn, metricId, fields=None):
 
 
 
+def getMetricsWithUpdateLock(conn, metricIds, fields=None):
+  """ Perform SELECT ... WHERE uid IN (...) FOR UPDATE on the given metric uids
+  and return the requested fields. Rows are locked in ascending uid order so
+  that concurrent callers acquire the locks in a consistent order.
+
+  :param conn: SQLAlchemy connection
+  :type conn: sqlalchemy.engine.Connection
+
+  :param metricIds: Sequence of metric uids
+
+  :param fields: Sequence of columns to be returned by underlying query;
+    `schema.metric.c.uid` is added if missing
+
+  :returns: Metric rows that were found, ordered by uid; uids that don't
+    correspond to a metric are omitted
+  :rtype: list of sqlalchemy.engine.RowProxy
+  """
+  if not metricIds:
+    return []
+
+  fields = list(fields or [schema.metric])
+  if not any(f is schema.metric or f is schema.metric.c.uid for f in fields):
+    fields.append(schema.metric.c.uid)
+
+  sel = (select(fields, order_by=schema.metric.c.uid.asc())
+         .where(schema.metric.c.uid.in_(metricIds))
+         .with_for_update(read=_SelectLock.UPDATE))
+
+  return conn.execute(sel).fetchall()
+
+
+
 class _SelectLock(object):
   """ Values for the read parameter of
   sqlalchemy.sql.selectable.Select.with_for_update
@@ -375,15 +420,77 @@ def getAllModels(conn, fields=None):
 
 
 
+# Sizes (seconds) of the time blocks of metric_display_value_rollup by the
+# anomaly periods (hours) that it serves; each period is broken into 24 blocks,
+# one per bar of the period's chart, so a block spans period * 60 * 60 / 24,
+# or period * 150, seconds
+_DISPLAY_VALUE_ROLLUP_BLOCK_SIZES = dict(
+  (period, period * 150) for period in (2, 24, 192))
+
+
+
 def getMetricIdsSortedByDisplayValue(conn, period):
   """ Get Metric IDs in order of anomalous behavior over a given time period
 
+  The window of the period ends at the last timestamp of any metric and is
+  broken into blocks, one per bar of the period's chart. The aggregated display
+  value of a metric is the sum of its max display values within each block.
+
+  The periods in _DISPLAY_VALUE_ROLLUP_BLOCK_SIZES are served from the
+  metric_display_value_rollup table, except for the block at the start of the
+  window that lies only partially within the window, which is aggregated from
+  metric_data; other periods are aggregated from metric_data altogether.
+
   :param conn: SQLAlchemy connection object
   :type conn: sqlalchemy.engine.base.Connection
   :param period: Time period (hours) over which to aggregate display values
   :type period: str
   :returns: Mapping of metric ids and aggregated display values
-            {metricId: MAX(display_value), ...}
+            {metricId: SUM(MAX(display_value)), ...}
+  """
+  blockSize = _DISPLAY_VALUE_ROLLUP_BLOCK_SIZES.get(int(period))
+  if blockSize is None:
+    return _getMetricIdsSortedByDisplayValueFromMetricData(conn, period)
+
+  # The last timestamp from any metric is used as the end of the window
+  windowEnd = conn.execute(
+    select([func.max(schema.metric_data.c.timestamp)])).scalar()
+  if windowEnd is None:
+    return dict()
+
+  windowStart = windowEnd - timedelta(hours=int(period))
+
+  # Blocks after the one containing windowStart lie entirely within the window
+  firstWholeBlock = (
+    int(epochFromNaiveUTCDatetime(windowStart)) // blockSize + 1)
+
+  rollup = schema.metric_display_value_rollup
+  sel = (select([rollup.c.uid, func.sum(rollup.c.max_display_value)])
+         .where(rollup.c.block_size_sec == blockSize)
+         .where(rollup.c.time_block >= firstWholeBlock)
+         .group_by(rollup.c.uid))
+
+  displayValueMap = dict((row[0], row[1]) for row in conn.execute(sel))
+
+  sel = (select([schema.metric_data.c.uid,
+                 func.max(schema.metric_data.c.display_value)])
+         .where(schema.metric_data.c.timestamp > windowStart)
+         .where(schema.metric_data.c.timestamp <
+                datetime.utcfromtimestamp(firstWholeBlock * blockSize))
+         .group_by(schema.metric_data.c.uid))
+
+  for metricId, maxDisplayValue in conn.execute(sel):
+    if maxDisplayValue is not None:
+      displayValueMap[metricId] = (displayValueMap.get(metricId, 0) +
+                                   maxDisplayValue)
+
+  return displayValueMap
+
+
+
+def _getMetricIdsSortedByDisplayValueFromMetricData(conn, period):
+  """ Aggregate display values of metrics over a given time period from
+  metric_data; see getMetricIdsSortedByDisplayValue
   """
 
   # This sub-query gets the last timestamp from any metric which is used as
@@ -624,6 +731,77 @@ def addMetricData(conn, metricId, data):
 
 
 
+def addMetricDataBatch(conn, dataByMetricId, lastRowidByMetricId):
+  """ Add Metric Data for multiple metrics in the caller's transaction: the
+  rowid ranges of all metrics are reserved with a single UPDATE and all samples
+  are written with a single multi-row INSERT.
+
+  NOTE: the caller must hold the update locks of the metric rows (see
+  `getMetricsWithUpdateLock`) in a transaction on conn, and commits the data
+  with that transaction.
+
+  :param conn: SQLAlchemy connection object with an active transaction
+  :type conn: sqlalchemy.engine.Connection
+  :param dataByMetricId: A dict mapping metric uid to a sequence of metric data
+    sample pairs (value, datetime.datetime)
+  :param lastRowidByMetricId: A dict mapping the uid of each metric in
+    dataByMetricId to the metric's last_rowid, as read with the metric row's
+    update lock
+  :returns: A dict mapping metric uid to the sequence of metric data rows that
+    were added for it, ordered by rowid in ascending order; each row is a dict
+    of column names/values. Metrics that had no samples are omitted.
+  """
+  assert type(conn) is Connection
+  assert conn.in_transaction()
+
+  dataByMetricId = dict((metricId, data)
+                        for metricId, data in dataByMetricId.iteritems()
+                        if data)
+
+  if not dataByMetricId:
+    return {}
+
+  update = (schema.metric.update() # pylint: disable=E1120
+            .where(schema.metric.c.uid.in_(dataByMetricId.keys())))
+
+  conn.execute(update.values(
+    last_rowid=schema.metric.c.last_rowid + case(
+      dict((metricId, len(data))
+           for metricId, data in dataByMetricId.iteritems()),
+      value=schema.metric.c.uid)))
+
+  rowsByMetricId = dict(
+    (metricId,
+     [dict(uid=metricId,
+           rowid=rowid,
+           timestamp=timestamp,
+           metric_value=metricValue)
+      for rowid, (metricValue, timestamp)
+      in enumerate(data, lastRowidByMetricId[metricId] + 1)])
+    for metricId, data in dataByMetricId.iteritems())
+
+  conn.execute(schema.metric_data.insert(), # pylint: disable=E1120
+               list(itertools.chain.from_iterable(
+                 rowsByMetricId.itervalues())))
+
+  return rowsByMetricId
+
+
+
+def _useUidTimestampIndex(sel):
+  """ Make MySQL read the rows of a select on metric_data that's filtered by
+  uid and ordered by timestamp from uid_timestamp_idx in timestamp order,
+  instead of reading all the metric's rows via the primary key and sorting
+  them.
+
+  :param sel: sqlalchemy select on metric_data
+  :returns: the select with the index hint
+  """
+  return sel.with_hint(schema.metric_data, "FORCE INDEX (uid_timestamp_idx)",
+                       "mysql")
+
+
+
 def getMetricData(conn,
                   metricId=None,
                   fields=None,
@@ -657,6 +835,29 @@ def getMetricData(conn,
   :returns: Metric data
   :rtype: sqlalchemy.engine.ResultProxy
   """
+  sel = _selectMetricData(metricId=metricId,
+                          fields=fields,
+                          rowid=rowid,
+                          start=start,
+                          stop=stop,
+                          limit=limit,
+                          fromTimestamp=fromTimestamp,
+                          toTimestamp=toTimestamp,
+                          score=score,
+                          sort=sort)
+
+  result = conn.execute(sel)
+
+  return result
+
+
+
+def _selectMetricData(metricId, fields, rowid, start, stop, limit,
+                      fromTimestamp, toTimestamp, score, sort):
+  """ Build the select of getMetricData; see getMetricData for parameters
+
+  :returns: sqlalchemy select on metric_data
+  """
   fields = fields or [schema.metric_data]
 
   if sort is None:
@@ -689,9 +890,86 @@ def getMetricData(conn,
   elif score == 0.0:
     sel = sel.where(schema.metric_data.c.anomaly_score != None)
 
-  result = conn.execute(sel)
+  if (metricId is not None and sort is not None and
+      getattr(sort, "element", sort) is schema.metric_data.c.timestamp):
+    sel = _useUidTimestampIndex(sel)
 
-  return result
+  return sel
+
+
+
+# Max number of metrics whose metric data is retrieved by a single statement in
+# getMetricDataPerMetric; bounds the number of rows buffered at a time
+_MAX_METRICS_PER_METRIC_DATA_QUERY = 100
+
+
+
+def getMetricDataPerMetric(conn,
+                           metricIds=None,
+                           fields=None,
+                           limit=None,
+                           fromTimestamp=None,
+                           toTimestamp=None,
+                           score=None,
+                           ascending=True):
+  """Get metric data of multiple metrics, grouped by metric and limited per
+  metric in SQL. Metrics are queried in chunks, so that only one chunk's rows
+  are held in memory at a time; the connection must therefore remain open
+  while the returned rows are consumed.
+
+  :param conn: SQLAlchemy connection object
+  :type conn: sqlalchemy.engine.base.Connection
+  :param metricIds: Sequence of metric uids; all metrics if None
+  :param fields: Sequence of metric_data columns to be returned by underlying
+    query; must include uid and timestamp
+  :param limit: Limit on number of rows to return per metric
+  :param fromTimestamp: Starting timestamp
+  :param toTimestamp: Ending timestamp
+  :param score: Return only rows with scores above this threshold
+    (all non-null scores for score=0)
+  :param ascending: True to return each metric's rows in ascending timestamp
+    order (and the earliest rows when limited); False for descending order
+    (and the latest rows)
+  :returns: generator of metric data rows ordered by uid, then timestamp
+  """
+  if metricIds is None:
+    metricIds = [row.uid for row in
+                 getAllMetrics(conn, fields=[schema.metric.c.uid])]
+
+  metricIds = sorted(metricIds)
+
+  fields = fields or [schema.metric_data]
+
+  if ascending:
+    sort = schema.metric_data.c.timestamp.asc()
+  else:
+    sort = schema.metric_data.c.timestamp.desc()
+
+  for i in xrange(0, len(metricIds), _MAX_METRICS_PER_METRIC_DATA_QUERY):
+    # One limited, index-ordered subselect per metric, since MySQL doesn't
+    # support per-group LIMIT
+    metricSels = [
+      _selectMetricData(metricId=metricId,
+                        fields=fields,
+                        rowid=None,
+                        start=None,
+                        stop=None,
+                        limit=limit,
+                        fromTimestamp=fromTimestamp,
+                        toTimestamp=toTimestamp,
+                        score=score,
+                        sort=sort).alias().select()
+      for metricId in metricIds[i:i + _MAX_METRICS_PER_METRIC_DATA_QUERY]]
+
+    metricData = union_all(*metricSels).alias("metric_data_per_metric")
+
+    timestamp = metricData.c.timestamp
+    sel = select([metricData],
+                 order_by=[metricData.c.uid,
+                           timestamp.asc() if ascending else timestamp.desc()])
+
+    for row in conn.execute(sel).fetchall():
+      yield row
 
 
 
@@ -712,6 +990,8 @@ def getMetricDataWithRawAnomalyScoresTail(conn, metricId, limit):
          .where(schema.metric_data.c.raw_anomaly_score != None)
          .limit(limit))
 
+  sel = _useUidTimestampIndex(sel)
+
   result = conn.execute(sel)
 
   return result.fetchall()
@@ -764,6 +1044,114 @@ def updateMetricDataColumns(conn, metricDataObj, fields):
 
 
 
+# Max number of metric_data rows updated by a single UPDATE statement in
+# updateMetricDataScoresBulk; bounds the size of the generated CASE expressions
+_MAX_METRIC_DATA_SCORE_UPDATE_ROWS = 500
+
+
+
+def updateMetricDataScoresBulk(conn, metricId, rows):
+  """Update raw_anomaly_score, anomaly_score and display_value of many
+  metric_data rows belonging to a single metric using a few set-based UPDATE
+  statements instead of one UPDATE per row.
+
+  Each statement is of the form:
+    UPDATE metric_data
+      SET raw_anomaly_score=CASE rowid WHEN ... THEN ... END, ...
+      WHERE uid=:metricId AND rowid IN (...)
+
+  :param conn: SQLAlchemy connection object
+  :type conn: sqlalchemy.engine.base.Connection
+  :param metricId: Metric uid
+  :type metricId: str
+  :param rows: sequence of objects with `rowid`, `raw_anomaly_score`,
+    `anomaly_score` and `display_value` attributes (e.g., MutableMetricDataRow)
+    that belong to the given metric
+  """
+  rowidColumn = schema.metric_data.c.rowid
+
+  for i in xrange(0, len(rows), _MAX_METRIC_DATA_SCORE_UPDATE_ROWS):
+    chunk = rows[i:i + _MAX_METRIC_DATA_SCORE_UPDATE_ROWS]
+
+    rowids = [row.rowid for row in chunk]
+
+    fields = dict(
+      (columnName,
+       case(dict((row.rowid, getattr(row, columnName)) for row in chunk),
+            value=rowidColumn))
+      for columnName in ("raw_anomaly_score", "anomaly_score", "display_value"))
+
+    update = (schema.metric_data.update() # pylint: disable=E1120
+              .where(schema.metric_data.c.uid == metricId)
+              .where(rowidColumn.in_(rowids)))
+    conn.execute(update.values(fields))
+
+
+
+def updateMetricDisplayValueRollup(conn, metricId, rows):
+  """Fold the display values of newly scored metric_data rows of a metric into
+  the metric_display_value_rollup table, and remove the metric's rollup rows
+  that can no longer fall within any period served by
+  getMetricIdsSortedByDisplayValue.
+
+  Should be called in the transaction that updates the rows' scores (see
+  updateMetricDataScoresBulk).
+
+  :param conn: SQLAlchemy connection object
+  :type conn: sqlalchemy.engine.base.Connection
+  :param metricId: Metric uid
+  :type metricId: str
+  :param rows: sequence of objects with `timestamp` and `display_value`
+    attributes (e.g., MutableMetricDataRow) that belong to the given metric
+  """
+  # Max display values by (block_size_sec, time_block)
+  blockMaxValues = dict()
+  latestEpoch = None
+
+  for row in rows:
+    if row.display_value is None:
+      continue
+
+    epoch = int(epochFromNaiveUTCDatetime(row.timestamp))
+    latestEpoch = max(epoch, latestEpoch)
+
+    for blockSize in _DISPLAY_VALUE_ROLLUP_BLOCK_SIZES.itervalues():
+      key = (blockSize, epoch // blockSize)
+      blockMaxValues[key] = max(row.display_value, blockMaxValues.get(key))
+
+  if not blockMaxValues:
+    return
+
+  # NOTE: sqlalchemy doesn't support "ON DUPLICATE KEY UPDATE" in its syntactic
+  # sugar; see https://bitbucket.org/zzzeek/sqlalchemy/issue/960
+  conn.execute(
+    text("INSERT INTO metric_display_value_rollup "
+         "(uid, block_size_sec, time_block, max_display_value) "
+         "VALUES (:uid, :blockSize, :timeBlock, :maxDisplayValue) "
+         "ON DUPLICATE KEY UPDATE max_display_value="
+         "GREATEST(max_display_value, VALUES(max_display_value))"),
+    [dict(uid=metricId,
+          blockSize=blockSize,
+          timeBlock=timeBlock,
+          maxDisplayValue=maxDisplayValue)
+     for (blockSize, timeBlock), maxDisplayValue
+     in sorted(blockMaxValues.iteritems())])
+
+  # The window of a period ends no earlier than this metric's latest row, so
+  # blocks up to the one containing the start of the window that ends at this
+  # row are no longer needed
+  rollup = schema.metric_display_value_rollup
+  expired = or_(*[
+    and_(rollup.c.block_size_sec == blockSize,
+         rollup.c.time_block <= (latestEpoch - period * 3600) // blockSize)
+    for period, blockSize in _DISPLAY_VALUE_ROLLUP_BLOCK_SIZES.iteritems()])
+
+  conn.execute(rollup.delete()  # pylint: disable=E1120
+               .where(rollup.c.uid == metricId)
+               .where(expired))
+
+
+
 def getMetricStats(conn, metricId):
   """
   :param conn: SQLAlchemy connection object
@@ -140,6 +140,48 @@ metric_data = Table(  # pylint: disable=C0103
 
 Index("timestamp_idx", metric_data.c.timestamp)
 Index("anomaly_score_idx", metric_data.c.anomaly_score)
+# Serves a metric's rows in timestamp order; raw_anomaly_score lets MySQL skip
+# unscored rows without reading them (see getMetricDataWithRawAnomalyScoresTail)
+Index("uid_timestamp_idx",
+      metric_data.c.uid,
+      metric_data.c.timestamp,
+      metric_data.c.raw_anomaly_score)
+
+
+
+# Max display_value of each metric per time block of metric_data, maintained by
+# the anomaly service as it scores metric data; time_block is
+# FLOOR(<epoch seconds of timestamp> / block_size_sec)
+metric_display_value_rollup = Table(  # pylint: disable=C0103
+    "metric_display_value_rollup",
+    metadata,
+    Column("uid",
+           VARCHAR(length=40),
+           ForeignKey(metric.c.uid,
+                      name="metric_display_value_rollup_to_metric_fk",
+                      onupdate="CASCADE", ondelete="CASCADE"),
+           primary_key=True,
+           nullable=False),
+    Column("block_size_sec",
+           INTEGER(),
+           primary_key=True,
+           autoincrement=False,
+           nullable=False),
+    Column("time_block",
+           INTEGER(),
+           primary_key=True,
+           autoincrement=False,
+           nullable=False),
+    Column("max_display_value",
+           INTEGER(),
+           autoincrement=False,
+           nullable=False),
+    schema=None,
+)
+
+Index("block_size_time_block_idx",
+      metric_display_value_rollup.c.block_size_sec,
+      metric_display_value_rollup.c.time_block)
 
 
 
@@ -23,12 +23,16 @@
 import itertools
 import json
 import logging
-from collections import namedtuple
+from collections import deque, namedtuple
 import math
+import multiprocessing
 from optparse import OptionParser
 import os
+import Queue
 import sys
+import threading
 import time
+import traceback
 import zlib
 
 from nta.utils import amqp
@@ -177,6 +181,16 @@ class AnomalyService(object):
 
   """
 
+  # Properties for publishing model command results on RabbitMQ exchange
+  _MODEL_COMMAND_RESULT_PROPERTIES = MessageProperties(
+    deliveryMode=amqp.constants.AMQPDeliveryModes.PERSISTENT_MESSAGE,
+    headers=dict(dataType="model-cmd-result"))
+
+  # Properties for publishing model inference results on RabbitMQ exchange
+  _MODEL_INFERENCE_RESULT_PROPERTIES = MessageProperties(
+    deliveryMode=amqp.constants.AMQPDeliveryModes.PERSISTENT_MESSAGE)
+
+
   def __init__(self):
     self._log = _getLogger()
 
@@ -192,6 +206,11 @@ class AnomalyService(object):
 
     self.likelihoodHelper = AnomalyLikelihoodHelper(self._log, config)
 
+    # Number of parallel result batch workers; 0 to process results in the
+    # consumer loop
+    self._numWorkers = config.getint("anomaly_service", "num_workers")
+    self._workerType = config.get("anomaly_service", "worker_type")
+
 
   def _processModelCommandResult(self, metricID, result):
     """
@@ -359,7 +378,7 @@ class AnomalyService(object):
                                                 metricDataRows=metricDataRows))
 
     # Update metric data rows with rescaled display values
-    # NOTE: doing this outside the updateColumns loop to avoid holding row locks
+    # NOTE: doing this outside the update transaction to avoid holding row locks
     #  any longer than necessary
     for metricData in metricDataRows:
       metricData.display_value = rescaleForDisplay(
@@ -372,11 +391,13 @@ class AnomalyService(object):
       @retryOnTransientErrors
       def runSQL(engine):
         with engine.begin() as conn:
-          for metricData in metricDataRows:
-            fields = {"raw_anomaly_score": metricData.raw_anomaly_score,
-                      "anomaly_score": metricData.anomaly_score,
-                      "display_value": metricData.display_value}
-            repository.updateMetricDataColumns(conn, metricData, fields)
+          repository.updateMetricDataScoresBulk(conn,
+                                                metricObj.uid,
+                                                metricDataRows)
+
+          repository.updateMetricDisplayValueRollup(conn,
+                                                    metricObj.uid,
+                                                    metricDataRows)
 
           self._updateAnomalyLikelihoodParams(
             conn,
@@ -391,6 +412,10 @@ class AnomalyService(object):
                         metricID, exc_info=True)
       return None
 
+    # The scores are saved, so they may now serve subsequent anomaly likelihood
+    # statistics refreshes
+    self.likelihoodHelper.cacheScoredMetricData(metricObj.uid, metricDataRows)
+
     self._log.debug("Updated HTM metric_data rows=[%s..%s] "
                     "of model=%s: duration=%ss",
                     metricDataRows[0].rowid, metricDataRows[-1].rowid,
@@ -628,22 +653,101 @@ class AnomalyService(object):
     return json.loads(zlib.decompress(payload))
 
 
+  def _processResultBatch(self, modelID, results, bus):
+    """ Process a batch of results from a model and publish the outcome to the
+    model results exchange
+
+    :param modelID: ID of the model that produced the results
+    :param results: sequence of ModelCommandResult and ModelInferenceResult
+      instances
+    :param bus: MessageBusConnector instance for publishing
+    """
+    if self._profiling:
+      batchStartTime = time.time()
+
+    inferenceResults = []
+    for result in results:
+      try:
+        if isinstance(result, ModelCommandResult):
+          self._processModelCommandResult(modelID, result)
+          # Construct model command result message for consumption by
+          # downstream processes
+          try:
+            cmdResultMessage = self._composeModelCommandResultMessage(
+              modelID=modelID,
+              cmdResult=result)
+          except (ObjectNotFoundError, MetricNotMonitoredError):
+            pass
+          else:
+            bus.publishExg(
+              exchange=self._modelResultsExchange,
+              routingKey="",
+              body=self._serializeModelResult(cmdResultMessage),
+              properties=self._MODEL_COMMAND_RESULT_PROPERTIES)
+        elif isinstance(result, ModelInferenceResult):
+          inferenceResults.append(result)
+        else:
+          self._log.error("Unsupported ModelResult=%r", result)
+      except ObjectNotFoundError:
+        self._log.exception("Error processing result=%r "
+                            "from model=%s", result, modelID)
+
+    if inferenceResults:
+      result = self._processModelInferenceResults(
+        inferenceResults,
+        metricID=modelID)
+
+      if result is not None:
+        # Construct model results payload for consumption by
+        # downstream processes
+        metricRow, dataRows = result
+        resultsMessage = self._composeModelInferenceResultsMessage(
+          metricRow,
+          dataRows)
+
+        payload = self._serializeModelResult(resultsMessage)
+
+        bus.publishExg(
+          exchange=self._modelResultsExchange,
+          routingKey="",
+          body=payload,
+          properties=self._MODEL_INFERENCE_RESULT_PROPERTIES)
+
+    if self._profiling:
+      if inferenceResults:
+        if result is not None:
+          # pylint: disable=W0633
+          metricRow, rows = result
+          rowIdRange = (
+            "%s..%s" % (rows[0].rowid, rows[-1].rowid)
+            if len(rows) > 1
+            else str(rows[0].rowid))
+          self._log.info(
+            "{TAG:ANOM.BATCH.INF.DONE} model=%s; "
+            "numItems=%d; rows=[%s]; tailRowTS=%s; duration=%.4fs; "
+            "ds=%s; name=%s",
+            modelID, len(results),
+            rowIdRange, rows[-1].timestamp.isoformat() + "Z",
+            time.time() - batchStartTime, metricRow.datasource,
+            metricRow.name)
+      else:
+        self._log.info(
+          "{TAG:ANOM.BATCH.CMD.DONE} model=%s; "
+          "numItems=%d; duration=%.4fs", modelID,
+          len(results), time.time() - batchStartTime)
+
+
   def run(self):
     """
     Consumes pending results.  Once result batch arrives, it will be dispatched
     to the correct model command result handler.
 
+    If the "num_workers" option of the "anomaly_service" configuration section
+    is non-zero, the result batches are processed in parallel by that many
+    workers; see `_ShardedResultBatchDispatcher`.
+
     :see: `_processModelCommandResult` and `_processModelInferenceResults`
     """
-    # Properties for publishing model command results on RabbitMQ exchange
-    modelCommandResultProperties = MessageProperties(
-        deliveryMode=amqp.constants.AMQPDeliveryModes.PERSISTENT_MESSAGE,
-        headers=dict(dataType="model-cmd-result"))
-
-    # Properties for publishing model inference results on RabbitMQ exchange
-    modelInferenceResultProperties = MessageProperties(
-        deliveryMode=amqp.constants.AMQPDeliveryModes.PERSISTENT_MESSAGE)
-
     # Declare an exchange for forwarding our results
     with amqp.synchronous_amqp_client.SynchronousAmqpClient(
         amqp.connection.getRabbitmqConnectionParameters()) as amqpClient:
@@ -651,88 +755,253 @@ class AnomalyService(object):
                                  exchangeType="fanout",
                                  durable=True)
 
-    with ModelSwapperInterface() as modelSwapper, MessageBusConnector() as bus:
-      with modelSwapper.consumeResults() as consumer:
-        for batch in consumer:
-          if self._profiling:
-            batchStartTime = time.time()
-
-          inferenceResults = []
-          for result in batch.objects:
-            try:
-              if isinstance(result, ModelCommandResult):
-                self._processModelCommandResult(batch.modelID, result)
-                # Construct model command result message for consumption by
-                # downstream processes
-                try:
-                  cmdResultMessage = self._composeModelCommandResultMessage(
-                    modelID=batch.modelID,
-                    cmdResult=result)
-                except (ObjectNotFoundError, MetricNotMonitoredError):
-                  pass
-                else:
-                  bus.publishExg(
-                    exchange=self._modelResultsExchange,
-                    routingKey="",
-                    body=self._serializeModelResult(cmdResultMessage),
-                    properties=modelCommandResultProperties)
-              elif isinstance(result, ModelInferenceResult):
-                inferenceResults.append(result)
-              else:
-                self._log.error("Unsupported ModelResult=%r", result)
-            except ObjectNotFoundError:
-              self._log.exception("Error processing result=%r "
-                                  "from model=%s", result, batch.modelID)
-
-          if inferenceResults:
-            result = self._processModelInferenceResults(
-              inferenceResults,
-              metricID=batch.modelID)
-
-            if result is not None:
-              # Construct model results payload for consumption by
-              # downstream processes
-              metricRow, dataRows = result
-              resultsMessage = self._composeModelInferenceResultsMessage(
-                metricRow,
-                dataRows)
-
-              payload = self._serializeModelResult(resultsMessage)
-
-              bus.publishExg(
-                exchange=self._modelResultsExchange,
-                routingKey="",
-                body=payload,
-                properties=modelInferenceResultProperties)
-
-          batch.ack()
-
-          if self._profiling:
-            if inferenceResults:
-              if result is not None:
-                # pylint: disable=W0633
-                metricRow, rows = result
-                rowIdRange = (
-                  "%s..%s" % (rows[0].rowid, rows[-1].rowid)
-                  if len(rows) > 1
-                  else str(rows[0].rowid))
-                self._log.info(
-                  "{TAG:ANOM.BATCH.INF.DONE} model=%s; "
-                  "numItems=%d; rows=[%s]; tailRowTS=%s; duration=%.4fs; "
-                  "ds=%s; name=%s",
-                  batch.modelID, len(batch.objects),
-                  rowIdRange, rows[-1].timestamp.isoformat() + "Z",
-                  time.time() - batchStartTime, metricRow.datasource,
-                  metricRow.name)
-            else:
-              self._log.info(
-                "{TAG:ANOM.BATCH.CMD.DONE} model=%s; "
-                "numItems=%d; duration=%.4fs", batch.modelID,
-                len(batch.objects), time.time() - batchStartTime)
+    if self._numWorkers > 0:
+      self._runShardedResultBatchDispatcher()
+    else:
+      with ModelSwapperInterface() as modelSwapper, \
+          MessageBusConnector() as bus:
+        with modelSwapper.consumeResults() as consumer:
+          for batch in consumer:
+            self._processResultBatch(batch.modelID, batch.objects, bus)
+            batch.ack()
 
     self._log.info("Stopped processing model results")
 
 
+  def _runShardedResultBatchDispatcher(self):
+    """ Consume pending results and dispatch them to parallel workers """
+    # NOTE: workers are started before connecting to the message bus, so that
+    # worker processes don't inherit our connections
+    with _ShardedResultBatchDispatcher(
+        numWorkers=self._numWorkers,
+        workerType=self._workerType) as dispatcher:
+
+      self._log.info("{TAG:ANOM.SHARDED.START} numWorkers=%d; workerType=%s",
+                     self._numWorkers, self._workerType)
+
+      with ModelSwapperInterface() as modelSwapper:
+        with modelSwapper.consumeResults(
+            prefetchMax=dispatcher.maxBatchesInFlight) as consumer:
+          for batch in consumer:
+            dispatcher.dispatch(batch)
+
+            if dispatcher.numBatchesInFlight >= dispatcher.maxBatchesInFlight:
+              # The broker won't deliver more batches until we ack some
+              dispatcher.waitForCompletions(
+                maxBatchesInFlight=dispatcher.maxBatchesInFlight - 1)
+            elif (dispatcher.numBatchesInFlight and
+                  not modelSwapper.resultsPending()):
+              # Our consumer would block waiting for new results, so don't
+              # leave completed batches unacked in the meantime
+              dispatcher.waitForCompletions(maxBatchesInFlight=0)
+
+          dispatcher.waitForCompletions(maxBatchesInFlight=0)
+
+
+
+class ResultBatchWorkerError(Exception):
+  """ A worker of _ShardedResultBatchDispatcher failed or stopped
+  unexpectedly
+  """
+  pass
+
+
+
+def _runResultBatchWorker(taskQueue, completionQueue):
+  """ Process result batches on behalf of _ShardedResultBatchDispatcher
+
+  :param taskQueue: queue of (sequence, modelID, results) tuples to process;
+    None is the signal to stop
+  :param completionQueue: queue for reporting (sequence, error) tuples of
+    processed tasks; error is None on success or the formatted traceback of the
+    failure, after which the worker stops
+  """
+  # Disable: Access to a protected member
+  # pylint: disable=W0212
+
+  # Each worker has its own service instance, so that the anomaly likelihood
+  # helper's caches aren't shared between threads and hold only the worker's
+  # partition of models
+  service = AnomalyService()
+
+  with MessageBusConnector() as bus:
+    while True:
+      task = taskQueue.get()
+      if task is None:
+        break
+
+      sequence, modelID, results = task
+      try:
+        service._processResultBatch(modelID, results, bus)
+      except Exception:  # pylint: disable=W0703
+        g_log.exception("Result batch worker failed on batch from model=%s",
+                        modelID)
+        completionQueue.put((sequence, traceback.format_exc()))
+        break
+
+      completionQueue.put((sequence, None))
+
+
+
+class _ShardedResultBatchDispatcher(object):
+  """ Dispatches consumed result batches to parallel workers, each of which
+  owns a hash partition of model IDs, so that the results of each model are
+  still processed in order. Batches are acked in the order of their delivery
+  as the workers complete them.
+  """
+
+  # Max number of unacked batches per worker: one being processed while the
+  # rest wait in the worker's task queue
+  _MAX_BATCHES_IN_FLIGHT_PER_WORKER = 4
+
+  # How often to check that the workers are alive while waiting for them
+  _WORKER_LIVENESS_CHECK_INTERVAL_SEC = 1
+
+
+  def __init__(self, numWorkers, workerType):
+    """
+    :param numWorkers: number of workers
+    :param workerType: "thread" or "process"
+    """
+    self._log = _getLogger()
+
+    if workerType == "thread":
+      queueClass = Queue.Queue
+      workerClass = threading.Thread
+    elif workerType == "process":
+      queueClass = multiprocessing.Queue
+      workerClass = multiprocessing.Process
+    else:
+      raise ValueError("Unknown anomaly service worker_type=%r" % (workerType,))
+
+    self.maxBatchesInFlight = (numWorkers *
+                               self._MAX_BATCHES_IN_FLIGHT_PER_WORKER)
+
+    self._completionQueue = queueClass()
+    self._taskQueues = [queueClass() for _ in xrange(numWorkers)]
+
+    self._workers = []
+    for i, taskQueue in enumerate(self._taskQueues):
+      worker = workerClass(target=_runResultBatchWorker,
+                           name="%s-%d" % (self.__class__.__name__, i),
+                           args=(taskQueue, self._completionQueue))
+      worker.daemon = True
+      self._workers.append(worker)
+
+    self._sequence = itertools.count()
+
+    # Dispatched batches in the order of their delivery: [(sequence, batch)]
+    self._batchesInFlight = deque()
+
+    # Sequence numbers of batches that were completed, but not acked yet
+    self._completedSequences = set()
+
+
+  def __enter__(self):
+    for worker in self._workers:
+      worker.start()
+    return self
+
+
+  def __exit__(self, _excType, _excVal, _excTb):
+    self.close()
+    return False
+
+
+  def close(self):
+    """ Stop the workers; batches that weren't acked yet will be redelivered
+    by the message bus
+    """
+    for taskQueue in self._taskQueues:
+      taskQueue.put(None)
+
+    for worker in self._workers:
+      worker.join(self._WORKER_LIVENESS_CHECK_INTERVAL_SEC)
+      if worker.is_alive():
+        self._log.warn("Result batch worker=%s didn't stop", worker.name)
+        if hasattr(worker, "terminate"):
+          worker.terminate()
+
+
+  @property
+  def numBatchesInFlight(self):
+    """ Number of dispatched batches that weren't acked yet """
+    return len(self._batchesInFlight)
+
+
+  def getWorkerIndex(self, modelID):
+    """ Get the index of the worker that owns the given model
+
+    NOTE: uses crc32 rather than hash(), which isn't guaranteed to be
+    consistent across processes
+    """
+    return (zlib.crc32(modelID) & 0xffffffff) % len(self._workers)
+
+
+  def dispatch(self, batch):
+    """ Queue up a consumed batch for processing by the worker that owns its
+    model, and ack the batches that were completed in the meantime
+
+    :param batch: model_swapper_interface._ConsumedResultBatch instance
+    """
+    sequence = next(self._sequence)
+    self._batchesInFlight.append((sequence, batch))
+
+    self._taskQueues[self.getWorkerIndex(batch.modelID)].put(
+      (sequence, batch.modelID, batch.objects))
+
+    while True:
+      try:
+        completion = self._completionQueue.get_nowait()
+      except Queue.Empty:
+        break
+      self._handleCompletion(*completion)
+
+    self._ackCompletedBatches()
+
+
+  def waitForCompletions(self, maxBatchesInFlight):
+    """ Wait for the workers to complete batches, acking them, until at most
+    the given number of batches remain unacked
+
+    :raises ResultBatchWorkerError: if a worker failed or stopped
+    """
+    while len(self._batchesInFlight) > maxBatchesInFlight:
+      try:
+        completion = self._completionQueue.get(
+          timeout=self._WORKER_LIVENESS_CHECK_INTERVAL_SEC)
+      except Queue.Empty:
+        for worker in self._workers:
+          if not worker.is_alive():
+            raise ResultBatchWorkerError("Result batch worker=%s stopped "
+                                         "unexpectedly" % (worker.name,))
+        continue
+
+      self._handleCompletion(*completion)
+      self._ackCompletedBatches()
+
+
+  def _handleCompletion(self, sequence, error):
+    if error is not None:
+      raise ResultBatchWorkerError("Result batch worker failed: %s" % (error,))
+
+    self._completedSequences.add(sequence)
+
+
+  def _ackCompletedBatches(self):
+    """ Ack the longest run of completed batches at the head of the batches in
+    flight with a single multiple-ack of the last one
+    """
+    lastCompletedBatch = None
+    while (self._batchesInFlight and
+           self._batchesInFlight[0][0] in self._completedSequences):
+      sequence, lastCompletedBatch = self._batchesInFlight.popleft()
+      self._completedSequences.remove(sequence)
+
+    if lastCompletedBatch is not None:
+      lastCompletedBatch.ack(multiple=True)
+
+
 
 def main(args):
   # Parse command line options
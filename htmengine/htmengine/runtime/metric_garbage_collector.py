@@ -23,9 +23,15 @@
 """Service for deleting old metric data rows. NOTE: This may not be appropriate
 for all applications, particularly those that accept custom metric data with
 arbitrary timestamps that are possibly in the past or future, such as HTM-IT.
+
+If the metric_data table is partitioned by timestamp (see
+htmengine.repository.metric_data_partitions), old metric data is purged by
+dropping the partitions that are entirely older than the threshold, and
+partitions are added ahead of time; otherwise, old rows are deleted in batches.
 """
 
 import argparse
+from datetime import datetime, timedelta
 import logging
 import sys
 import time
@@ -39,6 +45,7 @@ from nta.utils import sqlalchemy_utils
 
 import htmengine
 import htmengine.repository
+from htmengine.repository import metric_data_partitions
 from htmengine.repository import schema
 
 
@@ -54,6 +61,13 @@ _PAUSE_INTERVAL_SEC = 3600
 
 
 
+# How many days ahead of the current UTC day to keep partitions of a
+# partitioned metric_data table, so that incoming data doesn't land in the
+# p_future partition
+_PARTITIONS_AHEAD_DAYS = 7
+
+
+
 g_log = logging.getLogger(__name__)
 
 
@@ -101,14 +115,21 @@ def purgeOldMetricDataRows(thresholdDays):
   :param int thresholdDays: Metric data rows with timestamps older than this
     number of days will be purged.
 
-  :returns: number of rows that were deleted
+  :returns: number of rows that were deleted; estimated by MySQL if the
+    metric_data table is partitioned
 
   """
+  sqlEngine = htmengine.repository.engineFactory(htmengine.APP_CONFIG)
+
+  partitions = _getMetricDataPartitions(sqlEngine)
+  if partitions:
+    return _purgeOldMetricDataPartitions(sqlEngine=sqlEngine,
+                                         partitions=partitions,
+                                         thresholdDays=thresholdDays)
+
   g_log.info("Estimating number of rows in table=%s older than numDays=%s",
              schema.metric_data, thresholdDays)
 
-  sqlEngine = htmengine.repository.engineFactory(htmengine.APP_CONFIG)
-
   selectionPredicate = (
     schema.metric_data.c.timestamp <
     sql.func.date_sub(sql.func.utc_timestamp(),
@@ -171,6 +192,97 @@ def purgeOldMetricDataRows(thresholdDays):
 
 
 
+def _purgeOldMetricDataPartitions(sqlEngine, partitions, thresholdDays):
+  """ Add partitions of the partitioned metric_data table through
+  _PARTITIONS_AHEAD_DAYS, and drop those with timestamps that are entirely
+  older than the given number of days.
+
+  :param sqlalchemy.engine.Engine sqlEngine:
+  :param partitions: metric_data_partitions.MetricDataPartition objects of the
+    metric_data table
+  :param int thresholdDays: Partitions with all timestamps older than this
+    number of days will be dropped.
+
+  :returns: number of rows that were dropped, as estimated by MySQL
+  """
+  now = datetime.utcnow()
+
+  partitionDays = metric_data_partitions.getPartitionDays(partitions)
+
+  addedPartitions = _addMetricDataPartitions(
+    sqlEngine=sqlEngine,
+    partitions=partitions,
+    lastDay=(now + timedelta(days=_PARTITIONS_AHEAD_DAYS)).date(),
+    partitionDays=partitionDays)
+
+  if addedPartitions:
+    g_log.info("Added partitions=%s of partitionDays=%s to table=%s",
+               addedPartitions, partitionDays, schema.metric_data)
+
+  # Rows of a partition precede the start of its lessThan day
+  cutoffDay = (now - timedelta(days=thresholdDays)).date()
+
+  expiredPartitions = [p for p in partitions
+                       if p.lessThan is not None and p.lessThan <= cutoffDay]
+
+  if not expiredPartitions:
+    g_log.info("No partitions of table=%s older than numDays=%s",
+               schema.metric_data, thresholdDays)
+    return 0
+
+  estimate = sum(p.estimatedNumRows for p in expiredPartitions)
+
+  _dropMetricDataPartitions(sqlEngine=sqlEngine,
+                            partitionNames=[p.name for p in expiredPartitions])
+
+  g_log.info("Dropped partitions=%s with estimated numRows=%s older than "
+             "numDays=%s from table=%s",
+             [p.name for p in expiredPartitions], estimate, thresholdDays,
+             schema.metric_data)
+
+  return estimate
+
+
+
+@sqlalchemy_utils.retryOnTransientErrors
+def _getMetricDataPartitions(sqlEngine):
+  """
+  :param sqlalchemy.engine.Engine sqlEngine:
+  :returns: metric_data_partitions.MetricDataPartition objects of the
+    metric_data table; empty if it's not partitioned
+  """
+  with sqlEngine.connect() as conn:
+    return metric_data_partitions.getMetricDataPartitions(conn)
+
+
+
+@sqlalchemy_utils.retryOnTransientErrors
+def _addMetricDataPartitions(sqlEngine, partitions, lastDay, partitionDays):
+  """ See metric_data_partitions.addMetricDataPartitions
+
+  :param sqlalchemy.engine.Engine sqlEngine:
+  :returns: names of the added partitions
+  """
+  with sqlEngine.connect() as conn:
+    return metric_data_partitions.addMetricDataPartitions(
+      conn,
+      partitions=partitions,
+      lastDay=lastDay,
+      partitionDays=partitionDays)
+
+
+
+@sqlalchemy_utils.retryOnTransientErrors
+def _dropMetricDataPartitions(sqlEngine, partitionNames):
+  """ See metric_data_partitions.dropMetricDataPartitions
+
+  :param sqlalchemy.engine.Engine sqlEngine:
+  """
+  with sqlEngine.connect() as conn:
+    metric_data_partitions.dropMetricDataPartitions(conn, partitionNames)
+
+
+
 @sqlalchemy_utils.retryOnTransientErrors
 def _estimateNumRowsToDelete(sqlEngine, selectionPredicate):
   """
@@ -28,19 +28,24 @@ they come in as a batch but to time out quickly to avoid long delays in
 uploading.
 """
 
+from collections import deque
 import datetime
 import errno
+import functools
 import itertools
 import json
 import logging
 import optparse
 import os
+import select
 import socket
 import SocketServer
+import struct
 import threading
 import time
 
 from nta.utils.config import Config
+from nta.utils.error_handling import abortProgramOnAnyException
 from nta.utils.logging_support_raw import LoggingSupport
 from nta.utils import threading_utils
 
@@ -48,13 +53,16 @@ from htmengine import raiseExceptionOnMissingRequiredApplicationConfigPath
 from htmengine.htmengine_logging import getExtendedLogger
 from htmengine.model_swapper.model_swapper_interface import (
   MessageBusConnector)
-from nta.utils.message_bus_connector import MessageQueueNotFound
+from nta.utils.message_bus_connector import (MessageQueueNotFound,
+                                             UndeliveredMessagesError)
 
 
 
 # Max number of data samples per batch
 _MAX_BATCH_SIZE = 200
 
+_EXIT_CODE_ON_UNHANDLED_EXCEPTION_IN_THREAD = 1
+
 
 LOGGER = getExtendedLogger(__name__)
 
@@ -62,30 +70,54 @@ gQueueName = None
 
 gProfiling = False
 
+# _SampleCoalescer instance shared by all client connections; None if samples
+# are forwarded by each connection directly
+gCoalescer = None
+
+
+
+
+# Binary protocol record: the length of the UTF-8 metric name as big-endian
+# unsigned 16-bit integer, followed by the metric name, followed by the
+# big-endian float64 value and int64 unix timestamp
+_BINARY_NAME_LENGTH_STRUCT = struct.Struct("!H")
+_BINARY_VALUE_TIMESTAMP_STRUCT = struct.Struct("!dq")
+
+# Prefix of custom metric queue messages whose body consists of binary protocol
+# records instead of the JSON envelope of plaintext samples; JSON text never
+# starts with a NUL byte. The second byte is the format version.
+BINARY_MESSAGE_PREFIX = "\x00\x01"
 
 
 
 class Protocol(object):
   """
-  Currently supports only the Carbon plaintext protocol
+  PLAIN: the Carbon plaintext protocol
+  BINARY: length-prefixed binary records; see packBinarySample
   Future options are pickle and amqp
   """
 
   PLAIN = "plain"
+  BINARY = "binary"
 
   current = None
 
   @classmethod
   def values(cls):
-    return (cls.PLAIN,)
+    return (cls.PLAIN, cls.BINARY)
 
   @classmethod
   def getDefaultPort(cls, protocol):
     if protocol == cls.PLAIN:
-      return int((Config("application.conf",
-                         os.environ["APPLICATION_CONFIG_PATH"])
-                  .get("metric_listener", "plaintext_port")))
-    raise ValueError("Unknown protocol %r" % protocol)
+      optionName = "plaintext_port"
+    elif protocol == cls.BINARY:
+      optionName = "binary_port"
+    else:
+      raise ValueError("Unknown protocol %r" % protocol)
+
+    return int((Config("application.conf",
+                       os.environ["APPLICATION_CONFIG_PATH"])
+                .get("metric_listener", optionName)))
 
 
 
@@ -113,6 +145,93 @@ def parsePlaintext(data):
 
 
 
+def packBinarySample(metricName, value, timestamp):
+  """ Encode a data sample as a binary protocol record
+
+  :param metricName: metric name; unicode or UTF-8 encoded string
+  :param value: floating-point data value
+  :param timestamp: integer unix timestamp
+
+  :returns: binary protocol record string
+  """
+  if isinstance(metricName, unicode):
+    metricName = metricName.encode("utf-8")
+
+  return (_BINARY_NAME_LENGTH_STRUCT.pack(len(metricName)) + metricName +
+          _BINARY_VALUE_TIMESTAMP_STRUCT.pack(value, timestamp))
+
+
+
+def _getCompleteBinaryRecordsLength(data):
+  """ Get the length of the longest prefix of data that consists of complete
+  binary protocol records; the remainder is the beginning of an incomplete
+  record
+
+  :param data: string of binary protocol records
+  """
+  nameLengthSize = _BINARY_NAME_LENGTH_STRUCT.size
+  valueTimestampSize = _BINARY_VALUE_TIMESTAMP_STRUCT.size
+  unpackNameLength = _BINARY_NAME_LENGTH_STRUCT.unpack_from
+  dataLength = len(data)
+
+  end = 0
+  while end + nameLengthSize <= dataLength:
+    recordEnd = (end + nameLengthSize + unpackNameLength(data, end)[0] +
+                 valueTimestampSize)
+    if recordEnd > dataLength:
+      break
+    end = recordEnd
+
+  return end
+
+
+
+def parseBinarySamples(data, offset=0):
+  """ Parse binary protocol records
+
+  :param data: string of complete binary protocol records
+  :param offset: offset of the first record in data
+
+  :raises: ValueError when data ends with an incomplete record
+
+  :returns: a list of three-tuples:
+    (<metric-name>, <floating-point-value>, <datetime-timestamp>)
+  """
+  nameLengthSize = _BINARY_NAME_LENGTH_STRUCT.size
+  valueTimestampSize = _BINARY_VALUE_TIMESTAMP_STRUCT.size
+  unpackNameLength = _BINARY_NAME_LENGTH_STRUCT.unpack_from
+  unpackValueTimestamp = _BINARY_VALUE_TIMESTAMP_STRUCT.unpack_from
+  dataLength = len(data)
+
+  # Samples of many metrics share timestamps, so each distinct timestamp is
+  # converted to datetime only once
+  datetimes = dict()
+
+  samples = []
+  try:
+    while offset < dataLength:
+      nameStart = offset + nameLengthSize
+      nameEnd = nameStart + unpackNameLength(data, offset)[0]
+      offset = nameEnd + valueTimestampSize
+      if offset > dataLength:
+        raise ValueError("Truncated record")
+
+      value, timestamp = unpackValueTimestamp(data, nameEnd)
+
+      dt = datetimes.get(timestamp)
+      if dt is None:
+        dt = datetimes[timestamp] = datetime.datetime.utcfromtimestamp(
+          timestamp)
+
+      samples.append((data[nameStart:nameEnd], value, dt))
+  except (struct.error, ValueError) as e:
+    raise ValueError("Unable to parse binary records at offset=%d of len=%d: "
+                     "%r" % (offset, dataLength, e))
+
+  return samples
+
+
+
 class Transport(object):
   __slots__ = ("UDP", "TCP")
   UDP = "udp"
@@ -124,18 +243,43 @@ class Transport(object):
 
 
 
-def _forwardData(messageBus, data):
+class ServerMode(object):
+  """ THREADED: a thread per TCP client connection or UDP datagram
+  EVENT_LOOP: a single thread that multiplexes all clients; see EventLoopServer
+  """
+  __slots__ = ("THREADED", "EVENT_LOOP")
+  THREADED = "threaded"
+  EVENT_LOOP = "event_loop"
+
+  @classmethod
+  def values(cls):
+    return [getattr(cls, a) for a in cls.__slots__]
+
+
+
+def _forwardData(messageBus, data, waitForConfirm=True):
   """Puts the data in the custom metric queue.
 
-  :param data: A sequence of data samples
+  :param data: A sequence of data samples: plaintext sample strings or, if the
+    current protocol is Protocol.BINARY, strings of binary protocol records
+  :param waitForConfirm: False to pipeline the message, in which case its
+    delivery is guaranteed only after a subsequent _confirmForwardedData; see
+    MessageBusConnector.publish
   """
   if gProfiling:
     startTime = time.time()
 
-  message = json.dumps({"protocol": Protocol.PLAIN, "data": data})
+  if Protocol.current == Protocol.BINARY:
+    # Binary records are forwarded as received, without a text round trip
+    message = BINARY_MESSAGE_PREFIX + "".join(data)
+  else:
+    message = json.dumps({"protocol": Protocol.PLAIN, "data": data})
   try:
     LOGGER.debug("Publishing message: %s", message)
-    messageBus.publish(mqName=gQueueName, body=message, persistent=True)
+    messageBus.publish(mqName=gQueueName, body=message, persistent=True,
+                       waitForConfirm=waitForConfirm)
+  except UndeliveredMessagesError as e:
+    _republishUndeliveredData(messageBus, e.undelivered)
   except MessageQueueNotFound:
     LOGGER.debug("Creating message queue that doesn't exist: %s", gQueueName)
     messageBus.createMessageQueue(mqName=gQueueName, durable=True)
@@ -146,9 +290,15 @@ def _forwardData(messageBus, data):
 
   if gProfiling and data:
     now = time.time()
+    sample = None
     try:
-      for sample in data:
-        metricName, _value, timestamp = parsePlaintext(sample)
+      if Protocol.current == Protocol.BINARY:
+        samples = parseBinarySamples(message, len(BINARY_MESSAGE_PREFIX))
+      else:
+        samples = (parsePlaintext(sample) for sample in data)
+
+      for sample in samples:
+        metricName, _value, timestamp = sample
         LOGGER.info(
           "{TAG:CUSLSR.FW.DONE} metricName=%s; timestamp=%s; duration=%.4fs",
           metricName, timestamp.isoformat() + "Z", now - startTime)
@@ -158,6 +308,186 @@ def _forwardData(messageBus, data):
 
 
 
+def _confirmForwardedData(messageBus):
+  """Waits for the confirmation of the messages pipelined by _forwardData,
+  re-publishing those that were undelivered because the custom metric queue
+  didn't exist
+  """
+  try:
+    messageBus.waitForConfirms()
+  except UndeliveredMessagesError as e:
+    _republishUndeliveredData(messageBus, e.undelivered)
+
+
+
+def _republishUndeliveredData(messageBus, undelivered):
+  """Creates the custom metric queue and re-publishes undelivered messages
+
+  :param undelivered: sequence of (mqName, body) pairs of the messages
+  """
+  LOGGER.debug("Creating message queue that doesn't exist: %s", gQueueName)
+  messageBus.createMessageQueue(mqName=gQueueName, durable=True)
+
+  LOGGER.debug("Re-publishing numMessages=%d", len(undelivered))
+  for mqName, body in undelivered:
+    messageBus.publish(mqName=mqName, body=body, persistent=True)
+
+
+
+class _SampleCoalescer(object):
+  """ Coalesces the samples received from all client connections into
+  messages of up to a max size, and publishes them from a background thread
+  through a single message bus connection in publisher-confirm mode. Messages
+  are pipelined while more of them are ready, and confirmed together before
+  the publisher waits for more samples.
+
+  A sample waits at most the linger time for a message to fill up. When the
+  message bus falls behind and the pending samples exceed their max size,
+  add() blocks, which in turn stops the reading of client sockets and thus
+  applies backpressure to the clients.
+  """
+
+  # Estimated JSON encoding overhead per sample: quotes and separator
+  _SAMPLE_OVERHEAD_BYTES = 4
+
+
+  def __init__(self, maxMessageBytes, lingerSec, maxPendingBytes):
+    """
+    :param maxMessageBytes: max size of the samples of a published message
+    :param lingerSec: max seconds that a sample waits for a message to fill up
+    :param maxPendingBytes: max size of the samples waiting to be published,
+      beyond which add() blocks
+    """
+    self._maxMessageBytes = maxMessageBytes
+    self._lingerSec = lingerSec
+    self._maxPendingBytes = maxPendingBytes
+
+    self._condition = threading.Condition()
+
+    self._pendingSamples = deque()
+    self._pendingBytes = 0
+
+    # Time when the oldest pending sample was added
+    self._oldestPendingTime = None
+
+    self._closed = False
+
+    self._publisherThread = threading.Thread(
+      target=self._runPublisherThread,
+      name="%s-publisher" % (self.__class__.__name__,))
+    self._publisherThread.setDaemon(True)
+
+
+  def start(self):
+    self._publisherThread.start()
+
+
+  def close(self):
+    """ Publish the pending samples and stop the publisher thread """
+    with self._condition:
+      self._closed = True
+      self._condition.notifyAll()
+
+    self._publisherThread.join()
+
+
+  def add(self, samples):
+    """ Add samples for publishing; blocks while the size of pending samples
+    is at its max
+
+    :param samples: sequence of sample strings
+    """
+    with self._condition:
+      while self._pendingBytes >= self._maxPendingBytes and not self._closed:
+        self._condition.wait()
+
+      for sample in samples:
+        self._pendingSamples.append(sample)
+        self._pendingBytes += len(sample) + self._SAMPLE_OVERHEAD_BYTES
+
+      if self._oldestPendingTime is None and self._pendingSamples:
+        self._oldestPendingTime = time.time()
+        # Wake up the publisher to time the linger of the first pending sample
+        self._condition.notifyAll()
+      elif self._pendingBytes >= self._maxMessageBytes:
+        self._condition.notifyAll()
+
+
+  def _isMessageReady(self):
+    """
+    :returns: True if _takeMessageSamples would return without waiting
+    """
+    with self._condition:
+      if self._pendingBytes >= self._maxMessageBytes or self._closed:
+        return True
+
+      return bool(self._pendingSamples and
+                  self._oldestPendingTime + self._lingerSec <= time.time())
+
+
+  def _takeMessageSamples(self):
+    """ Wait until a message fills up or the oldest pending sample's linger
+    time expires, and remove the message's samples from the pending samples
+
+    :returns: non-empty list of samples; None if closed and all samples were
+      taken
+    """
+    with self._condition:
+      while self._pendingBytes < self._maxMessageBytes:
+        if self._pendingSamples:
+          remainingSec = (self._oldestPendingTime + self._lingerSec -
+                          time.time())
+          if remainingSec <= 0 or self._closed:
+            break
+          self._condition.wait(remainingSec)
+        elif self._closed:
+          return None
+        else:
+          self._condition.wait()
+
+      samples = []
+      numBytes = 0
+      while self._pendingSamples:
+        sampleBytes = (len(self._pendingSamples[0]) +
+                       self._SAMPLE_OVERHEAD_BYTES)
+        if samples and numBytes + sampleBytes > self._maxMessageBytes:
+          break
+        samples.append(self._pendingSamples.popleft())
+        numBytes += sampleBytes
+
+      self._pendingBytes -= numBytes
+
+      # Samples left behind keep the time of the oldest sample, so that they
+      # get published without another linger period
+      if not self._pendingSamples:
+        self._oldestPendingTime = None
+
+      # Unblock producers waiting for pending samples to drain
+      self._condition.notifyAll()
+
+      return samples
+
+
+  @abortProgramOnAnyException(
+    _EXIT_CODE_ON_UNHANDLED_EXCEPTION_IN_THREAD,
+    logger=LOGGER)
+  def _runPublisherThread(self):
+    with MessageBusConnector() as messageBus:
+      while True:
+        if not self._isMessageReady():
+          # Confirm the pipelined messages before waiting for more samples
+          _confirmForwardedData(messageBus)
+
+        samples = self._takeMessageSamples()
+        if samples is None:
+          break
+
+        _forwardData(messageBus, samples, waitForConfirm=False)
+
+      _confirmForwardedData(messageBus)
+
+
+
 class _TimeoutSafeBufferedLineReader(object):
   """We have and use this class as an indirect replacement for socket.makefile()
   instance, because socket.makefile() doesn't work properly when timeout is set
@@ -276,8 +606,33 @@ class UDPHandler(SocketServer.BaseRequestHandler):
 
   def handle(self):
     data = self.request[0].strip()
-    with MessageBusConnector() as messageBus:
-      _forwardData(messageBus, (data,))
+    if gCoalescer is not None:
+      gCoalescer.add((data,))
+    else:
+      with MessageBusConnector() as messageBus:
+        _forwardData(messageBus, (data,))
+
+
+
+class BinaryUDPHandler(SocketServer.BaseRequestHandler):
+  """ Receives datagrams of complete binary protocol records """
+
+
+  def handle(self):
+    data = self.request[0]
+    end = _getCompleteBinaryRecordsLength(data)
+    if end < len(data):
+      LOGGER.warning("Discarding incomplete binary record of len=%d from "
+                     "client=%s", len(data) - end, self.client_address)
+    if end == 0:
+      return
+
+    records = data[:end] if end < len(data) else data
+    if gCoalescer is not None:
+      gCoalescer.add((records,))
+    else:
+      with MessageBusConnector() as messageBus:
+        _forwardData(messageBus, (records,))
 
 
 
@@ -295,23 +650,80 @@ class TCPHandler(SocketServer.StreamRequestHandler):
                   "currentConcurrency=%d", threading.currentThread().ident,
                   self.client_address, concurrencyCount)
 
-      batch = []
-      with MessageBusConnector() as messageBus:
-        for line in _readlines(self.connection):
-          if line is not None:
-            batch.append(line.strip())
-            LOGGER.debug("got line=%r; batchLen=%d", line, len(batch))
-          else:
-            LOGGER.debug("got data break; batchLen=%d", len(batch))
-
-          if (line is None and batch) or len(batch) >= _MAX_BATCH_SIZE:
-            _forwardData(messageBus, batch)
-            batch = []
-        else:
-          if batch:
-            # Send the remnant
-            _forwardData(messageBus, batch)
-          return
+      if gCoalescer is not None:
+        self._receiveSamples(gCoalescer.add)
+      else:
+        with MessageBusConnector() as messageBus:
+          self._receiveSamples(functools.partial(_forwardData, messageBus))
+
+
+  def _receiveSamples(self, forward):
+    """ Read samples from the connection and forward them in batches
+
+    :param forward: function for forwarding a batch of samples: forward(batch)
+    """
+    batch = []
+    for line in _readlines(self.connection):
+      if line is not None:
+        batch.append(line.strip())
+        LOGGER.debug("got line=%r; batchLen=%d", line, len(batch))
+      else:
+        LOGGER.debug("got data break; batchLen=%d", len(batch))
+
+      if (line is None and batch) or len(batch) >= _MAX_BATCH_SIZE:
+        forward(batch)
+        batch = []
+    else:
+      if batch:
+        # Send the remnant
+        forward(batch)
+
+
+
+class BinaryTCPHandler(TCPHandler):
+  """ Receives a stream of binary protocol records """
+
+  _RECV_BUF_SIZE = 65536
+
+
+  def _receiveSamples(self, forward):
+    """ Read records from the connection and forward the complete records of
+    each received chunk of data as one batch item
+
+    :param forward: function for forwarding a batch of records: forward(batch)
+    """
+    self.connection.settimeout(None)
+
+    # Beginning of an incomplete record; it's shorter than the max record
+    # length, because the name length is bounded
+    partialRecord = ""
+    while True:
+      try:
+        data = self.connection.recv(self._RECV_BUF_SIZE)
+      except socket.error as e:
+        if e.args[0] == errno.EINTR:
+          continue
+        raise
+
+      if not data:
+        # EOF reached
+        break
+
+      if partialRecord:
+        data = partialRecord + data
+
+      end = _getCompleteBinaryRecordsLength(data)
+      if end == len(data):
+        forward((data,))
+        partialRecord = ""
+      else:
+        if end:
+          forward((data[:end],))
+        partialRecord = data[end:]
+
+    if partialRecord:
+      LOGGER.warning("Discarding incomplete binary record of len=%d from "
+                     "client=%s", len(partialRecord), self.client_address)
 
 
 
@@ -328,24 +740,366 @@ class ThreadedTCPServer(SocketServer.ThreadingMixIn,
 
 
 
+class _Poller(object):
+  """ Socket readiness notification via epoll where available and poll
+  elsewhere; level-triggered
+  """
+
+  if hasattr(select, "epoll"):
+    READ_EVENTS = select.EPOLLIN | select.EPOLLERR | select.EPOLLHUP
+  else:
+    READ_EVENTS = select.POLLIN | select.POLLERR | select.POLLHUP
+
+
+  def __init__(self):
+    if hasattr(select, "epoll"):
+      self._impl = select.epoll()
+      self._timeoutScale = 1
+    else:
+      self._impl = select.poll()
+      # poll expects milliseconds
+      self._timeoutScale = 1000
+
+
+  def register(self, fd):
+    self._impl.register(fd, self.READ_EVENTS)
+
+
+  def unregister(self, fd):
+    self._impl.unregister(fd)
+
+
+  def poll(self, timeout):
+    """
+    :param timeout: max seconds to wait for events
+    :returns: sequence of (fd, eventMask) pairs
+    """
+    try:
+      return self._impl.poll(timeout * self._timeoutScale)
+    except (IOError, select.error) as e:
+      if e.args[0] == errno.EINTR:
+        return ()
+      raise
+
+
+  def close(self):
+    if hasattr(self._impl, "close"):
+      self._impl.close()
+
+
+
+class _ClientConnection(object):
+  """ State of a TCP client connection of EventLoopServer """
+
+  __slots__ = ("sock", "address", "partialLine")
+
+  def __init__(self, sock, address):
+    self.sock = sock
+    self.address = address
+
+    # Received text following the last newline; with Protocol.BINARY, the
+    # beginning of an incomplete record
+    self.partialLine = ""
+
+
+
+class EventLoopServer(object):
+  """ Single-threaded server that multiplexes all of its TCP client connections
+  or UDP datagrams with an event loop, and forwards the samples from all
+  clients through a single message bus connection.
+
+  Lines are received into a single reusable buffer, from which complete lines
+  are sliced out directly. The samples received from all ready clients are
+  forwarded in batches of up to _MAX_BATCH_SIZE samples, and when no more data
+  is ready. With Protocol.BINARY, the complete records of each received chunk
+  of data are forwarded as one batch item without being parsed.
+
+  Implements the subset of the SocketServer server interface used by runServer:
+  server_address, serve_forever(), shutdown() and server_close()
+  """
+
+  _RECV_BUF_SIZE = 65536
+
+  _LISTEN_BACKLOG = 1024
+
+  # Connections whose text without a newline grows beyond this length are
+  # closed, so that a misbehaving client can't exhaust memory
+  _MAX_LINE_LENGTH = 65536
+
+  # Max datagrams to read from the UDP socket per readiness event, so that the
+  # batch gets forwarded during a sustained burst
+  _MAX_DATAGRAMS_PER_EVENT = _MAX_BATCH_SIZE
+
+  # Max size of the binary records of a batch
+  _MAX_BINARY_BATCH_BYTES = 262144
+
+
+  def __init__(self, listeningAddr, transport, protocol=Protocol.PLAIN):
+    """
+    :param listeningAddr: (host, port) pair to listen on
+    :param transport: Transport.TCP or Transport.UDP
+    :param protocol: Protocol.PLAIN or Protocol.BINARY
+    """
+    self._transport = transport
+    self._protocol = protocol
+
+    if transport == Transport.TCP:
+      self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    elif transport == Transport.UDP:
+      self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    else:
+      raise ValueError("Unknown transport %r" % (transport,))
+
+    try:
+      self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+      self.socket.bind(listeningAddr)
+      if transport == Transport.TCP:
+        self.socket.listen(self._LISTEN_BACKLOG)
+      self.socket.setblocking(False)
+    except:
+      self.socket.close()
+      raise
+
+    self.server_address = self.socket.getsockname()
+
+    self._recvBuf = bytearray(self._RECV_BUF_SIZE)
+
+    # Map of file descriptors to _ClientConnection instances
+    self._connections = dict()
+
+    # Samples pending forwarding
+    self._batch = []
+
+    # Size of the binary records pending forwarding
+    self._batchBytes = 0
+
+    self._shutdownRequested = False
+    self._isShutDown = threading.Event()
+    self._isShutDown.set()
+
+
+  def serve_forever(self, poll_interval=0.5):
+    """ Serve clients until shutdown() is called """
+    self._shutdownRequested = False
+    self._isShutDown.clear()
+
+    poller = _Poller()
+    try:
+      with MessageBusConnector() as messageBus:
+        serverFD = self.socket.fileno()
+        poller.register(serverFD)
+
+        while not self._shutdownRequested:
+          for fd, _eventMask in poller.poll(poll_interval):
+            if fd == serverFD:
+              if self._transport == Transport.TCP:
+                self._acceptConnections(poller)
+              else:
+                self._readDatagrams(messageBus)
+            else:
+              connection = self._connections.get(fd)
+              if connection is not None:
+                self._readConnection(connection, poller, messageBus)
+
+          if self._batch:
+            # Data break
+            self._forwardBatch(messageBus)
+    finally:
+      for connection in self._connections.values():
+        self._closeConnection(connection, poller)
+      poller.close()
+      self._isShutDown.set()
+
+
+  def shutdown(self):
+    """ Stop the serve_forever loop and wait until it stops; must be called
+    from a different thread than serve_forever
+    """
+    self._shutdownRequested = True
+    self._isShutDown.wait()
+
+
+  def server_close(self):
+    self.socket.close()
+
+
+  def _acceptConnections(self, poller):
+    while True:
+      try:
+        sock, address = self.socket.accept()
+      except socket.error as e:
+        if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK, errno.ECONNABORTED):
+          return
+        if e.args[0] == errno.EINTR:
+          continue
+        raise
+
+      sock.setblocking(False)
+      connection = _ClientConnection(sock, address)
+      self._connections[sock.fileno()] = connection
+      poller.register(sock.fileno())
+
+      LOGGER.info("Receiving samples from client=%s at currentConcurrency=%d",
+                  address, len(self._connections))
+
+
+  def _closeConnection(self, connection, poller):
+    fd = connection.sock.fileno()
+    poller.unregister(fd)
+    del self._connections[fd]
+    connection.sock.close()
+
+
+  def _readConnection(self, connection, poller, messageBus):
+    try:
+      nbytes = connection.sock.recv_into(self._recvBuf)
+    except socket.error as e:
+      if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+        return
+      LOGGER.warning("Closing connection from client=%s due to error=%r",
+                     connection.address, e)
+      nbytes = 0
+
+    if nbytes == 0:
+      # EOF reached; forward the remnant without newline
+      if connection.partialLine:
+        if self._protocol == Protocol.BINARY:
+          LOGGER.warning("Discarding incomplete binary record of len=%d from "
+                         "client=%s", len(connection.partialLine),
+                         connection.address)
+        else:
+          self._addSample(connection.partialLine, messageBus)
+      self._closeConnection(connection, poller)
+      return
+
+    if self._protocol == Protocol.BINARY:
+      data = str(self._recvBuf[0:nbytes])
+      if connection.partialLine:
+        data = connection.partialLine + data
+
+      # The partial record is shorter than the max record length, because the
+      # name length is bounded
+      end = _getCompleteBinaryRecordsLength(data)
+      connection.partialLine = data[end:]
+      if end:
+        self._addBinaryRecords(data[:end] if end < len(data) else data,
+                               messageBus)
+      return
+
+    buf = self._recvBuf
+    start = 0
+    while True:
+      eolPos = buf.find("\n", start, nbytes)
+      if eolPos == -1:
+        break
+
+      line = str(buf[start:eolPos])
+      if connection.partialLine:
+        line = connection.partialLine + line
+        connection.partialLine = ""
+
+      self._addSample(line, messageBus)
+      start = eolPos + 1
+
+    if start < nbytes:
+      connection.partialLine += str(buf[start:nbytes])
+
+      if len(connection.partialLine) > self._MAX_LINE_LENGTH:
+        LOGGER.warning("Closing connection from client=%s due to line "
+                       "exceeding maxLength=%d", connection.address,
+                       self._MAX_LINE_LENGTH)
+        self._closeConnection(connection, poller)
+
+
+  def _readDatagrams(self, messageBus):
+    for _ in xrange(self._MAX_DATAGRAMS_PER_EVENT):
+      try:
+        nbytes, address = self.socket.recvfrom_into(self._recvBuf)
+      except socket.error as e:
+        if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+          return
+        if e.args[0] == errno.EINTR:
+          continue
+        raise
+
+      data = str(self._recvBuf[0:nbytes])
+      if self._protocol == Protocol.BINARY:
+        end = _getCompleteBinaryRecordsLength(data)
+        if end < len(data):
+          LOGGER.warning("Discarding incomplete binary record of len=%d from "
+                         "client=%s", len(data) - end, address)
+          data = data[:end]
+        if data:
+          self._addBinaryRecords(data, messageBus)
+      else:
+        self._addSample(data, messageBus)
+
+
+  def _addSample(self, line, messageBus):
+    sample = line.strip()
+    if not sample:
+      return
+
+    self._batch.append(sample)
+    LOGGER.debug("got line=%r; batchLen=%d", line, len(self._batch))
+
+    if len(self._batch) >= _MAX_BATCH_SIZE:
+      self._forwardBatch(messageBus)
+
+
+  def _addBinaryRecords(self, records, messageBus):
+    self._batch.append(records)
+    self._batchBytes += len(records)
+
+    if (len(self._batch) >= _MAX_BATCH_SIZE or
+        self._batchBytes >= self._MAX_BINARY_BATCH_BYTES):
+      self._forwardBatch(messageBus)
+
+
+  def _forwardBatch(self, messageBus):
+    batch = self._batch
+    self._batch = []
+    self._batchBytes = 0
+    if gCoalescer is not None:
+      gCoalescer.add(batch)
+    else:
+      _forwardData(messageBus, batch)
+
+
+
 @raiseExceptionOnMissingRequiredApplicationConfigPath
 def runServer(host="0.0.0.0", port=None, protocol=Protocol.PLAIN,
-              transport=Transport.TCP):
+              transport=Transport.TCP, serverMode=None):
+  """
+  :param serverMode: ServerMode value; None to use the "server_mode" option of
+    the "metric_listener" configuration section
+  """
   Protocol.current = protocol
   if port is None:
     port = Protocol.getDefaultPort(protocol)
 
-  LOGGER.info("Starting with host=%s, port=%s, protocol=%s, transport=%s",
-              host, port, protocol, transport)
-
-  if transport == Transport.UDP:
-    server = ThreadedUDPServer((host, port), UDPHandler)
-  elif transport == Transport.TCP:
-    server = ThreadedTCPServer((host, port), TCPHandler)
-
   config = Config("application.conf",
                   os.environ["APPLICATION_CONFIG_PATH"])
 
+  if serverMode is None:
+    serverMode = config.get("metric_listener", "server_mode")
+
+  LOGGER.info("Starting with host=%s, port=%s, protocol=%s, transport=%s, "
+              "serverMode=%s", host, port, protocol, transport, serverMode)
+
+  if serverMode == ServerMode.EVENT_LOOP:
+    server = EventLoopServer((host, port), transport, protocol)
+  elif serverMode != ServerMode.THREADED:
+    raise ValueError("Unknown server mode %r" % (serverMode,))
+  elif transport == Transport.UDP:
+    server = ThreadedUDPServer(
+      (host, port),
+      BinaryUDPHandler if protocol == Protocol.BINARY else UDPHandler)
+  elif transport == Transport.TCP:
+    server = ThreadedTCPServer(
+      (host, port),
+      BinaryTCPHandler if protocol == Protocol.BINARY else TCPHandler)
+
   global gQueueName
   gQueueName = config.get("metric_listener", "queue_name")
 
@@ -353,8 +1107,24 @@ def runServer(host="0.0.0.0", port=None, protocol=Protocol.PLAIN,
   gProfiling = (config.getboolean("debugging", "profiling") or
                 LOGGER.isEnabledFor(logging.DEBUG))
 
+  global gCoalescer
+  lingerMS = config.getint("metric_listener", "coalesce_linger_ms")
+  if lingerMS > 0:
+    gCoalescer = _SampleCoalescer(
+      maxMessageBytes=config.getint("metric_listener",
+                                    "coalesce_max_message_bytes"),
+      lingerSec=lingerMS / 1000.0,
+      maxPendingBytes=config.getint("metric_listener",
+                                    "coalesce_max_pending_bytes"))
+    gCoalescer.start()
+
   # Serve until there is an interrupt
-  server.serve_forever()
+  try:
+    server.serve_forever()
+  finally:
+    if gCoalescer is not None:
+      gCoalescer.close()
+      gCoalescer = None
 
 
 
@@ -365,11 +1135,15 @@ if __name__ == "__main__":
   parser.add_option("--host", default="0.0.0.0")
   parser.add_option("--port", type="int", default=None,
                     help="Default ports (from config): 2003 for plaintext, "
-                         "2004 for pickle")
+                         "2005 for binary")
   parser.add_option("--protocol", choices=Protocol.values(),
                     default=Protocol.PLAIN)
   parser.add_option("--transport", choices=Transport.values(),
                     default=Transport.TCP)
+  parser.add_option("--server-mode", choices=ServerMode.values(),
+                    default=None,
+                    help="Default from metric_listener.server_mode config")
   options, _ = parser.parse_args()
 
-  runServer(options.host, options.port, options.protocol, options.transport)
+  runServer(options.host, options.port, options.protocol, options.transport,
+            options.server_mode)
@@ -31,6 +31,7 @@ of the entire rows. We might only need the `uid`.
 
 from collections import defaultdict
 import datetime
+import functools
 import itertools
 import json
 import logging
@@ -42,7 +43,10 @@ from htmengine import (raiseExceptionOnMissingRequiredApplicationConfigPath,
 from htmengine.adapters.datasource import createCustomDatasourceAdapter
 import htmengine.exceptions
 from htmengine.htmengine_logging import getExtendedLogger
-from htmengine.runtime.metric_listener import parsePlaintext, Protocol
+from htmengine.runtime.metric_listener import (BINARY_MESSAGE_PREFIX,
+                                               parseBinarySamples,
+                                               parsePlaintext,
+                                               Protocol)
 from htmengine.runtime.metric_streamer_util import MetricStreamer
 from htmengine.model_swapper.model_swapper_interface import (
     MessageBusConnector, ModelSwapperInterface)
@@ -67,13 +71,30 @@ gProfiling = False
 
 
 
+class ConsumerMode(object):
+  """ PUSH: the broker pushes messages to the consumer, up to a prefetch window
+  of unacked messages, and batches close on size or linger time
+  POLL: messages are polled one broker round trip at a time, and batches close
+  on size or when the queue is empty
+  """
+  __slots__ = ("PUSH", "POLL")
+  PUSH = "push"
+  POLL = "poll"
+
+  @classmethod
+  def values(cls):
+    return [getattr(cls, a) for a in cls.__slots__]
+
+
+
 def _handleBatch(engine, messages, messageRxTimes, metricStreamer,
                  modelSwapper):
   """Process a batch of messages from the queue.
 
   This parses the message contents as JSON and uses the 'protocol' field to
-  determine how to parse the 'data' in the message. The data is added to the
-  database and sent through the metric streamer.
+  determine how to parse the 'data' in the message; messages that start with
+  BINARY_MESSAGE_PREFIX consist of binary protocol records instead. The data is
+  added to the database and sent through the metric streamer.
 
   The Metric objects are cached in gCustomMetrics to minimize database
   lookups.
@@ -91,6 +112,22 @@ def _handleBatch(engine, messages, messageRxTimes, metricStreamer,
   # Use the protocol to determine the message format
   data = []
   for m, rxTime in itertools.izip_longest(messages, messageRxTimes):
+    if m.body.startswith(BINARY_MESSAGE_PREFIX):
+      try:
+        samples = parseBinarySamples(m.body, len(BINARY_MESSAGE_PREFIX))
+      except ValueError:
+        LOGGER.warn("Discarding binary message that can't be parsed: %r",
+                    m.body[:100])
+        continue
+
+      data.extend(samples)
+      if gProfiling and rxTime is not None:
+        for metricName, _value, metricTimestamp in samples:
+          LOGGER.info(
+            "{TAG:CUSSTR.DATA.RX} metricName=%s; timestamp=%s; rxTime=%.4f",
+            metricName, metricTimestamp.isoformat() + "Z", rxTime)
+      continue
+
     try:
       message = json.loads(m.body)
       protocol = message["protocol"]
@@ -130,35 +167,58 @@ def _handleBatch(engine, messages, messageRxTimes, metricStreamer,
 
 
 def _addMetricData(engine, dataDict, metricStreamer, modelSwapper):
-  """Send metric data for each metric to the metric streamer.
+  """Send metric data for all metrics to the metric streamer in one batch.
+
+  Metrics that aren't in the cache are created first. Metrics that turn out to
+  no longer exist (e.g., deleted and re-created) are reloaded and their data is
+  streamed individually.
 
-  TODO: document args
+  :param engine: SQLAlchemy engine object
+  :type engine: sqlalchemy.engine.Engine
+  :param dataDict: a dict mapping metric name to a sequence of parsed
+    plaintext records (metricName, value, datetime.datetime)
+  :param metricStreamer: a :class:`MetricStreamer` instance to use
+  :param modelSwapper: a :class:`ModelSwapperInterface` instance to use
   """
   # For each metric, create the metric if it doesn't exist and add the data
+  dataByMetricID = dict()
+  metricNamesByID = dict()
   for metricName, metricData in dataDict.iteritems():
     if metricName not in gCustomMetrics:
       # Metric doesn't exist, create it
-      _addMetric(engine, metricName)
+      try:
+        _addMetric(engine, metricName)
+      except Exception:  # Exception excludes KeyboardInterrupt from supervisor
+        LOGGER.exception("Error adding custom metric %s", metricName)
+        continue
     else:
       gCustomMetrics[metricName][1] = datetime.datetime.utcnow()
-    # Add the data
-    metricData = [(dt, value) for _, value, dt in metricData]
 
+    metricID = gCustomMetrics[metricName][0].uid
+    dataByMetricID[metricID] = [(dt, value) for _, value, dt in metricData]
+    metricNamesByID[metricID] = metricName
+
+  try:
+    missingMetricIDs = metricStreamer.streamMetricDataBatch(dataByMetricID,
+                                                            modelSwapper)
+  except Exception:  # Exception excludes KeyboardInterrupt from supervisor
+    LOGGER.exception("Error adding custom metric data for %d metrics",
+                     len(dataByMetricID))
+    return
+
+  for metricID in missingMetricIDs:
+    # The metric may have been deleted and re-created, so attempt to update
+    # the cache.
+    metricName = metricNamesByID[metricID]
+    metricData = dataByMetricID[metricID]
     try:
+      _addMetric(engine, metricName)
       metricStreamer.streamMetricData(metricData,
                                       gCustomMetrics[metricName][0].uid,
                                       modelSwapper)
     except htmengine.exceptions.ObjectNotFoundError:
-      # The metric may have been deleted and re-created, so attempt to update
-      # the cache.
-      _addMetric(engine, metricName)
-      try:
-        metricStreamer.streamMetricData(metricData,
-                                        gCustomMetrics[metricName][0].uid,
-                                        modelSwapper)
-      except htmengine.exceptions.ObjectNotFoundError:
-        LOGGER.exception("Failed to add data for metric %s with uid %s",
-                         metricName, gCustomMetrics[metricName][0].uid)
+      LOGGER.exception("Failed to add data for metric %s with uid %s",
+                       metricName, gCustomMetrics[metricName][0].uid)
     except Exception:  # Exception excludes KeyboardInterrupt from supervisor
       LOGGER.exception("Error adding custom metric data: %r", metricData)
 
@@ -208,12 +268,90 @@ def _trimMetricCache():
       del gCustomMetrics[name]
 
 
+def _processBatch(engine, messages, messageRxTimes, metricStreamer,
+                  modelSwapper):
+  """ Handle a batch of messages, and ack all of them at once
+
+  See _handleBatch for args
+  """
+  try:
+    _handleBatch(engine,
+                 messages,
+                 messageRxTimes,
+                 metricStreamer,
+                 modelSwapper)
+  except Exception:  # pylint: disable=W0703
+    LOGGER.exception("Unknown failure in processing messages.")
+    # Make sure that we ack messages when there is an unexpected error
+    # to avoid getting hung forever on one bad record.
+
+  # Ack all the messages
+  messages[-1].ack(multiple=True)
+
+
+
+def _runPushConsumer(consumer, lingerSec, processBatch):
+  """ Process batches of messages as the broker pushes them to the consumer
+
+  :param consumer: blocking consumer of the custom metric queue
+  :param lingerSec: max seconds that a message waits for its batch to fill up
+  :param processBatch: function for processing and acking a batch of
+    messages: processBatch(messages, messageRxTimes)
+  """
+  for messages in consumer.readBatches(maxBatchSize=MAX_MESSAGES_PER_BATCH,
+                                       lingerSec=lingerSec):
+    if gProfiling:
+      messageRxTimes = [time.time()] * len(messages)
+    else:
+      messageRxTimes = []
+
+    processBatch(messages, messageRxTimes)
+
+
+
+def _runPollingConsumer(consumer, processBatch):
+  """ Poll for messages one at a time, and process them in batches
+
+  :param consumer: consumer of the custom metric queue
+  :param processBatch: function for processing and acking a batch of
+    messages: processBatch(messages, messageRxTimes)
+  """
+  messages = []
+  messageRxTimes = []
+  while True:
+    message = consumer.pollOneMessage()
+    if message is not None:
+      messages.append(message)
+      if gProfiling:
+        messageRxTimes.append(time.time())
+
+    if message is None or len(messages) >= MAX_MESSAGES_PER_BATCH:
+      if messages:
+        # Process the batch
+        processBatch(messages, messageRxTimes)
+
+        # Clear the message buffer
+        messages = []
+        messageRxTimes = []
+      else:
+        # Queue is empty, wait before retrying
+        time.sleep(POLL_DELAY_SEC)
+
+
+
 @raiseExceptionOnMissingRequiredApplicationConfigPath
 def runServer():
   # Get the current list of custom metrics
   appConfig = Config("application.conf",
                      os.environ["APPLICATION_CONFIG_PATH"])
 
+  consumerMode = appConfig.get("metric_storer", "consumer_mode")
+  if consumerMode not in ConsumerMode.values():
+    raise ValueError("Unknown consumer mode %r" % (consumerMode,))
+
+  prefetchMax = appConfig.getint("metric_storer", "prefetch_max")
+  lingerSec = appConfig.getint("metric_storer", "batch_linger_ms") / 1000.0
+
   engine = repository.engineFactory(appConfig)
   global gCustomMetrics
   now = datetime.datetime.utcnow()
@@ -232,42 +370,22 @@ def runServer():
   metricStreamer = MetricStreamer()
   modelSwapper = ModelSwapperInterface()
 
+  processBatch = functools.partial(_processBatch,
+                                   engine,
+                                   metricStreamer=metricStreamer,
+                                   modelSwapper=modelSwapper)
+
   with MessageBusConnector() as bus:
     if not bus.isMessageQeueuePresent(queueName):
       bus.createMessageQueue(mqName=queueName, durable=True)
-    LOGGER.info("Waiting for messages. To exit, press CTRL+C")
-    with bus.consume(queueName) as consumer:
-      messages = []
-      messageRxTimes = []
-      while True:
-        message = consumer.pollOneMessage()
-        if message is not None:
-          messages.append(message)
-          if gProfiling:
-            messageRxTimes.append(time.time())
-
-        if message is None or len(messages) >= MAX_MESSAGES_PER_BATCH:
-          if messages:
-            # Process the batch
-            try:
-              _handleBatch(engine,
-                           messages,
-                           messageRxTimes,
-                           metricStreamer,
-                           modelSwapper)
-            except Exception:  # pylint: disable=W0703
-              LOGGER.exception("Unknown failure in processing messages.")
-              # Make sure that we ack messages when there is an unexpected error
-              # to avoid getting hung forever on one bad record.
-
-            # Ack all the messages
-            messages[-1].ack(multiple=True)
-            # Clear the message buffer
-            messages = []
-            messageRxTimes = []
-          else:
-            # Queue is empty, wait before retrying
-            time.sleep(POLL_DELAY_SEC)
+    LOGGER.info("Waiting for messages in consumerMode=%s. To exit, press "
+                "CTRL+C", consumerMode)
+    if consumerMode == ConsumerMode.PUSH:
+      with bus.consume(queueName, prefetchMax=prefetchMax) as consumer:
+        _runPushConsumer(consumer, lingerSec, processBatch)
+    else:
+      with bus.consume(queueName) as consumer:
+        _runPollingConsumer(consumer, processBatch)
 
 
 
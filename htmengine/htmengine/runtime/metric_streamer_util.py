@@ -295,6 +295,141 @@ class MetricStreamer(object):
      datasource,
      metricStatus) = storeDataWithRetries()
 
+    self._forwardStoredRows(modelInputRows=modelInputRows,
+                            metricID=metricID,
+                            datasource=datasource,
+                            metricStatus=metricStatus,
+                            modelSwapper=modelSwapper)
+
+
+  def streamMetricDataBatch(self, dataByMetricID, modelSwapper):
+    """ Multi-metric version of `streamMetricData`: store the data samples of
+    many metrics in metric_data table in a single transaction, and stream the
+    data samples to the models associated with the metrics that are monitored.
+
+    All affected metric rows are locked with one SELECT ... FOR UPDATE, then
+    the rowid ranges of all metrics are reserved at once and all samples are
+    written with one multi-row INSERT in the same transaction (see
+    `repository.addMetricDataBatch`).
+
+    :param dataByMetricID: A dict mapping unique metric id to a sequence of
+      data samples; each data sample is a pair: (datetime.datetime, float)
+
+    :param modelSwapper: ModelSwapper object for sending data to models
+    :type modelSwapper: an instance of ModelSwapperInterface
+
+    :returns: ids of the metrics in dataByMetricID that don't exist; no data
+      was stored for those metrics
+    :rtype: set
+    """
+    dataByMetricID = dict((metricID, data)
+                          for metricID, data in dataByMetricID.iteritems()
+                          if data)
+    if not dataByMetricID:
+      self._log.warn("Empty input metric data batch")
+      return set()
+
+    @repository.retryOnTransientErrors
+    def storeDataWithRetries():
+      """
+      :returns: a two-tuple <storedMetrics, missingMetricIDs>;
+        storedMetrics: a sequence of three-tuples
+          <metricID, modelInputRows, metricRow> for metrics that were in a
+          state suitable for streaming; modelInputRows is a (possibly empty)
+          tuple of ModelInputRow objects corresponding to the samples that
+          were stored, ordered by rowid; metricRow has the metric's status and
+          datasource fields
+        missingMetricIDs: set of metric ids that don't exist
+      """
+      with repository.engineFactory(config).connect() as conn:
+        with conn.begin():
+          # Syncrhonize with adapter's monitorMetric
+          metricRows = repository.getMetricsWithUpdateLock(
+            conn,
+            dataByMetricID.keys(),
+            fields=[schema.metric.c.uid,
+                    schema.metric.c.status,
+                    schema.metric.c.last_rowid,
+                    schema.metric.c.datasource])
+
+          missingMetricIDs = (set(dataByMetricID) -
+                              set(row.uid for row in metricRows))
+
+          passingSamplesByMetricID = dict()
+          streamableMetricRows = []
+          for metricObj in metricRows:
+            if (metricObj.status != MetricStatus.UNMONITORED and
+                metricObj.status != MetricStatus.ACTIVE and
+                metricObj.status != MetricStatus.PENDING_DATA and
+                metricObj.status != MetricStatus.CREATE_PENDING):
+              self._log.error("Can't stream: metric=%s has unexpected "
+                              "status=%s", metricObj.uid, metricObj.status)
+              continue
+
+            streamableMetricRows.append(metricObj)
+            passingSamplesByMetricID[metricObj.uid] = self._scrubDataSamples(
+              dataByMetricID[metricObj.uid],
+              metricObj.uid,
+              conn,
+              metricObj.last_rowid)
+
+          storedRowsByMetricID = repository.addMetricDataBatch(
+            conn,
+            dict((metricID, tuple((value, ts) for (ts, value) in samples))
+                 for metricID, samples in passingSamplesByMetricID.iteritems()),
+            dict((metricObj.uid, metricObj.last_rowid)
+                 for metricObj in streamableMetricRows))
+
+      storedMetrics = []
+      for metricObj in streamableMetricRows:
+        rows = storedRowsByMetricID.get(metricObj.uid, ())
+        if rows:
+          # Update tail metric data timestamp cache for metrics stored by us
+          self._tailInputMetricDataTimestamps[metricObj.uid] = (
+            rows[-1]["timestamp"])
+
+        modelInputRows = tuple(
+          ModelInputRow(rowID=row["rowid"],
+                        data=(row["timestamp"], row["metric_value"],))
+          for row in rows)
+
+        storedMetrics.append((metricObj.uid, modelInputRows, metricObj))
+
+      return storedMetrics, missingMetricIDs
+
+
+    storedMetrics, missingMetricIDs = storeDataWithRetries()
+
+    # The rows are already stored, so a failure to forward one metric's rows
+    # mustn't prevent forwarding the rows of the remaining metrics
+    for metricID, modelInputRows, metricObj in storedMetrics:
+      try:
+        self._forwardStoredRows(modelInputRows=modelInputRows,
+                                metricID=metricID,
+                                datasource=metricObj.datasource,
+                                metricStatus=metricObj.status,
+                                modelSwapper=modelSwapper)
+      except Exception:  # Exception excludes KeyboardInterrupt from supervisor
+        self._log.exception("Error forwarding stored rows of metric=%s",
+                            metricID)
+
+    return missingMetricIDs
+
+
+  def _forwardStoredRows(self, modelInputRows, metricID, datasource,
+                         metricStatus, modelSwapper):
+    """ Stream newly-stored rows to the model associated with the metric if the
+    metric is monitored, or activate the model if the metric is in
+    PENDING_DATA state and there are now enough data samples.
+
+    :param modelInputRows: None if metric was in state not suitable for
+      streaming; otherwise a (possibly empty) tuple of ModelInputRow objects
+      corresponding to the samples that were stored; ordered by rowid
+    :param metricID: unique id of the HTM metric
+    :param datasource: metric's datasource
+    :param metricStatus: metric's status at the time the rows were stored
+    :param modelSwapper: ModelSwapper object for sending data to models
+    """
     if modelInputRows is None:
       # Metric was in state not suitable for streaming
       return
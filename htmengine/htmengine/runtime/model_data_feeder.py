@@ -56,7 +56,9 @@ def sendInputRowsToModel(modelId, inputRows, batchSize,
       submitStartTime = time.time()
 
     try:
-      batchID = modelSwapper.submitRequests(modelId, batch)
+      # Batches are pipelined and confirmed together below
+      batchID = modelSwapper.submitRequests(modelId, batch,
+                                            waitForConfirm=False)
     except model_swapper_interface.ModelNotFound as ex:
       # Likely a race-condition with the app layer's model deletion code path
       # TODO: unit-test
@@ -85,3 +87,14 @@ def sendInputRowsToModel(modelId, inputRows, batchSize,
           (("%sZ..%sZ" % (headTS.isoformat(), tailTS.isoformat()))
             if len(batch) > 1 else (headTS.isoformat() + "Z")),
           time.time() - submitStartTime)
+
+  try:
+    modelSwapper.waitForConfirms()
+  except model_swapper_interface.ModelNotFound as ex:
+    # Likely a race-condition with the app layer's model deletion code path
+    logger.warning("model=%s not found from waitForConfirms; "
+                   "race-condition with model deletion path? %r", modelId, ex)
+  except:
+    logger.exception("Error confirming batches submitted to model=%s; "
+                     "numRows=%d", modelId, len(inputRows))
+    raise
@@ -126,6 +126,60 @@ jsonEncode = partial(json.dumps, cls=_JSONEncoder, indent=2)
 
 
 
+def _iterencodeLazily(obj, encoder):
+  """ Generate JSON fragments of obj, encoding iterators (e.g., generators)
+  within dicts and iterators element by element as JSON arrays
+  """
+  if isinstance(obj, dict):
+    yield "{"
+    for i, (key, value) in enumerate(obj.iteritems()):
+      if i:
+        yield ", "
+      yield encoder.encode(key if isinstance(key, basestring) else str(key))
+      yield ": "
+      for fragment in _iterencodeLazily(value, encoder):
+        yield fragment
+    yield "}"
+  elif hasattr(obj, "next") and iter(obj) is obj:
+    yield "["
+    for i, item in enumerate(obj):
+      if i:
+        yield ", "
+      for fragment in _iterencodeLazily(item, encoder):
+        yield fragment
+    yield "]"
+  else:
+    yield encoder.encode(obj)
+
+
+
+def jsonEncodeChunks(obj, chunkSize=65536):
+  """ Serialize an object into JSON incrementally, for streaming a large
+  response. Unlike jsonEncode, iterators within obj (e.g., generators) are
+  consumed as they are encoded, so only about chunkSize characters of output
+  are held in memory at a time.
+
+  :param obj: object to serialize; same as for jsonEncode
+  :param int chunkSize: minimum number of characters per chunk, except for the
+    last one
+  :returns: generator of JSON string chunks that make up the serialized object
+  """
+  encoder = _JSONEncoder()
+  fragments = []
+  size = 0
+  for fragment in _iterencodeLazily(obj, encoder):
+    fragments.append(fragment)
+    size += len(fragment)
+    if size >= chunkSize:
+      yield "".join(fragments)
+      fragments = []
+      size = 0
+
+  if fragments:
+    yield "".join(fragments)
+
+
+
 def msgpack_pack(obj):
   """
   Serialize an Object using "msgpack".
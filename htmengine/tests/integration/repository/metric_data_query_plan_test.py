@@ -0,0 +1,177 @@
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2015, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+
+"""Query plan regression tests for reads of a metric's data in timestamp order;
+these must be served from uid_timestamp_idx without sorting the metric's rows.
+"""
+
+from datetime import datetime, timedelta
+import unittest
+import uuid
+
+from mock import Mock
+
+from nta.utils.logging_support_raw import LoggingSupport
+
+import htmengine
+from htmengine.test_utils import repository_test_utils
+import htmengine.repository
+from htmengine.repository import schema
+
+
+
+def setUpModule():
+  LoggingSupport.initTestApp()
+
+
+
+class MetricDataQueryPlanTestCase(unittest.TestCase):
+
+  # Rows per metric; enough for MySQL to pick plans as for a real table
+  _NUM_ROWS = 1000
+
+  # Number of most recent rows of each metric that have yet to be scored
+  _NUM_UNSCORED_ROWS = 10
+
+
+  def setUp(self):
+    tempRepository = repository_test_utils.HtmengineManagedTempRepository(
+      "query_plan")
+    tempRepository.start()
+    self.addCleanup(tempRepository.stop)
+
+    self.engine = htmengine.repository.engineFactory(
+      config=htmengine.APP_CONFIG)
+
+    self.start = datetime(2015, 11, 1)
+
+    self.metricIds = [uuid.uuid1().hex for _ in xrange(3)]
+
+    with self.engine.connect() as conn:
+      for metricId in self.metricIds:
+        htmengine.repository.addMetric(conn, uid=metricId)
+        htmengine.repository.addMetricData(
+          conn,
+          metricId=metricId,
+          data=[(float(i), self.start + timedelta(minutes=5 * i))
+                for i in xrange(self._NUM_ROWS)])
+
+        scoredRows = [
+          Mock(rowid=rowid,
+               raw_anomaly_score=0.5,
+               anomaly_score=0.25,
+               display_value=0)
+          for rowid in xrange(1, self._NUM_ROWS - self._NUM_UNSCORED_ROWS + 1)]
+
+        with conn.begin():
+          htmengine.repository.updateMetricDataScoresBulk(conn, metricId,
+                                                          scoredRows)
+
+      conn.execute("ANALYZE TABLE metric_data")
+
+
+  def _explainRepositoryQuery(self, queryFunction, *args, **kwargs):
+    """ Run a repository query function and EXPLAIN the select that it executes
+
+    :param queryFunction: repository function that takes a connection as its
+      first arg and executes a single select
+    :returns: the select's EXPLAIN rows
+    """
+    with self.engine.connect() as conn:
+      connWrap = Mock(wraps=conn)
+      queryFunction(connWrap, *args, **kwargs)
+
+      self.assertEqual(connWrap.execute.call_count, 1)
+      sel = connWrap.execute.call_args[0][0]
+
+      compiled = sel.compile(dialect=conn.dialect)
+      params = [compiled.params[name] for name in compiled.positiontup]
+
+      return conn.execute("EXPLAIN " + str(compiled), *params).fetchall()
+
+
+  def _assertReadsUidTimestampIndexInOrder(self, plan):
+    self.assertEqual(len(plan), 1)
+    self.assertEqual(plan[0]["key"], "uid_timestamp_idx")
+    self.assertNotIn("Using filesort", plan[0]["Extra"] or "")
+
+
+  def testGetMetricDataTimestampRange(self):
+    fromTimestamp = self.start + timedelta(days=1)
+    toTimestamp = self.start + timedelta(days=2)
+
+    plan = self._explainRepositoryQuery(
+      htmengine.repository.getMetricData,
+      metricId=self.metricIds[1],
+      fromTimestamp=fromTimestamp,
+      toTimestamp=toTimestamp,
+      sort=schema.metric_data.c.timestamp.asc())
+
+    self._assertReadsUidTimestampIndexInOrder(plan)
+    self.assertEqual(plan[0]["type"], "range")
+
+    with self.engine.connect() as conn:
+      rows = htmengine.repository.getMetricData(
+        conn,
+        metricId=self.metricIds[1],
+        fromTimestamp=fromTimestamp,
+        toTimestamp=toTimestamp,
+        sort=schema.metric_data.c.timestamp.asc()).fetchall()
+
+    self.assertEqual(len(rows), 24 * 12 + 1)
+    self.assertEqual(rows[0].timestamp, fromTimestamp)
+    self.assertEqual(rows[-1].timestamp, toTimestamp)
+
+
+  def testGetMetricDataTimestampDescendingWithScores(self):
+    # As read by the metric data API without a "from" timestamp
+    plan = self._explainRepositoryQuery(
+      htmengine.repository.getMetricData,
+      metricId=self.metricIds[1],
+      score=0.0,
+      sort=schema.metric_data.c.timestamp.desc())
+
+    self._assertReadsUidTimestampIndexInOrder(plan)
+
+
+  def testGetMetricDataWithRawAnomalyScoresTail(self):
+    plan = self._explainRepositoryQuery(
+      htmengine.repository.getMetricDataWithRawAnomalyScoresTail,
+      metricId=self.metricIds[1],
+      limit=50)
+
+    self._assertReadsUidTimestampIndexInOrder(plan)
+
+    with self.engine.connect() as conn:
+      rows = htmengine.repository.getMetricDataWithRawAnomalyScoresTail(
+        conn, metricId=self.metricIds[1], limit=50)
+
+    self.assertEqual(
+      [row.rowid for row in rows],
+      range(self._NUM_ROWS - self._NUM_UNSCORED_ROWS,
+            self._NUM_ROWS - self._NUM_UNSCORED_ROWS - 50,
+            -1))
+
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -22,6 +22,9 @@
 """Integration test for htmengine.runtime.metric_garbage_collector
 """
 
+# Suppress pylint warnings concerning access to protected member
+# pylint: disable=W0212
+
 from datetime import datetime, timedelta
 import unittest
 import uuid
@@ -33,6 +36,7 @@ from nta.utils.logging_support_raw import LoggingSupport
 import htmengine
 from htmengine.test_utils import repository_test_utils
 import htmengine.repository
+from htmengine.repository import metric_data_partitions
 from htmengine.runtime import metric_garbage_collector
 
 
@@ -118,3 +122,82 @@ class MetricGarbageCollectorTestCase(unittest.TestCase):
       self.assertItemsEqual(
         [(row["value"], row["timestamp"]) for row in youngRows],
         [(row.metric_value, row.timestamp) for row in remainingRows])  # pylint: disable=E1101
+
+
+  def testPurgeOldMetricDataPartitions(self):
+
+    gcThresholdDays = 90
+
+    now = datetime.utcnow().replace(microsecond=0)
+
+    uid1 = uuid.uuid1().hex
+
+    oldRows = [
+      dict(
+        value=1.0,
+        timestamp=now - timedelta(days=gcThresholdDays + 3),
+      ),
+
+      dict(
+        value=2.0,
+        timestamp=now - timedelta(days=gcThresholdDays + 5),
+      ),
+    ]
+
+    youngRows = [
+      dict(
+        value=3.0,
+        timestamp=now,
+      ),
+
+      dict(
+        value=4.0,
+        timestamp=now - timedelta(days=gcThresholdDays - 1),
+      ),
+    ]
+
+    allRows = oldRows + youngRows
+
+    # Use a temporary database
+    with repository_test_utils.HtmengineManagedTempRepository("metric_gc"):
+      engine = htmengine.repository.engineFactory(config=htmengine.APP_CONFIG)
+
+      # Partition metric_data daily, with older rows in p_start
+      with engine.connect() as conn:  # pylint: disable=E1101
+        metric_data_partitions.partitionMetricDataTable(
+          conn,
+          firstDay=(now - timedelta(days=gcThresholdDays + 4)).date(),
+          lastDay=now.date(),
+          partitionDays=1)
+
+      # Add the dummy metric rows
+      allData = [(row["value"], row["timestamp"]) for row in allRows]
+      with engine.connect() as conn:  # pylint: disable=E1101
+        htmengine.repository.addMetric(conn, uid=uid1)
+        htmengine.repository.addMetricData(conn, metricId=uid1, data=allData)
+
+      # Execute
+      metric_garbage_collector.purgeOldMetricDataRows(gcThresholdDays)
+
+      # Verify that only the old rows got purged
+      with engine.connect() as conn:  # pylint: disable=E1101
+        remainingRows = htmengine.repository.getMetricData(conn).fetchall()
+        partitions = metric_data_partitions.getMetricDataPartitions(conn)
+
+      self.assertItemsEqual(
+        [(row["value"], row["timestamp"]) for row in youngRows],
+        [(row.metric_value, row.timestamp) for row in remainingRows])  # pylint: disable=E1101
+
+      # Verify that expired partitions were dropped and partitions were added
+      # ahead
+      self.assertNotIn(metric_data_partitions.START_PARTITION,
+                       [p.name for p in partitions])
+      self.assertGreater(
+        partitions[0].lessThan,
+        (now - timedelta(days=gcThresholdDays + 1)).date())
+      self.assertGreater(
+        partitions[-2].lessThan,
+        (now + timedelta(
+          days=metric_garbage_collector._PARTITIONS_AHEAD_DAYS)).date())
+      self.assertEqual(partitions[-1].name,
+                       metric_data_partitions.FUTURE_PARTITION)
@@ -0,0 +1,75 @@
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2015, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+"""Add metric_display_value_rollup table
+
+Revision ID: 6558209db23e
+Revises: 1d2eddc43366
+Create Date: 2015-11-12 10:42:17.318215
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# Revision identifiers, used by Alembic. Do not change.
+revision = "6558209db23e"
+down_revision = "1d2eddc43366"
+
+
+
+def upgrade():
+  """Add the metric_display_value_rollup table and populate it from
+  metric_data for the time blocks of the 2, 24 and 192 hour anomaly periods
+  """
+  op.create_table(
+      "metric_display_value_rollup",
+      sa.Column("uid", sa.VARCHAR(length=40), nullable=False),
+      sa.Column("block_size_sec", sa.INTEGER(), autoincrement=False,
+                nullable=False),
+      sa.Column("time_block", sa.INTEGER(), autoincrement=False,
+                nullable=False),
+      sa.Column("max_display_value", sa.INTEGER(), autoincrement=False,
+                nullable=False),
+      sa.ForeignKeyConstraint(["uid"], [u"metric.uid"],
+                              name=u"metric_display_value_rollup_to_metric_fk",
+                              onupdate=u"CASCADE", ondelete=u"CASCADE"),
+      sa.PrimaryKeyConstraint("uid", "block_size_sec", "time_block")
+  )
+  op.create_index("block_size_time_block_idx", "metric_display_value_rollup",
+                  ["block_size_sec", "time_block"], unique=False)
+
+  for blockSize in (2 * 150, 24 * 150, 192 * 150):
+    op.execute(
+      "INSERT INTO metric_display_value_rollup "
+      "(uid, block_size_sec, time_block, max_display_value) "
+      "SELECT uid, %(blockSize)d, "
+      "       TIMESTAMPDIFF(SECOND, '1970-01-01 00:00:00', timestamp) "
+      "           DIV %(blockSize)d AS time_block, "
+      "       MAX(display_value) "
+      "FROM metric_data WHERE display_value IS NOT NULL "
+      "GROUP BY uid, time_block" % dict(blockSize=blockSize))
+
+
+
+def downgrade():
+  """Perform the downgrade."""
+  raise NotImplementedError("Rollback is not supported.")
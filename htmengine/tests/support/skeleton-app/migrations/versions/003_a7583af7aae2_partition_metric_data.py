@@ -0,0 +1,73 @@
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2015, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+"""Partition metric_data by week of timestamp
+
+Revision ID: a7583af7aae2
+Revises: 6558209db23e
+Create Date: 2015-11-16 09:12:40.527341
+"""
+
+from datetime import datetime, timedelta
+
+from alembic import op
+
+from htmengine.repository import metric_data_partitions
+
+
+# Revision identifiers, used by Alembic. Do not change.
+revision = 'a7583af7aae2'
+down_revision = '6558209db23e'
+
+
+# Weekly partitions cover this many days of existing metric data, which spans
+# the 90 days retained by metric-data-garbage-collector; older rows go to the
+# p_start partition
+_HISTORY_DAYS = 91
+
+# Partitions are created this many days ahead; the garbage collector adds
+# partitions of the same span ahead from then on
+_AHEAD_DAYS = 7
+
+# Number of days spanned by each partition. Lookups by (uid, rowid) without a
+# timestamp range can't be pruned and probe every partition, so the partitions
+# are kept few; weekly partitions purge expired data up to a week late
+_PARTITION_DAYS = 7
+
+
+
+def upgrade():
+  """ Range-partition metric_data by week of timestamp, so that old metric data
+  is purged by dropping partitions; see
+  htmengine.repository.metric_data_partitions
+  """
+  today = datetime.utcnow().date()
+
+  metric_data_partitions.partitionMetricDataTable(
+    op.get_bind(),
+    firstDay=today - timedelta(days=_HISTORY_DAYS),
+    lastDay=today + timedelta(days=_AHEAD_DAYS),
+    partitionDays=_PARTITION_DAYS)
+
+
+
+def downgrade():
+  raise NotImplementedError("Rollback is not supported.")
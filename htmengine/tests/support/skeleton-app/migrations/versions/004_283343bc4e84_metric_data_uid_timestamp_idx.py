@@ -0,0 +1,49 @@
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2015, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+"""Add uid_timestamp_idx to metric_data
+
+Revision ID: 283343bc4e84
+Revises: a7583af7aae2
+Create Date: 2015-11-18 14:05:51.602893
+"""
+
+from alembic import op
+
+
+# Revision identifiers, used by Alembic. Do not change.
+revision = '283343bc4e84'
+down_revision = 'a7583af7aae2'
+
+
+
+def upgrade():
+  """Add an index on metric_data for reading a metric's rows in timestamp
+  order, including raw_anomaly_score for skipping unscored rows
+  """
+  op.create_index("uid_timestamp_idx", "metric_data",
+                  ["uid", "timestamp", "raw_anomaly_score"], unique=False)
+
+
+
+def downgrade():
+  """Perform the downgrade."""
+  raise NotImplementedError("Rollback is not supported.")
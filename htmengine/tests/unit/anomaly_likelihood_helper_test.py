@@ -0,0 +1,311 @@
+#!/usr/bin/env python
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2015, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+"""
+Unit tests for htmengine.anomaly_likelihood_helper
+"""
+
+import copy
+from collections import namedtuple
+import datetime
+import random
+import unittest
+
+
+from mock import MagicMock, Mock, patch
+
+from nupic.algorithms import anomaly_likelihood as algorithms
+
+from htmengine import anomaly_likelihood_helper
+
+
+
+# Disable warning: Access to a protected member
+# pylint: disable=W0212
+
+
+
+class AnomalyLikelihoodBatchTestCase(unittest.TestCase):
+
+
+  def _createParams(self, windowSize, numHistoricalValues, mean, stdev,
+                    historicalLikelihoods=None):
+    historicalValues = [random.random() for _ in xrange(numHistoricalValues)]
+    params = {
+      "distribution": {"name": "normal", "mean": mean, "variance": stdev ** 2,
+                       "stdev": stdev},
+      "movingAverage": {"historicalValues": historicalValues,
+                        "total": sum(historicalValues),
+                        "windowSize": windowSize}
+    }
+
+    if historicalLikelihoods is not None:
+      params["historicalLikelihoods"] = historicalLikelihoods
+
+    return params
+
+
+  def _assertSameAsPerRowUpdates(self, scores, params):
+    batch = anomaly_likelihood_helper._AnomalyLikelihoodBatch(
+      scores, copy.deepcopy(params))
+
+    rowParams = copy.deepcopy(params)
+    for i, score in enumerate(scores):
+      (likelihood,), _, rowParams = algorithms.updateAnomalyLikelihoods(
+        ((datetime.datetime.utcnow(), 1.0, score),), rowParams)
+
+      self.assertEqual(batch.likelihoods[i], likelihood)
+
+      batchParams = batch.getParams(i + 1)
+      self.assertEqual(batchParams["movingAverage"],
+                       rowParams["movingAverage"])
+      self.assertEqual(batchParams["historicalLikelihoods"],
+                       rowParams["historicalLikelihoods"])
+      self.assertEqual(batchParams["distribution"], rowParams["distribution"])
+
+
+  def testSameResultsAsPerRowUpdates(self):
+    random.seed(42)
+
+    for windowSize in (1, 10, 30):
+      for numHistoricalValues in (0, windowSize // 2, windowSize):
+        scores = [random.choice((random.random(), random.random() ** 8, 0.0,
+                                 1.0))
+                  for _ in xrange(200)]
+        params = self._createParams(
+          windowSize, numHistoricalValues, mean=random.uniform(0.01, 0.5),
+          stdev=random.uniform(0.001, 0.2),
+          historicalLikelihoods=[0.5] * min(3, windowSize))
+
+        self._assertSameAsPerRowUpdates(scores, params)
+
+
+  def testSameResultsAsPerRowUpdatesWithFilteredLikelihoods(self):
+    # Runs of highly anomalous scores produce likelihoods in the red zone,
+    # which are filtered
+    random.seed(42)
+    scores = [1.0] * 20 + [0.0] * 20 + [1.0] * 20
+    params = self._createParams(windowSize=5, numHistoricalValues=5, mean=0.1,
+                                stdev=0.05, historicalLikelihoods=[1e-7])
+
+    self._assertSameAsPerRowUpdates(scores, params)
+
+    batch = anomaly_likelihood_helper._AnomalyLikelihoodBatch(scores, params)
+    self.assertIn(1.0 - 0.999, batch.likelihoods.tolist())
+
+
+  def testSameResultsAsPerRowUpdatesWithoutHistoricalLikelihoods(self):
+    random.seed(42)
+    scores = [random.random() for _ in xrange(50)]
+    params = self._createParams(windowSize=10, numHistoricalValues=3, mean=0.2,
+                                stdev=0.1)
+
+    self._assertSameAsPerRowUpdates(scores, params)
+
+
+  def testParamsAreNotModified(self):
+    params = self._createParams(windowSize=3, numHistoricalValues=3, mean=0.2,
+                                stdev=0.1, historicalLikelihoods=[0.5])
+    originalParams = copy.deepcopy(params)
+
+    batch = anomaly_likelihood_helper._AnomalyLikelihoodBatch(
+      [0.1, 0.9, 0.5, 0.3], params)
+    batch.getParams(4)
+
+    self.assertEqual(params, originalParams)
+
+
+  def testInvalidInputRaisesValueError(self):
+    params = self._createParams(windowSize=3, numHistoricalValues=0, mean=0.2,
+                                stdev=0.1)
+
+    with self.assertRaises(ValueError):
+      anomaly_likelihood_helper._AnomalyLikelihoodBatch([], params)
+
+    with self.assertRaises(ValueError):
+      anomaly_likelihood_helper._AnomalyLikelihoodBatch([0.5], {})
+
+
+
+
+_MetricDataRow = namedtuple("_MetricDataRow",
+                            "rowid timestamp metric_value raw_anomaly_score")
+
+
+
+def _createRows(firstRowID, numRows):
+  return [
+    _MetricDataRow(rowid=rowID,
+                   timestamp=(datetime.datetime(2015, 1, 1) +
+                              datetime.timedelta(minutes=5 * rowID)),
+                   metric_value=float(rowID),
+                   raw_anomaly_score=0.5)
+    for rowID in xrange(firstRowID, firstRowID + numRows)]
+
+
+
+class StatsSampleTailCacheTestCase(unittest.TestCase):
+
+
+  def _createCache(self, maxMetrics=10, maxSamples=1000,
+                   maxSamplesPerMetric=100):
+    cacheClass = anomaly_likelihood_helper._StatsSampleTailCache
+    return cacheClass(
+      maxMetrics=maxMetrics,
+      maxMemoryBytes=maxSamples * cacheClass._ESTIMATED_SAMPLE_SIZE_BYTES,
+      maxSamplesPerMetric=maxSamplesPerMetric)
+
+
+  def testGetTailOfContiguousRows(self):
+    cache = self._createCache()
+    rows = _createRows(1, 20)
+
+    self.assertIsNone(cache.getTail("m1", limit=10, nextRowID=21))
+
+    cache.setTail("m1", rows, isComplete=False)
+
+    self.assertEqual(cache.getTail("m1", limit=10, nextRowID=21), rows[-10:])
+    self.assertEqual(cache.getTail("m1", limit=20, nextRowID=21), rows)
+
+    # An incomplete tail can't satisfy a larger limit, and the miss drops it
+    self.assertIsNone(cache.getTail("m1", limit=21, nextRowID=21))
+    self.assertNotIn("m1", cache)
+
+    # A complete tail satisfies any limit
+    cache.setTail("m1", rows, isComplete=True)
+    self.assertEqual(cache.getTail("m1", limit=100, nextRowID=21), rows)
+
+
+  def testGetTailOfNonContiguousRowsMisses(self):
+    cache = self._createCache()
+    cache.setTail("m1", _createRows(1, 20), isComplete=True)
+
+    # E.g., redelivery of an earlier result batch
+    self.assertIsNone(cache.getTail("m1", limit=10, nextRowID=15))
+    self.assertNotIn("m1", cache)
+    self.assertEqual(cache.numSamples, 0)
+
+
+  def testExtendTail(self):
+    cache = self._createCache(maxSamplesPerMetric=30)
+    rows = _createRows(1, 40)
+
+    # Extending a metric that isn't cached is a no-op
+    cache.extendTail("m1", rows[:20])
+    self.assertNotIn("m1", cache)
+
+    cache.setTail("m1", rows[:20], isComplete=True)
+    cache.extendTail("m1", rows[20:])
+
+    # The ring buffer retains the most recent samples
+    self.assertEqual(cache.getTail("m1", limit=30, nextRowID=41), rows[10:])
+    self.assertEqual(cache.numSamples, 30)
+
+    # Non-contiguous rows drop the tail
+    cache.extendTail("m1", _createRows(50, 5))
+    self.assertNotIn("m1", cache)
+    self.assertEqual(cache.numSamples, 0)
+
+
+  def testEmptyTailIsExtendedButNotReturned(self):
+    cache = self._createCache()
+    cache.setTail("m1", [], isComplete=True)
+
+    rows = _createRows(1, 5)
+    cache.extendTail("m1", rows)
+
+    self.assertEqual(cache.getTail("m1", limit=10, nextRowID=6), rows)
+
+
+  def testEvictionOfLeastRecentlyUsedMetrics(self):
+    cache = self._createCache(maxMetrics=2, maxSamples=25)
+
+    cache.setTail("m1", _createRows(1, 10), isComplete=True)
+    cache.setTail("m2", _createRows(1, 10), isComplete=True)
+
+    # Use m1, so m2 becomes least-recently-used
+    self.assertIsNotNone(cache.getTail("m1", limit=10, nextRowID=11))
+
+    cache.setTail("m3", _createRows(1, 10), isComplete=True)
+    self.assertEqual(len(cache), 2)
+    self.assertNotIn("m2", cache)
+
+    # Exceed the memory bound
+    cache.extendTail("m3", _createRows(11, 10))
+    self.assertEqual(len(cache), 1)
+    self.assertIn("m3", cache)
+    self.assertEqual(cache.numSamples, 20)
+
+
+
+class AnomalyLikelihoodHelperSampleCacheTestCase(unittest.TestCase):
+
+
+  def _createHelper(self):
+    configValues = {
+      "statistics_refresh_rate": 10,
+      "statistics_min_sample_size": 10,
+      "statistics_sample_size": 30,
+      "sample_cache_max_metrics": 10,
+      "sample_cache_max_mb": 1
+    }
+    config = Mock(spec_set=["loadConfig", "getint"])
+    config.getint.side_effect = lambda section, option: configValues[option]
+
+    return anomaly_likelihood_helper.AnomalyLikelihoodHelper(Mock(), config)
+
+
+  @patch.object(anomaly_likelihood_helper.repository,
+                "getMetricDataWithRawAnomalyScoresTail", autospec=True)
+  def testTailIsReadFromDatabaseOnlyOnCacheMiss(self, getTailMock):
+    helper = self._createHelper()
+    engineMock = MagicMock()
+
+    rows = _createRows(1, 50)
+    getTailMock.return_value = list(reversed(rows[-30:]))
+
+    # Cache miss fills the cache with statistics_sample_size rows
+    tail = helper._tailMetricDataWithRawAnomalyScoresIter(
+      engineMock, "m1", limit=20, nextRowID=51)
+    self.assertEqual(list(tail), rows[-20:])
+    self.assertEqual(getTailMock.call_count, 1)
+    self.assertEqual(getTailMock.call_args[1]["limit"], 30)
+
+    # The next batch is served from the cache once its rows were saved
+    newRows = _createRows(51, 5)
+    helper.cacheScoredMetricData("m1", newRows)
+
+    tail = helper._tailMetricDataWithRawAnomalyScoresIter(
+      engineMock, "m1", limit=30, nextRowID=56)
+    self.assertEqual(list(tail), rows[-25:] + newRows)
+    self.assertEqual(getTailMock.call_count, 1)
+
+    # Redelivery of the batch misses the cache
+    getTailMock.return_value = list(reversed(rows[-25:] + newRows))
+    helper._tailMetricDataWithRawAnomalyScoresIter(
+      engineMock, "m1", limit=30, nextRowID=51)
+    self.assertEqual(getTailMock.call_count, 2)
+
+
+
+if __name__ == "__main__":
+  unittest.main()
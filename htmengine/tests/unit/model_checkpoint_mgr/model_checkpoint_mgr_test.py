@@ -20,6 +20,7 @@
 # http://numenta.org/licenses/
 # ----------------------------------------------------------------------
 
+import os
 import uuid
 
 import unittest
@@ -327,6 +328,43 @@ class TestModelCheckpointMgr(unittest.TestCase):
                      "attributes3")
 
 
+  def testBeginSaveAndCompleteSave(self):
+    """ Test saving a checkpoint in two phases via beginSave and completeSave
+    """
+    checkpointMgr = ModelCheckpointMgr()
+
+    modelID = uuid.uuid1().hex
+
+    checkpointMgr.define(modelID, definition=dict(a=1, b=2))
+
+    model1 = ModelFactory.create(self._getModelParams("variant1"))
+    checkpointMgr.save(modelID, model1, attributes="attributes1")
+
+    # The pending checkpoint doesn't replace the existing one until it's
+    # completed
+    model2 = ModelFactory.create(self._getModelParams("variant2"))
+    pendingCheckpoint = checkpointMgr.beginSave(modelID, model2,
+                                                attributes="attributes2")
+    self.assertEqual(checkpointMgr.loadCheckpointAttributes(modelID),
+                     "attributes1")
+
+    checkpointMgr.completeSave(pendingCheckpoint)
+    model = checkpointMgr.load(modelID)
+    self.assertEqual(str(model.getFieldInfo()), str(model2.getFieldInfo()))
+    self.assertEqual(checkpointMgr.loadCheckpointAttributes(modelID),
+                     "attributes2")
+
+    # A failure to serialize the model doesn't leave anything behind in the
+    # scratch directory
+    scratchContents = os.listdir(checkpointMgr._scratchDir)
+    with self.assertRaises(AttributeError):
+      checkpointMgr.beginSave(modelID, "InvalidModel", attributes="attributes3")
+    self.assertEqual(os.listdir(checkpointMgr._scratchDir), scratchContents)
+
+    self.assertEqual(checkpointMgr.loadCheckpointAttributes(modelID),
+                     "attributes2")
+
+
   def testUpdateCheckpointAttributesNoModelEntry(self):
     """ When a model entry doesn't exist, calling  updateCheckpointAttributes
     should raise ModelNotFound
@@ -382,6 +420,74 @@ class TestModelCheckpointMgr(unittest.TestCase):
                      newAttributes)
 
 
+  def testCheckpointLog(self):
+    """ Test appendCheckpointLog and loadCheckpointLog """
+    checkpointMgr = ModelCheckpointMgr()
+
+    modelID = uuid.uuid1().hex
+
+    # Calling appendCheckpointLog when the model entry doesn't exist should
+    # raise ModelNotFound
+    with self.assertRaises(ModelNotFound):
+      checkpointMgr.appendCheckpointLog(modelID, [1, 2], 0)
+
+    # Save its definition and checkpoint
+    checkpointMgr.define(modelID, definition=dict(a=1, b=2))
+    model = ModelFactory.create(self._getModelParams("variant1"))
+    checkpointMgr.save(modelID, model, attributes="attributes1")
+
+    # The log of a new checkpoint is empty
+    self.assertEqual(list(checkpointMgr.loadCheckpointLog(modelID, 0)), [])
+
+    logSize1 = checkpointMgr.appendCheckpointLog(modelID, [1, "two"], 0)
+    self.assertGreater(logSize1, 0)
+    logSize2 = checkpointMgr.appendCheckpointLog(modelID, [[3.0]], logSize1)
+    self.assertGreater(logSize2, logSize1)
+
+    self.assertEqual(list(checkpointMgr.loadCheckpointLog(modelID, logSize2)),
+                     [1, "two", [3.0]])
+
+    # Only the valid content is loaded
+    self.assertEqual(list(checkpointMgr.loadCheckpointLog(modelID, logSize1)),
+                     [1, "two"])
+
+    # Appending after the valid content overwrites whatever follows it
+    logSize3 = checkpointMgr.appendCheckpointLog(modelID, [4], logSize1)
+    self.assertEqual(list(checkpointMgr.loadCheckpointLog(modelID, logSize3)),
+                     [1, "two", 4])
+
+    # A new checkpoint starts out with an empty log
+    checkpointMgr.save(modelID, model, attributes="attributes2")
+    logSize4 = checkpointMgr.appendCheckpointLog(modelID, [5], 0)
+    self.assertEqual(list(checkpointMgr.loadCheckpointLog(modelID, logSize4)),
+                     [5])
+
+
+  def testGetCheckpointSize(self):
+    """ Test getCheckpointSize """
+    checkpointMgr = ModelCheckpointMgr()
+
+    modelID = uuid.uuid1().hex
+
+    # Calling getCheckpointSize when the model entry doesn't exist should raise
+    # ModelNotFound
+    with self.assertRaises(ModelNotFound):
+      checkpointMgr.getCheckpointSize(modelID)
+
+    # Save its definition
+    checkpointMgr.define(modelID, definition=dict(a=1, b=2))
+
+    # Model entry exists, but a checkpoint hasn't been saved yet
+    with self.assertRaises(ModelNotFound):
+      checkpointMgr.getCheckpointSize(modelID)
+
+    # Save the checkpoint
+    model = ModelFactory.create(self._getModelParams("variant1"))
+    checkpointMgr.save(modelID, model, attributes="attributes1")
+
+    self.assertGreater(checkpointMgr.getCheckpointSize(modelID), 0)
+
+
   def testCloneModelFromNonExistentSourceRaisesModelNotFound(self):
     checkpointMgr = ModelCheckpointMgr()
 
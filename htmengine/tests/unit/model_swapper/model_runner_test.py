@@ -27,6 +27,7 @@ Unit tests for Model Swapper's ModelRunner class
 import base64
 import cPickle
 import datetime
+from StringIO import StringIO
 import logging
 import os
 import select
@@ -34,7 +35,7 @@ import threading
 import unittest
 
 
-from mock import Mock, patch
+from mock import MagicMock, Mock, patch
 
 
 from nupic.data.fieldmeta import FieldMetaInfo
@@ -85,8 +86,12 @@ class _FakeConsumer(object):
     return self
 
   def __exit__(self, *args, **kwargs):
+    self.close()
     return False
 
+  def close(self):
+    pass
+
   def __iter__(self):
     for value in self._requests:
       yield value
@@ -227,7 +232,8 @@ class TestModelRunner(unittest.TestCase):
     ]
 
     swapperMock.submitResults.assert_called_once_with(
-      modelID=modelID, results=expectedResults)
+      modelID=modelID, results=expectedResults, waitForConfirm=False)
+    swapperMock.waitForConfirms.assert_called_once_with()
 
 
   def testDeleteModelThatDoesNotExist(
@@ -721,7 +727,8 @@ class TestModelRunner(unittest.TestCase):
     ]
 
     swapperMock.submitResults.assert_called_once_with(
-      modelID=modelID, results=expectedResults)
+      modelID=modelID, results=expectedResults, waitForConfirm=False)
+    swapperMock.waitForConfirms.assert_called_once_with()
 
 
   def testLoadFromFullAndSaveIncremental(
@@ -750,6 +757,7 @@ class TestModelRunner(unittest.TestCase):
     checkpointMgrInstanceMock.loadModelDefinition.return_value = (
       dict(inputSchema=inputRecordSchema))
     checkpointMgrInstanceMock.load.return_value = modelInstanceMock
+    checkpointMgrInstanceMock.appendCheckpointLog.return_value = 1234
 
     # Prepare input requests for ModelRunner
     requests = [
@@ -784,17 +792,20 @@ class TestModelRunner(unittest.TestCase):
     # Verify loading of model
     checkpointMgrInstanceMock.load.assert_called_once_with(modelID)
 
+    # Nothing to replay from the checkpoint log
+    self.assertEqual(checkpointMgrInstanceMock.loadCheckpointLog.call_count, 0)
+
     # Verify expected saving of model
     self.assertEqual(checkpointMgrInstanceMock.save.call_count, 0)
 
+    checkpointMgrInstanceMock.appendCheckpointLog.assert_called_once_with(
+      modelID, [row.data for row in requests[0].objects], 0)
+
     expectedCheckpointAttributes = {
       model_runner._ModelArchiver._BATCH_IDS_CHECKPOINT_ATTR_NAME:
         [requests[0].batchID],
-      model_runner._ModelArchiver._INPUT_SAMPLES_SINCE_CHECKPOINT_ATTR_NAME:
-        base64.standard_b64encode(cPickle.dumps(
-          [row.data for row in requests[0].objects],
-          cPickle.HIGHEST_PROTOCOL
-        ))
+      model_runner._ModelArchiver._INPUT_SAMPLES_LOG_SIZE_ATTR_NAME: 1234,
+      model_runner._ModelArchiver._NUM_INPUT_SAMPLES_ATTR_NAME: 2
       }
     checkpointMgrInstanceMock.updateCheckpointAttributes. \
       assert_called_once_with(modelID, expectedCheckpointAttributes)
@@ -812,7 +823,8 @@ class TestModelRunner(unittest.TestCase):
     ]
 
     swapperMock.submitResults.assert_called_once_with(
-      modelID=modelID, results=expectedResults)
+      modelID=modelID, results=expectedResults, waitForConfirm=False)
+    swapperMock.waitForConfirms.assert_called_once_with()
 
 
   def testLoadFromFullAndSaveFull(
@@ -908,15 +920,138 @@ class TestModelRunner(unittest.TestCase):
     ]
 
     swapperMock.submitResults.assert_called_once_with(
-      modelID=modelID, results=expectedResults)
+      modelID=modelID, results=expectedResults, waitForConfirm=False)
+    swapperMock.waitForConfirms.assert_called_once_with()
 
 
   def testLoadFromIncrementalAndSaveIncremental(
       self,
       modelCheckpointMgrClassMock,
       modelSwapperInterfaceClassMock):
-    # Test loading from incremental checkpoint and saving via incremental
-    # checkpoint; also verify the inference path.
+    # Test loading from incremental checkpoint with input samples in the
+    # checkpoint log and saving via incremental checkpoint, which appends the new
+    # input samples to the log; also verify the inference path.
+    modelID = "abc"
+
+    inputRecordSchema = [FieldMetaInfo("c1", "float", "")]
+    # 2 for catch-up from data samples in checkpoint
+    # plus 2 more from new input rows
+    anomalyScore1 = 1.111111
+    anomalyScore2 = 2.222222
+    anomalyScore3 = 3.333333
+    anomalyScore4 = 4.444444
+
+    modelInstanceMock = Mock(
+      run=Mock(
+        side_effect=[
+          # 2 results for catch-up from data samples in checkpoint
+          # plus 2 more from new input rows
+          Mock(inferences=dict(anomalyScore=anomalyScore1)),
+          Mock(inferences=dict(anomalyScore=anomalyScore2)),
+          Mock(inferences=dict(anomalyScore=anomalyScore3)),
+          Mock(inferences=dict(anomalyScore=anomalyScore4))
+        ]
+      )
+    )
+
+    checkpointMgrInstanceMock = modelCheckpointMgrClassMock.return_value
+    initialIncrementalSamples = [
+      [datetime.datetime.utcnow(), -1.0],
+      [datetime.datetime.utcnow(), -2.0]
+    ]
+    checkpointMgrInstanceMock.loadCheckpointAttributes. \
+      return_value = (
+        {
+          model_runner._ModelArchiver._BATCH_IDS_CHECKPOINT_ATTR_NAME:
+            ["1", "2", "3"],
+          model_runner._ModelArchiver._INPUT_SAMPLES_LOG_SIZE_ATTR_NAME: 1000,
+          model_runner._ModelArchiver._NUM_INPUT_SAMPLES_ATTR_NAME:
+            len(initialIncrementalSamples)
+        }
+      )
+    checkpointMgrInstanceMock.loadModelDefinition.return_value = (
+      dict(inputSchema=inputRecordSchema))
+    checkpointMgrInstanceMock.load.return_value = modelInstanceMock
+    checkpointMgrInstanceMock.loadCheckpointLog.return_value = iter(
+      initialIncrementalSamples)
+    checkpointMgrInstanceMock.appendCheckpointLog.return_value = 2000
+
+    # Prepare input requests for ModelRunner
+    requests = [
+      _ConsumedRequestBatch(
+        batchID="foobar",
+        ack=Mock(),
+        objects=[
+          ModelInputRow(rowID=1, data=[datetime.datetime.utcnow(), 1.0]),
+          ModelInputRow(rowID=2, data=[datetime.datetime.utcnow(), 2.0])])
+    ]
+
+    swapperMock = modelSwapperInterfaceClassMock.return_value
+    swapperMock.consumeRequests.return_value = _FakeConsumer(requests)
+
+    mr = model_runner.ModelRunner(modelID=modelID)
+
+    runnerThread = threading.Thread(target=mr.run)
+    runnerThread.setDaemon(True)
+    runnerThread.start()
+
+    # It should stop almost immediately after mock-processing the two requests
+    runnerThread.join(timeout=5)
+    self.assertFalse(runnerThread.isAlive())
+
+    mr.close()
+    swapperMock.close.assert_called_once_with()
+
+    # Verify loading of "inputSchema" metadata
+    checkpointMgrInstanceMock.loadModelDefinition.assert_called_once_with(
+      modelID)
+
+    # Verify loading of model
+    checkpointMgrInstanceMock.load.assert_called_once_with(modelID)
+
+    # Verify expected saving of model
+    self.assertEqual(checkpointMgrInstanceMock.save.call_count, 0)
+
+    # Only the new input samples are appended to the checkpoint log
+    checkpointMgrInstanceMock.loadCheckpointLog.assert_called_once_with(
+      modelID, 1000)
+    checkpointMgrInstanceMock.appendCheckpointLog.assert_called_once_with(
+      modelID, [row.data for row in requests[0].objects], 1000)
+
+    expectedCheckpointAttributes = {
+      model_runner._ModelArchiver._BATCH_IDS_CHECKPOINT_ATTR_NAME:
+        [requests[0].batchID],
+      model_runner._ModelArchiver._INPUT_SAMPLES_LOG_SIZE_ATTR_NAME: 2000,
+      model_runner._ModelArchiver._NUM_INPUT_SAMPLES_ATTR_NAME: 4
+      }
+    checkpointMgrInstanceMock.updateCheckpointAttributes. \
+      assert_called_once_with(modelID, expectedCheckpointAttributes)
+
+    # Verify number of samples passed to model
+    self.assertEqual(modelInstanceMock.run.call_count,
+                     len(initialIncrementalSamples) + len(requests[0].objects))
+
+    # Verify emitted results
+    requestObjects = requests[0].objects
+    expectedResults = [
+      ModelInferenceResult(
+        rowID=requestObjects[0].rowID, status=0, anomalyScore=anomalyScore3),
+      ModelInferenceResult(
+        rowID=requestObjects[1].rowID, status=0, anomalyScore=anomalyScore4),
+    ]
+
+    swapperMock.submitResults.assert_called_once_with(
+      modelID=modelID, results=expectedResults, waitForConfirm=False)
+    swapperMock.waitForConfirms.assert_called_once_with()
+
+
+  def testLoadFromLegacyIncrementalAndSaveIncremental(
+      self,
+      modelCheckpointMgrClassMock,
+      modelSwapperInterfaceClassMock):
+    # Test loading from incremental checkpoint with input samples in the legacy
+    # checkpoint attribute and saving via incremental checkpoint, which moves
+    # them to the checkpoint log; also verify the inference path.
     modelID = "abc"
 
     inputRecordSchema = [FieldMetaInfo("c1", "float", "")]
@@ -960,6 +1095,8 @@ class TestModelRunner(unittest.TestCase):
     checkpointMgrInstanceMock.loadModelDefinition.return_value = (
       dict(inputSchema=inputRecordSchema))
     checkpointMgrInstanceMock.load.return_value = modelInstanceMock
+    checkpointMgrInstanceMock.loadCheckpointLog.return_value = iter(())
+    checkpointMgrInstanceMock.appendCheckpointLog.return_value = 1234
 
     # Prepare input requests for ModelRunner
     requests = [
@@ -997,14 +1134,16 @@ class TestModelRunner(unittest.TestCase):
     # Verify expected saving of model
     self.assertEqual(checkpointMgrInstanceMock.save.call_count, 0)
 
+    checkpointMgrInstanceMock.appendCheckpointLog.assert_called_once_with(
+      modelID,
+      initialIncrementalSamples + [row.data for row in requests[0].objects],
+      0)
+
     expectedCheckpointAttributes = {
       model_runner._ModelArchiver._BATCH_IDS_CHECKPOINT_ATTR_NAME:
         [requests[0].batchID],
-      model_runner._ModelArchiver._INPUT_SAMPLES_SINCE_CHECKPOINT_ATTR_NAME:
-        base64.standard_b64encode(cPickle.dumps(
-          initialIncrementalSamples + [row.data for row in requests[0].objects],
-          cPickle.HIGHEST_PROTOCOL
-        ))
+      model_runner._ModelArchiver._INPUT_SAMPLES_LOG_SIZE_ATTR_NAME: 1234,
+      model_runner._ModelArchiver._NUM_INPUT_SAMPLES_ATTR_NAME: 4
       }
     checkpointMgrInstanceMock.updateCheckpointAttributes. \
       assert_called_once_with(modelID, expectedCheckpointAttributes)
@@ -1023,7 +1162,8 @@ class TestModelRunner(unittest.TestCase):
     ]
 
     swapperMock.submitResults.assert_called_once_with(
-      modelID=modelID, results=expectedResults)
+      modelID=modelID, results=expectedResults, waitForConfirm=False)
+    swapperMock.waitForConfirms.assert_called_once_with()
 
 
   def testLoadFromIncrementalAndSaveFull(
@@ -1132,7 +1272,8 @@ class TestModelRunner(unittest.TestCase):
     ]
 
     swapperMock.submitResults.assert_called_once_with(
-      modelID=modelID, results=expectedResults)
+      modelID=modelID, results=expectedResults, waitForConfirm=False)
+    swapperMock.waitForConfirms.assert_called_once_with()
 
 
   @patch.object(
@@ -1218,6 +1359,105 @@ class TestModelRunner(unittest.TestCase):
       self.assertEqual(swapperMock.submitResults.call_count, len(requests))
 
 
+  @patch.object(
+    model_runner, "ModelFactory", autospec=True,
+    create=Mock(spec_set=model_runner.ModelFactory.create))
+  @patch.object(select, "select", autospec=True, return_value=((), (), ()))
+  def testBackgroundFullCheckpoint(
+      self, selectMock, modelFactoryClassMock, modelCheckpointMgrClassMock,
+      modelSwapperInterfaceClassMock):
+    # Verify that with background_full_checkpoints, the full checkpoint is
+    # completed via beginSave/completeSave and that the request batches of its
+    # run are acked only after the checkpoint is completed
+
+    modelCheckpointMgrClassMock.return_value.loadCheckpointAttributes. \
+      side_effect = model_checkpoint_mgr.ModelNotFound
+
+    requestsPerCheckpoint = 10
+    with ConfigAttributePatch(
+        modelSwapperConfig.CONFIG_NAME,
+        modelSwapperConfig.baseConfigDir,
+        (("model_runner", "target_requests_per_checkpoint",
+          str(requestsPerCheckpoint)),
+         ("model_runner", "background_full_checkpoints", "true"))):
+      modelID = "abc"
+      inputRecordSchema = [FieldMetaInfo("c1", "float", "")]
+      dummyModelParams = dict(modelConfig="a", inferenceArgs="b")
+
+      # Record the order of checkpoint completion and acks of runs; NOTE:
+      # _FakeConsumer replays all requests in each run, so the individual acks
+      # of duplicate batches aren't recorded
+      events = []
+
+      # Configure ModelCheckpointMgr mock
+      checkpointMgrInstanceMock = modelCheckpointMgrClassMock.return_value
+      checkpointMgrInstanceMock.loadModelDefinition.return_value = dict(
+        inputSchema=inputRecordSchema, modelParams=dummyModelParams)
+      checkpointMgrInstanceMock.load.side_effect = (
+        model_checkpoint_mgr.ModelNotFound)
+      checkpointMgrInstanceMock.appendCheckpointLog.return_value = 100
+      checkpointMgrInstanceMock.completeSave.side_effect = (
+        lambda pendingCheckpoint: events.append("completeSave"))
+
+      # Configure ModelFactory mock
+      modelInstanceMock = Mock(run=Mock(
+        return_value=Mock(inferences=dict(anomalyScore=1.1))))
+
+      modelFactoryClassMock.create.return_value = modelInstanceMock
+
+      # Prepare input requests for ModelRunner
+      requests = [
+        _ConsumedRequestBatch(
+          batchID="foobar_%s" % (i,),
+          ack=Mock(side_effect=lambda multiple=False, i=i: (
+            events.append("ack_%s" % (i,)) if multiple else None)),
+          objects=[ModelInputRow(rowID=i,
+                                 data=[datetime.datetime.utcnow(), 1.0])])
+        for i in xrange(requestsPerCheckpoint + requestsPerCheckpoint // 2)
+      ]
+
+      swapperMock = modelSwapperInterfaceClassMock.return_value
+      swapperMock.consumeRequests.return_value = _FakeConsumer(requests)
+
+      mr = model_runner.ModelRunner(modelID=modelID)
+
+      runnerThread = threading.Thread(target=mr.run)
+      runnerThread.setDaemon(True)
+      runnerThread.start()
+
+      # It should stop almost immediately after mock-processing all requests
+      runnerThread.join(timeout=5)
+      self.assertFalse(runnerThread.isAlive())
+
+      mr.close()
+
+      # Verify that the full checkpoint was completed in the background
+      self.assertEqual(checkpointMgrInstanceMock.save.call_count, 0)
+      self.assertEqual(checkpointMgrInstanceMock.beginSave.call_count, 1)
+      _, kwargs = checkpointMgrInstanceMock.beginSave.call_args
+      self.assertEqual(kwargs["modelID"], modelID)
+      self.assertIs(kwargs["model"], modelInstanceMock)
+      self.assertItemsEqual(
+        kwargs["attributes"][
+          model_runner._ModelArchiver._BATCH_IDS_CHECKPOINT_ATTR_NAME],
+        [request.batchID for request in requests[:requestsPerCheckpoint]])
+      checkpointMgrInstanceMock.completeSave.assert_called_once_with(
+        checkpointMgrInstanceMock.beginSave.return_value)
+
+      # The remaining requests were saved via incremental checkpoint
+      self.assertEqual(
+        checkpointMgrInstanceMock.updateCheckpointAttributes.call_count, 1)
+
+      # Verify that the first run's requests were acked only after the
+      # checkpoint was completed
+      lastRequestIndex = len(requests) - 1
+      self.assertEqual(
+        events,
+        ["completeSave",
+         "ack_%s" % (requestsPerCheckpoint - 1,),
+         "ack_%s" % (lastRequestIndex,)])
+
+
   @patch.object(
     model_runner, "ModelFactory", autospec=True,
     create=Mock(spec_set=model_runner.ModelFactory.create))
@@ -1448,5 +1688,116 @@ class TestModelRunner(unittest.TestCase):
 
 
 
+class TestResidentModels(unittest.TestCase):
+  """ Unit tests for running models in a resident ModelRunner process """
+
+
+  def testResidentModelCacheEvictsLeastRecentlyUsed(self):
+    cache = model_runner._ResidentModelCache(memoryBudget=100)
+
+    archivers = dict((modelID, Mock(name=modelID))
+                     for modelID in ("a", "b", "c", "d"))
+
+    cache.add("a", archivers["a"], 40)
+    cache.add("b", archivers["b"], 40)
+
+    # Using "a" makes "b" the least-recently used model
+    self.assertIs(cache.pop("a"), archivers["a"])
+    cache.add("a", archivers["a"], 40)
+
+    # Exceeding the budget evicts "b"
+    cache.add("c", archivers["c"], 30)
+    self.assertNotIn("b", cache)
+    self.assertIn("a", cache)
+    self.assertIn("c", cache)
+    self.assertEqual(len(cache), 2)
+
+    self.assertIsNone(cache.pop("b"))
+
+    # A model that exceeds the budget by itself evicts everything
+    cache.add("d", archivers["d"], 101)
+    self.assertEqual(len(cache), 0)
+
+
+  @patch.object(model_runner, "ModelRunner", autospec=True)
+  def testRunResidentModels(self, modelRunnerClassMock):
+    archivers = dict()
+
+    def createModelRunner(modelID, archiver):
+      if archiver is None:
+        archiver = Mock(spec_set=model_runner._ModelArchiver)
+        archiver.checkpointMgr.getCheckpointSize.return_value = 10
+        archivers.setdefault(modelID, []).append(archiver)
+
+      runner = MagicMock(archiver=archiver)
+      runner.__enter__.return_value = runner
+      runner.__exit__.return_value = False
+      return runner
+
+    modelRunnerClassMock.side_effect = createModelRunner
+
+    # Run "abc" twice, "def" once; the empty line is a belated preemption
+    # request that must be ignored
+    readFD, writeFD = os.pipe()
+    try:
+      with os.fdopen(writeFD, "w") as controlFile:
+        controlFile.write("abc\n\nabc\ndef\n")
+
+      statusFile = StringIO()
+      model_runner.runResidentModels(controlFD=readFD, statusFile=statusFile,
+                                     memoryBudget=1000)
+    finally:
+      os.close(readFD)
+
+    self.assertEqual(statusFile.getvalue(), "0\n0\n0\n")
+
+    # The second run of "abc" reused the model loaded by the first one
+    self.assertEqual(len(archivers["abc"]), 1)
+    self.assertEqual(len(archivers["def"]), 1)
+    self.assertEqual(
+      modelRunnerClassMock.call_args_list[1][1],
+      dict(modelID="abc", archiver=archivers["abc"][0]))
+    archivers["abc"][0].isCheckpointCurrent.assert_called_once_with()
+
+
+  @patch.object(model_runner, "ModelRunner", autospec=True)
+  def testRunResidentModelsWithStaleOrFailedModels(self, modelRunnerClassMock):
+    staleArchiver = Mock(spec_set=model_runner._ModelArchiver)
+    staleArchiver.checkpointMgr.getCheckpointSize.return_value = 10
+    # The model ran elsewhere since we last ran it
+    staleArchiver.isCheckpointCurrent.return_value = False
+
+    def createModelRunner(modelID, archiver):
+      if modelID == "bad":
+        raise Exception("From Generic Exception Error Test")
+
+      runner = MagicMock(archiver=archiver or staleArchiver)
+      runner.__enter__.return_value = runner
+      runner.__exit__.return_value = False
+      return runner
+
+    modelRunnerClassMock.side_effect = createModelRunner
+
+    readFD, writeFD = os.pipe()
+    try:
+      with os.fdopen(writeFD, "w") as controlFile:
+        controlFile.write("abc\nbad\nabc\n")
+
+      statusFile = StringIO()
+      model_runner.runResidentModels(controlFD=readFD, statusFile=statusFile,
+                                     memoryBudget=1000)
+    finally:
+      os.close(readFD)
+
+    # The failed model reports non-zero exit status
+    self.assertEqual(statusFile.getvalue(), "0\n1\n0\n")
+
+    # The stale model was loaded again from its checkpoint
+    self.assertEqual(
+      modelRunnerClassMock.call_args_list[2][1],
+      dict(modelID="abc", archiver=None))
+
+
+
 if __name__ == '__main__':
   unittest.main()
@@ -28,6 +28,7 @@ import copy
 import datetime
 import json
 import os
+import threading
 import unittest
 import uuid
 
@@ -462,6 +463,67 @@ class BatchPackagerTestCase(unittest.TestCase):
     self.assertEqual(requestBatch[2].rowID, inputBatch[2].rowID)
 
 
+  def testBinaryMarshalUnmarshal(self):
+    timestamp = datetime.datetime(2015, 10, 21, 16, 29, 3, 123456)
+    inputBatch = [
+      ModelCommand(commandID="abc", method="defineModel",
+        args={'key1': 4098, 'key2': 4139}),
+      ModelInputRow(rowID=1, data=[timestamp, 1.5]),
+      ModelInputRow(rowID=2, data=(timestamp, -2.25)),
+      ModelInputRow(rowID=3, data=[timestamp, 7, 2 ** 40]),
+      ModelInputRow(rowID=4, data=[datetime.datetime(1969, 7, 20, 20, 17, 40,
+                                                     1), 0.0]),
+      ModelInputRow(rowID="foo", data=[1, 2, "Sep 21 02:24:21 UTC 2013"]),
+      ModelInputRow(rowID=5, data=[timestamp, None]),
+      ModelInputRow(rowID=6, data=[True, 1.0]),
+      ModelCommandResult(commandID="commandID", method="testMethod", status=1,
+        errorMessage="errorMessage"),
+      ModelInferenceResult(rowID=7, status=0, anomalyScore=0.125),
+      ModelInferenceResult(rowID=8, status=0, anomalyScore=1),
+      ModelInferenceResult(rowID=9, status=1, errorMessage="error"),
+      ModelInferenceResult(rowID=10, status=0, anomalyScore=0.5),
+    ]
+
+    batchState = BatchPackager.marshal(batch=inputBatch, binary=True)
+
+    self.assertEqual(batchState[:2], "\x00\x01")
+
+    outputBatch = BatchPackager.unmarshal(batchState=batchState)
+    self.assertEqual(outputBatch, tuple(inputBatch))
+
+    self.assertEqual(outputBatch[1].data, [timestamp, 1.5])
+    self.assertEqual(outputBatch[4].data[0],
+                     datetime.datetime(1969, 7, 20, 20, 17, 40, 1))
+    self.assertIsInstance(outputBatch[10].anomalyScore, int)
+    self.assertIsInstance(outputBatch[7].data[0], bool)
+
+
+  def testBinaryMarshalIsCompact(self):
+    timestamp = datetime.datetime(2015, 10, 21, 16, 29, 3)
+    inputBatch = [
+      ModelInputRow(rowID=1000000 + i,
+                    data=[timestamp + datetime.timedelta(minutes=5 * i),
+                          1234.5678 + i])
+      for i in xrange(1000)]
+
+    binaryBatchState = BatchPackager.marshal(batch=inputBatch, binary=True)
+
+    self.assertLess(len(binaryBatchState),
+                    len(BatchPackager.marshal(batch=inputBatch)) / 2)
+
+    self.assertEqual(BatchPackager.unmarshal(batchState=binaryBatchState),
+                     tuple(inputBatch))
+
+
+  def testUnmarshalUnsupportedBinaryVersion(self):
+    batchState = BatchPackager.marshal(
+      batch=[ModelInferenceResult(rowID=7, status=0, anomalyScore=0.125)],
+      binary=True)
+
+    with self.assertRaises(ValueError):
+      BatchPackager.unmarshal(batchState="\x00\x02" + batchState[2:])
+
+
 
 class RequestMessagePackagerTestCase(unittest.TestCase):
   """
@@ -600,11 +662,135 @@ class ModelSwapperInterfaceTestCase(unittest.TestCase):
 
     self.assertEqual(messageBusConnectorMock.publish.call_count, 2)
 
+    # The request batch is pipelined and confirmed; the pending notification
+    # is published when the interface is closed
     messageBusConnectorMock.publish.assert_any_call(
-      modelMQName, msg, persistent=True)
+      modelMQName, msg, persistent=True, waitForConfirm=False)
 
-    messageBusConnectorMock.publish.assert_any_call(
-      notificationMQName, json.dumps(modelID), persistent=False)
+    messageBusConnectorMock.publish.assert_called_with(
+      notificationMQName, json.dumps([modelID]), persistent=False)
+
+    messageBusConnectorMock.waitForConfirms.assert_called_once_with()
+
+
+  @patch.object(model_swapper_interface, "MessageBusConnector", autospec=True)
+  def testSubmitPipelinedRequestsCoalescesNotifications(
+      self, messageBusConnectorClassMock):
+    requests = [
+      ModelInputRow(rowID="foo", data=[1, 2, "Sep 21 02:24:21 UTC 2013"]),
+    ]
+
+    messageBusConnectorMock = messageBusConnectorClassMock.return_value
+
+    with ConfigAttributePatch(
+        modelSwapperConfig.CONFIG_NAME,
+        modelSwapperConfig.baseConfigDir,
+        ((ModelSwapperInterface._CONFIG_SECTION,
+          ModelSwapperInterface._NOTIFICATION_COALESCE_WINDOW_OPTION_NAME,
+          "60000"),)):
+      interface = ModelSwapperInterface()
+
+    notificationMQName = interface._schedulerNotificationQueueName
+
+    for modelID in ("abc", "def", "abc", "abc"):
+      interface.submitRequests(modelID=modelID, requests=requests,
+                               waitForConfirm=False)
+
+    # Only the request batches are published before the confirmation
+    self.assertEqual(messageBusConnectorMock.publish.call_count, 4)
+    self.assertFalse(messageBusConnectorMock.waitForConfirms.called)
+
+    interface.waitForConfirms()
+    interface.waitForConfirms()
+
+    # The notification is pending for the rest of the coalescing window
+    self.assertEqual(messageBusConnectorMock.publish.call_count, 4)
+
+    interface.close()
+
+    # A single notification carries the IDs of all the models
+    self.assertEqual(messageBusConnectorMock.publish.call_count, 5)
+    messageBusConnectorMock.publish.assert_called_with(
+      notificationMQName, json.dumps(["abc", "def"]), persistent=False)
+
+
+  @patch.object(model_swapper_interface, "MessageBusConnector", autospec=True)
+  def testSubmitRequestsCoalescesNotificationsWithinWindow(
+      self, messageBusConnectorClassMock):
+    # Notifications of request batches that are submitted and confirmed by
+    # separate submitRequests calls within the coalescing window are published
+    # as a single message at the end of the window
+    requests = [
+      ModelInputRow(rowID="foo", data=[1, 2, "Sep 21 02:24:21 UTC 2013"]),
+    ]
+
+    messageBusConnectorMock = messageBusConnectorClassMock.return_value
+
+    notificationPublished = threading.Event()
+
+    def publish(mqName, *_args, **_kwargs):
+      if mqName == interface._schedulerNotificationQueueName:
+        notificationPublished.set()
+
+    messageBusConnectorMock.publish.side_effect = publish
+
+    with ConfigAttributePatch(
+        modelSwapperConfig.CONFIG_NAME,
+        modelSwapperConfig.baseConfigDir,
+        ((ModelSwapperInterface._CONFIG_SECTION,
+          ModelSwapperInterface._NOTIFICATION_COALESCE_WINDOW_OPTION_NAME,
+          "200"),)):
+      interface = ModelSwapperInterface()
+
+    try:
+      interface.submitRequests(modelID="abc", requests=requests)
+      interface.submitRequests(modelID="def", requests=requests)
+
+      self.assertEqual(messageBusConnectorMock.waitForConfirms.call_count, 2)
+
+      self.assertTrue(notificationPublished.wait(10))
+
+      self.assertEqual(messageBusConnectorMock.publish.call_count, 3)
+      messageBusConnectorMock.publish.assert_called_with(
+        interface._schedulerNotificationQueueName, json.dumps(["abc", "def"]),
+        persistent=False)
+    finally:
+      interface.close()
+
+    # Nothing was pending when the interface was closed
+    self.assertEqual(messageBusConnectorMock.publish.call_count, 3)
+
+
+  @patch.object(model_swapper_interface, "MessageBusConnector", autospec=True)
+  def testSubmitPipelinedRequestsWithoutCoalescingWindow(
+      self, messageBusConnectorClassMock):
+    requests = [
+      ModelInputRow(rowID="foo", data=[1, 2, "Sep 21 02:24:21 UTC 2013"]),
+    ]
+
+    messageBusConnectorMock = messageBusConnectorClassMock.return_value
+
+    with ConfigAttributePatch(
+        modelSwapperConfig.CONFIG_NAME,
+        modelSwapperConfig.baseConfigDir,
+        ((ModelSwapperInterface._CONFIG_SECTION,
+          ModelSwapperInterface._NOTIFICATION_COALESCE_WINDOW_OPTION_NAME,
+          "0"),)):
+      interface = ModelSwapperInterface()
+
+    for modelID in ("abc", "abc"):
+      interface.submitRequests(modelID=modelID, requests=requests,
+                               waitForConfirm=False)
+
+    self.assertEqual(messageBusConnectorMock.publish.call_count, 2)
+
+    # The notification is published as soon as the batches are confirmed
+    interface.waitForConfirms()
+
+    self.assertEqual(messageBusConnectorMock.publish.call_count, 3)
+    messageBusConnectorMock.publish.assert_called_with(
+      interface._schedulerNotificationQueueName, json.dumps(["abc"]),
+      persistent=False)
 
 
   @patch.object(model_swapper_interface, "MessageBusConnector", autospec=True,
@@ -622,20 +808,21 @@ class ModelSwapperInterfaceTestCase(unittest.TestCase):
 
     # Configure mock
     messageBusConnectorMock = messageBusConnectorClassMock.return_value
-    messageBusConnectorMock.publish.side_effect = (
-      message_bus_connector.MessageQueueNotFound(
-        "expected exception from publish to non-existent model"))
 
     # Run
     with self.assertRaises(
         model_swapper_interface.ModelNotFound) as assertionCM:
       with ModelSwapperInterface() as interface:
+        messageBusConnectorMock.waitForConfirms.side_effect = (
+          message_bus_connector.UndeliveredMessagesError(
+            [(interface._getModelInputQName(modelID), "msg")]))
+
         interface.submitRequests(modelID=modelID, requests=requests)
 
     # Verify
-    self.assertIn("expected exception from publish to non-existent model",
-                  assertionCM.exception.args[0])
+    self.assertIn(modelID, assertionCM.exception.args[0])
 
+    # No notification for the model whose request batch wasn't delivered
     self.assertEqual(messageBusConnectorMock.publish.call_count, 1)
 
 
@@ -656,13 +843,15 @@ class ModelSwapperInterfaceTestCase(unittest.TestCase):
 
     # Configure mock
     messageBusConnectorMock = messageBusConnectorClassMock.return_value
-    messageBusConnectorMock.publish.side_effect = (
-      Mock(),
-      message_bus_connector.MessageQueueNotFound(
-        "expected exception from publishing of notification"))
 
     # Run
     with ModelSwapperInterface() as interface:
+      def publish(mqName, *_args, **_kwargs):
+        if mqName == interface._schedulerNotificationQueueName:
+          raise message_bus_connector.MessageQueueNotFound(mqName)
+
+      messageBusConnectorMock.publish.side_effect = publish
+
       batchID = interface.submitRequests(modelID=modelID, requests=requests)
 
     # Verify
@@ -770,7 +959,7 @@ class ModelSwapperInterfaceTestCase(unittest.TestCase):
     modelMQName = interface._modelInputQueueNamePrefix + modelID
 
     messageBusConnectorMock.consume.assert_called_once_with(
-      modelMQName, blocking=False)
+      modelMQName, blocking=False, prefetchMax=None)
 
 
   @patch.object(model_swapper_interface, "MessageBusConnector", autospec=True,
@@ -869,20 +1058,22 @@ class ModelSwapperInterfaceTestCase(unittest.TestCase):
 
     # Configure mocks
 
-    exception = message_bus_connector.MessageQueueNotFound(
-                  "publish failed in mock test")
-
     messageBusConnectorMock = messageBusConnectorClassMock.return_value
-    messageBusConnectorMock.publish.side_effect = exception
 
     # Run
 
     with ModelSwapperInterface() as interface:
+      messageBusConnectorMock.waitForConfirms.side_effect = (
+        message_bus_connector.UndeliveredMessagesError(
+          [(interface._getModelInputQName(modelID), "msg")]))
+
       interface.deleteModel(modelID=modelID, commandID=commandID)
 
     # Verify
 
     self.assertEqual(messageBusConnectorMock.purge.call_count, 1)
+
+    # No notification for the model whose request batch wasn't delivered
     self.assertEqual(messageBusConnectorMock.publish.call_count, 1)
 
 
@@ -952,54 +1143,177 @@ class ModelSwapperInterfaceTestCase(unittest.TestCase):
     self.assertFalse(inputPending)
 
 
+  @patch.object(
+    model_swapper_interface, "MessageBusConnector", autospec=True,
+    getMessageCount=Mock(spec_set=MessageBusConnector.getMessageCount))
+  def testGetModelInputDepth(self, messageBusConnectorClassMock):
+    modelID = "model_foo"
+
+    messageBusConnectorMock = messageBusConnectorClassMock.return_value
+    messageBusConnectorMock.getMessageCount.return_value = 7
+
+    with ModelSwapperInterface() as interface:
+      inputDepth = interface.getModelInputDepth(modelID=modelID)
+
+    self.assertEqual(messageBusConnectorMock.getMessageCount.call_count, 1)
+
+    self.assertEqual(inputDepth, 7)
+
+
+  @patch.object(
+    model_swapper_interface, "MessageBusConnector", autospec=True,
+    getMessageCount=Mock(spec_set=MessageBusConnector.getMessageCount))
+  def testGetModelInputDepthMessageQueueNotFoundInterpretedAsZero(
+    self, messageBusConnectorClassMock):
+    modelID = "model_foo"
+
+    messageBusConnectorMock = messageBusConnectorClassMock.return_value
+    messageBusConnectorMock.getMessageCount.side_effect = (
+      message_bus_connector.MessageQueueNotFound)
+
+    with ModelSwapperInterface() as interface:
+      inputDepth = interface.getModelInputDepth(modelID=modelID)
+
+    self.assertEqual(messageBusConnectorMock.getMessageCount.call_count, 1)
+
+    self.assertEqual(inputDepth, 0)
+
+
+  @patch.object(
+    model_swapper_interface, "MessageBusConnector", autospec=True,
+    isEmpty=Mock(spec_set=MessageBusConnector.isEmpty))
+  def testResultsPending(self, messageBusConnectorClassMock):
+    messageBusConnectorMock = messageBusConnectorClassMock.return_value
+    messageBusConnectorMock.isEmpty.side_effect = [
+      False,
+      True,
+      message_bus_connector.MessageQueueNotFound]
+
+    with ModelSwapperInterface() as interface:
+      self.assertTrue(interface.resultsPending())
+      self.assertFalse(interface.resultsPending())
+      self.assertFalse(interface.resultsPending())
+
+      messageBusConnectorMock.isEmpty.assert_called_with(
+        interface._resultsQueueName)
+
+    self.assertEqual(messageBusConnectorMock.isEmpty.call_count, 3)
+
+
+  @patch.object(model_swapper_interface, "MessageBusConnector", autospec=True,
+                consume=Mock(spec_set=MessageBusConnector.consume))
+  def testConsumeResultsWithPrefetchMax(self, messageBusConnectorClassMock):
+    messageBusConnectorMock = messageBusConnectorClassMock.return_value
+    messageBusConnectorMock.consume.return_value = Mock(
+      spec_set=message_bus_connector._QueueConsumer)
+
+    with ModelSwapperInterface() as interface:
+      with interface.consumeResults(prefetchMax=16):
+        pass
+
+      messageBusConnectorMock.consume.assert_called_once_with(
+        interface._resultsQueueName, blocking=True, prefetchMax=16)
+
+
   @patch.object(
     model_swapper_interface, "MessageBusConnector", autospec=True,
     isEmpty=Mock(spec_set=MessageBusConnector.isEmpty),
-    getAllMessageQueues=Mock(spec_set=MessageBusConnector.getAllMessageQueues))
+    getMessageQueueDepths=Mock(
+      spec_set=MessageBusConnector.getMessageQueueDepths))
   def testGetModelsWithInputPending(self, messageBusConnectorClassMock):
-    modelsPendingMap = {
-      "model_one": True,
+    # Map of model IDs to depths of their input queues; None if the broker has
+    # no statistics of the queue yet
+    modelDepthsMap = {
+      "model_one": 1,
+      "model_two": 25,
+      "model_three": 0,
+      "model_four": 0,
+      "model_five": 3,
+      "new_pending_one": None,
+      "new_empty_one": None,
       "disappeared_one": None,
-      "model_two": True,
-      "model_three": False,
-      "disappeared_two": None,
-      "model_four": False,
-      "model_five": True
     }
 
-    with ModelSwapperInterface() as interface:
-      allMessageQueues = [interface._getModelInputQName(modelID)
-                          for modelID in modelsPendingMap]
-
-    isEmptyResults = [
-      (not pending if pending is not None
-       else message_bus_connector.MessageQueueNotFound(mq))
-      for mq, pending in modelsPendingMap.iteritems()]
+    isEmptyResultsMap = {
+      "new_pending_one": False,
+      "new_empty_one": True,
+      "disappeared_one": message_bus_connector.MessageQueueNotFound(
+        "disappeared_one"),
+    }
 
-    # Add some queue names that don't look like model input queue names
-    allMessageQueues.extend(
-      ("not.model.input.queue1", "not.model.input.queue2"))
-    isEmptyResults.extend((False, False))
+    with ModelSwapperInterface() as interface:
+      depths = dict((interface._getModelInputQName(modelID), depth)
+                    for modelID, depth in modelDepthsMap.iteritems())
+      isEmptyResults = dict((interface._getModelInputQName(modelID), result)
+                            for modelID, result in isEmptyResultsMap.iteritems())
+      prefix = interface._modelInputQueueNamePrefix
+
+    def isEmpty(mqName):
+      result = isEmptyResults[mqName]
+      if isinstance(result, Exception):
+        raise result
+      return result
 
     # Configure message bus connector mock
     messageBusConnectorMock = messageBusConnectorClassMock.return_value
-    messageBusConnectorMock.isEmpty.side_effect = isEmptyResults
-    messageBusConnectorMock.getAllMessageQueues.return_value = (
-      allMessageQueues)
+    messageBusConnectorMock.isEmpty.side_effect = isEmpty
+    messageBusConnectorMock.getMessageQueueDepths.return_value = depths
 
     # Go for it!
     with ModelSwapperInterface() as interface:
-      actualModelsWithInput = interface.getModelsWithInputPending()
+      with patch.object(model_swapper_interface, "time", autospec=True):
+        actualModelsWithInput = interface.getModelsWithInputPending()
 
+    # Only the queues without statistics are checked individually
+    messageBusConnectorMock.getMessageQueueDepths.assert_called_once_with(
+      namePrefix=prefix)
     self.assertEqual(messageBusConnectorMock.isEmpty.call_count,
-                     len(modelsPendingMap))
-
-    self.assertEqual(messageBusConnectorMock.getAllMessageQueues.call_count, 1)
+                     len(isEmptyResultsMap))
 
     # Verify results
-    expectedSet = set(modelID for modelID, pending
-                      in modelsPendingMap.iteritems() if pending)
-    self.assertEqual(set(actualModelsWithInput), expectedSet)
+    self.assertEqual(
+      set(actualModelsWithInput),
+      set(["model_one", "model_two", "model_five", "new_pending_one"]))
+
+
+  @patch.object(
+    model_swapper_interface, "MessageBusConnector", autospec=True,
+    createMessageQueue=Mock(spec_set=MessageBusConnector.createMessageQueue),
+    isEmpty=Mock(spec_set=MessageBusConnector.isEmpty),
+    getMessageQueueDepths=Mock(
+      spec_set=MessageBusConnector.getMessageQueueDepths))
+  @patch.object(model_swapper_interface, "time", autospec=True)
+  def testGetModelsWithInputPendingWaitsForStatistics(
+      self, timeMock, messageBusConnectorClassMock):
+    # Input submitted just before the notification queue was initialized isn't
+    # reflected by the queue statistics until they catch up
+    lagSec = message_bus_connector.MANAGEMENT_STATISTICS_LAG_SEC
+    clock = [1000.0]
+    timeMock.time.side_effect = lambda: clock[0]
+
+    def sleep(sec):
+      clock[0] += sec
+    timeMock.sleep.side_effect = sleep
+
+    with ModelSwapperInterface() as interface:
+      mqName = interface._getModelInputQName("model_one")
+
+    def getMessageQueueDepths(namePrefix):  # pylint: disable=W0613
+      return {mqName: 0 if clock[0] < 1000.0 + lagSec else 1}
+
+    messageBusConnectorMock = messageBusConnectorClassMock.return_value
+    messageBusConnectorMock.getMessageQueueDepths.side_effect = (
+      getMessageQueueDepths)
+
+    with ModelSwapperInterface() as interface:
+      interface.initSchedulerNotification()
+
+      clock[0] += 1
+      modelsWithInput = interface.getModelsWithInputPending()
+
+    self.assertEqual(modelsWithInput, ("model_one",))
+    timeMock.sleep.assert_called_once_with(lagSec - 1)
+    self.assertEqual(messageBusConnectorMock.isEmpty.call_count, 0)
 
 
   @patch.object(model_swapper_interface, "MessageBusConnector", autospec=True)
@@ -1024,8 +1338,43 @@ class ModelSwapperInterfaceTestCase(unittest.TestCase):
 
     mqName = interface._resultsQueueName
 
-    messageBusConnectorMock.publish.assert_called_once_with(mqName, msg,
-                                                            persistent=True)
+    messageBusConnectorMock.publish.assert_called_once_with(
+      mqName, msg, persistent=True, waitForConfirm=False)
+    messageBusConnectorMock.waitForConfirms.assert_called_once_with()
+
+
+  @patch.object(model_swapper_interface, "MessageBusConnector", autospec=True)
+  def testSubmitResultsInBinaryFormat(self, messageBusConnectorClassMock):
+    results = [
+      ModelCommandResult(commandID="abc", method="testMethod", status=0,
+        args={'key1': 4098, 'key2': 4139}),
+      ModelInferenceResult(rowID=1, status=0, anomalyScore=0.25),
+      ModelInferenceResult(rowID=2, status=0, anomalyScore=0.5)
+    ]
+
+    messageBusConnectorMock = messageBusConnectorClassMock.return_value
+
+    with ConfigAttributePatch(
+        modelSwapperConfig.CONFIG_NAME,
+        modelSwapperConfig.baseConfigDir,
+        ((ModelSwapperInterface._CONFIG_SECTION,
+          ModelSwapperInterface._BATCH_FORMAT_OPTION_NAME,
+          "binary"),)):
+      interface = ModelSwapperInterface()
+
+    modelID = "foofar"
+    interface.submitResults(modelID=modelID, results=results)
+
+    msg = ResultMessagePackager.marshal(
+      modelID=modelID,
+      batchState=BatchPackager.marshal(batch=results, binary=True))
+
+    messageBusConnectorMock.publish.assert_called_once_with(
+      interface._resultsQueueName, msg, persistent=True, waitForConfirm=False)
+
+    r = ResultMessagePackager.unmarshal(msg)
+    self.assertEqual(r.modelID, modelID)
+    self.assertEqual(BatchPackager.unmarshal(r.batchState), tuple(results))
 
 
   @patch.object(model_swapper_interface, "MessageBusConnector", autospec=True,
@@ -1042,27 +1391,27 @@ class ModelSwapperInterfaceTestCase(unittest.TestCase):
     ]
 
     messageBusConnectorMock = messageBusConnectorClassMock.return_value
-    messageBusConnectorMock.publish.side_effect = (
-      message_bus_connector.MessageQueueNotFound("from mock test"),
-      Mock())
 
     modelID = "foofar"
 
-    with ModelSwapperInterface() as interface:
-      interface.submitResults(modelID=modelID, results=results)
+    msg = ResultMessagePackager.marshal(
+      modelID=modelID,
+      batchState=BatchPackager.marshal(batch=results))
 
+    with ModelSwapperInterface() as interface:
       mqName = interface._resultsQueueName
 
+      messageBusConnectorMock.waitForConfirms.side_effect = (
+        message_bus_connector.UndeliveredMessagesError([(mqName, msg)]))
+
+      interface.submitResults(modelID=modelID, results=results)
+
     # Verify
     messageBusConnectorMock.createMessageQueue.assert_called_once_with(
       mqName, durable=True)
 
     self.assertEqual(messageBusConnectorMock.publish.call_count, 2)
 
-    msg = ResultMessagePackager.marshal(
-      modelID=modelID,
-      batchState=BatchPackager.marshal(batch=results))
-
     messageBusConnectorMock.publish.assert_called_with(mqName, msg,
                                                        persistent=True)
 
@@ -1079,14 +1428,21 @@ class ModelSwapperInterfaceTestCase(unittest.TestCase):
 
     messageBusConnectorMock = messageBusConnectorClassMock.return_value
     messageBusConnectorMock.publish.side_effect = (
-      message_bus_connector.MessageQueueNotFound("from mock test"),
+      None,
       Exception("re-publish failed in mock test"))
 
     modelID = "foofar"
 
+    msg = ResultMessagePackager.marshal(
+      modelID=modelID,
+      batchState=BatchPackager.marshal(batch=results))
+
     with self.assertRaises(Exception) as raisesCM:
       with ModelSwapperInterface() as interface:
         mqName = interface._resultsQueueName
+        messageBusConnectorMock.waitForConfirms.side_effect = (
+          message_bus_connector.UndeliveredMessagesError([(mqName, msg)]))
+
         interface.submitResults(modelID=modelID, results=results)
 
     # Verify
@@ -1098,10 +1454,6 @@ class ModelSwapperInterfaceTestCase(unittest.TestCase):
 
     self.assertEqual(messageBusConnectorMock.publish.call_count, 2)
 
-    msg = ResultMessagePackager.marshal(
-      modelID=modelID,
-      batchState=BatchPackager.marshal(batch=results))
-
     messageBusConnectorMock.publish.assert_called_with(mqName, msg,
                                                        persistent=True)
 
@@ -1228,6 +1580,17 @@ class ModelSwapperInterfaceTestCase(unittest.TestCase):
     self.assertEqual(messageBusConnectorMock.createMessageQueue.call_count, 1)
 
 
+  def testDecodeCoalescedModelSchedulerNotification(self):
+    ackMock = Mock(return_value=None)
+
+    notification = model_swapper_interface._ConsumedNotification.decodeMessage(
+      message_bus_connector._ConsumedMessage(body=json.dumps(["abc", "def"]),
+                                             ack=ackMock))
+
+    self.assertEqual(notification.modelIDs, ["abc", "def"])
+    self.assertIs(notification.ack, ackMock)
+
+
   @patch.object(
     model_swapper_interface, "MessageBusConnector", autospec=True,
     consume=Mock(spec_set=MessageBusConnector.consume))
@@ -1253,7 +1616,7 @@ class ModelSwapperInterfaceTestCase(unittest.TestCase):
 
       notification = next(iter(consumer))
 
-      self.assertEqual(notification.value, modelID)
+      self.assertEqual(notification.modelIDs, [modelID])
       self.assertTrue(callable(notification.ack))
       self.assertIs(notification.ack, ackMock)
 
@@ -0,0 +1,331 @@
+#!/usr/bin/env python
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2015, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+"""
+Unit tests for the Model Swapper's scheduling policies
+"""
+
+import unittest
+
+
+from mock import Mock, patch
+
+
+from htmengine.model_checkpoint_mgr import model_checkpoint_mgr
+from htmengine.model_swapper import ModelSwapperConfig
+from htmengine.model_swapper import model_swapper_interface
+from htmengine.model_swapper import scheduling_policy
+from htmengine.model_swapper.scheduling_policy import (
+  FifoSchedulingPolicy,
+  PriorityCostSchedulingPolicy)
+
+from nta.utils.test_utils.config_test_utils import ConfigAttributePatch
+
+
+
+# Disable warning: Access to a protected member
+# pylint: disable=W0212
+
+
+
+class IndexedHeapTestCase(unittest.TestCase):
+
+
+  def testPopInKeyOrderWithTiesInInsertionOrder(self):
+    heap = scheduling_policy._IndexedHeap()
+    heap.push("a", 2, "va")
+    heap.push("b", 1, "vb")
+    heap.push("c", 2, "vc")
+    heap.push("d", 0, "vd")
+
+    self.assertEqual(len(heap), 4)
+    self.assertEqual([heap.pop() for _ in xrange(4)],
+                     [("d", "vd"), ("b", "vb"), ("a", "va"), ("c", "vc")])
+    self.assertEqual(len(heap), 0)
+
+    with self.assertRaises(IndexError):
+      heap.pop()
+
+
+  def testRemoveAndReplace(self):
+    heap = scheduling_policy._IndexedHeap()
+    heap.push("a", 1, "va")
+    heap.push("b", 2, "vb")
+    heap.push("c", 3, "vc")
+
+    self.assertTrue(heap.remove("a"))
+    self.assertFalse(heap.remove("a"))
+    self.assertNotIn("a", heap)
+
+    # Re-keying an item replaces its previous entry
+    heap.push("c", 0, "vc2")
+    self.assertEqual(heap.getValue("c"), "vc2")
+    self.assertEqual(len(heap), 2)
+
+    self.assertEqual(heap.pop(), ("c", "vc2"))
+    self.assertEqual(heap.pop(), ("b", "vb"))
+    self.assertEqual(len(heap), 0)
+
+
+  def testStaleEntriesArePruned(self):
+    heap = scheduling_policy._IndexedHeap()
+    heap.push("a", 0)
+    heap.push("b", 0)
+
+    for i in xrange(100):
+      heap.push("a", i)
+
+    self.assertLessEqual(
+      len(heap._heap),
+      heap._MAX_HEAP_TO_ITEMS_RATIO * len(heap) + 1)
+    self.assertEqual(heap.pop(), ("b", None))
+    self.assertEqual(heap.pop(), ("a", None))
+
+
+
+@patch.object(scheduling_policy.time, "time", autospec=True)
+class FifoSchedulingPolicyTestCase(unittest.TestCase):
+
+
+  def testWaitingModelsAreScheduledInOrderOfArrival(self, timeMock):
+    timeMock.return_value = 1000
+    policy = FifoSchedulingPolicy()
+
+    for modelID in ("c", "a", "b"):
+      policy.addWaitingModel(modelID)
+
+    self.assertEqual(policy.numWaitingModels, 3)
+    self.assertTrue(policy.isModelWaiting("a"))
+    self.assertFalse(policy.isModelWaiting("x"))
+
+    self.assertEqual([policy.popNextWaitingModel() for _ in xrange(3)],
+                     ["c", "a", "b"])
+    self.assertEqual(policy.numWaitingModels, 0)
+
+
+  def testLeastRecentlyActiveModelIsPreempted(self, timeMock):
+    policy = FifoSchedulingPolicy()
+
+    timeMock.return_value = 1000
+    policy.addRunningModel("a", 0)
+    timeMock.return_value = 1001
+    policy.addRunningModel("b", 1)
+    timeMock.return_value = 1002
+    policy.addRunningModel("c", 2)
+
+    # New input for "a" makes "b" the least-recently-active model
+    timeMock.return_value = 1003
+    policy.updateRunningModel("a")
+
+    # Slot 1 is already pending preemption
+    self.assertEqual(policy.popPreemptionVictim(excludedSlots={1}), ("c", 2))
+
+    # A model that completed execution is no longer a candidate
+    policy.removeRunningModel("a")
+    self.assertIsNone(policy.popPreemptionVictim(excludedSlots=()))
+
+    # Input for a model that's no longer a candidate doesn't resurrect it
+    policy.updateRunningModel("c")
+    self.assertIsNone(policy.popPreemptionVictim(excludedSlots=()))
+
+
+
+@patch.object(scheduling_policy.time, "time", autospec=True,
+              return_value=1000)
+@patch.object(scheduling_policy, "ModelCheckpointMgr", autospec=True)
+class PriorityCostSchedulingPolicyTestCase(unittest.TestCase):
+
+
+  def _createPolicy(self, checkpointMgrClassMock, inputDepths, checkpointSizes,
+                    priorities):
+    swapperMock = Mock(
+      spec_set=model_swapper_interface.ModelSwapperInterface)
+    swapperMock.getModelInputDepth.side_effect = inputDepths.__getitem__
+
+    def getCheckpointSize(modelID):
+      if modelID not in checkpointSizes:
+        raise model_checkpoint_mgr.ModelNotFound(modelID)
+      return checkpointSizes[modelID]
+
+    def loadModelDefinition(modelID):
+      definition = dict(modelParams=dict(), inputSchema=[])
+      if modelID in priorities:
+        definition["schedulingPriority"] = priorities[modelID]
+      return definition
+
+    checkpointMgrMock = checkpointMgrClassMock.return_value
+    checkpointMgrMock.getCheckpointSize.side_effect = getCheckpointSize
+    checkpointMgrMock.loadModelDefinition.side_effect = loadModelDefinition
+
+    return PriorityCostSchedulingPolicy(swapperAPI=swapperMock,
+                                        priorityWeightSec=60,
+                                        inputDepthWeightSec=10,
+                                        loadCostWeightSecPerMB=1)
+
+
+  def testRealtimeModelsAreScheduledBeforeBackfillModels(
+      self, checkpointMgrClassMock, timeMock):
+    mb = 1024 * 1024
+    policy = self._createPolicy(
+      checkpointMgrClassMock,
+      inputDepths=dict(backfill=1023, realtime=1, bigRealtime=1, urgent=1023,
+                       new=3),
+      checkpointSizes=dict(backfill=mb, realtime=mb, bigRealtime=50 * mb,
+                           urgent=mb),
+      priorities=dict(urgent=2))
+
+    timeMock.return_value = 1000
+    policy.addWaitingModel("backfill")
+
+    timeMock.return_value = 1001
+    policy.addWaitingModel("urgent")
+    policy.addWaitingModel("bigRealtime")
+    policy.addWaitingModel("realtime")
+    policy.addWaitingModel("new")
+
+    # key = arrival time - 60 * priority + 10 * log2(1 + depth) + size in MB
+    #   backfill: 1000 + 100 + 1 = 1101
+    #   urgent: 1001 - 120 + 100 + 1 = 982
+    #   bigRealtime: 1001 + 10 + 50 = 1061
+    #   realtime: 1001 + 10 + 1 = 1012
+    #   new (no checkpoint): 1001 + 20 = 1021
+    self.assertEqual([policy.popNextWaitingModel() for _ in xrange(5)],
+                     ["urgent", "realtime", "new", "bigRealtime", "backfill"])
+
+
+  def testBackfillModelsArePreemptedBeforeRealtimeModels(
+      self, checkpointMgrClassMock, timeMock):
+    mb = 1024 * 1024
+    policy = self._createPolicy(
+      checkpointMgrClassMock,
+      inputDepths=dict(backfill=1023, realtime=1, urgent=1023),
+      checkpointSizes=dict(backfill=mb, realtime=mb, urgent=mb),
+      priorities=dict(urgent=2))
+
+    timeMock.return_value = 1000
+    policy.addRunningModel("realtime", 0)
+    policy.addRunningModel("urgent", 1)
+
+    timeMock.return_value = 1050
+    policy.addRunningModel("backfill", 2)
+
+    # key = activity time + 60 * priority - 10 * log2(1 + depth) + size in MB
+    #   realtime: 1000 - 10 + 1 = 991
+    #   urgent: 1000 + 120 - 100 + 1 = 1021
+    #   backfill: 1050 - 100 + 1 = 951
+    self.assertEqual(policy.popPreemptionVictim(excludedSlots=()),
+                     ("backfill", 2))
+    self.assertEqual(policy.popPreemptionVictim(excludedSlots=()),
+                     ("realtime", 0))
+    self.assertEqual(policy.popPreemptionVictim(excludedSlots=()),
+                     ("urgent", 1))
+
+
+  def testModelEvaluationIsRefreshedAfterModelCompletes(
+      self, checkpointMgrClassMock, timeMock):
+    policy = self._createPolicy(checkpointMgrClassMock,
+                                inputDepths=dict(a=1), checkpointSizes=dict(),
+                                priorities=dict())
+
+    swapperMock = policy._swapperAPI
+    checkpointMgrMock = checkpointMgrClassMock.return_value
+
+    # The evaluation made while the model was waiting is reused when it runs
+    policy.addWaitingModel("a")
+    policy.popNextWaitingModel()
+    policy.addRunningModel("a", 0)
+    policy.updateRunningModel("a")
+    self.assertEqual(swapperMock.getModelInputDepth.call_count, 1)
+
+    # The model's input depth, checkpoint and definition are re-evaluated the
+    # next time it is scheduled
+    policy.removeRunningModel("a")
+    policy.addWaitingModel("a")
+    self.assertEqual(swapperMock.getModelInputDepth.call_count, 2)
+    self.assertEqual(checkpointMgrMock.getCheckpointSize.call_count, 2)
+    self.assertEqual(checkpointMgrMock.loadModelDefinition.call_count, 2)
+
+
+  def testPriorityChangeTakesEffectAfterModelCompletes(
+      self, checkpointMgrClassMock, timeMock):
+    priorities = dict(a=0)
+    policy = self._createPolicy(checkpointMgrClassMock,
+                                inputDepths=dict(a=0, b=0),
+                                checkpointSizes=dict(),
+                                priorities=priorities)
+
+    timeMock.return_value = 1000
+    policy.addWaitingModel("a")
+    self.assertEqual(policy.popNextWaitingModel(), "a")
+    policy.addRunningModel("a", 0)
+
+    # The model is redefined with a higher priority while it's running
+    priorities["a"] = 2
+    policy.removeRunningModel("a")
+
+    # key = arrival time - 60 * priority
+    #   b: 1000
+    #   a: 1001 - 120 = 881
+    policy.addWaitingModel("b")
+    timeMock.return_value = 1001
+    policy.addWaitingModel("a")
+
+    self.assertEqual([policy.popNextWaitingModel() for _ in xrange(2)],
+                     ["a", "b"])
+
+
+
+class CreateSchedulingPolicyTestCase(unittest.TestCase):
+
+
+  def _patchPolicyName(self, policyName):
+    config = ModelSwapperConfig()
+    return ConfigAttributePatch(config.CONFIG_NAME, config.baseConfigDir,
+                                (("scheduling", "policy", policyName),))
+
+
+  def testCreateFifoPolicy(self):
+    with self._patchPolicyName("fifo"):
+      policy = scheduling_policy.createSchedulingPolicy(Mock())
+
+    self.assertIsInstance(policy, FifoSchedulingPolicy)
+
+
+  @patch.object(scheduling_policy, "ModelCheckpointMgr", autospec=True)
+  def testCreatePriorityCostPolicy(self, _checkpointMgrClassMock):
+    swapperMock = Mock()
+    with self._patchPolicyName("priority_cost"):
+      policy = scheduling_policy.createSchedulingPolicy(swapperMock)
+
+    self.assertIsInstance(policy, PriorityCostSchedulingPolicy)
+    self.assertIs(policy._swapperAPI, swapperMock)
+
+
+  def testCreateUnknownPolicyRaisesValueError(self):
+    with self._patchPolicyName("round_robin"):
+      with self.assertRaises(ValueError):
+        scheduling_policy.createSchedulingPolicy(Mock())
+
+
+
+if __name__ == "__main__":
+  unittest.main()
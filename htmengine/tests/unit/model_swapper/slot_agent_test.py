@@ -27,6 +27,8 @@ Unit tests for the Model Swapper's SlotAgent class
 from functools import partial
 import Queue
 import os
+import subprocess
+import sys
 import threading
 import unittest
 
@@ -241,6 +243,85 @@ class SlotAgentTestCase(unittest.TestCase):
       self.assertEqual(modelRunnerProxyMock.stopGracefully.call_count, 1)
 
 
+  @patch.object(slot_agent, "ModelRunnerProxy", autospec=True,
+                side_effect=RuntimeError(
+                  "ModelRunnerProxy constructor should not have been called"))
+  @patch.object(slot_agent, "ResidentModelRunnerProcess", autospec=True)
+  def testSwapModelsInSlotAgentWithResidentModels(
+      self, residentProcessClassMock, _modelRunnerProxyClassMock):
+    residentProcessMock = residentProcessClassMock.return_value
+    residentProcessMock.startModel.return_value.stopGracefully.return_value = 0
+
+    modelFinishedQ = Queue.Queue()
+
+    def modelFinishedCallback(modelID, exitStatus):
+      modelFinishedQ.put((modelID, exitStatus))
+
+    sa = slot_agent.SlotAgent(slotID=1, residentModels=True)
+
+    modelIDs = ["abc", "def", "abc"]
+
+    for modelID in modelIDs:
+      sa.startModel(
+        modelID=modelID,
+        modelFinishedCallback=partial(modelFinishedCallback, modelID))
+      sa.stopModel()
+      self.assertEqual((modelID, 0), modelFinishedQ.get(timeout=5))
+      sa.releaseSlot()
+
+    # Close slot agent
+    t = threading.Thread(target=sa.close)
+    t.setDaemon(True)
+    t.start()
+    t.join(timeout=5)
+    self.assertFalse(t.isAlive())
+
+    # All models ran in the same resident process, which was closed along with
+    # the slot agent
+    self.assertEqual(residentProcessClassMock.call_count, 1)
+    self.assertEqual(
+      [kwargs["modelID"]
+       for _args, kwargs in residentProcessMock.startModel.call_args_list],
+      modelIDs)
+    residentProcessMock.close.assert_called_once_with()
+
+
+  def testResidentModelRunnerProcess(self):
+    # Stand in for the resident ModelRunner process with one that reports
+    # success for each model right away
+    fakeModelRunnerScript = (
+      "import sys\n"
+      "for line in iter(sys.stdin.readline, ''):\n"
+      "  if line.strip():\n"
+      "    sys.stdout.write('0\\n')\n"
+      "    sys.stdout.flush()\n")
+
+    popen = subprocess.Popen
+    def popenFakeModelRunner(args, **kwargs):
+      self.assertIn("--resident", args)
+      return popen(args=[sys.executable, "-c", fakeModelRunnerScript],
+                   **kwargs)
+
+    terminationQ = Queue.Queue()
+
+    with patch.object(slot_agent.subprocess, "Popen", autospec=True,
+                      side_effect=popenFakeModelRunner) as popenMock:
+      process = slot_agent.ResidentModelRunnerProcess(
+        logger=slot_agent._getLogger())
+
+      for modelID in ["abc", "def"]:
+        modelRunner = process.startModel(
+          modelID=modelID,
+          onTermination=partial(terminationQ.put, modelID))
+        self.assertEqual(terminationQ.get(timeout=5), modelID)
+        self.assertEqual(modelRunner.stopGracefully(), 0)
+
+      process.close()
+
+    # Both models ran in the same process
+    self.assertEqual(popenMock.call_count, 1)
+
+
   @patch.object(
     slot_agent, "ModelRunnerProxy", autospec=True,
     side_effect=RuntimeError("Something that should trigger "
@@ -278,7 +278,7 @@ def _createModelSwapperInterfaceInstanceMock():
 
 def _createModelInputNotification(modelID):
   return model_swapper_interface._ConsumedNotification(
-      value=modelID,
+      modelIDs=[modelID],
       ack=Mock(spec_set=lambda: None, return_value=None))
 
 
@@ -299,6 +299,71 @@ class TestSwapController(unittest.TestCase):
     del sc
 
 
+  @patch.multiple(swap_controller, autospec=True,
+                  ModelSwapperInterface=mock.DEFAULT,
+                  SlotAgent=mock.DEFAULT)
+  def testNewInputNotificationsAreMergedAndDeduped(self, **_kwargs):
+    sc = SwapController(concurrency=2)
+
+    # Notifications that arrive before the event loop gets to them are merged
+    # into a single event
+    sc._newInputNotifyTS(["c", "b", "c"])
+    sc._newInputNotifyTS(["b", "a"])
+    sc._newInputNotifyTS([])
+
+    self.assertEqual(sc._eventQ.qsize(), 1)
+
+    evt = sc._eventQ.get_nowait()
+    sc._handleNewInputNotifyEvent(**evt)
+
+    self.assertEqual(len(sc._runningModelsMap), 2)
+    self.assertEqual(sc._schedulingPolicy.numWaitingModels, 1)
+    self.assertFalse(sc._pendingInputModelIDs)
+
+    # Models are scheduled in order of arrival of their notifications
+    self.assertItemsEqual(sc._runningModelsMap.keys(), ["c", "b"])
+    self.assertEqual(sc._schedulingPolicy.popNextWaitingModel(), "a")
+    sc._schedulingPolicy.addWaitingModel("a")
+
+    # Notifications of running and waiting models don't schedule them again
+    sc._newInputNotifyTS(["a", "b", "c"])
+    evt = sc._eventQ.get_nowait()
+    sc._handleNewInputNotifyEvent(**evt)
+
+    self.assertEqual(len(sc._runningModelsMap), 2)
+    self.assertEqual(sc._schedulingPolicy.numWaitingModels, 1)
+    self.assertTrue(sc._eventQ.empty())
+
+
+  @patch.multiple(swap_controller, autospec=True,
+                  ModelSwapperInterface=mock.DEFAULT,
+                  SlotAgent=mock.DEFAULT)
+  @patch.object(SwapController, "_MAX_LAST_SLOT_ENTRIES_PER_SLOT", 1)
+  def testLastSlotIndexByModelIsCapped(self, **_kwargs):
+    sc = SwapController(concurrency=2)
+    sc._residentModels = True
+    sc._mainSwapper.modelInputPending.return_value = False
+
+    def runModel(modelID):
+      sc._assignModelToFreeSlot(modelID)
+      sc._handleModelDoneNotifyEvent(
+        method=SwapController._MODEL_DONE_NOTIFY_METHOD, modelID=modelID,
+        exitStatus=0, endTime=time.time())
+
+    for modelID in ("a", "b", "c"):
+      runModel(modelID)
+
+    # Only the two most recently assigned models are remembered
+    self.assertEqual(sc._lastSlotIndexByModel.keys(), ["b", "c"])
+
+    # Reassigning a model makes it the most recently assigned one
+    lastSlotIndex = sc._lastSlotIndexByModel["b"]
+    sc._assignModelToFreeSlot("b")
+
+    self.assertEqual(sc._runningModelsMap["b"].slotIndex, lastSlotIndex)
+    self.assertEqual(sc._lastSlotIndexByModel.keys(), ["c", "b"])
+
+
   @patch.object(swap_controller, "ModelSwapperInterface", autospec=True,
                 return_value=_createModelSwapperInterfaceInstanceMock())
   @patch.object(swap_controller, "SlotAgent", autospec=True)
@@ -369,7 +434,7 @@ class TestSwapController(unittest.TestCase):
       modelID: modelInputDesc
     }
     slotAgents = []
-    slotAgentClassMock.side_effect = (lambda slotID:
+    slotAgentClassMock.side_effect = (lambda slotID, residentModels:
       slotAgents.append(
         _DummySlotAgent(slotID, modelInputDescriptors.__getitem__))
       or slotAgents[-1])
@@ -479,7 +544,7 @@ class TestSwapController(unittest.TestCase):
       for modelID in modelIDs)
 
     slotAgents = []
-    slotAgentClassMock.side_effect = (lambda slotID:
+    slotAgentClassMock.side_effect = (lambda slotID, residentModels:
       slotAgents.append(
         _DummySlotAgent(slotID, modelInputDescriptors.__getitem__))
       or slotAgents[-1])
@@ -504,12 +569,15 @@ class TestSwapController(unittest.TestCase):
       name="runSwapControllerThread",
       args=(sc, runResultQ))
     scThread.setDaemon(True)
-    scThread.start()
 
-    # Prod SwapController to process all models
+    # Prod SwapController to process all models; enqueue the notifications
+    # before starting it, so that each model's first notification precedes the
+    # notifications of models that are preempted and need to run again
     for modelID in modelIDs:
       notificationConsumer.q.put(_createModelInputNotification(modelID))
 
+    scThread.start()
+
     # Wait for model input queues to drain
     for modelID, desc in modelInputDescriptors.iteritems():
       g_logger.info("Waiting for model=%s inputQ to be empty", modelID)
@@ -0,0 +1,149 @@
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2015, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+"""Unit test for htmengine.repository.metric_data_partitions
+"""
+
+from datetime import date
+import unittest
+
+from mock import Mock
+
+from htmengine.repository import metric_data_partitions
+from htmengine.repository.metric_data_partitions import MetricDataPartition
+
+
+
+class MetricDataPartitionsTestCase(unittest.TestCase):
+
+
+  def testGetMetricDataPartitions(self):
+    conn = Mock()
+    # NOTE: TO_DAYS("2015-11-10") is 736277
+    conn.execute.return_value = [("p_start", "736277", 10),
+                                 ("p20151110", "736278", 20),
+                                 ("p_future", "MAXVALUE", 0)]
+
+    partitions = metric_data_partitions.getMetricDataPartitions(conn)
+
+    self.assertEqual(
+      partitions,
+      [MetricDataPartition("p_start", date(2015, 11, 10), 10),
+       MetricDataPartition("p20151110", date(2015, 11, 11), 20),
+       MetricDataPartition("p_future", None, 0)])
+
+
+  def testGetPartitionDays(self):
+    self.assertEqual(
+      metric_data_partitions.getPartitionDays(
+        [MetricDataPartition("p_start", date(2015, 11, 2), 0),
+         MetricDataPartition("p20151102", date(2015, 11, 9), 0),
+         MetricDataPartition("p_future", None, 0)]),
+      7)
+
+    self.assertEqual(
+      metric_data_partitions.getPartitionDays(
+        [MetricDataPartition("p_start", date(2015, 11, 2), 0),
+         MetricDataPartition("p_future", None, 0)],
+        default=3),
+      3)
+
+    # Weekly partitions are assumed by default
+    self.assertEqual(
+      metric_data_partitions.getPartitionDays(
+        [MetricDataPartition("p_start", date(2015, 11, 2), 0),
+         MetricDataPartition("p_future", None, 0)]),
+      7)
+
+
+  def testPartitionMetricDataTable(self):
+    conn = Mock()
+
+    metric_data_partitions.partitionMetricDataTable(
+      conn,
+      firstDay=date(2015, 11, 10),
+      lastDay=date(2015, 11, 12),
+      partitionDays=1)
+
+    self.assertEqual(conn.execute.call_count, 2)
+    self.assertEqual(
+      conn.execute.call_args_list[0][0][0],
+      "ALTER TABLE metric_data DROP FOREIGN KEY metric_data_to_metric_fk")
+    self.assertEqual(
+      conn.execute.call_args_list[1][0][0],
+      "ALTER TABLE metric_data "
+      "DROP PRIMARY KEY, ADD PRIMARY KEY (uid, rowid, timestamp) "
+      "PARTITION BY RANGE (TO_DAYS(timestamp)) ("
+      "PARTITION p_start VALUES LESS THAN (736277), "
+      "PARTITION p20151110 VALUES LESS THAN (736278), "
+      "PARTITION p20151111 VALUES LESS THAN (736279), "
+      "PARTITION p20151112 VALUES LESS THAN (736280), "
+      "PARTITION p_future VALUES LESS THAN MAXVALUE)")
+
+
+  def testAddMetricDataPartitions(self):
+    conn = Mock()
+
+    partitions = [MetricDataPartition("p_start", date(2015, 11, 2), 0),
+                  MetricDataPartition("p20151102", date(2015, 11, 9), 0),
+                  MetricDataPartition("p_future", None, 0)]
+
+    addedPartitions = metric_data_partitions.addMetricDataPartitions(
+      conn, partitions=partitions, lastDay=date(2015, 11, 16),
+      partitionDays=7)
+
+    self.assertEqual(addedPartitions, ["p20151109", "p20151116"])
+
+    conn.execute.assert_called_once_with(
+      "ALTER TABLE metric_data REORGANIZE PARTITION p_future INTO ("
+      "PARTITION p20151109 VALUES LESS THAN (736283), "
+      "PARTITION p20151116 VALUES LESS THAN (736290), "
+      "PARTITION p_future VALUES LESS THAN MAXVALUE)")
+
+
+  def testAddMetricDataPartitionsAlreadyCovered(self):
+    conn = Mock()
+
+    partitions = [MetricDataPartition("p_start", date(2015, 11, 2), 0),
+                  MetricDataPartition("p20151102", date(2015, 11, 9), 0),
+                  MetricDataPartition("p_future", None, 0)]
+
+    addedPartitions = metric_data_partitions.addMetricDataPartitions(
+      conn, partitions=partitions, lastDay=date(2015, 11, 8),
+      partitionDays=7)
+
+    self.assertEqual(addedPartitions, [])
+    self.assertEqual(conn.execute.call_count, 0)
+
+
+  def testDropMetricDataPartitions(self):
+    conn = Mock()
+
+    metric_data_partitions.dropMetricDataPartitions(
+      conn, ["p_start", "p20151102"])
+
+    conn.execute.assert_called_once_with(
+      "ALTER TABLE metric_data DROP PARTITION p_start, p20151102")
+
+
+
+if __name__ == "__main__":
+  unittest.main()
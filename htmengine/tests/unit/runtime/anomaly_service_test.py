@@ -43,6 +43,7 @@ import validictory
 
 from nta.utils.date_time_utils import epochFromNaiveUTCDatetime
 from nta.utils.logging_support_raw import LoggingSupport
+from nta.utils.test_utils.config_test_utils import ConfigAttributePatch
 
 from htmengine import htmengineerrno
 import htmengine.exceptions as app_exceptions
@@ -944,5 +945,171 @@ class UpdateAnomalyLikelihoodParamsTestCase(unittest.TestCase):
         json.dumps({"anomalyLikelihoodParams": "likelihood-state"})})
 
 
+
+def _createResultBatch(modelID, rowID):
+  return model_swapper_interface._ConsumedResultBatch(
+    modelID=modelID,
+    objects=[ModelInferenceResult(rowID=rowID, status=0, anomalyScore=0)],
+    ack=Mock(spec_set=(lambda multiple: None)))
+
+
+
+class ShardedResultBatchDispatcherTestCase(unittest.TestCase):
+  """ Unit tests for parallel processing of result batches """
+
+
+  def testBatchesOfModelAreDispatchedToSameWorkerInOrder(self):
+    dispatcher = anomaly_service._ShardedResultBatchDispatcher(
+      numWorkers=3, workerType="thread")
+
+    modelIDs = ["model%d" % (i,) for i in xrange(10)]
+    batches = [_createResultBatch(modelID, rowID)
+               for rowID in xrange(5)
+               for modelID in modelIDs]
+
+    for batch in batches:
+      dispatcher.dispatch(batch)
+
+    self.assertEqual(dispatcher.numBatchesInFlight, len(batches))
+
+    # The workers weren't started, so the tasks remain in their queues
+    tasksByModel = dict()
+    for workerIndex, taskQueue in enumerate(dispatcher._taskQueues):
+      while not taskQueue.empty():
+        sequence, modelID, results = taskQueue.get_nowait()
+        self.assertEqual(dispatcher.getWorkerIndex(modelID), workerIndex)
+        tasksByModel.setdefault(modelID, []).append((sequence, results))
+
+    self.assertItemsEqual(tasksByModel.keys(), modelIDs)
+
+    for modelID, tasks in tasksByModel.iteritems():
+      self.assertEqual(
+        tasks,
+        [(sequence, batch.objects)
+         for sequence, batch in enumerate(batches)
+         if batch.modelID == modelID])
+
+    self.assertGreater(
+      len(set(dispatcher.getWorkerIndex(modelID) for modelID in modelIDs)), 1)
+
+
+  def testBatchesAreAckedInDeliveryOrder(self):
+    dispatcher = anomaly_service._ShardedResultBatchDispatcher(
+      numWorkers=2, workerType="thread")
+
+    batches = [_createResultBatch("model%d" % (i,), rowID=1)
+               for i in xrange(4)]
+    for batch in batches:
+      dispatcher.dispatch(batch)
+
+    # Completion of later batches doesn't ack them while an earlier one is
+    # still in flight
+    dispatcher._handleCompletion(1, None)
+    dispatcher._handleCompletion(2, None)
+    dispatcher._ackCompletedBatches()
+
+    for batch in batches:
+      self.assertFalse(batch.ack.called)
+    self.assertEqual(dispatcher.numBatchesInFlight, 4)
+
+    # Completion of the earliest batch acks the run of completed batches with a
+    # single multiple-ack
+    dispatcher._handleCompletion(0, None)
+    dispatcher._ackCompletedBatches()
+
+    self.assertFalse(batches[0].ack.called)
+    self.assertFalse(batches[1].ack.called)
+    batches[2].ack.assert_called_once_with(multiple=True)
+    self.assertFalse(batches[3].ack.called)
+    self.assertEqual(dispatcher.numBatchesInFlight, 1)
+
+    dispatcher._handleCompletion(3, None)
+    dispatcher._ackCompletedBatches()
+
+    batches[3].ack.assert_called_once_with(multiple=True)
+    self.assertEqual(dispatcher.numBatchesInFlight, 0)
+
+
+  def testWorkerErrorIsRaised(self):
+    dispatcher = anomaly_service._ShardedResultBatchDispatcher(
+      numWorkers=2, workerType="thread")
+
+    dispatcher.dispatch(_createResultBatch("model1", rowID=1))
+
+    with self.assertRaises(anomaly_service.ResultBatchWorkerError):
+      dispatcher._handleCompletion(0, "Traceback: ...")
+
+
+  def testUnknownWorkerType(self):
+    with self.assertRaises(ValueError):
+      anomaly_service._ShardedResultBatchDispatcher(numWorkers=2,
+                                                    workerType="fiber")
+
+
+  @patch("htmengine.runtime.anomaly_service.amqp", autospec=True)
+  @patch.object(anomaly_service, "MessageBusConnector", autospec=True)
+  @patch.object(anomaly_service, "ModelSwapperInterface", autospec=True)
+  @patch.object(anomaly_service.AnomalyService, "_processResultBatch",
+                autospec=True)
+  def testRunWithThreadWorkers(self, processResultBatchMock,
+                               ModelSwapperInterfaceMock, *_args):
+    batches = [_createResultBatch("model%d" % (i % 3,), rowID=i)
+               for i in xrange(9)]
+
+    modelSwapperMock = (
+      ModelSwapperInterfaceMock.return_value.__enter__.return_value)
+    modelSwapperMock.consumeResults.return_value = MagicMock(
+      __enter__=Mock(return_value=batches))
+    modelSwapperMock.resultsPending.return_value = False
+
+    with ConfigAttributePatch(
+        anomaly_service.config.CONFIG_NAME,
+        anomaly_service.config.baseConfigDir,
+        (("anomaly_service", "num_workers", "2"),
+         ("anomaly_service", "worker_type", "thread"))):
+      anomaly_service.AnomalyService().run()
+
+    modelSwapperMock.consumeResults.assert_called_once_with(prefetchMax=8)
+
+    self.assertEqual(
+      [(batch.modelID, batch.objects)
+       for batch in batches],
+      sorted(
+        [(callArgs[0][1], callArgs[0][2])
+         for callArgs in processResultBatchMock.call_args_list],
+        key=lambda (_modelID, results): results[0].rowID))
+
+    # The results queue was empty, so each batch was acked as it was completed
+    for batch in batches:
+      batch.ack.assert_called_once_with(multiple=True)
+
+
+  @patch("htmengine.runtime.anomaly_service.amqp", autospec=True)
+  @patch.object(anomaly_service, "MessageBusConnector", autospec=True)
+  @patch.object(anomaly_service, "ModelSwapperInterface", autospec=True)
+  @patch.object(anomaly_service.AnomalyService, "_processResultBatch",
+                autospec=True, side_effect=Exception("from test"))
+  def testRunWithFailedThreadWorker(self, _processResultBatchMock,
+                                    ModelSwapperInterfaceMock, *_args):
+    batch = _createResultBatch("model1", rowID=1)
+
+    modelSwapperMock = (
+      ModelSwapperInterfaceMock.return_value.__enter__.return_value)
+    modelSwapperMock.consumeResults.return_value = MagicMock(
+      __enter__=Mock(return_value=[batch]))
+    modelSwapperMock.resultsPending.return_value = False
+
+    with ConfigAttributePatch(
+        anomaly_service.config.CONFIG_NAME,
+        anomaly_service.config.baseConfigDir,
+        (("anomaly_service", "num_workers", "2"),
+         ("anomaly_service", "worker_type", "thread"))):
+      with self.assertRaises(anomaly_service.ResultBatchWorkerError):
+        anomaly_service.AnomalyService().run()
+
+    self.assertFalse(batch.ack.called)
+
+
+
 if __name__ == '__main__':
   unittest.main()
@@ -27,6 +27,7 @@ htmengine.runtime.metric_garbage_collector.purgeOldMetricDataRows
 # pylint: disable=W0212
 
 
+from datetime import date, datetime
 import itertools
 import unittest
 
@@ -36,6 +37,7 @@ from mock import patch
 from nta.utils.logging_support_raw import LoggingSupport
 
 import htmengine.repository
+from htmengine.repository.metric_data_partitions import MetricDataPartition
 from htmengine.runtime import metric_garbage_collector
 
 
@@ -45,6 +47,8 @@ def setUpModule():
 
 
 
+@patch("htmengine.runtime.metric_garbage_collector"
+       "._getMetricDataPartitions", new=mock.Mock(return_value=[]))
 @patch("htmengine.runtime.metric_garbage_collector"
        "._deleteRows", autospec=True)
 @patch("htmengine.runtime.metric_garbage_collector"
@@ -180,3 +184,99 @@ class PurgeOldMetricDataRowsUnitTestCase(unittest.TestCase):
 
     # Make sure it didn't try to retrieve candidates beyond estimated number
     self.assertEqual(len(tuple(candidatesIter)), 1)
+
+
+
+@patch("htmengine.runtime.metric_garbage_collector"
+       "._dropMetricDataPartitions", autospec=True)
+@patch("htmengine.runtime.metric_garbage_collector"
+       "._addMetricDataPartitions", autospec=True)
+@patch("htmengine.runtime.metric_garbage_collector"
+       "._getMetricDataPartitions", autospec=True)
+@patch("htmengine.runtime.metric_garbage_collector"
+       "._estimateNumRowsToDelete", autospec=True)
+@patch("htmengine.runtime.metric_garbage_collector"
+       ".htmengine.repository",
+       new=mock.Mock(spec_set=htmengine.repository))
+@patch("htmengine.runtime.metric_garbage_collector.datetime", autospec=True)
+class PurgeOldMetricDataPartitionsUnitTestCase(unittest.TestCase):
+
+
+  def testPurgeOldMetricDataRowsDropsExpiredPartitions(
+      self,
+      datetimeMock,
+      estimateNumRowsToDeleteMock,
+      getMetricDataPartitionsMock,
+      addMetricDataPartitionsMock,
+      dropMetricDataPartitionsMock):
+
+    datetimeMock.utcnow.return_value = datetime(2015, 11, 12, 13, 14, 15)
+
+    partitions = [
+      MetricDataPartition("p_start", date(2015, 8, 13), 1000),
+      MetricDataPartition("p20150813", date(2015, 8, 14), 100),
+      MetricDataPartition("p20150814", date(2015, 8, 15), 10),
+      MetricDataPartition("p20150815", date(2015, 8, 16), 1),
+      MetricDataPartition("p20151117", date(2015, 11, 18), 0),
+      MetricDataPartition("p20151118", date(2015, 11, 19), 0),
+      MetricDataPartition("p_future", None, 0)
+    ]
+    getMetricDataPartitionsMock.return_value = partitions
+    addMetricDataPartitionsMock.return_value = ["p20151119"]
+
+    # Execute
+    numDeleted = metric_garbage_collector.purgeOldMetricDataRows(
+      thresholdDays=90)
+
+    # Only partitions that end by the start of 2015-08-14 are entirely older
+    # than 90 days
+    self.assertEqual(numDeleted, 1100)
+
+    dropMetricDataPartitionsMock.assert_called_once_with(
+      sqlEngine=mock.ANY, partitionNames=["p_start", "p20150813"])
+
+    addMetricDataPartitionsMock.assert_called_once_with(
+      sqlEngine=mock.ANY,
+      partitions=partitions,
+      lastDay=date(2015, 11, 19),
+      partitionDays=1)
+
+    # Rows are not deleted individually
+    self.assertEqual(estimateNumRowsToDeleteMock.call_count, 0)
+
+
+  def testPurgeOldMetricDataRowsWithoutExpiredPartitions(
+      self,
+      datetimeMock,
+      estimateNumRowsToDeleteMock,
+      getMetricDataPartitionsMock,
+      addMetricDataPartitionsMock,
+      dropMetricDataPartitionsMock):
+
+    datetimeMock.utcnow.return_value = datetime(2015, 11, 12, 13, 14, 15)
+
+    partitions = [
+      MetricDataPartition("p_start", date(2015, 10, 1), 1000),
+      MetricDataPartition("p20151001", date(2015, 10, 8), 100),
+      MetricDataPartition("p20151008", date(2015, 10, 15), 10),
+      MetricDataPartition("p_future", None, 0)
+    ]
+    getMetricDataPartitionsMock.return_value = partitions
+    addMetricDataPartitionsMock.return_value = []
+
+    # Execute
+    numDeleted = metric_garbage_collector.purgeOldMetricDataRows(
+      thresholdDays=90)
+
+    self.assertEqual(numDeleted, 0)
+
+    self.assertEqual(dropMetricDataPartitionsMock.call_count, 0)
+
+    # Weekly partitions are extended by weekly partitions
+    addMetricDataPartitionsMock.assert_called_once_with(
+      sqlEngine=mock.ANY,
+      partitions=partitions,
+      lastDay=date(2015, 11, 19),
+      partitionDays=7)
+
+    self.assertEqual(estimateNumRowsToDeleteMock.call_count, 0)
@@ -22,7 +22,10 @@
 
 """Tests the metric listener."""
 
+import datetime
 import socket
+import threading
+import time
 import unittest
 
 import mock
@@ -51,6 +54,61 @@ class MetricListenerTest(unittest.TestCase):
     self.assertEqual(dt.second, 55)
 
 
+  def testParseBinarySamples(self):
+    data = (metric_listener.packBinarySample("test.metric", 4.5, 1386792175) +
+            metric_listener.packBinarySample(u"test.metric\u00e9", -1.0,
+                                             1386792175) +
+            metric_listener.packBinarySample("", 0.0, 0))
+
+    samples = metric_listener.parseBinarySamples(data)
+
+    self.assertEqual(
+      samples,
+      [("test.metric", 4.5, datetime.datetime(2013, 12, 11, 20, 2, 55)),
+       ("test.metric\xc3\xa9", -1.0, datetime.datetime(2013, 12, 11, 20, 2, 55)),
+       ("", 0.0, datetime.datetime(1970, 1, 1))])
+
+    # Records that start at an offset
+    self.assertEqual(metric_listener.parseBinarySamples("xy" + data, 2),
+                     samples)
+
+    # Truncated records
+    for end in (1, 5, len(data) - 1):
+      with self.assertRaises(ValueError):
+        metric_listener.parseBinarySamples(data[:end])
+
+
+  def testGetCompleteBinaryRecordsLength(self):
+    record = metric_listener.packBinarySample("test.metric", 4.5, 1386792175)
+
+    for data, expectedLength in (("", 0),
+                                 (record[:1], 0),
+                                 (record[:-1], 0),
+                                 (record, len(record)),
+                                 (record * 2 + record[:3], len(record) * 2)):
+      self.assertEqual(
+        metric_listener._getCompleteBinaryRecordsLength(data),
+        expectedLength)
+
+
+  @patch.object(Protocol, "current", Protocol.BINARY)
+  def testForwardDataInBinaryProtocol(self):
+    records = [
+      metric_listener.packBinarySample("metric.a", 1.0, 1386120789),
+      (metric_listener.packBinarySample("metric.b", 2.0, 1386120789) +
+       metric_listener.packBinarySample("metric.c", 3.0, 1386120799))]
+
+    messageBus = Mock(spec_set=["publish", "createMessageQueue"])
+    metric_listener._forwardData(messageBus, records)
+
+    self.assertEqual(messageBus.publish.call_count, 1)
+    body = messageBus.publish.call_args[1]["body"]
+
+    # Records are concatenated as received behind the binary message prefix
+    self.assertEqual(body, metric_listener.BINARY_MESSAGE_PREFIX +
+                     "".join(records))
+
+
   @patch.object(metric_listener, "MessageBusConnector", autospec=True)
   @patch.object(metric_listener, "_forwardData", autospec=True)
   def testPlaintextTCP(self, forwardDataMock,
@@ -122,5 +180,329 @@ class MetricListenerTest(unittest.TestCase):
 
 
 
+
+@patch.object(metric_listener, "MessageBusConnector", autospec=True)
+@patch.object(metric_listener, "_forwardData", autospec=True)
+class EventLoopServerTest(unittest.TestCase):
+
+
+  def _startServer(self, transport, protocol=Protocol.PLAIN):
+    server = metric_listener.EventLoopServer(("127.0.0.1", 0), transport,
+                                             protocol)
+    self.addCleanup(server.server_close)
+
+    serverThread = threading.Thread(target=server.serve_forever,
+                                    kwargs=dict(poll_interval=0.05))
+    serverThread.setDaemon(True)
+    serverThread.start()
+    self.addCleanup(serverThread.join)
+    self.addCleanup(server.shutdown)
+
+    return server
+
+
+  @staticmethod
+  def _waitForSamples(forwardDataMock, numSamples):
+    deadline = time.time() + 5
+    while time.time() < deadline:
+      forwarded = [sample
+                   for callArgs in forwardDataMock.call_args_list
+                   for sample in callArgs[0][1]]
+      if len(forwarded) >= numSamples:
+        return forwarded
+      time.sleep(0.01)
+    return forwarded
+
+
+  def testPlaintextTCPWithMultipleClients(self, forwardDataMock,
+                                          messageBusConnectorClassMock):
+    server = self._startServer(metric_listener.Transport.TCP)
+
+    clients = []
+    for _ in xrange(3):
+      client = socket.create_connection(server.server_address)
+      clients.append(client)
+
+    # Lines split across sends and a final line without newline
+    clients[0].sendall("metric.a 1 1386120789\nmetric.a 2 13861")
+    clients[1].sendall("metric.b 1 1386120789\n")
+    clients[2].sendall("metric.c 1 1386120789\n\nmetric.c 2 1386120799\n")
+    time.sleep(0.1)
+    clients[0].sendall("20799\nmetric.a 3 1386120809")
+    for client in clients:
+      client.close()
+
+    forwarded = self._waitForSamples(forwardDataMock, 6)
+
+    self.assertItemsEqual(
+      forwarded,
+      ["metric.a 1 1386120789",
+       "metric.a 2 1386120799",
+       "metric.a 3 1386120809",
+       "metric.b 1 1386120789",
+       "metric.c 1 1386120789",
+       "metric.c 2 1386120799"])
+
+    # Samples of each client are forwarded in order
+    for metricName in ("metric.a", "metric.c"):
+      samples = [sample for sample in forwarded
+                 if sample.startswith(metricName)]
+      self.assertEqual(samples, sorted(samples))
+
+    # All clients share a single message bus connection
+    self.assertEqual(messageBusConnectorClassMock.call_count, 1)
+    for callArgs in forwardDataMock.call_args_list:
+      self.assertIs(
+        callArgs[0][0],
+        messageBusConnectorClassMock.return_value.__enter__.return_value)
+
+
+  def testPlaintextTCPBatchSizeLimit(self, forwardDataMock,
+                                     _messageBusConnectorClassMock):
+    server = self._startServer(metric_listener.Transport.TCP)
+
+    numSamples = metric_listener._MAX_BATCH_SIZE * 2 + 1
+    client = socket.create_connection(server.server_address)
+    client.sendall("".join("metric.a %d 1386120789\n" % (i,)
+                           for i in xrange(numSamples)))
+    client.close()
+
+    forwarded = self._waitForSamples(forwardDataMock, numSamples)
+
+    self.assertEqual(forwarded,
+                     ["metric.a %d 1386120789" % (i,)
+                      for i in xrange(numSamples)])
+
+    for callArgs in forwardDataMock.call_args_list:
+      self.assertLessEqual(len(callArgs[0][1]), metric_listener._MAX_BATCH_SIZE)
+
+
+  def testPlaintextUDP(self, forwardDataMock, messageBusConnectorClassMock):
+    server = self._startServer(metric_listener.Transport.UDP)
+
+    client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    self.addCleanup(client.close)
+    for i in xrange(5):
+      client.sendto("metric.a %d 1386120789\n" % (i,), server.server_address)
+
+    forwarded = self._waitForSamples(forwardDataMock, 5)
+
+    self.assertEqual(forwarded,
+                     ["metric.a %d 1386120789" % (i,) for i in xrange(5)])
+
+    self.assertEqual(messageBusConnectorClassMock.call_count, 1)
+
+
+  def testBinaryTCP(self, forwardDataMock, _messageBusConnectorClassMock):
+    server = self._startServer(metric_listener.Transport.TCP,
+                               Protocol.BINARY)
+
+    records = [metric_listener.packBinarySample("metric.%d" % (i,), i,
+                                                1386120789 + i)
+               for i in xrange(5)]
+    data = "".join(records)
+
+    # Records split across sends, and an incomplete record at EOF
+    client = socket.create_connection(server.server_address)
+    client.sendall(data[:len(records[0]) + 3])
+    time.sleep(0.1)
+    client.sendall(data[len(records[0]) + 3:] + records[0][:-1])
+    client.close()
+
+    forwarded = self._waitForSamples(forwardDataMock, 2)
+
+    # Only complete records are forwarded, without being re-encoded
+    self.assertEqual("".join(forwarded), data)
+    self.assertEqual(forwarded[0], records[0])
+
+
+  def testBinaryUDP(self, forwardDataMock, _messageBusConnectorClassMock):
+    server = self._startServer(metric_listener.Transport.UDP,
+                               Protocol.BINARY)
+
+    record1 = metric_listener.packBinarySample("metric.a", 1.0, 1386120789)
+    record2 = metric_listener.packBinarySample("metric.b", 2.0, 1386120789)
+
+    client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    self.addCleanup(client.close)
+    client.sendto(record1 + record2, server.server_address)
+    # Datagram with a truncated trailing record
+    client.sendto(record2 + record1[:-1], server.server_address)
+
+    forwarded = self._waitForSamples(forwardDataMock, 2)
+
+    self.assertEqual(forwarded, [record1 + record2, record2])
+
+
+
+
+@patch.object(metric_listener, "MessageBusConnector", autospec=True)
+@patch.object(metric_listener, "_forwardData", autospec=True)
+class SampleCoalescerTest(unittest.TestCase):
+
+
+  def testMessagesAreCappedBySize(self, forwardDataMock,
+                                  messageBusConnectorClassMock):
+    samples = ["metric.a %d 1386120789" % (i,) for i in xrange(1000)]
+
+    coalescer = metric_listener._SampleCoalescer(maxMessageBytes=1000,
+                                                 lingerSec=60,
+                                                 maxPendingBytes=10 ** 6)
+    coalescer.start()
+    for i in xrange(0, len(samples), 7):
+      coalescer.add(samples[i:i + 7])
+    coalescer.close()
+
+    messages = [callArgs[0][1] for callArgs in forwardDataMock.call_args_list]
+
+    self.assertEqual([sample for message in messages for sample in message],
+                     samples)
+
+    for message in messages:
+      self.assertLessEqual(
+        sum(len(sample) + metric_listener._SampleCoalescer
+            ._SAMPLE_OVERHEAD_BYTES
+            for sample in message),
+        1000)
+
+    # Only the last message may be short of the size cap
+    self.assertGreater(len(messages[0]), 30)
+    self.assertLess(len(messages), 40)
+
+    self.assertEqual(messageBusConnectorClassMock.call_count, 1)
+
+
+  def testSamplesArePublishedAfterLingerTime(self, forwardDataMock,
+                                             _messageBusConnectorClassMock):
+    published = threading.Event()
+    forwardDataMock.side_effect = lambda *_args, **_kwargs: published.set()
+
+    publisherIdle = threading.Event()
+
+    coalescer = metric_listener._SampleCoalescer(maxMessageBytes=10 ** 6,
+                                                 lingerSec=0.05,
+                                                 maxPendingBytes=10 ** 7)
+
+    with patch.object(metric_listener, "_confirmForwardedData", autospec=True,
+                      side_effect=lambda *_args: publisherIdle.set()):
+      coalescer.start()
+      self.addCleanup(coalescer.close)
+
+      # Add a lone sample only once the publisher waits for samples
+      self.assertTrue(publisherIdle.wait(5))
+      time.sleep(0.1)
+
+      coalescer.add(["metric.a 1 1386120789"])
+
+      self.assertTrue(published.wait(2))
+
+    forwardDataMock.assert_called_once_with(
+      mock.ANY, ["metric.a 1 1386120789"], waitForConfirm=False)
+
+
+  def testPipelinedMessagesAreConfirmedBeforeWaiting(
+      self, forwardDataMock, messageBusConnectorClassMock):
+    messageBusMock = (messageBusConnectorClassMock.return_value
+                      .__enter__.return_value)
+
+    events = []
+    confirmed = threading.Event()
+    forwardDataMock.side_effect = (
+      lambda _messageBus, data, **_kwargs: events.append(("forward", data)))
+
+    def waitForConfirms():
+      events.append(("confirm",))
+      confirmed.set()
+
+    messageBusMock.waitForConfirms.side_effect = waitForConfirms
+
+    coalescer = metric_listener._SampleCoalescer(maxMessageBytes=50,
+                                                 lingerSec=60,
+                                                 maxPendingBytes=10 ** 6)
+    self.addCleanup(coalescer.close)
+
+    samples = ["metric.a %d 1386120789" % (i,) for i in xrange(4)]
+    coalescer.add(samples)
+    coalescer.start()
+
+    self.assertTrue(confirmed.wait(5))
+
+    # Messages that are ready together are pipelined, then confirmed together
+    self.assertEqual(events, [("forward", samples[:2]),
+                              ("forward", samples[2:]),
+                              ("confirm",)])
+    for callArgs in forwardDataMock.call_args_list:
+      self.assertEqual(callArgs[1], dict(waitForConfirm=False))
+
+
+  def testBackpressure(self, forwardDataMock, _messageBusConnectorClassMock):
+    brokerReady = threading.Event()
+    forwardDataMock.side_effect = (
+      lambda *_args, **_kwargs: brokerReady.wait(5))
+
+    coalescer = metric_listener._SampleCoalescer(maxMessageBytes=100,
+                                                 lingerSec=0,
+                                                 maxPendingBytes=200)
+    coalescer.start()
+    self.addCleanup(coalescer.close)
+
+    producerDone = threading.Event()
+
+    def produce():
+      for i in xrange(100):
+        coalescer.add(["metric.a %d 1386120789" % (i,)])
+      producerDone.set()
+
+    producer = threading.Thread(target=produce)
+    producer.setDaemon(True)
+    producer.start()
+
+    # The producer is blocked while the message bus doesn't accept messages
+    self.assertFalse(producerDone.wait(0.2))
+    self.assertLessEqual(coalescer._pendingBytes, 200 + 100)
+
+    brokerReady.set()
+    self.assertTrue(producerDone.wait(5))
+
+    coalescer.close()
+
+    self.assertEqual(
+      [sample
+       for callArgs in forwardDataMock.call_args_list
+       for sample in callArgs[0][1]],
+      ["metric.a %d 1386120789" % (i,) for i in xrange(100)])
+
+
+  def testTCPHandlerForwardsToCoalescer(self, forwardDataMock,
+                                        messageBusConnectorClassMock):
+    coalescerMock = Mock(spec_set=metric_listener._SampleCoalescer)
+
+    samples = ["test.metric 4 1386120789\n", "test.metric 5 1386120799"]
+
+    def recvIntoMock(buf):
+      if not samples:
+        return 0
+      data = samples.pop(0)
+      buf[0:len(data)] = data[:]
+      return len(data)
+
+    mockSock = MagicMock(
+      spec_set=socket.socket,
+      recv_into=Mock(spec_set=socket.socket.recv_into,
+                     side_effect=recvIntoMock))
+
+    with patch.object(metric_listener, "gCoalescer", new=coalescerMock):
+      TCPHandler(request=mockSock,
+                 client_address=("127.0.0.1", 2999),
+                 server=MagicMock(concurrencyTracker=MagicMock(
+                   spec=metric_listener.threading_utils.ThreadsafeCounter)))
+
+    coalescerMock.add.assert_called_once_with(
+      ["test.metric 4 1386120789", "test.metric 5 1386120799"])
+    self.assertFalse(forwardDataMock.called)
+    self.assertFalse(messageBusConnectorClassMock.called)
+
+
+
 if __name__ == "__main__":
   unittest.main()
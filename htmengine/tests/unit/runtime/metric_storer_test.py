@@ -32,6 +32,7 @@ import mock
 from mock import MagicMock, Mock, patch
 
 from htmengine.model_swapper import model_swapper_interface
+from htmengine.runtime import metric_listener
 from htmengine.runtime import metric_storer
 from htmengine.runtime import metric_streamer_util
 
@@ -56,8 +57,9 @@ class MetricStorerTest(unittest.TestCase):
 
     metricStreamerMock = MagicMock(
       spec_set=metric_streamer_util.MetricStreamer,
-      streamMetricData=Mock(
-        spec_set=metric_streamer_util.MetricStreamer.streamMetricData))
+      streamMetricDataBatch=Mock(
+        spec_set=metric_streamer_util.MetricStreamer.streamMetricDataBatch,
+        return_value=set()))
 
     body = '{"protocol": "plain", "data": ["test.metric 4.0 1386792175"]}'
 
@@ -71,15 +73,132 @@ class MetricStorerTest(unittest.TestCase):
 
     # Check the results
     addMetricMock.assert_called_once_with(mockEngine, "test.metric")
-    self.assertEqual(metricStreamerMock.streamMetricData.call_count, 1)
-    data, _uid, modelSwapper = metricStreamerMock.streamMetricData.call_args[0]
+    self.assertEqual(metricStreamerMock.streamMetricDataBatch.call_count, 1)
+    dataByMetricID, modelSwapper = (
+      metricStreamerMock.streamMetricDataBatch.call_args[0])
     self.assertIs(modelSwapper, modelSwapperMock)
+    self.assertEqual(dataByMetricID.keys(), [metricMock.uid])
+    data = dataByMetricID[metricMock.uid]
     self.assertEqual(len(data), 1)
     self.assertEqual(len(data[0]), 2)
     self.assertEqual(repr(data[0][0]),
                      "datetime.datetime(2013, 12, 11, 20, 2, 55)")
     self.assertAlmostEqual(data[0][1], 4.0)
 
+  @patch("htmengine.runtime.metric_storer._addMetric")
+  @patch("sqlalchemy.engine")
+  def testHandleBatchMultipleMetrics(self, mockEngine, addMetricMock):
+    metricMock1 = MagicMock(uid="uid1")
+    metricMock2 = MagicMock(uid="uid2")
+    recreatedMetricMock2 = MagicMock(uid="uid2-recreated")
+
+    metric_storer.gCustomMetrics = {
+      "test.metric1": [metricMock1, datetime.datetime.utcnow()],
+      "test.metric2": [metricMock2, datetime.datetime.utcnow()]}
+
+    def addMetricSideEffect(_engine, metricName):
+      self.assertEqual(metricName, "test.metric2")
+      metric_storer.gCustomMetrics[metricName] = [
+        recreatedMetricMock2, datetime.datetime.utcnow()]
+
+    addMetricMock.side_effect = addMetricSideEffect
+
+    modelSwapperMock = MagicMock(
+      spec_set=model_swapper_interface.ModelSwapperInterface)
+
+    # Simulate test.metric2 having been deleted and re-created
+    metricStreamerMock = MagicMock(
+      spec_set=metric_streamer_util.MetricStreamer,
+      streamMetricDataBatch=Mock(
+        spec_set=metric_streamer_util.MetricStreamer.streamMetricDataBatch,
+        return_value=set(["uid2"])),
+      streamMetricData=Mock(
+        spec_set=metric_streamer_util.MetricStreamer.streamMetricData))
+
+    message1 = MagicMock(
+      body=('{"protocol": "plain", "data": ['
+            '"test.metric1 1.0 1386792175", "test.metric2 2.0 1386792175"]}'))
+    message2 = MagicMock(
+      body='{"protocol": "plain", "data": ["test.metric1 3.0 1386792475"]}')
+
+    # Call the function under test
+    metric_storer._handleBatch(mockEngine, [message1, message2], [],
+                               metricStreamerMock, modelSwapperMock)
+
+    # Data for both metrics is streamed in a single batch
+    self.assertEqual(metricStreamerMock.streamMetricDataBatch.call_count, 1)
+    dataByMetricID, modelSwapper = (
+      metricStreamerMock.streamMetricDataBatch.call_args[0])
+    self.assertIs(modelSwapper, modelSwapperMock)
+    self.assertItemsEqual(dataByMetricID.keys(), ["uid1", "uid2"])
+    self.assertEqual([value for _, value in dataByMetricID["uid1"]],
+                     [1.0, 3.0])
+    self.assertEqual([value for _, value in dataByMetricID["uid2"]], [2.0])
+
+    # Data of the missing metric is re-sent for the re-created metric
+    addMetricMock.assert_called_once_with(mockEngine, "test.metric2")
+    metricStreamerMock.streamMetricData.assert_called_once_with(
+      dataByMetricID["uid2"], "uid2-recreated", modelSwapperMock)
+
+
+  @patch("htmengine.runtime.metric_storer._addMetric")
+  @patch("sqlalchemy.engine")
+  def testHandleBatchBinary(self, mockEngine, addMetricMock):
+    metricMock1 = MagicMock(uid="uid1")
+    metricMock2 = MagicMock(uid="uid2")
+
+    metric_storer.gCustomMetrics = {
+      "test.metric1": [metricMock1, datetime.datetime.utcnow()],
+      "test.metric2": [metricMock2, datetime.datetime.utcnow()]}
+
+    modelSwapperMock = MagicMock(
+      spec_set=model_swapper_interface.ModelSwapperInterface)
+
+    metricStreamerMock = MagicMock(
+      spec_set=metric_streamer_util.MetricStreamer,
+      streamMetricDataBatch=Mock(
+        spec_set=metric_streamer_util.MetricStreamer.streamMetricDataBatch,
+        return_value=set()))
+
+    # Binary messages may be mixed with plaintext messages
+    message1 = MagicMock(
+      body=(metric_listener.BINARY_MESSAGE_PREFIX +
+            metric_listener.packBinarySample("test.metric1", 1.0, 1386792175) +
+            metric_listener.packBinarySample("test.metric2", 2.0, 1386792175)))
+    message2 = MagicMock(
+      body='{"protocol": "plain", "data": ["test.metric1 3.0 1386792475"]}')
+
+    metric_storer._handleBatch(mockEngine, [message1, message2], [],
+                               metricStreamerMock, modelSwapperMock)
+
+    self.assertFalse(addMetricMock.called)
+    self.assertEqual(metricStreamerMock.streamMetricDataBatch.call_count, 1)
+    dataByMetricID, _ = metricStreamerMock.streamMetricDataBatch.call_args[0]
+    self.assertEqual(
+      dataByMetricID,
+      {"uid1": [(datetime.datetime(2013, 12, 11, 20, 2, 55), 1.0),
+                (datetime.datetime(2013, 12, 11, 20, 7, 55), 3.0)],
+       "uid2": [(datetime.datetime(2013, 12, 11, 20, 2, 55), 2.0)]})
+
+
+  @patch.object(metric_storer, "LOGGER")
+  @patch("sqlalchemy.engine")
+  def testHandleDataInvalidBinaryBody(self, mockEngine, loggingMock):
+    """Make sure _handleData doesn't throw an exception for truncated binary
+    data."""
+    body = (metric_listener.BINARY_MESSAGE_PREFIX +
+            metric_listener.packBinarySample("test.metric", 4.0,
+                                             1386792175)[:-1])
+    message = MagicMock()
+    message.body = body
+    metricStreamerMock = MagicMock()
+    metric_storer._handleBatch(mockEngine, [message], [], metricStreamerMock,
+                               MagicMock())
+    # Check the results
+    self.assertTrue(loggingMock.warn.called)
+    self.assertFalse(metricStreamerMock.streamMetricDataBatch.called)
+
+
   @patch.object(metric_storer, "LOGGER")
   @patch("sqlalchemy.engine")
   def testHandleDataInvalidProtocol(self, mockEngine, loggingMock):
@@ -109,6 +228,36 @@ class MetricStorerTest(unittest.TestCase):
     self.assertTrue(loggingMock.warn.called)
 
 
+  @patch.object(metric_storer, "_handleBatch", autospec=True,
+                side_effect=Exception("Failed to handle batch"))
+  def testProcessBatchAcksBatchOnFailure(self, handleBatchMock):
+    messages = [MagicMock(), MagicMock()]
+
+    metric_storer._processBatch("engine", messages, [], "streamer", "swapper")
+
+    handleBatchMock.assert_called_once_with("engine", messages, [], "streamer",
+                                            "swapper")
+
+    # All messages are acked at once
+    messages[-1].ack.assert_called_once_with(multiple=True)
+    self.assertFalse(messages[0].ack.called)
+
+
+  def testRunPushConsumer(self):
+    batches = [[MagicMock()] * metric_storer.MAX_MESSAGES_PER_BATCH,
+               [MagicMock()]]
+    consumerMock = Mock(spec_set=["readBatches"],
+                        readBatches=Mock(return_value=iter(batches)))
+    processBatchMock = Mock()
+
+    metric_storer._runPushConsumer(consumerMock, 0.05, processBatchMock)
+
+    consumerMock.readBatches.assert_called_once_with(
+      maxBatchSize=metric_storer.MAX_MESSAGES_PER_BATCH, lingerSec=0.05)
+    self.assertEqual(processBatchMock.call_args_list,
+                     [mock.call(batch, []) for batch in batches])
+
+
   def testTrimMetricCacheNoMetrics(self):
     metric_storer.MAX_CACHED_METRICS = 5
     metric_storer.CACHED_METRICS_TO_KEEP = 3
@@ -79,6 +79,133 @@ class MetricStreamerTestCase(unittest.TestCase):
     self.assertSequenceEqual(passingData, expectedPassingSamples)
 
 
+  @patch.object(metric_streamer_util, "repository", autospec=True)
+  def testStreamMetricDataBatch(self, repositoryMock):
+    repositoryMock.retryOnTransientErrors.side_effect = lambda f: f
+
+    now = datetime.utcnow()
+    oneInterval = timedelta(seconds=300)
+
+    repositoryMock.getMetricsWithUpdateLock.return_value = [
+      Mock(uid="active", status=metric_streamer_util.MetricStatus.ACTIVE,
+           last_rowid=10, datasource="custom"),
+      Mock(uid="unmonitored",
+           status=metric_streamer_util.MetricStatus.UNMONITORED,
+           last_rowid=0, datasource="custom"),
+      Mock(uid="error", status=metric_streamer_util.MetricStatus.ERROR,
+           last_rowid=5, datasource="custom"),
+    ]
+
+    def addMetricDataBatchSideEffect(_conn, dataByMetricId,
+                                     _lastRowidByMetricId):
+      return dict(
+        (metricId,
+         [dict(uid=metricId, rowid=rowid, timestamp=ts, metric_value=value)
+          for rowid, (value, ts) in enumerate(data, 1)])
+        for metricId, data in dataByMetricId.iteritems())
+
+    repositoryMock.addMetricDataBatch.side_effect = addMetricDataBatchSideEffect
+
+    streamer = metric_streamer_util.MetricStreamer()
+
+    dataByMetricID = {
+      "active": [(now, 1.0), (now + oneInterval, 2.0)],
+      "unmonitored": [(now, 3.0)],
+      "error": [(now, 4.0)],
+      "missing": [(now, 5.0)],
+    }
+
+    modelSwapperMock = Mock(
+      spec_set=model_swapper_interface.ModelSwapperInterface)
+
+    with patch.object(streamer, "_getTailMetricRowTimestamp", autospec=True,
+                      return_value=None), \
+        patch.object(streamer, "_sendInputRowsToModel",
+                     autospec=True) as sendInputRowsToModelMock:
+      missingMetricIDs = streamer.streamMetricDataBatch(dataByMetricID,
+                                                        modelSwapperMock)
+
+    self.assertEqual(missingMetricIDs, set(["missing"]))
+
+    # All metrics are locked with a single query
+    self.assertEqual(repositoryMock.getMetricsWithUpdateLock.call_count, 1)
+    self.assertItemsEqual(
+      repositoryMock.getMetricsWithUpdateLock.call_args[0][1],
+      dataByMetricID.keys())
+
+    # Samples of streamable metrics are stored with a single call as
+    # (value, timestamp) pairs
+    self.assertEqual(repositoryMock.addMetricDataBatch.call_count, 1)
+    self.assertEqual(
+      repositoryMock.addMetricDataBatch.call_args[0][1],
+      {"active": ((1.0, now), (2.0, now + oneInterval)),
+       "unmonitored": ((3.0, now),)})
+
+    # ... along with the last rowids read with the metrics' update locks
+    self.assertEqual(
+      repositoryMock.addMetricDataBatch.call_args[0][2],
+      {"active": 10, "unmonitored": 0})
+
+    # Only rows of the active metric are sent to its model
+    self.assertEqual(sendInputRowsToModelMock.call_count, 1)
+    kwargs = sendInputRowsToModelMock.call_args[1]
+    self.assertEqual(kwargs["metricID"], "active")
+    self.assertIs(kwargs["modelSwapper"], modelSwapperMock)
+    self.assertEqual(
+      [(row.rowID, row.data) for row in kwargs["inputRows"]],
+      [(1, (now, 1.0)), (2, (now + oneInterval, 2.0))])
+
+
+  @patch.object(metric_streamer_util, "repository", autospec=True)
+  def testStreamMetricDataBatchForwardsRemainingMetricsOnError(
+      self, repositoryMock):
+    repositoryMock.retryOnTransientErrors.side_effect = lambda f: f
+
+    now = datetime.utcnow()
+
+    repositoryMock.getMetricsWithUpdateLock.return_value = [
+      Mock(uid="first", status=metric_streamer_util.MetricStatus.ACTIVE,
+           last_rowid=0, datasource="custom"),
+      Mock(uid="second", status=metric_streamer_util.MetricStatus.ACTIVE,
+           last_rowid=0, datasource="custom"),
+    ]
+
+    repositoryMock.addMetricDataBatch.return_value = {
+      "first": [dict(uid="first", rowid=1, timestamp=now, metric_value=1.0)],
+      "second": [dict(uid="second", rowid=1, timestamp=now, metric_value=2.0)],
+    }
+
+    streamer = metric_streamer_util.MetricStreamer()
+
+    modelSwapperMock = Mock(
+      spec_set=model_swapper_interface.ModelSwapperInterface)
+
+    def sendInputRowsToModelSideEffect(inputRows, metricID, modelSwapper):
+      if metricID == "first":
+        raise Exception("Fake forwarding failure")
+
+    with patch.object(streamer, "_getTailMetricRowTimestamp", autospec=True,
+                      return_value=None), \
+        patch.object(streamer, "_sendInputRowsToModel", autospec=True,
+                     side_effect=sendInputRowsToModelSideEffect
+                    ) as sendInputRowsToModelMock:
+      missingMetricIDs = streamer.streamMetricDataBatch(
+        {"first": [(now, 1.0)], "second": [(now, 2.0)]},
+        modelSwapperMock)
+
+    self.assertEqual(missingMetricIDs, set())
+
+    # The second metric's rows are submitted despite the first one's failure
+    self.assertEqual(
+      [kwargs["metricID"]
+       for _args, kwargs in sendInputRowsToModelMock.call_args_list],
+      ["first", "second"])
+    kwargs = sendInputRowsToModelMock.call_args[1]
+    self.assertEqual(
+      [(row.rowID, row.data) for row in kwargs["inputRows"]],
+      [(1, (now, 2.0))])
+
+
   def testSendInputRowsToModel(self):
     """ Test MetricStreamer._sendInputRowsToModel """
     metricDataOutputChunkSize = metric_streamer_util.config.getint(
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2015, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+"""Unit tests for htmengine.utils"""
+
+import datetime
+import json
+import unittest
+
+from htmengine import utils
+
+
+
+class JSONEncodeChunksTestCase(unittest.TestCase):
+
+
+  def testEncodesSameAsJSONEncode(self):
+    obj = {"names": ["timestamp", "value"],
+           "data": [(datetime.datetime(2015, 11, 12, 13, 14, 15), 1.5),
+                    (datetime.datetime(2015, 11, 12, 13, 19, 15), None)],
+           "nested": {"uid": "abc", "count": 2}}
+
+    self.assertEqual(json.loads("".join(utils.jsonEncodeChunks(obj))),
+                     json.loads(utils.jsonEncode(obj)))
+
+
+  def testEncodesIteratorsLazily(self):
+    consumed = []
+
+    def generateRecords(count):
+      for i in xrange(count):
+        consumed.append(i)
+        yield {"uid": str(i), "data": iter([[i, i * 2]])}
+
+    chunks = utils.jsonEncodeChunks({"metrics": generateRecords(1000)},
+                                    chunkSize=100)
+
+    firstChunk = next(chunks)
+    self.assertGreaterEqual(len(firstChunk), 100)
+    self.assertLess(len(consumed), 1000)
+
+    result = json.loads(firstChunk + "".join(chunks))
+    self.assertEqual(len(consumed), 1000)
+    self.assertEqual(result["metrics"][999], {"uid": "999", "data": [[999,
+                                                                      1998]]})
+
+
+  def testEncodesEmptyIterator(self):
+    self.assertEqual(
+      json.loads("".join(utils.jsonEncodeChunks({"data": iter([])}))),
+      {"data": []})
+
+
+
+if __name__ == "__main__":
+  unittest.main()
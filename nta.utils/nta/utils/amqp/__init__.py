@@ -19,6 +19,7 @@
 # http://numenta.org/licenses/
 # ----------------------------------------------------------------------
 
+from . import client_pool
 from . import connection
 from . import constants
 from . import consumer
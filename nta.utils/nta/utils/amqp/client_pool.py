@@ -0,0 +1,286 @@
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2015, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+"""
+Process-wide pool of AMQP clients.
+
+Bringing up an AMQP connection takes several round trips to the broker (TCP
+handshake, protocol negotiation, authentication, tuning and channel opening),
+which dominates the latency of short-lived publishers. The pool retains idle
+SynchronousAmqpClient instances, so that subsequent users reuse their
+connections and, when configured alike, their channels.
+"""
+
+import logging
+import os
+import threading
+import time
+import weakref
+
+from nta.utils.amqp import connection as amqp_connection
+from nta.utils.amqp import synchronous_amqp_client
+
+
+g_log = logging.getLogger(__name__)
+
+
+# The process-wide SynchronousAmqpClientPool instance; see getClientPool()
+g_clientPool = None
+
+g_clientPoolLock = threading.Lock()
+
+# Map of clients created by client pools to the ID of the process that created
+# each one, so that clients inherited by a forked child process are recognized;
+# guarded by g_clientPoolLock
+g_clientPids = weakref.WeakKeyDictionary()
+
+
+
+def _isForeignClient(client):
+  """
+  :returns: True if the client was created by a pool in another process (i.e.,
+    inherited from the parent by a forked child process), so that its socket
+    is shared with that process
+  """
+  with g_clientPoolLock:
+    pid = g_clientPids.get(client)
+
+  return pid is not None and pid != os.getpid()
+
+
+
+def getClientPool():
+  """ Get the process-wide client pool, creating it on first use; a forked
+  child process gets a pool of its own.
+
+  :rtype: SynchronousAmqpClientPool
+  """
+  global g_clientPool  # pylint: disable=W0603
+
+  pool = g_clientPool
+  if pool is not None and pool.pid == os.getpid():
+    return pool
+
+  with g_clientPoolLock:
+    if g_clientPool is None or g_clientPool.pid != os.getpid():
+      config = amqp_connection.RabbitmqConfig()
+      g_clientPool = SynchronousAmqpClientPool(
+        maxIdleClients=config.getint("client_pool", "max_idle_clients"),
+        maxIdleSec=config.getfloat("client_pool", "max_idle_sec"))
+
+    return g_clientPool
+
+
+
+class SynchronousAmqpClientPool(object):
+  """ Thread-safe pool of idle SynchronousAmqpClient instances.
+
+  Idle clients are grouped by broker endpoint (host, port, vhost and user).
+  Each one is labeled with the kind of its channel's configuration: a client is
+  handed out with its channel only to a user that requests the same kind of
+  channel; otherwise, its channel is closed and only its connection is reused.
+
+  Clients are health-checked before they're pooled and again before they're
+  handed out, and idle clients are evicted after maxIdleSec.
+
+  NOTE: a pool belongs to the process that created it; clients inherited by a
+  forked child share their sockets with the parent, so the child must use a
+  pool of its own (see getClientPool). Clients from another process are
+  dropped instead of being pooled, handed out or closed, so that the child
+  never disturbs the parent's connections.
+  """
+
+  _CLIENT_CLASS = synchronous_amqp_client.SynchronousAmqpClient
+
+
+  def __init__(self, maxIdleClients, maxIdleSec):
+    """
+    :param int maxIdleClients: max number of idle clients retained per broker
+      endpoint; 0 disables pooling
+    :param float maxIdleSec: idle clients are evicted after this many seconds
+    """
+    self._maxIdleClients = maxIdleClients
+    self._maxIdleSec = maxIdleSec
+
+    # ID of the process that owns this pool
+    self.pid = os.getpid()
+
+    self._lock = threading.Lock()
+
+    # Map of endpoint keys to lists of idle (client, channelKind, releaseTime)
+    # entries, least-recently released first
+    self._idleClients = dict()
+
+
+  @staticmethod
+  def _getEndpointKey(connectionParams):
+    return (connectionParams.host, connectionParams.port,
+            connectionParams.vhost, connectionParams.credentials.username,
+            connectionParams.credentials.password)
+
+
+  def acquire(self, connectionParams, channelKind=None, channelConfigCb=None):
+    """ Get a client from the pool, or create one if no healthy idle client is
+    available
+
+    :param nta.utils.amqp.connection.ConnectionParams connectionParams:
+      parameters for connecting to AMQP broker
+    :param channelKind: hashable label of the channel configuration applied by
+      channelConfigCb; None if the client's channel is not to be reused
+    :param channelConfigCb: channelConfigCb arg of SynchronousAmqpClient
+
+    :rtype: nta.utils.amqp.synchronous_amqp_client.SynchronousAmqpClient
+    """
+    endpointKey = self._getEndpointKey(connectionParams)
+
+    while True:
+      entry = None
+
+      with self._lock:
+        expiredClients = self._popExpiredClientsNoLock()
+
+        entries = self._idleClients.get(endpointKey)
+        if entries:
+          # Prefer the most recently released client with a matching channel
+          for i in xrange(len(entries) - 1, -1, -1):
+            if channelKind is not None and entries[i][1] == channelKind:
+              entry = entries.pop(i)
+              break
+          else:
+            entry = entries.pop()
+
+      self._closeClients(expiredClients)
+
+      if entry is None:
+        client = self._CLIENT_CLASS(connectionParams,
+                                    channelConfigCb=channelConfigCb)
+        with g_clientPoolLock:
+          g_clientPids[client] = os.getpid()
+
+        return client
+
+      client, idleChannelKind, _ = entry
+
+      if _isForeignClient(client):
+        g_log.debug("Dropping pooled client=%r of another process", client)
+        continue
+
+      if not client.isIdleAndHealthy():
+        g_log.debug("Discarding unhealthy pooled client=%r", client)
+        self._closeClients((client,))
+        continue
+
+      if channelKind is None or idleChannelKind != channelKind:
+        try:
+          client.resetChannel(channelConfigCb)
+        except Exception:  # pylint: disable=W0703
+          g_log.warning("Reset of channel of pooled client=%r failed", client,
+                        exc_info=True)
+          self._closeClients((client,))
+          continue
+
+      return client
+
+
+  def release(self, client, channelKind=None):
+    """ Return a client to the pool; it's closed instead if it's unhealthy or
+    the pool is full
+
+    :param nta.utils.amqp.synchronous_amqp_client.SynchronousAmqpClient client:
+    :param channelKind: channelKind that the client was acquired with; None to
+      close the client's channel, so that any unacknowledged deliveries are
+      requeued by the broker
+    """
+    if _isForeignClient(client):
+      g_log.debug("Dropping released client=%r of another process", client)
+      return
+
+    if os.getpid() != self.pid or self._maxIdleClients <= 0:
+      self._closeClients((client,))
+      return
+
+    try:
+      if channelKind is None:
+        client.resetChannel(None)
+
+      healthy = client.isIdleAndHealthy()
+    except Exception:  # pylint: disable=W0703
+      g_log.warning("Health check of released client=%r failed", client,
+                    exc_info=True)
+      healthy = False
+
+    if not healthy:
+      self._closeClients((client,))
+      return
+
+    endpointKey = self._getEndpointKey(client.connectionParams)
+
+    with self._lock:
+      expiredClients = self._popExpiredClientsNoLock()
+
+      entries = self._idleClients.setdefault(endpointKey, [])
+      entries.append((client, channelKind, time.time()))
+
+      while len(entries) > self._maxIdleClients:
+        expiredClients.append(entries.pop(0)[0])
+
+    self._closeClients(expiredClients)
+
+
+  def clear(self):
+    """ Close all idle clients """
+    with self._lock:
+      idleClients = [entry[0] for entries in self._idleClients.itervalues()
+                     for entry in entries]
+      self._idleClients.clear()
+
+    self._closeClients(idleClients)
+
+
+  def _popExpiredClientsNoLock(self):
+    """ Remove idle clients that expired; the caller must hold self._lock
+
+    :returns: list of the removed clients
+    """
+    expiredClients = []
+    deadline = time.time() - self._maxIdleSec
+
+    for endpointKey, entries in self._idleClients.items():
+      while entries and entries[0][2] < deadline:
+        expiredClients.append(entries.pop(0)[0])
+
+      if not entries:
+        del self._idleClients[endpointKey]
+
+    return expiredClients
+
+
+  @staticmethod
+  def _closeClients(clients):
+    for client in clients:
+      if _isForeignClient(client):
+        # Closing it would tear down the other process's connection
+        continue
+
+      try:
+        client.close()
+      except Exception:  # pylint: disable=W0703
+        g_log.warning("Closing of client=%r failed", client, exc_info=True)
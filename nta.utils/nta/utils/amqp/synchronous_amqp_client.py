@@ -26,8 +26,11 @@ TODO need unit tests
 """
 from collections import deque
 from datetime import datetime
+import errno
 import logging
+import select
 import socket
+import time
 
 from haigha.connections.rabbit_connection import RabbitConnection
 from haigha.message import Message as HaighaMessage
@@ -64,34 +67,11 @@ class _CallbackSink(object):
                                             self.values)
 
 
-class _PubackState(_CallbackSink):
-
-  __slots__ = ()
-
-  ACK = 1
-  NACK = 2
-
-  def handleAck(self, deliveryTag):
-    """Message Ack'ed in RabbitMQ Publisher Acknowledgments mode"""
-    g_log.debug("Message ACKed: tag=%s", deliveryTag)
-
-    assert not self.ready, (deliveryTag, self.values)
-
-    self(self.ACK, deliveryTag)
-
-  def handleNack(self, deliveryTag):
-    """Message Nack'ed in RabbitMQ Publisher Acknowledgments mode"""
-    g_log.error("Message NACKed: tag=%s", deliveryTag)
-
-    assert not self.ready, (deliveryTag, self.values)
-
-    self(self.NACK, deliveryTag)
-
-
 class _ChannelContext(object):
 
   __slots__ = ("channel", "nextConsumerTag", "consumerSet", "pendingEvents",
-               "pubacksSelected", "returnedMessages")
+               "pubacksSelected", "returnedMessages", "unconfirmedTags",
+               "numNacked")
 
   def __init__(self, channel):
     self.channel = None
@@ -109,6 +89,13 @@ class _ChannelContext(object):
     # Holds messages of type ReturnedMessage received via Basic.Return
     self.returnedMessages = None
 
+    # Delivery tags of published messages awaiting Basic.Ack or Basic.Nack in
+    # publisher-acknowledgments mode
+    self.unconfirmedTags = None
+
+    # Number of published messages NACKed since they were last checked
+    self.numNacked = None
+
     self.reset()
     self.channel = channel
 
@@ -129,6 +116,13 @@ class _ChannelContext(object):
     # Holds messages of type ReturnedMessage received via Basic.Return
     self.returnedMessages = []
 
+    # Delivery tags of published messages awaiting Basic.Ack or Basic.Nack in
+    # publisher-acknowledgments mode
+    self.unconfirmedTags = set()
+
+    # Number of published messages NACKed since they were last checked
+    self.numNacked = 0
+
 
   def __repr__(self):
     return ("%s(channel=%s, nextConsumerTag=%s, pubacksSelected=%s, "
@@ -140,6 +134,21 @@ class _ChannelContext(object):
               len(self.pendingEvents))
 
 
+  def handlePublisherAck(self, deliveryTag):
+    """Message Ack'ed in RabbitMQ Publisher Acknowledgments mode; haigha
+    expands multiple-message acks into a call per message
+    """
+    g_log.debug("Message ACKed: tag=%s", deliveryTag)
+
+    self.unconfirmedTags.discard(deliveryTag)
+
+  def handlePublisherNack(self, deliveryTag, _requeue=False):
+    """Message Nack'ed in RabbitMQ Publisher Acknowledgments mode"""
+    g_log.error("Message NACKed: tag=%s", deliveryTag)
+
+    self.unconfirmedTags.discard(deliveryTag)
+    self.numNacked += 1
+
   def ack(self, deliveryTag, multiple):
     """ Acks a messages or multiple messages using the context's channel.
 
@@ -325,6 +334,7 @@ class SynchronousAmqpClient(object):
     # Instantiate underlying connection object
     params = (connectionParams if connectionParams is not None
               else amqp_connection.ConnectionParams())
+    self._connectionParams = params
 
     # NOTE: we could get a `close_cb` call from RabbitConnection constructor, so
     # prepare for it by initializing `self._connection`
@@ -394,10 +404,73 @@ class SynchronousAmqpClient(object):
     self.close()
 
 
+  @property
+  def connectionParams(self):
+    """ Parameters that the client connected to the broker with
+
+    :rtype: nta.utils.amqp.connection.ConnectionParams
+    """
+    return self._connectionParams
+
+
   def isOpen(self):
     return self._connection is not None and not self._connection.closed
 
 
+  def isIdleAndHealthy(self):
+    """ Check whether the client may be handed over to another user: its
+    connection is open, and its channel, if any, has no consumers, published
+    messages awaiting confirmation, returned messages or pending events. Frames
+    that arrived while the client was idle (e.g., the broker's closing of the
+    channel or connection) are processed first.
+
+    :rtype: bool
+    """
+    if not self.isOpen() or self._connection.transport is None:
+      return False
+
+    try:
+      sock = self._connection.transport._sock  # pylint: disable=W0212
+      readable, _, _ = select.select((sock,), (), (), 0)
+      if readable:
+        self._connection.read_frames()
+    except Exception:  # pylint: disable=W0703
+      g_log.debug("Idle client failed health check", exc_info=True)
+      return False
+
+    if not self.isOpen():
+      return False
+
+    channelContext = self._channelContextInstance
+    return channelContext is None or not (
+      channelContext.consumerSet or channelContext.unconfirmedTags or
+      channelContext.numNacked or channelContext.returnedMessages or
+      channelContext.pendingEvents)
+
+
+  def resetChannel(self, channelConfigCb):
+    """ Close the channel, if any, while keeping the connection open. The broker
+    requeues the channel's unacknowledged deliveries. A new channel is brought
+    up on demand and configured via the given callback.
+
+    :param channelConfigCb: see the constructor's channelConfigCb arg
+    """
+    self._channelConfigCb = channelConfigCb
+
+    channelContext = self._channelContextInstance
+    if channelContext is None:
+      return
+
+    self._userInitiatedClosing = True
+    try:
+      channelContext.channel.close()
+    finally:
+      self._userInitiatedClosing = False
+      if self._channelContextInstance is not None:
+        self._channelContextInstance.reset()
+        self._channelContextInstance = None
+
+
   def close(self):
     """Gracefully close client"""
     self._userInitiatedClosing = True
@@ -439,14 +512,27 @@ class SynchronousAmqpClient(object):
       channelContext.channel.confirm.select(nowait=False)
       channelContext.pubacksSelected = True
 
+      channelContext.channel.basic.set_ack_listener(
+        channelContext.handlePublisherAck)
+      channelContext.channel.basic.set_nack_listener(
+        channelContext.handlePublisherNack)
+
       # NOTE: Unroutable messages returned after this will be in the context of
       # publisher acknowledgments
       self._raiseAndClearIfReturnedMessages()
 
 
-  def publish(self, message, exchange, routingKey, mandatory=False):
+  def publish(self, message, exchange, routingKey, mandatory=False,
+              maxUnconfirmed=0):
     """ Publish a message
 
+    In publisher-acknowledgments mode, confirmations may be pipelined by
+    passing maxUnconfirmed > 0: publish then returns as soon as no more than
+    maxUnconfirmed published messages await confirmation, instead of waiting
+    for a broker round trip per message. NACKs and returns of such messages are
+    raised by the next call that waits for all confirmations: `publish` with
+    maxUnconfirmed=0 or `waitForConfirms`.
+
     :param nta.utils.amqp.messages.Message message:
     :param str exchange: destination exchange name; "" for default exchange
     :param str routingKey: Message routing key
@@ -454,6 +540,10 @@ class SynchronousAmqpClient(object):
       message cannot be routed to a queue. If this flag is True, the server will
       return an unroutable message with a Return method. If this flag is False
       the server silently drops the message.
+    :param int maxUnconfirmed: in publisher-acknowledgments mode, max number of
+      published messages that may remain unconfirmed when this method returns;
+      0 to wait for confirmation of this and all previously published messages
+      [default=0]
 
     :raises nta.utils.amqp.exceptions.UnroutableError: when in
       non-publisher-acknowledgments mode, raised before attempting to publish
@@ -473,44 +563,20 @@ class SynchronousAmqpClient(object):
 
     if channelContext.pubacksSelected:
       # In publisher-acknowledgments mode
-      assert not channelContext.returnedMessages, (
-        len(channelContext.returnedMessages),
-        channelContext.returnedMessages)
-
-      pubackState = _PubackState()
-      channelContext.channel.basic.set_ack_listener(pubackState.handleAck)
-      channelContext.channel.basic.set_nack_listener(pubackState.handleNack)
-
       deliveryTag = channelContext.channel.basic.publish(
         message,
         exchange=exchange,
         routing_key=routingKey,
         mandatory=mandatory)
 
-      # Wait for ACK or NACK
-      while not pubackState.ready:
-        self._connection.read_frames()
+      channelContext.unconfirmedTags.add(deliveryTag)
 
-      try:
-        ((how, responseTag),) = pubackState.values
-      except ValueError:
-        g_log.exception("Error unpacking values=%r", pubackState.values)
-        raise
-
-      assert responseTag == deliveryTag, ((how, responseTag), deliveryTag)
-
-      if how == _PubackState.NACK:
-        # Raise NackError with returned message
-        returnedMessages = channelContext.returnedMessages
-        channelContext.returnedMessages = []
-
-        raise amqp_exceptions.NackError(returnedMessages)
-
-      # It was Acked
-      assert how == _PubackState.ACK, how
-
-      # Raise if this message was returned as unroutable
-      self._raiseAndClearIfReturnedMessages()
+      if maxUnconfirmed:
+        # Wait for room in the window of unconfirmed messages
+        while len(channelContext.unconfirmedTags) > maxUnconfirmed:
+          self._connection.read_frames()
+      else:
+        self.waitForConfirms()
 
     else:
       # Not in publisher-acknowledgments mode
@@ -524,6 +590,39 @@ class SynchronousAmqpClient(object):
                                            mandatory=mandatory)
 
 
+  def waitForConfirms(self):
+    """ In publisher-acknowledgments mode, wait until all published messages
+    are ACKed or NACKed by the broker; no-op otherwise
+
+    NOTE: RabbitMQ returns an unroutable message before ACKing it
+
+    :raises nta.utils.amqp.exceptions.NackError: if any of the messages
+      published since the last check were NACKed by the broker; the exception
+      holds the messages that were returned along with them
+    :raises nta.utils.amqp.exceptions.UnroutableError: if any of the messages
+      published since the last check were returned as unroutable
+    :raises nta.utils.amqp.exceptions.AmqpChannelError:
+    """
+    channelContext = self._channelContextInstance
+    if channelContext is None or not channelContext.pubacksSelected:
+      return
+
+    while channelContext.unconfirmedTags:
+      self._connection.read_frames()
+
+    if channelContext.numNacked:
+      channelContext.numNacked = 0
+
+      # Raise NackError with returned messages
+      returnedMessages = channelContext.returnedMessages
+      channelContext.returnedMessages = []
+
+      raise amqp_exceptions.NackError(returnedMessages)
+
+    # Raise if any of the messages were returned as unroutable
+    self._raiseAndClearIfReturnedMessages()
+
+
   def requestQoS(self, prefetchSize=0, prefetchCount=0, entireConnection=False):
     """This method requests a specific quality of service. The QoS can be
     specified for the current channel or for all channels on the connection. The
@@ -613,7 +712,7 @@ class SynchronousAmqpClient(object):
     return bool(channelContext is not None and channelContext.pendingEvents)
 
 
-  def getNextEvent(self):
+  def getNextEvent(self, timeout=None):
     """Get next event, blocking if there isn't one yet. See `hasEvent()`. You
     MUST have an active consumer (`createConsumer`) or other event source before
     calling this method.
@@ -623,19 +722,64 @@ class SynchronousAmqpClient(object):
       nta.utils.amqp.messages.ConsumerMessage
       nta.utils.amqp.consumer.ConsumerCancellation
 
-    :returns: the next event when it becomes available
+    :param timeout: max seconds to wait for an event; None to wait
+      indefinitely
+
+    :returns: the next event when it becomes available; None if the timeout
+      expired first
 
     :raises nta.utils.amqp.exceptions.AmqpChannelError:
     """
     # We expect the context to be set up already
     channelContext = self._channelContextInstance
 
+    if timeout is not None:
+      deadline = time.time() + timeout
+
     while not channelContext.pendingEvents:
+      if timeout is not None and not self._waitForInput(deadline):
+        return None
+
       self._connection.read_frames()
 
     return channelContext.pendingEvents.popleft()
 
 
+  def _waitForInput(self, deadline):
+    """Wait until data from the broker is ready to be read
+
+    NOTE: haigha's synchronous read_frames() blocks for up to the heartbeat
+    interval, so we wait on the connection's socket instead. read_frames()
+    processes all complete frames that it reads, so no complete frames are
+    left behind in haigha's buffer while we wait.
+
+    :param deadline: time.time() value beyond which to stop waiting
+
+    :returns: True if data is ready to be read; False if the deadline passed
+      first
+    """
+    transport = self._connection.transport
+    if transport is None:
+      # Connection is closed; let read_frames() deal with it as usual
+      return True
+
+    sock = transport._sock  # pylint: disable=W0212
+    while True:
+      remainingSec = deadline - time.time()
+      if remainingSec <= 0:
+        return False
+
+      try:
+        readable, _, _ = select.select((sock,), (), (), remainingSec)
+      except select.error as e:
+        if e.args[0] == errno.EINTR:
+          continue
+        raise
+
+      if readable:
+        return True
+
+
   def readEvents(self):
     """Generator that yields results of `getNextEvent()`"""
     while True:
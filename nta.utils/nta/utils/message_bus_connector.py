@@ -27,6 +27,7 @@ from collections import namedtuple
 import contextlib
 import json
 import logging
+import re
 import select
 import socket
 import time
@@ -52,6 +53,24 @@ class MessageQueueNotFound(MessageBusConnectorError):
 
 
 
+class UndeliveredMessagesError(MessageQueueNotFound):
+  """ Some of the pipelined messages couldn't be delivered, because their
+  destination message queues were not found; the others were delivered
+  """
+
+  def __init__(self, undelivered):
+    """
+    :param undelivered: sequence of (mqName, body) pairs of the undelivered
+      messages
+    """
+    super(UndeliveredMessagesError, self).__init__(
+      "%d message(s) undelivered to missing mqs=%s" % (
+        len(undelivered), sorted(set(mqName for mqName, _ in undelivered))))
+
+    self.undelivered = undelivered
+
+
+
 class ConsumerCancelled(MessageBusConnectorError):
   """Message consumer was cancelled by remote peer"""
   pass
@@ -73,6 +92,23 @@ _RETRY_ON_AMQP_ERROR = error_handling.retry(
 )
 
 
+# Upper bound on how far the RabbitMQ Management Plugin's queue statistics may
+# lag behind the state of the queues: the broker's default statistics
+# collection interval (collect_statistics_interval) of 5 seconds plus a margin
+MANAGEMENT_STATISTICS_LAG_SEC = 6
+
+
+# Errors upon which pipelined messages that await confirmation are republished
+_PIPELINE_FAILURE_ERRORS = (
+  amqp.exceptions.AmqpChannelError,
+  amqp.exceptions.AmqpConnectionError,
+  amqp.exceptions.NackError,
+  socket.gaierror,
+  socket.error,
+  select.error,
+)
+
+
 
 class MessageProperties(amqp.messages.BasicProperties):
   """ basic.Properties of a message per AMQP 0.9.1
@@ -100,6 +136,17 @@ class MessageBusConnector(object):
   # This is the limit for how many unacked messages the broker may deliver
   _PREFETCH_MAX = 2
 
+  # Max number of pipelined messages that may await the broker's confirmation
+  _MAX_UNCONFIRMED_PUBLISHES = 100
+
+  # Label of our channel configuration in the AMQP client pool; pooled clients
+  # with publisher acknowledgments enabled are reused along with their channels
+  _PUBLISHER_CHANNEL_KIND = "message_bus_connector.publisher"
+
+  # Number of queues per page of paged RabbitMQ Management Plugin queries; the
+  # plugin caps the page size at 500
+  _MANAGEMENT_QUERY_PAGE_SIZE = 500
+
 
   def __init__(self):
     self._logger = g_log
@@ -115,11 +162,22 @@ class MessageBusConnector(object):
       # messages) or returns the message
       client.enablePublisherAcks()
 
-    self._channelMgr = _ChannelManager(configureChannel=configureChannel)
+    self._channelMgr = _ChannelManager(
+      configureChannel=configureChannel,
+      channelKind=self._PUBLISHER_CHANNEL_KIND)
 
     # Active _QueueConsumer instances
     self._consumers = []
 
+    # (mqName, amqp.messages.Message) pairs of pipelined messages published
+    # since the last confirmation barrier; they're republished if the channel
+    # fails before the broker confirms them
+    self._unconfirmedPublishes = []
+
+    # AMQP client through which the unconfirmed messages were published; None
+    # if pipelined publishing failed
+    self._pipelineClient = None
+
 
   def __enter__(self):
     return self
@@ -131,6 +189,14 @@ class MessageBusConnector(object):
 
 
   def close(self):
+    if self._unconfirmedPublishes:
+      self._logger.error(
+        "While closing %s, discovered numMessages=%d pipelined messages "
+        "without confirmation of delivery", self.__class__.__name__,
+        len(self._unconfirmedPublishes))
+      self._unconfirmedPublishes = []
+      self._pipelineClient = None
+
     if self._consumers:
       self._logger.error(
         "While closing %s, discovered %s unclosed consumers; will "
@@ -236,6 +302,27 @@ class MessageBusConnector(object):
         raise
 
 
+  @_RETRY_ON_AMQP_ERROR
+  def getMessageCount(self, mqName):
+    """ Get the number of messages in a message queue that are ready for
+    delivery; messages that have been delivered, but not acked yet aren't
+    included
+
+    raises: MessageQueueNotFound
+    """
+    try:
+      r = self._channelMgr.client.declareQueue(mqName,
+                                               passive=True)
+      return r.messageCount
+    except amqp.exceptions.AmqpChannelError as e:
+      if e.code == amqp.constants.AMQPErrorCodes.NOT_FOUND:
+        self._channelMgr.reset()
+        raise MessageQueueNotFound(
+          "getMessageCount: mq=%s not found (%r)" % (mqName, e,))
+      else:
+        raise
+
+
   def isMessageQeueuePresent(self, mqName):
     """
     retval: True if the queue exists; False if it doesn't exist
@@ -258,12 +345,51 @@ class MessageBusConnector(object):
 
     retval: (possibly empty) sequence of message queue names
     """
-    connectionParams = amqp.connection.RabbitmqManagementConnectionParams()
+    return tuple(d["name"] for d in self._queryManagementQueues(
+      params={"columns": "name"}))
+
+
+  def getMessageQueueDepths(self, namePrefix=""):
+    """ Get the number of messages in message queues whose names start with the
+    given prefix. The depths of all the queues are retrieved via a single paged
+    query of the RabbitMQ Management Plugin, rather than one broker call per
+    queue.
 
-    # Use RabbitMQ Management Plugin to retrieve the names of message
-    # queues
+    NOTE: the Management Plugin's statistics are sampled periodically by the
+    broker, so they may lag behind the actual state of the queues by up to
+    MANAGEMENT_STATISTICS_LAG_SEC.
+
+    :param namePrefix: retrieve only the queues whose names start with this
+      prefix; all queues if empty
+
+    :returns: dict that maps names of message queues to the number of messages
+      in them (both ready and unacknowledged), or to None if the broker has not
+      collected statistics of the queue yet (e.g., it was just created)
+    """
+    params = {"columns": "name,messages"}
+    if namePrefix:
+      params["name"] = "^" + re.escape(namePrefix)
+      params["use_regex"] = "true"
 
-    # Buld a URL for retrieving queue names from the default vhost
+    items = self._queryManagementQueues(params=params, paged=True)
+
+    return dict((d["name"], d.get("messages")) for d in items
+                if d["name"].startswith(namePrefix))
+
+
+  def _queryManagementQueues(self, params, paged=False):
+    """ Query queue objects of our vhost via the RabbitMQ Management Plugin
+
+    :param params: dict of query parameters
+    :param paged: True to retrieve the queues in pages of
+      _MANAGEMENT_QUERY_PAGE_SIZE queues each; servers that don't support
+      pagination return all the queues in response to the first query
+
+    :returns: sequence of dicts of queue attributes
+    """
+    connectionParams = amqp.connection.RabbitmqManagementConnectionParams()
+
+    # Buld a URL for retrieving queues from the default vhost
     # NOTE: we encode the default vhost name ("/") in hex because it cannot be
     # passed verbatim in the URL
     vhost = connectionParams.vhost
@@ -271,26 +397,46 @@ class MessageBusConnector(object):
       connectionParams.host, connectionParams.port,
       vhost if vhost != "/" else "%" + vhost.encode("hex"))
 
-    response = None
-    try:
-      response = requests.get(
-        url,
-        auth=(connectionParams.username,
-              connectionParams.password),
-        params={"columns": "name"})
+    items = []
+    page = 1
+    while True:
+      pageParams = dict(params)
+      if paged:
+        pageParams.update(page=page,
+                          page_size=self._MANAGEMENT_QUERY_PAGE_SIZE)
 
-      response.raise_for_status()
-    except Exception:
-      self._logger.exception(
-        "getAllMessageQueues failed; url=%r; response=%r", url, response)
-      raise
+      response = None
+      try:
+        response = requests.get(
+          url,
+          auth=(connectionParams.username,
+                connectionParams.password),
+          params=pageParams)
 
+        response.raise_for_status()
+      except Exception:
+        self._logger.exception(
+          "Query of message queues failed; url=%r; params=%r; response=%r",
+          url, pageParams, response)
+        raise
 
-    return tuple(d["name"] for d in json.loads(response.text))
+      result = json.loads(response.text)
 
+      if not isinstance(result, dict):
+        # Unpaged result
+        items.extend(result)
+        break
 
-  @_RETRY_ON_AMQP_ERROR
-  def publish(self, mqName, body, persistent):
+      items.extend(result["items"])
+      if page >= result["page_count"]:
+        break
+
+      page += 1
+
+    return items
+
+
+  def publish(self, mqName, body, persistent, waitForConfirm=True):
     """ Publish a message to the queue; delivers message to the queue or "dies"
     trying. Assumes the message queue already exists. See
     `MessageBusConnector.publishExg`
@@ -304,8 +450,16 @@ class MessageBusConnector(object):
     persistent: True to have the message backed up to disk; this only makes
       sense if the message queue was created as "durable" (
       see createMessageQueue). False for no backup.
-
-    raises: MessageQueueNotFound
+    waitForConfirm: True to wait until the broker confirms the delivery of
+      this and all previously pipelined messages; False to pipeline the
+      message: return as soon as it's sent, while up to
+      _MAX_UNCONFIRMED_PUBLISHES messages may await confirmation. The delivery
+      guarantee of pipelined messages applies only after a subsequent
+      successful `waitForConfirms` or publish with waitForConfirm=True.
+      [Defaults to waitForConfirm=True]
+
+    raises: MessageQueueNotFound; UndeliveredMessagesError if pipelined
+      messages couldn't be delivered
     """
     if not mqName:
       raise ValueError("Name cannot be empty or None: %r" % (mqName,))
@@ -314,6 +468,104 @@ class MessageBusConnector(object):
                        properties=(self._PERSISTENT_PUBLISH_PROPERTIES
                                    if persistent else None))
 
+    if waitForConfirm and not self._unconfirmedPublishes:
+      self._publishWithConfirm(mqName, msg)
+      return
+
+    self._publishPipelined(mqName, msg)
+
+    if waitForConfirm:
+      self.waitForConfirms()
+
+
+  def waitForConfirms(self):
+    """ Wait until the broker confirms the delivery of the pipelined messages;
+    see `publish`.
+
+    If the channel or connection fails before all of them are confirmed, they
+    are republished one at a time with confirmation, so some of them may be
+    delivered twice, in keeping with the "at-least-once" delivery guarantee.
+
+    raises: UndeliveredMessagesError if some of the messages couldn't be
+      delivered, because their destination message queues were not found; the
+      others were delivered
+    """
+    publications = self._unconfirmedPublishes
+    if not publications:
+      return
+
+    self._unconfirmedPublishes = []
+    pipelineClient, self._pipelineClient = self._pipelineClient, None
+
+    undelivered = []
+    republish = False
+    try:
+      if pipelineClient is not None and (
+          self._channelMgr.client is pipelineClient):
+        pipelineClient.waitForConfirms()
+      else:
+        republish = True
+    except amqp.exceptions.UnroutableError as e:
+      undelivered = [(returned.methodInfo.routingKey, returned.body)
+                     for returned in e.messages]
+    except _PIPELINE_FAILURE_ERRORS as e:
+      self._logger.warning("Waiting for confirmation of numMessages=%d failed: "
+                           "%r", len(publications), e)
+      republish = True
+
+    if republish:
+      self._logger.warning("Republishing numMessages=%d pipelined messages",
+                           len(publications))
+      for mqName, msg in publications:
+        try:
+          self._publishWithConfirm(mqName, msg)
+        except MessageQueueNotFound:
+          undelivered.append((mqName, msg.body))
+
+    if undelivered:
+      raise UndeliveredMessagesError(undelivered)
+
+
+  def _publishPipelined(self, mqName, msg):
+    """ Publish a message without waiting for its confirmation; on failure,
+    recover by republishing the unconfirmed messages via `waitForConfirms`
+
+    :param mqName: name of the existing destination message queue
+    :param amqp.messages.Message msg:
+    """
+    self._unconfirmedPublishes.append((mqName, msg))
+    try:
+      client = self._channelMgr.client
+      if len(self._unconfirmedPublishes) == 1:
+        self._pipelineClient = client
+
+      if client is self._pipelineClient:
+        # NOTE: when using the default exchange (""), the the routing key is
+        #   used to select the destination queue
+        client.publish(msg,
+                       exchange="",
+                       routingKey=mqName,
+                       mandatory=True,
+                       maxUnconfirmed=self._MAX_UNCONFIRMED_PUBLISHES)
+        return
+    except _PIPELINE_FAILURE_ERRORS as e:
+      self._logger.warning("Pipelined publishing to mq=%s failed: %r", mqName,
+                           e)
+
+    # The channel was re-established while messages awaited confirmation
+    self._pipelineClient = None
+    self.waitForConfirms()
+
+
+  @_RETRY_ON_AMQP_ERROR
+  def _publishWithConfirm(self, mqName, msg):
+    """ Publish a message and wait for its confirmation
+
+    :param mqName: name of the existing destination message queue
+    :param amqp.messages.Message msg:
+
+    raises: MessageQueueNotFound
+    """
     # NOTE: when using the default exchange (""), the the routing key is used
     #   to select the destination queue
     try:
@@ -366,7 +618,7 @@ class MessageBusConnector(object):
     return True
 
 
-  def consume(self, mqName, blocking=True):
+  def consume(self, mqName, blocking=True, prefetchMax=None):
     """ Create an instance of _QueueConsumer iterable for consuming messages.
     The iterable yields an instance of _ConsumedMessage.
 
@@ -374,6 +626,9 @@ class MessageBusConnector(object):
     blocking: if True, the iterable will block until another message becomes
       available; if False, the iterable will terminate iteration when no more
       messages are available in the queue. [Defaults to blocking=True]
+    prefetchMax: limit for how many unacked messages the broker may deliver to
+      a blocking consumer; None to use the default limit. Consumers that
+      process several messages concurrently need a larger limit.
 
     The iterable raises: MessageQueueNotFound
 
@@ -395,7 +650,8 @@ class MessageBusConnector(object):
     consumer = _QueueConsumer(
       mqName=mqName,
       blocking=blocking,
-      prefetchMax=self._PREFETCH_MAX,
+      prefetchMax=(prefetchMax if prefetchMax is not None
+                   else self._PREFETCH_MAX),
       bus=self)
 
     self._consumers.append(consumer)
@@ -471,6 +727,78 @@ class _QueueConsumer(object):
   def __iter__(self):
     """ yield an instance of _ConsumedMessage when a message becomes available
 
+    :raises MessageQueueNotFound:
+    :raises ConsumerCancelled:
+    """
+    return self._readMessages()
+
+
+  def readBatches(self, maxBatchSize, lingerSec):
+    """ Generator that yields batches of messages from a blocking consumer. A
+    batch is closed when it reaches maxBatchSize messages or when lingerSec
+    elapse after the arrival of its first message, whichever comes first.
+
+    The messages of a batch may be acked at once by acking its last message
+    with multiple=True before the next batch is requested. NOTE: the broker
+    stops delivering when prefetchMax messages are unacked, so batches don't
+    exceed prefetchMax messages.
+
+    :param maxBatchSize: max number of messages per batch
+    :param lingerSec: max seconds that the first message of a batch waits for
+      the batch to fill up
+
+    :yields: non-empty list of _ConsumedMessage instances
+
+    :raises MessageQueueNotFound:
+    :raises ConsumerCancelled:
+    """
+    assert self._blocking, "readBatches requires a blocking consumer"
+
+    batch = []
+
+    # Time when the current batch closes; in a list for access from closures
+    batchDeadline = [None]
+
+    def getWaitTimeout():
+      if not batch:
+        return None
+      return max(batchDeadline[0] - time.time(), 0)
+
+    def onRecovery():
+      # The unacked messages of the interrupted channel get redelivered, and
+      # can't be acked through the new channel
+      if batch:
+        self._logger.warn(
+          "Discarding batch of numMessages=%d interrupted by channel recovery "
+          "on mq=%s; the broker will redeliver them", len(batch),
+          self._mqName)
+        del batch[:]
+
+    for message in self._readMessages(getWaitTimeout, onRecovery):
+      if message is not None:
+        if not batch:
+          batchDeadline[0] = time.time() + lingerSec
+        batch.append(message)
+        if len(batch) < maxBatchSize:
+          continue
+      elif not batch:
+        continue
+
+      completeBatch = list(batch)
+      del batch[:]
+      yield completeBatch
+
+
+  def _readMessages(self, getWaitTimeout=None, onRecovery=None):
+    """ Generator that yields an instance of _ConsumedMessage when a message
+    becomes available
+
+    :param getWaitTimeout: optional function for blocking consumers that
+      returns the max seconds to wait for the next message, or None to wait
+      indefinitely; None is yielded when the wait times out
+    :param onRecovery: optional function to call after recovering from a
+      channel or connection failure: onRecovery()
+
     :raises MessageQueueNotFound:
     :raises ConsumerCancelled:
     """
@@ -516,8 +844,13 @@ class _QueueConsumer(object):
                                            exclusive=False)
       try:
         while True:
-          evt = amqpClient.getNextEvent()
-          if type(evt) is amqp.messages.ConsumerMessage:
+          evt = amqpClient.getNextEvent(
+            timeout=getWaitTimeout() if getWaitTimeout is not None else None)
+          if evt is None:
+            # Timed out
+            yield None
+
+          elif type(evt) is amqp.messages.ConsumerMessage:
 
             assert evt.methodInfo.consumerTag == consumer.tag, (
               evt.methodInfo.consumerTag, consumer, evt)
@@ -561,7 +894,10 @@ class _QueueConsumer(object):
 
       try:
         for message in source:
-          yield _ConsumedMessage(body=message.body, ack=message.ack)
+          if message is not None:
+            yield _ConsumedMessage(body=message.body, ack=message.ack)
+          else:
+            yield None
         else:
           assert not self._blocking, (
             "Unexpected termination of blocking iterator")
@@ -596,6 +932,9 @@ class _QueueConsumer(object):
 
         time.sleep(sleepOnFailureSec)
 
+        if onRecovery is not None:
+          onRecovery()
+
 
   def close(self):
     if self._channelMgr is None:
@@ -640,16 +979,21 @@ class _QueueConsumer(object):
 
 class _ChannelManager(object):
   """
+  Draws AMQP clients from the process-wide client pool and returns them to the
+  pool when closed; clients that fail are closed instead.
+
   NOT thread-safe
   """
 
-  _CLIENT_CLASS = amqp.synchronous_amqp_client.SynchronousAmqpClient
-
-  def __init__(self, configureChannel=None):
+  def __init__(self, configureChannel=None, channelKind=None):
     """
     configureChannel: Function to call to configure channel after channel is
       created: NoneType
       configureChannel(amqp.synchronous_amqp_client.SynchronousAmqpClient)
+    channelKind: label of the channel configuration for reuse of pooled
+      channels; None to reuse only connections of pooled clients, closing the
+      channel when returning the client to the pool (e.g., so that the broker
+      requeues unacknowledged deliveries)
     """
     self._logger = g_log
 
@@ -658,6 +1002,8 @@ class _ChannelManager(object):
     # amqp.synchronous_amqp_client.SynchronousAmqpClient
     self._configureChannel = configureChannel
 
+    self._channelKind = channelKind
+
     # AMQP client
     self._client = None
 
@@ -683,8 +1029,14 @@ class _ChannelManager(object):
 
 
   def close(self):
-    """ Close Channel Manager; it's not reusable after this call """
-    self.reset()
+    """ Close Channel Manager, returning the client to the client pool; it's not
+    reusable after this call
+    """
+    client, self._client = self._client, None
+    if client is not None:
+      amqp.client_pool.getClientPool().release(client,
+                                               channelKind=self._channelKind)
+
     self._configureChannel = None
     self._logger.debug("Closed")
 
@@ -696,8 +1048,10 @@ class _ChannelManager(object):
                 connectionParams.host, connectionParams.port,
                 connectionParams.credentials.username)
 
-    return self._CLIENT_CLASS(connectionParams,
-                              channelConfigCb=self._configureChannel)
+    return amqp.client_pool.getClientPool().acquire(
+      connectionParams,
+      channelKind=self._channelKind,
+      channelConfigCb=self._configureChannel)
 
 
   def _refreshChannelNoRetries(self):
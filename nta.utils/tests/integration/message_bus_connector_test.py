@@ -38,12 +38,14 @@ import uuid
 from mock import patch
 
 from nta.utils import amqp
+from nta.utils.error_handling import retry
 from nta.utils.logging_support_raw import LoggingSupport
 from nta.utils import message_bus_connector
 from nta.utils.message_bus_connector import \
     MessageBusConnector, \
     MessageQueueNotFound, \
-    MessageProperties
+    MessageProperties, \
+    UndeliveredMessagesError
 from nta.utils.test_utils import amqp_test_utils
 
 
@@ -88,6 +90,7 @@ class MessageQueueManagementTestCase(_TestCaseBase):
     deleteMessageQueue
     purge
     isEmpty
+    getMessageCount
   """
 
   def testCreateDurableMessageQueue(self):
@@ -291,6 +294,33 @@ class MessageQueueManagementTestCase(_TestCaseBase):
         bus.isEmpty(mqName=mqName)
 
 
+  def testGetMessageCount(self):
+    mqName = self._getUniqueMessageQueueName()
+
+    with amqp_test_utils.managedQueueDeleter(mqName):
+      with MessageBusConnector() as bus:
+        # Create the queue
+        bus.createMessageQueue(mqName=mqName, durable=True)
+
+        self.assertEqual(bus.getMessageCount(mqName), 0)
+
+        # Now add some messages
+        bus.publish(mqName, "abc", persistent=True)
+        bus.publish(mqName, "def", persistent=True)
+
+        self.assertEqual(bus.getMessageCount(mqName), 2)
+
+
+  def testGetMessageCountWithQueueNotFound(self):
+    # Verify that getMessageCount on a non-existent message queue raises the
+    # expected exception
+    mqName = self._getUniqueMessageQueueName()
+
+    with MessageBusConnector() as bus:
+      with self.assertRaises(MessageQueueNotFound):
+        bus.getMessageCount(mqName=mqName)
+
+
   def testGetAllMessageQueues(self):
     durableMQ = self._getUniqueMessageQueueName()
     nonDurableMQ = self._getUniqueMessageQueueName()
@@ -307,6 +337,33 @@ class MessageQueueManagementTestCase(_TestCaseBase):
         self.assertIn(nonDurableMQ, allQueues)
 
 
+  def testGetMessageQueueDepths(self):
+    emptyMQ = self._getUniqueMessageQueueName()
+    nonEmptyMQ = self._getUniqueMessageQueueName()
+
+    with amqp_test_utils.managedQueueDeleter((emptyMQ, nonEmptyMQ)):
+      with MessageBusConnector() as bus:
+        bus.createMessageQueue(mqName=emptyMQ, durable=True)
+        bus.createMessageQueue(mqName=nonEmptyMQ, durable=True)
+
+        bus.publish(nonEmptyMQ, "abc", persistent=True)
+        bus.publish(nonEmptyMQ, "def", persistent=True)
+
+        # Depths are reported once the broker collects queue statistics
+        @retry(timeoutSec=30, initialRetryDelaySec=0.5, maxRetryDelaySec=2,
+               retryExceptions=(AssertionError,))
+        def verifyDepths():
+          depths = bus.getMessageQueueDepths(
+            namePrefix=self.__class__.__name__ + ".")
+          self.assertEqual(depths.get(emptyMQ), 0)
+          self.assertEqual(depths.get(nonEmptyMQ), 2)
+
+        verifyDepths()
+
+        depths = bus.getMessageQueueDepths(namePrefix=emptyMQ)
+        self.assertItemsEqual(depths.keys(), [emptyMQ])
+
+
 
 class MessagePublisherTestCase(_TestCaseBase):
   """ Tests the message queue publishing functionality of
@@ -413,6 +470,49 @@ class MessagePublisherTestCase(_TestCaseBase):
         self.assertSequenceEqual(actualContent, expectedContent)
 
 
+  def testPublishPipelinedMessages(self):
+    numMessagesToPublish = 250
+
+    mqName = self._getUniqueMessageQueueName()
+
+    with amqp_test_utils.managedQueueDeleter(mqName):
+      with MessageBusConnector() as bus:
+        bus.createMessageQueue(mqName=mqName, durable=True)
+
+        expectedContent = [str(i) for i in xrange(numMessagesToPublish)]
+
+        for body in expectedContent:
+          bus.publish(mqName, body, persistent=True, waitForConfirm=False)
+
+        bus.waitForConfirms()
+
+      self.assertEqual(_getQueueMessageCount(mqName), numMessagesToPublish)
+
+      connParams = amqp.connection.getRabbitmqConnectionParameters()
+
+      with amqp.synchronous_amqp_client.SynchronousAmqpClient(connParams) as (
+        amqpClient):
+        actualContent = []
+        for i in xrange(numMessagesToPublish):
+          msg = amqpClient.getOneMessage(mqName, noAck=False)
+          actualContent.append(msg.body)
+          msg.ack()
+
+        self.assertSequenceEqual(actualContent, expectedContent)
+
+
+  def testPublishPipelinedWithQueueNotFound(self):
+    mqName = self._getUniqueMessageQueueName()
+
+    with MessageBusConnector() as bus:
+      bus.publish(mqName, "abc", persistent=True, waitForConfirm=False)
+
+      with self.assertRaises(UndeliveredMessagesError) as cm:
+        bus.waitForConfirms()
+
+    self.assertEqual(cm.exception.undelivered, [(mqName, "abc")])
+
+
   def testPublishWithQueueNotFound(self):
     # Verify that isEmpty on a non-existent message queue raises the expected
     # exception
@@ -891,6 +991,60 @@ class MessageConsumerTestCase(_TestCaseBase):
       self.assertEqual(_getQueueMessageCount(mqName), 0)
 
 
+  def testConsumerReadBatches(self):
+    # Publish messages, and use readBatches to retrieve them in batches
+    # that close on size and linger time
+    numMessagesToPublish = 5
+
+    mqName = self._getUniqueMessageQueueName()
+
+    with amqp_test_utils.managedQueueDeleter(mqName):
+      with MessageBusConnector() as bus:
+        bus.createMessageQueue(mqName=mqName, durable=True)
+
+        expectedContent = [str(i) for i in xrange(numMessagesToPublish)]
+        for body in expectedContent:
+          bus.publish(mqName, body, persistent=True)
+
+      # NOTE: we use a thread to avoid deadlocking the test runner in case
+      #  something is wrong with the iterable
+      def runConsumerThread(mqName, numBatches, resultQ):
+        try:
+          with MessageBusConnector() as bus:
+            with bus.consume(mqName=mqName, prefetchMax=10) as consumer:
+              it = consumer.readBatches(maxBatchSize=2, lingerSec=0.1)
+              for _i in xrange(numBatches):
+                batch = next(it)
+                resultQ.put([msg.body for msg in batch])
+                batch[-1].ack(multiple=True)
+        except:
+          resultQ.put(dict(exception=sys.exc_info()[1]))
+          raise
+
+      resultQ = Queue.Queue()
+      consumerThread = threading.Thread(
+        target=runConsumerThread,
+        args=(mqName, 3, resultQ))
+      consumerThread.setDaemon(True)
+      consumerThread.start()
+
+      consumerThread.join(timeout=30)
+      self.assertFalse(consumerThread.isAlive())
+
+      # Full batches, followed by the remnant upon linger time expiration
+      actualBatches = []
+      while True:
+        try:
+          actualBatches.append(resultQ.get_nowait())
+        except Queue.Empty:
+          break
+
+      self.assertEqual(actualBatches, [["0", "1"], ["2", "3"], ["4"]])
+
+      # Verify that all messages were acked
+      self.assertEqual(_getQueueMessageCount(mqName), 0)
+
+
   def testMessageBusConnectorCleanupOfConsumerGenerators(self):
     # Verify that MessageBusConnector closes unclosed consumers
     numMessagesToPublish = 1
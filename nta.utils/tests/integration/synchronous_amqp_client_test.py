@@ -26,6 +26,7 @@ Integration tests for the nta.utils.amqp.SynchronousAmqpClient module
 
 import logging
 import requests
+import time
 import unittest
 
 from nta.utils.error_handling import retry
@@ -696,6 +697,25 @@ class SynchronousAmqpClientTest(unittest.TestCase):
                                            routingKey=routingKey))
 
 
+  def testConsumerGetNextEventWithTimeout(self):
+    """ Tests that getNextEvent() returns None when its timeout expires before
+    an event arrives
+    """
+    self._connectToClient()
+    queueName = "testQueue"
+
+    self.client.declareQueue(queueName)
+    self.client.createConsumer(queueName)
+
+    startTime = time.time()
+    self.assertIsNone(self.client.getNextEvent(timeout=0.2))
+    self.assertGreaterEqual(time.time() - startTime, 0.2)
+
+    self.client.publish(Message("test-msg"), "", queueName)
+    message = self.client.getNextEvent(timeout=5)
+    self.assertEqual(message.body, "test-msg")
+
+
   def testRecoverUnackedMessages(self):
     """ Tests the recover method to re-queue unacked messages. """
     self._connectToClient()
@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2015, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+"""Unit tests for the process-wide pool of AMQP clients"""
+
+
+import os
+import unittest
+
+from mock import Mock, patch
+
+from nta.utils.amqp import client_pool
+from nta.utils.amqp.client_pool import SynchronousAmqpClientPool
+from nta.utils.amqp.connection import ConnectionParams
+
+
+
+def _createClientMock(connectionParams,
+                      channelConfigCb=None):  # pylint: disable=W0613
+  clientMock = Mock(
+    spec_set=client_pool.synchronous_amqp_client.SynchronousAmqpClient)
+  clientMock.connectionParams = connectionParams
+  clientMock.isIdleAndHealthy.return_value = True
+  return clientMock
+
+
+
+@patch.object(SynchronousAmqpClientPool, "_CLIENT_CLASS",
+              side_effect=_createClientMock)
+class SynchronousAmqpClientPoolTest(unittest.TestCase):
+  """ Unit tests for SynchronousAmqpClientPool """
+
+  def testReuseOfClientWithSameChannelKind(self, clientClassMock):
+    pool = SynchronousAmqpClientPool(maxIdleClients=2, maxIdleSec=60)
+    params = ConnectionParams()
+
+    client = pool.acquire(params, channelKind="pub")
+    self.assertEqual(clientClassMock.call_count, 1)
+
+    pool.release(client, channelKind="pub")
+    self.assertFalse(client.close.called)
+    self.assertFalse(client.resetChannel.called)
+
+    # The client is reused along with its channel
+    self.assertIs(pool.acquire(params, channelKind="pub"), client)
+    self.assertEqual(clientClassMock.call_count, 1)
+    self.assertFalse(client.resetChannel.called)
+
+
+  def testReuseOfConnectionWithOtherChannelKind(self, clientClassMock):
+    pool = SynchronousAmqpClientPool(maxIdleClients=2, maxIdleSec=60)
+    params = ConnectionParams()
+
+    client = pool.acquire(params, channelKind="pub")
+    pool.release(client, channelKind="pub")
+
+    # Only the connection is reused
+    configureChannel = Mock()
+    self.assertIs(pool.acquire(params, channelKind=None,
+                               channelConfigCb=configureChannel),
+                  client)
+    client.resetChannel.assert_called_once_with(configureChannel)
+
+    # The channel of a client without channel kind is closed when it's
+    # released
+    client.resetChannel.reset_mock()
+    pool.release(client, channelKind=None)
+    client.resetChannel.assert_called_once_with(None)
+
+    self.assertEqual(clientClassMock.call_count, 1)
+
+
+  def testClientsOfOtherEndpointsAreNotReused(self, clientClassMock):
+    pool = SynchronousAmqpClientPool(maxIdleClients=2, maxIdleSec=60)
+
+    client = pool.acquire(ConnectionParams(vhost="a"), channelKind="pub")
+    pool.release(client, channelKind="pub")
+
+    self.assertIsNot(pool.acquire(ConnectionParams(vhost="b"),
+                                  channelKind="pub"),
+                     client)
+    self.assertEqual(clientClassMock.call_count, 2)
+
+
+  def testUnhealthyClientsAreClosed(self, _clientClassMock):
+    pool = SynchronousAmqpClientPool(maxIdleClients=2, maxIdleSec=60)
+    params = ConnectionParams()
+
+    # Unhealthy on release
+    client = pool.acquire(params, channelKind="pub")
+    client.isIdleAndHealthy.return_value = False
+    pool.release(client, channelKind="pub")
+    client.close.assert_called_once_with()
+
+    # Unhealthy while idle in the pool
+    client = pool.acquire(params, channelKind="pub")
+    pool.release(client, channelKind="pub")
+    client.isIdleAndHealthy.return_value = False
+
+    self.assertIsNot(pool.acquire(params, channelKind="pub"), client)
+    client.close.assert_called_once_with()
+
+
+  def testIdleClientLimitAndEviction(self, _clientClassMock):
+    pool = SynchronousAmqpClientPool(maxIdleClients=2, maxIdleSec=60)
+    params = ConnectionParams()
+
+    clients = [pool.acquire(params, channelKind="pub") for _ in xrange(3)]
+    for client in clients:
+      pool.release(client, channelKind="pub")
+
+    # The least-recently released client was closed to honor the limit
+    clients[0].close.assert_called_once_with()
+    self.assertFalse(clients[1].close.called)
+    self.assertFalse(clients[2].close.called)
+
+    # Idle clients expire
+    with patch.object(client_pool.time, "time", autospec=True,
+                      return_value=client_pool.time.time() + 61):
+      newClient = pool.acquire(params, channelKind="pub")
+
+    self.assertNotIn(newClient, clients)
+    clients[1].close.assert_called_once_with()
+    clients[2].close.assert_called_once_with()
+
+
+  def testPoolingDisabled(self, _clientClassMock):
+    pool = SynchronousAmqpClientPool(maxIdleClients=0, maxIdleSec=60)
+
+    client = pool.acquire(ConnectionParams(), channelKind="pub")
+    pool.release(client, channelKind="pub")
+    client.close.assert_called_once_with()
+
+
+  def testClientsAreNotPooledAfterFork(self, _clientClassMock):
+    pool = SynchronousAmqpClientPool(maxIdleClients=2, maxIdleSec=60)
+
+    params = ConnectionParams()
+    client = pool.acquire(params, channelKind="pub")
+    idleClient = pool.acquire(params, channelKind="pub")
+    pool.release(idleClient, channelKind="pub")
+
+    with patch.object(client_pool, "g_clientPool", new=None), \
+        patch.object(client_pool.os, "getpid", autospec=True,
+                     return_value=os.getpid() + 1):
+      # The child process gets a pool of its own
+      childPool = client_pool.getClientPool()
+      self.assertIsNot(childPool, pool)
+
+      # A client inherited from the parent is dropped, not pooled
+      childPool.release(client, channelKind="pub")
+      childClient = childPool.acquire(params, channelKind="pub")
+      self.assertIsNot(childClient, client)
+
+      # Nor is the parent's idle client handed out
+      self.assertNotIn(pool.acquire(params, channelKind="pub"),
+                       (client, idleClient))
+
+      pool.clear()
+
+    # The parent's connections were left alone
+    self.assertFalse(client.close.called)
+    self.assertFalse(client.resetChannel.called)
+    self.assertFalse(idleClient.close.called)
+
+
+
+if __name__ == '__main__':
+  unittest.main()
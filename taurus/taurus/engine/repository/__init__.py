@@ -33,6 +33,7 @@ from taurus.engine.repository.migrate import migrate
 import htmengine.repository
 from htmengine.repository import (addMetric,
                                   addMetricData,
+                                  addMetricDataBatch,
                                   deleteMetric,
                                   deleteModel,
                                   getCustomMetricByName,
@@ -45,9 +46,11 @@ from htmengine.repository import (addMetric,
                                   getMetric,
                                   getMetricWithSharedLock,
                                   getMetricWithUpdateLock,
+                                  getMetricsWithUpdateLock,
                                   getMetricCountForServer,
                                   getMetricData,
                                   getMetricDataCount,
+                                  getMetricDataPerMetric,
                                   getProcessedMetricDataCount,
                                   getMetricDataWithRawAnomalyScoresTail,
                                   getMetricIdsSortedByDisplayValue,
@@ -61,6 +64,8 @@ from htmengine.repository import (addMetric,
                                   updateMetricColumns,
                                   updateMetricColumnsForRefStatus,
                                   updateMetricDataColumns,
+                                  updateMetricDataScoresBulk,
+                                  updateMetricDisplayValueRollup,
                                   lockOperationExclusive,
                                   OperationLock)
 
@@ -25,4 +25,5 @@ from htmengine.repository.schema import (metadata,
                                          instance_status_history,
                                          metric,
                                          metric_data,
+                                         metric_display_value_rollup,
                                          lock)
@@ -20,7 +20,6 @@
 # ----------------------------------------------------------------------
 # pylint: disable=C0103,W1401
 import calendar
-from collections import defaultdict
 import itertools
 import json
 import math
@@ -459,6 +458,8 @@ class MetricDataHandler(AuthenticatedBaseHandler):
     anomaly = float(queryParams.get("anomaly") or 0.0)
     limit = int(queryParams.get("limit") or 0)
 
+    # Rows are consumed while the response is streamed, so the connection must
+    # remain open until the response is complete
     with web.ctx.connFactory() as conn:
       fields = (schema.metric_data.c.uid,
                 schema.metric_data.c.timestamp,
@@ -468,28 +469,40 @@ class MetricDataHandler(AuthenticatedBaseHandler):
       names = ("names",) + tuple(["value" if col.name == "metric_value"
                                   else col.name
                                   for col in fields])
-      if fromTimestamp:
-        sort = schema.metric_data.c.timestamp.asc()
+
+      if metricId is None:
+        # Retrieve the data in chunks of metrics, grouped by metric and limited
+        # per metric by the database
+        result = repository.getMetricDataPerMetric(
+          conn,
+          fields=fields,
+          limit=limit or None,
+          fromTimestamp=fromTimestamp,
+          toTimestamp=toTimestamp,
+          score=anomaly,
+          ascending=bool(fromTimestamp))
       else:
-        sort = schema.metric_data.c.timestamp.desc()
-
-      result = repository.getMetricData(conn,
-                                        metricId=metricId,
-                                        fields=fields,
-                                        fromTimestamp=fromTimestamp,
-                                        toTimestamp=toTimestamp,
-                                        score=anomaly,
-                                        sort=sort)
-
-    if "application/octet-stream" in web.ctx.env.get('HTTP_ACCEPT', ""):
-      results_per_uid = defaultdict(int)
-      packer = msgpack.Packer()
-      self.addStandardHeaders(content_type='application/octet-stream')
-      web.header('X-Accel-Buffering', 'no')
-
-      yield packer.pack(names)
-      for row in result:
-        if not limit or (limit and len(results_per_uid[row.uid]) < limit):
+        if fromTimestamp:
+          sort = schema.metric_data.c.timestamp.asc()
+        else:
+          sort = schema.metric_data.c.timestamp.desc()
+
+        result = repository.getMetricData(conn,
+                                          metricId=metricId,
+                                          fields=fields,
+                                          limit=limit or None,
+                                          fromTimestamp=fromTimestamp,
+                                          toTimestamp=toTimestamp,
+                                          score=anomaly,
+                                          sort=sort)
+
+      if "application/octet-stream" in web.ctx.env.get('HTTP_ACCEPT', ""):
+        packer = msgpack.Packer()
+        self.addStandardHeaders(content_type='application/octet-stream')
+        web.header('X-Accel-Buffering', 'no')
+
+        yield packer.pack(names)
+        for row in result:
           resultTuple = (
               row.uid,
               calendar.timegm(row.timestamp.timetuple()),
@@ -498,45 +511,30 @@ class MetricDataHandler(AuthenticatedBaseHandler):
               row.rowid,
             )
           yield packer.pack(resultTuple)
-          results_per_uid[row.uid] += 1
-    else:
-
-      if metricId is None:
-        output = {}
-        for row in result:
-          uid = row.uid
-          default = {"uid": uid, "data": []}
-          recordTuple = (
-            row.timestamp.strftime("%Y-%m-%d %H:%M:%S"),
-            row.metric_value,
-            row.anomaly_score,
-            row.rowid
-          )
-          metricDataRecord = output.setdefault(uid, default)
-          if not limit or (limit and len(metricDataRecord["data"]) < limit):
-            metricDataRecord["data"].append(recordTuple)
-
-        results = {
-          "metrics":  output.values(),
-          "names": names[2:]
-        }
-
       else:
-        if limit:
-          results = {"names": names[2:],
-                     "data": [(row.timestamp.strftime("%Y-%m-%d %H:%M:%S"),
-                               row.metric_value,
-                               row.anomaly_score,
-                               row.rowid)
-                              for row in itertools.islice(result, 0, limit)]}
+        def recordTuples(rows):
+          for row in rows:
+            yield (row.timestamp.strftime("%Y-%m-%d %H:%M:%S"),
+                   row.metric_value,
+                   row.anomaly_score,
+                   row.rowid)
+
+        if metricId is None:
+          # Each metric's data is encoded while its rows are consumed
+          results = {
+            "metrics": ({"uid": uid, "data": recordTuples(rows)}
+                        for uid, rows in itertools.groupby(
+                          result, key=lambda row: row.uid)),
+            "names": names[2:]
+          }
         else:
           results = {"names": names[2:],
-                     "data": [(row.timestamp.strftime("%Y-%m-%d %H:%M:%S"),
-                               row.metric_value,
-                               row.anomaly_score,
-                               row.rowid) for row in result]}
-      self.addStandardHeaders()
-      yield utils.jsonEncode(results)
+                     "data": recordTuples(result)}
+
+        self.addStandardHeaders()
+        web.header('X-Accel-Buffering', 'no')
+        for chunk in utils.jsonEncodeChunks(results):
+          yield chunk
 
 
 
@@ -29,6 +29,7 @@ Implements param finder, which automatically
 """
 
 import datetime
+import itertools
 import json
 import numpy
 import os
@@ -38,10 +39,6 @@ from pkg_resources import resource_stream
 from nupic.frameworks.opf.common_models.cluster_params import (
   getScalarMetricWithTimeOfDayAnomalyParams)
 
-_CORRELATION_MODE_VALID = 0
-_CORRELATION_MODE_SAME = 1
-_CORRELATION_MODE_FULL = 2
-
 _AGGREGATION_WINDOW_THRESH = 0.03
 
 # Maximum number of rows param_finder will process
@@ -57,63 +54,15 @@ MIN_NUM_ROWS = 100
 # aggregation
 MIN_ROW_AFTER_AGGREGATION = 1000
 
+# Maximum number of data points after resampling. Data with gaps may resample
+# into many more points than it has rows; such data is resampled at a multiple
+# of the median sampling interval instead, so that it fits
+MAX_NUM_RESAMPLED_ROWS = 2 * MAX_NUM_ROWS
+
 # Set DISABLE_DAY_OF_WEEK_ENCODER to True to disable the use of day of week
 # encoder
 DISABLE_DAY_OF_WEEK_ENCODER = True
 
-def _convolve(vector1, vector2, mode):
-  """
-  Returns the discrete, linear convolution of two one-dimensional sequences.
-
-  The convolution operator is often seen in signal processing, where it
-  models the effect of a linear time-invariant system on a signal [1]_.  In
-  probability theory, the sum of two independent random variables is
-  distributed according to the convolution of their individual
-  distributions.
-
-  If `vector2` is longer than `vector1`, the arrays are swapped before
-  computation.
-
-  References
-  ----------
-  .. [1] Wikipedia, "Convolution", http://en.wikipedia.org/wiki/Convolution.
-
-  @param vector1 (array_like) First one-dimensional input array (N,)
-
-  @param vector2 (array_like) Second one-dimensional input array (M,)
-
-  @param mode (int) Indicates mode of convolution, which takes the value of
-      _CORRELATION_MODE_FULL:
-        This returns the convolution at each point of overlap, with an output
-        shape of (N+M-1,). At the end-points of the convolution, the signals
-        do not overlap completely, and boundary effects may be seen.
-
-      _CORRELATION_MODE_SAME:
-        Mode `same` returns output of length ``max(M, N)``.  Boundary
-        effects are still visible.
-
-      _CORRELATION_MODE_VALID:
-        Mode `valid` returns output of length
-        ``max(M, N) - min(M, N) + 1``.  The convolution product is only given
-        for points where the signals overlap completely.  Values outside
-        the signal boundary have no effect.
-
-  @return (ndarray) Discrete, linear convolution of `vector1` and `vector2`
-
-  """
-  vector1 = numpy.array(vector1, ndmin=1)
-  vector2 = numpy.array(vector2, ndmin=1)
-
-  if len(vector1) == 0:
-    raise ValueError("vector1 cannot be empty")
-  if len(vector2) == 0:
-    raise ValueError("vector2 cannot be empty")
-
-  if len(vector2) > len(vector1):
-    vector1, vector2 = vector2, vector1
-
-  return numpy.core.multiarray.correlate(vector1, vector2[::-1], mode)
-
 
 
 def _rickerWavelet(numPoints, waveletWidth):
@@ -164,13 +113,29 @@ def _cwt(data, wavelet, widths):
 
   @param widths (sequence) Widths to use for transform
 
-  @return (ndarray) Will have shape of (len(data), len(widths))
+  @return (ndarray) Will have shape of (len(widths), len(data))
 
   """
-  output = numpy.zeros([len(widths), len(data)])
-  for ind, width in enumerate(widths):
-    waveletData = wavelet(min(10 * width, len(data)), width)
-    output[ind, :] = _convolve(data, waveletData, mode=_CORRELATION_MODE_SAME)
+  numPoints = len(data)
+  waveletsData = [wavelet(min(10 * width, numPoints), width)
+                  for width in widths]
+
+  # Convolve via FFT: the spectrum of the data is computed once and multiplied
+  # by the spectrum of each wavelet, which is O(N log N) per width instead of
+  # O(N * M) for direct convolution with a wavelet of M points. The transform
+  # is zero-padded to a power of two that fits the full linear convolution.
+  maxWaveletLength = max(len(waveletData) for waveletData in waveletsData)
+  fftLength = 1 << int(numpy.ceil(numpy.log2(numPoints + maxWaveletLength - 1)))
+  dataSpectrum = numpy.fft.rfft(data, fftLength)
+
+  output = numpy.zeros([len(widths), numPoints])
+  for ind, waveletData in enumerate(waveletsData):
+    fullConvolution = numpy.fft.irfft(
+      dataSpectrum * numpy.fft.rfft(waveletData, fftLength), fftLength)
+    # Keep the center part of the same length as data, like "same" mode of
+    # numpy.convolve
+    start = (len(waveletData) - 1) // 2
+    output[ind, :] = fullConvolution[start:start + numPoints]
   return output
 
 
@@ -206,16 +171,13 @@ def findParameters(samples):
       "valueFieldName": The name of the field in 'modelConfig'
       corresponding to the metric value (string)
   """
-  (timestamps, values) = zip(*samples)
+  # Only the first MAX_NUM_ROWS samples are used
+  (timestamps, values) = zip(*itertools.islice(samples, MAX_NUM_ROWS))
   numRecords = len(timestamps)
 
   if not isinstance(timestamps[0], datetime.datetime):
     raise TypeError("timestamps must be datetime type")
 
-  if numRecords > MAX_NUM_ROWS:
-    timestamps = timestamps[:MAX_NUM_ROWS]
-    values = values[:MAX_NUM_ROWS]
-
   if numRecords < MIN_NUM_ROWS:
     outputInfo = {
       "aggInfo": None,
@@ -231,12 +193,15 @@ def findParameters(samples):
   (medianSamplingInterval,
    medianAbsoluteDevSamplingInterval) = _getMedianSamplingInterval(timestamps)
 
+  resamplingInterval = _getResamplingInterval(timestamps,
+                                              medianSamplingInterval)
+
   (timestamps, values) = _resampleData(timestamps,
                                        values,
-                                       medianSamplingInterval)
+                                       resamplingInterval)
 
   (cwtVar, timeScale) = _calculateContinuousWaveletTransform(
-    medianSamplingInterval, values)
+    resamplingInterval, values)
 
   suggestedSamplingInterval = _determineAggregationWindow(
     timeScale=timeScale,
@@ -337,6 +302,29 @@ def _getModelParams(useTimeOfDay, useDayOfWeek, values):
 
 
 
+def _getResamplingInterval(timestamps, samplingInterval):
+  """
+  Return the sampling interval at which to resample data, so that there are
+  at most MAX_NUM_RESAMPLED_ROWS data points after resampling.
+
+  @param timestamps numpy array of timestamp in datetime64 type
+
+  @param samplingInterval (timedelta64) median sampling interval of the data
+
+  @return (timedelta64) samplingInterval, or the smallest multiple of it that
+          limits the number of resampled data points
+  """
+  totalDuration = (timestamps[-1] - timestamps[0])
+  nSampleNew = numpy.floor(totalDuration / samplingInterval) + 1
+  decimationFactor = int(numpy.ceil(nSampleNew / MAX_NUM_RESAMPLED_ROWS))
+
+  if decimationFactor > 1:
+    return samplingInterval * decimationFactor
+
+  return samplingInterval
+
+
+
 def _resampleData(timestamps, values, newSamplingInterval):
   """
   Resample data at new sampling interval using linear interpolation
@@ -357,9 +345,8 @@ def _resampleData(timestamps, values, newSamplingInterval):
   nSampleNew = numpy.floor(totalDuration / newSamplingInterval) + 1
   nSampleNew = nSampleNew.astype("int")
 
-  newTimeStamps = numpy.empty(nSampleNew, dtype="datetime64[s]")
-  for sampleI in xrange(nSampleNew):
-    newTimeStamps[sampleI] = timestamps[0] + sampleI * newSamplingInterval
+  newTimeStamps = (timestamps[0] +
+                   numpy.arange(nSampleNew) * newSamplingInterval)
 
   newValues = numpy.interp((newTimeStamps - timestamps[0]).astype("float32"),
                            (timestamps - timestamps[0]).astype("float32"),
@@ -117,6 +117,46 @@ class ParamFinderTestCase(unittest.TestCase):
     self.assertTrue(abs(targetPeriod - calculatedPeriod) / targetPeriod < .1)
 
 
+  def testCwtMatchesDirectConvolution(self):
+    """
+    Verify that the FFT-based CWT matches direct convolution with each wavelet
+    """
+    values = numpy.random.RandomState(42).randn(1001)
+    widths = numpy.logspace(0, numpy.log10(len(values) / 10), 50)
+
+    cwtMatrix = param_finder._cwt(values, param_finder._rickerWavelet, widths)
+
+    self.assertEqual(cwtMatrix.shape, (len(widths), len(values)))
+    for ind, width in enumerate(widths):
+      waveletData = param_finder._rickerWavelet(min(10 * width, len(values)),
+                                                width)
+      self.assertTrue(numpy.allclose(
+        cwtMatrix[ind], numpy.convolve(values, waveletData, mode="same")))
+
+
+  def testGetResamplingInterval(self):
+    samplingInterval = numpy.timedelta64(300, 's')
+    timestamps = numpy.array([numpy.datetime64("2015-01-01T00:00:00"),
+                              numpy.datetime64("2015-01-02T00:00:00")],
+                             dtype="datetime64[s]")
+
+    # Data that fits is resampled at its own sampling interval
+    self.assertEqual(
+      param_finder._getResamplingInterval(timestamps, samplingInterval),
+      samplingInterval)
+
+    # Data spanning a long gap is resampled at a multiple of it
+    timestamps[-1] = (timestamps[0] + samplingInterval *
+                      (3 * param_finder.MAX_NUM_RESAMPLED_ROWS - 1))
+    resamplingInterval = param_finder._getResamplingInterval(timestamps,
+                                                             samplingInterval)
+    self.assertEqual(resamplingInterval, samplingInterval * 3)
+
+    (newTimeStamps, _newValues) = param_finder._resampleData(
+      timestamps, numpy.array([0.0, 1.0]), resamplingInterval)
+    self.assertEqual(len(newTimeStamps), param_finder.MAX_NUM_RESAMPLED_ROWS)
+
+
   def testDetermineEncoderTypes(self):
     # daily and weekly periodicity in units of seconds
     dayPeriod = 86400.0